@@ -0,0 +1,500 @@
+# The analysis functions of the app. They do not use tkinter, so they can be used both by the pages of the GUI and
+# by the headless command line mode in headless.py
+
+# For logging what the app does, instead of printing it
+import logging
+
+# For passing the data provider on to the workers of a comparison, and the metric to the score function
+import functools
+import operator
+
+# Heavy libraries are imported the first time they are used, so that the app starts fast
+from lazy_modules import lazy_import
+
+# For matrix operations on historic stock price data
+np = lazy_import('numpy')
+
+# For running the analysis of many stocks at the same time
+from ranking import rank_stocks, rank_stocks_sharded, assignment_beta_score, DEFAULT_MAX_WORKERS, ASSIGNMENT_METRIC
+
+# Number of symbols that are downloaded with one request in technical_analysis_batch
+BATCH_CHUNK_SIZE = 50
+
+# Error of the stocks of a batch that were not analyzed because the batch was cancelled
+CANCELLED_ERROR = 'Cancelled before the stock was analyzed'
+
+# Cache for the market index prices that all stocks are compared to
+from index_cache import index_series_cache, BENCHMARK_INDEX_SYMBOL, BENCHMARK_PERIOD, STATISTICS_PERIOD
+
+# Vectorized calculation of technical values for many stocks at once
+from indicators import compute_technical_panel, latest_return_statistics
+
+# The prices of many stocks in compact matrices instead of one dataframe per stock
+from price_panel import PricePanel
+
+# Local store of historic prices, so that prices are only downloaded once
+from price_store import get_price_store, period_start_date
+
+# Local store of financial statements, so that they are only downloaded when a new fiscal year may exist
+from statement_store import get_statement_store
+
+# Market data providers, for analyzing data from other sources than the local stores
+from data_providers import get_default_provider, run_sync
+
+# Timing of the fetch and compute stages
+from tracing import span
+
+# Concurrent analyses of the same stock share one download and calculation
+from single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Single flight groups of the analyses of single stocks, the key is the symbol and the provider
+technical_flight = SingleFlight('technical')
+fundamental_flight = SingleFlight('fundamental')
+
+""" RESULTS"""
+
+# The results of the analyses are small records with __slots__, so that a ranking of thousands of stocks does not keep
+# a dictionary per result. They can still be unpacked like the tuples that the analyses used to return, in the order
+# of __slots__.
+
+
+# Returns the price value as a python float. float32 prices from a PricePanel become the shortest decimal number with
+# the same float32 value, so that a price of 63.1361 is not shown as 63.13610076904297
+def price_to_float(value):
+    return float(str(value))
+
+
+# Result of the technical analysis of one stock during the latest BENCHMARK_PERIOD:
+#   price_development  price development in percent
+#   beta_assignment    "betavalue" as defined in the assignment (instead of traditional betavalue)
+#   lowest_price, highest_price  lowest and highest price
+#   currency           currency of the stock as a string, None if it was not fetched
+class TechnicalResult:
+
+    __slots__ = ('price_development', 'beta_assignment', 'lowest_price', 'highest_price', 'currency')
+
+    def __init__(self, price_development, beta_assignment, lowest_price, highest_price, currency=None):
+        # Plain python floats, numpy scalars take more memory and do not turn into json
+        self.price_development = float(price_development)
+        self.beta_assignment = float(beta_assignment)
+        self.lowest_price = price_to_float(lowest_price)
+        self.highest_price = price_to_float(highest_price)
+        self.currency = currency
+
+    def __iter__(self):
+        return (getattr(self, field) for field in self.__slots__)
+
+    def __repr__(self):
+        return 'TechnicalResult(' + ', '.join(field + '=' + repr(getattr(self, field))
+                                              for field in self.__slots__) + ')'
+
+
+# Result of the fundamental analysis of one stock for its latest fiscal year:
+#   equity_ratio        total shareholder equity divided by total assets
+#   price_per_earnings  total shareholder equity divided by net income
+#   price_per_revenue   total shareholder equity divided by total revenue
+class FundamentalResult:
+
+    __slots__ = ('equity_ratio', 'price_per_earnings', 'price_per_revenue')
+
+    def __init__(self, equity_ratio, price_per_earnings, price_per_revenue):
+        self.equity_ratio = float(equity_ratio)
+        self.price_per_earnings = float(price_per_earnings)
+        self.price_per_revenue = float(price_per_revenue)
+
+    def __iter__(self):
+        return (getattr(self, field) for field in self.__slots__)
+
+    def __repr__(self):
+        return 'FundamentalResult(' + ', '.join(field + '=' + repr(getattr(self, field))
+                                                for field in self.__slots__) + ')'
+
+
+""" FUNCTIONS"""
+
+# All the analysis functions take a provider argument. If it is None (the default) prices and statements are read
+# from the shared local stores, which download what is missing with the default data provider. If it is a
+# data_providers.DataProvider, the data is read from it directly without the local stores, for example from a
+# directory of csv files.
+
+# Returns a dictionary with symbols as keys and price dataframes as values for the symbols during period, for
+# example '1mo'. Symbols without prices are left out
+def fetch_prices(symbols, period, provider=None, chunk_size=BATCH_CHUNK_SIZE):
+    if provider is None:
+        return get_price_store().get_prices_batch(symbols, period_start_date(period), chunk_size=chunk_size)
+    return run_sync(provider.get_prices(symbols, period_start_date(period)))
+
+
+# Returns a PricePanel with the prices of symbols during period, one row per symbol in the same order. Symbols without
+# prices get rows with only NaN. The local price store reads the prices straight into the panel, prices from a
+# provider are converted from its dataframes
+def fetch_price_panel(symbols, period, provider=None, chunk_size=BATCH_CHUNK_SIZE):
+    if provider is None:
+        return get_price_store().get_price_panel(symbols, period_start_date(period), chunk_size=chunk_size)
+    return PricePanel.from_frames(fetch_prices(symbols, period, provider, chunk_size), symbols)
+
+
+# Returns the prices of the market index during period. Raises ValueError if there are none
+def fetch_index_prices(period, provider=None):
+    if provider is None:
+        return index_series_cache.get_series(BENCHMARK_INDEX_SYMBOL, period)
+
+    index_prices = fetch_prices([BENCHMARK_INDEX_SYMBOL], period, provider).get(BENCHMARK_INDEX_SYMBOL)
+    if index_prices is None:
+        raise ValueError('No price data found for ' + BENCHMARK_INDEX_SYMBOL)
+    return index_prices
+
+
+# Returns a dictionary with symbols as keys and their currencies as values. Symbols without a known currency are
+# left out
+def fetch_currencies(symbols, provider=None):
+    if provider is None:
+        provider = get_default_provider()
+
+    metadata_by_symbol = run_sync(provider.get_metadata(symbols))
+    return {symbol: metadata_by_symbol[symbol]['currency'] for symbol in metadata_by_symbol}
+
+
+# Returns the tuple (period, balance_sheet, income_statement) with the latest financial statements of symbol
+def fetch_statements(symbol, provider=None):
+    if provider is None:
+        return get_statement_store().get_latest_statements(symbol)
+
+    results, errors = run_sync(provider.get_statements([symbol]))
+    if symbol in errors:
+        raise errors[symbol]
+    return results[symbol]
+
+
+# Calculates the technical values for every stock in price_panel (a PricePanel) compared to the market index, from a
+# dataframe with the prices of the index. The dataframe needs the columns 'Open' and 'Close' with one row per market
+# day, oldest first, as returned by yfinance.
+# Returns the dictionary of 1-D arrays from compute_technical_panel
+def calculate_technical_panel(price_panel, index_prices):
+    return compute_technical_panel(price_panel.open, price_panel.high, price_panel.low, price_panel.close,
+                                   index_prices['Open'].to_numpy(float), index_prices['Close'].to_numpy(float))
+
+
+# Returns the TechnicalResult of the stock in row symbol_idx of technical_panel (from calculate_technical_panel)
+def technical_result(technical_panel, symbol_idx, currency=None):
+    return TechnicalResult(technical_panel['price_development'][symbol_idx],
+                           technical_panel['beta_assignment'][symbol_idx], technical_panel['lowest_price'][symbol_idx],
+                           technical_panel['highest_price'][symbol_idx], currency)
+
+
+# Technical analysis function that inputs some stock data as a dictionary
+# with the mandatory 'Symbol' key inside. The symbol will be as standard in yahoo finance. for example 'AAPL'
+
+# The function returns a TechnicalResult containing the following data for the LAST 30 DAYS:
+# price_development: Stock_price_change_in_percent during the latest 30 days
+# beta_assignment: Beta_value_as_defined_in_the_assignment (instead of traditional betavalue)
+# lowest_price during these 30 days
+# highest_price during last 30 days
+# currency of stock (in the form of a string)
+
+# If an error occurs the function will return None
+# If the same stock is already being analyzed, for example on another page, the result of that analysis is returned
+def technical_analysis(stock_data, provider=None):
+    return technical_flight.run((stock_data.get('Symbol'), provider), run_technical_analysis, stock_data, provider)
+
+
+# Runs the technical analysis for technical_analysis, same arguments and return value
+def run_technical_analysis(stock_data, provider=None):
+    # Added try catch to catch errors
+    try:
+        # Run technical analysis
+
+        with span('technical.fetch'):
+            # Retrieve a price panel containing the stock price for the latest 30 days from the local price store.
+            # Only the days that are not already stored are downloaded
+            stock_prices_latest_30_days = fetch_price_panel([stock_data['Symbol']], BENCHMARK_PERIOD, provider)
+            if not stock_prices_latest_30_days.has_prices()[0]:
+                raise ValueError('No price data found for ' + stock_data['Symbol'])
+
+            # Get the dow jones prices from the shared index cache, it is only downloaded once per market day
+            dow_jones_data = fetch_index_prices(BENCHMARK_PERIOD, provider)
+
+        logger.debug('Prices of %s: %d days', stock_data['Symbol'], len(stock_prices_latest_30_days.dates))
+
+        # Calculate the technical values from the stock and dow jones prices
+        with span('technical.compute'):
+            technical_panel = calculate_technical_panel(stock_prices_latest_30_days, dow_jones_data)
+
+        logger.debug('"Beta value" of %s: %s', stock_data['Symbol'], technical_panel['beta_assignment'][0])
+
+        # Get currency for stock
+        with span('technical.fetch_currency'):
+            currency = fetch_currencies([stock_data['Symbol']], provider)[stock_data['Symbol']]
+
+
+        # Return the values calculated above in function, as defined in comment above function
+        return technical_result(technical_panel, 0, currency)
+    except Exception as e:
+        logger.warning('Technical analysis of %s failed: %s', stock_data.get('Symbol'), e)
+
+    return None
+
+
+# Returns True if cancel_event, a threading.Event or None, has been set
+def is_cancelled(cancel_event):
+    return cancel_event is not None and cancel_event.is_set()
+
+
+# Gives the symbols that are neither in results nor in errors the CANCELLED_ERROR. Returns (results, errors)
+def cancel_remaining(symbols, results, errors):
+    for symbol in symbols:
+        if symbol not in results and symbol not in errors:
+            errors[symbol] = CANCELLED_ERROR
+    return results, errors
+
+
+# Technical analysis for many stocks at once. Instead of one download per stock, the prices that are missing in the
+# local price store are downloaded for up to chunk_size symbols with one request.
+# Input is a list of yahoo finance symbol strings, for example ['AAPL', 'VOLV-B.ST'].
+# The currency needs one extra request per stock, so it is only fetched if include_currency is True. Otherwise the
+# currency in the returned results will be None. The currencies of the whole batch are fetched at the same time.
+#
+# The function returns two dictionaries, (results, errors). results has the symbols that could be analyzed as keys and
+# the same TechnicalResult records as technical_analysis returns as values. errors has the symbols that failed as keys and a string
+# describing the error as values. Every symbol will be in exactly one of the dictionaries.
+#
+# If cancel_event (a threading.Event) is set while the batch runs, the next download or calculation is skipped and
+# the stocks that are not done get the CANCELLED_ERROR, so that a cancelled comparison does not keep downloading.
+def technical_analysis_batch(symbols, chunk_size=BATCH_CHUNK_SIZE, include_currency=False, provider=None,
+                             cancel_event=None):
+    results = {}
+    errors = {}
+
+    # Remove duplicate symbols but keep the order
+    symbols = list(dict.fromkeys(symbols))
+
+    # The dow jones prices are the same for all stocks, get them once from the cache
+    try:
+        dow_jones_data = fetch_index_prices(BENCHMARK_PERIOD, provider)
+    except Exception as e:
+        # Without the index no stock can be analyzed
+        for symbol in symbols:
+            errors[symbol] = 'Could not get index prices: ' + str(e)
+        return results, errors
+    if is_cancelled(cancel_event):
+        return cancel_remaining(symbols, results, errors)
+
+    # Read the prices for all the symbols from the local price store into one price panel. The missing prices are
+    # downloaded with one request per chunk of chunk_size symbols
+    try:
+        with span('technical_batch.fetch'):
+            price_panel = fetch_price_panel(symbols, BENCHMARK_PERIOD, provider, chunk_size)
+    except Exception as e:
+        for symbol in symbols:
+            errors[symbol] = str(e)
+        return results, errors
+    if is_cancelled(cancel_event):
+        return cancel_remaining(symbols, results, errors)
+
+    # Calculate the technical values for all the symbols at once from the aligned price panel
+    with span('technical_batch.compute'):
+        technical_panel = calculate_technical_panel(price_panel, dow_jones_data)
+
+    # Get the currencies of all the analyzed stocks at once, only if they were asked for
+    currency_by_symbol = {}
+    if include_currency and not is_cancelled(cancel_event):
+        analyzed_symbols = [symbols[symbol_idx] for symbol_idx in range(len(symbols))
+                            if not np.isnan(technical_panel['beta_assignment'][symbol_idx])]
+        try:
+            with span('technical_batch.fetch_currency'):
+                currency_by_symbol = fetch_currencies(analyzed_symbols, provider)
+        except Exception as e:
+            logger.warning('Could not get currencies: %s', e)
+
+    for symbol_idx in range(len(symbols)):
+        if is_cancelled(cancel_event):
+            return cancel_remaining(symbols, results, errors)
+        symbol = symbols[symbol_idx]
+
+        # Stocks without any prices get NaN
+        if np.isnan(technical_panel['beta_assignment'][symbol_idx]):
+            errors[symbol] = 'No price data found for ' + symbol
+            continue
+
+        # A stock without a currency fails only if the currency was asked for
+        currency = currency_by_symbol.get(symbol)
+        if include_currency and currency is None:
+            errors[symbol] = 'No currency found for ' + symbol
+            continue
+
+        results[symbol] = technical_result(technical_panel, symbol_idx, currency)
+
+    return results, errors
+
+
+# Calculates the rolling return statistics (beta, correlation, volatility and alpha against the market index for
+# every window in ROLLING_WINDOWS) for many stocks at once from the daily prices during STATISTICS_PERIOD.
+# Input is a list of yahoo finance symbol strings, the missing prices are downloaded for up to chunk_size symbols
+# with one request.
+#
+# The function returns two dictionaries, (results, errors), like technical_analysis_batch. The values in results are
+# dictionaries with the metric names, for example 'beta_60', as keys and the statistics as values. Statistics that
+# need a longer history than the stock has are NaN. cancel_event works like in technical_analysis_batch.
+def return_statistics_batch(symbols, chunk_size=BATCH_CHUNK_SIZE, provider=None, cancel_event=None):
+    results = {}
+    errors = {}
+
+    # Remove duplicate symbols but keep the order
+    symbols = list(dict.fromkeys(symbols))
+
+    # The index prices are the same for all stocks, get them once from the cache
+    try:
+        index_data = fetch_index_prices(STATISTICS_PERIOD, provider)
+    except Exception as e:
+        for symbol in symbols:
+            errors[symbol] = 'Could not get index prices: ' + str(e)
+        return results, errors
+    if is_cancelled(cancel_event):
+        return cancel_remaining(symbols, results, errors)
+
+    try:
+        with span('statistics_batch.fetch'):
+            price_panel = fetch_price_panel(symbols, STATISTICS_PERIOD, provider, chunk_size)
+    except Exception as e:
+        for symbol in symbols:
+            errors[symbol] = str(e)
+        return results, errors
+    if is_cancelled(cancel_event):
+        return cancel_remaining(symbols, results, errors)
+
+    # The returns of the stocks and the index have to be from the same days, so the index is aligned to the days of
+    # the price panel. Days where the index has no price give NaN returns and are skipped in the statistics
+    with span('statistics_batch.compute'):
+        index_close = index_data['Close'].reindex(price_panel.date_index()).to_numpy(float)
+        latest_statistics = latest_return_statistics(price_panel.close, index_close)
+        has_prices = price_panel.has_prices()
+
+    for symbol_idx in range(len(symbols)):
+        if is_cancelled(cancel_event):
+            return cancel_remaining(symbols, results, errors)
+        symbol = symbols[symbol_idx]
+
+        if not has_prices[symbol_idx]:
+            errors[symbol] = 'No price data found for ' + symbol
+            continue
+
+        results[symbol] = {metric: float(latest_statistics[metric][symbol_idx]) for metric in latest_statistics}
+
+    return results, errors
+
+
+# Compares the stocks in stock_symbols according to metric, one of the names in RANKING_METRICS. By default the
+# "betavalue" from the assignment is used. stock_identifiers are the descriptions of the stocks
+# shown to the user and max_workers is the number of downloads that can run at the same time.
+# This function does all the slow network work of a comparison and is run in the background by BetaRankingPage.
+# Returns the list of tuples (symbol, score, description) from rank_stocks, sorted with the highest
+# score first. on_progress and cancel_event are given to rank_stocks, to show the ranking while it grows and to stop
+# the comparison early.
+# With processes larger than 1 the stocks are ranked in that many processes by rank_stocks_sharded instead, each with
+# max_workers downloads at the same time, for universes so large that the calculations are the slow part. The provider
+# is then sent to the processes, so it must be possible to pickle it.
+def run_stock_comparison(stock_symbols, stock_identifiers, max_workers=DEFAULT_MAX_WORKERS, metric=ASSIGNMENT_METRIC,
+                         provider=None, on_progress=None, cancel_event=None, processes=1):
+    # The assignment "betavalue" needs a month of prices, the return statistics more than a year
+    if metric == ASSIGNMENT_METRIC:
+        index_period = BENCHMARK_PERIOD
+    else:
+        index_period = STATISTICS_PERIOD
+
+    # Download the dow jones prices once before the workers start, so they all read them from the cache.
+    # If it fails here every stock will get an error and be ranked at the bottom as usual.
+    # A given provider has no cache, every worker reads the index from it
+    if provider is None:
+        try:
+            index_series_cache.get_series(BENCHMARK_INDEX_SYMBOL, index_period)
+        except Exception as e:
+            logger.warning('Could not get index prices: %s', e)
+
+    # Run the analysis for all stocks in a pool of workers and get them sorted by the metric
+    # Stocks where the analysis failed will get score 0 and be ranked at the bottom
+    # The functions are sent to the processes of a sharded ranking, so they can not be lambdas.
+    # In threads the running chunks also stop when cancel_event is set. An event can not be sent to other processes,
+    # there only the shards that have not started are cancelled
+    batch_arguments = {'provider': provider}
+    if processes <= 1:
+        batch_arguments['cancel_event'] = cancel_event
+    if metric == ASSIGNMENT_METRIC:
+        batch_analysis_function = functools.partial(technical_analysis_batch, **batch_arguments)
+        score_function = assignment_beta_score
+    else:
+        batch_analysis_function = functools.partial(return_statistics_batch, **batch_arguments)
+        score_function = operator.itemgetter(metric)
+
+    with span('compare.rank'):
+        if processes > 1:
+            beta_and_symbol_list = rank_stocks_sharded(stock_symbols, stock_identifiers, batch_analysis_function,
+                                                       processes=processes, max_workers=max_workers,
+                                                       chunk_size=BATCH_CHUNK_SIZE, score_function=score_function,
+                                                       on_progress=on_progress, cancel_event=cancel_event)
+        else:
+            beta_and_symbol_list = rank_stocks(stock_symbols, stock_identifiers, batch_analysis_function,
+                                               max_workers=max_workers, chunk_size=BATCH_CHUNK_SIZE,
+                                               score_function=score_function, on_progress=on_progress,
+                                               cancel_event=cancel_event)
+
+    if cancel_event is not None and cancel_event.is_set():
+        logger.info('Comparison cancelled after %d of %d stocks', len(beta_and_symbol_list), len(stock_symbols))
+    else:
+        logger.info('Ranked %d stocks by %s', len(beta_and_symbol_list), metric)
+    logger.debug('Index cache: %s', index_series_cache.statistics())
+
+    return beta_and_symbol_list
+
+
+# Input: dictionary with 'Symbol' key that corresponds to the yahoo symbol string used in their API and website.
+# For example 'AAPL' or 'SAAX' or 'VOLV-B.ST'
+# The method will the caluclate a set of fundamental values. The equity ratio, price_per_earnings for the
+# company (not stock), and lastly price per revenue (also for company).
+# The output will be a FundamentalResult consisting of these values represented as floats.
+# If the same stock is already being analyzed, for example on another page, the result (or error) of that analysis is
+# returned
+def fundamental_analysis(stock_data, provider=None):
+    return fundamental_flight.run((stock_data['Symbol'], provider), run_fundamental_analysis, stock_data, provider)
+
+
+# Runs the fundamental analysis for fundamental_analysis, same arguments and return value
+def run_fundamental_analysis(stock_data, provider=None):
+
+    # Run fundamental analysis
+
+    # Get the balance sheet and income statement for the latest fiscal year. Both are downloaded with one request
+    # and stored on disk, so they are only downloaded again when a newer fiscal year may have been published
+    with span('fundamental.fetch'):
+        fiscal_period, balance_sheet_latest_year_for_this_stock, income_statement_latest_year_for_this_stock = \
+            fetch_statements(stock_data['Symbol'], provider)
+    logger.debug('Fiscal period of %s: %s', stock_data['Symbol'], fiscal_period)
+
+    with span('fundamental.compute'):
+        # Calculate solidity
+        total_shareholder_equity = balance_sheet_latest_year_for_this_stock['totalStockholderEquity']
+        total_assets = balance_sheet_latest_year_for_this_stock['totalAssets']
+
+        # Equity ratio ~ soliditet
+        equity_ratio = total_shareholder_equity / total_assets
+
+        # Calulate p/e
+
+        # Get net income for the latest fiscal year
+        net_income = income_statement_latest_year_for_this_stock['netIncome']
+
+        # Calculate price per earnings by dividing total shareholder equity by net income
+        price_per_earnings = total_shareholder_equity / net_income
+
+        # Calculate price per revenue by dividing total shareholder equity with total_revenue
+        total_revenue = income_statement_latest_year_for_this_stock['totalRevenue']
+        price_per_revenue = total_shareholder_equity / total_revenue
+
+    logger.debug('Fundamental values of %s: equity ratio %s, p/e %s, p/s %s', stock_data['Symbol'], equity_ratio,
+                 price_per_earnings, price_per_revenue)
+
+    return FundamentalResult(equity_ratio, price_per_earnings, price_per_revenue)
+
+
+# Copyright 2020 Oliver Midbrink
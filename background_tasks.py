@@ -0,0 +1,213 @@
+# For running the slow network and analysis work in other threads than the tkinter main thread
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# For measuring how long the result handling has taken during one poll
+import time
+
+# How often (in milliseconds) the tkinter main thread checks for finished tasks
+POLL_INTERVAL_MS = 20
+
+# Longest time (in seconds) that finished tasks are handled during one poll, so that the GUI keeps
+# drawing even if a lot of tasks finish at the same time
+POLL_TIME_BUDGET = 0.015
+
+# Number of tasks that can run at the same time
+DEFAULT_MAX_WORKERS = 24
+
+logger = logging.getLogger(__name__)
+
+
+# A handle for a task that has been submitted to a BackgroundTaskExecutor. It can be used to cancel the task.
+# Functions that run for a long time can check is_cancelled() and stop early, and can send results that are not
+# final to the main thread with report_progress().
+class BackgroundTask:
+
+    # Initialize the task. channel is the channel it was submitted on, result_queue is the queue of the executor,
+    # on_progress is called in the main thread with the values given to report_progress and on_cancel is called in
+    # the main thread if the task is cancelled before its result has been handled
+    def __init__(self, channel, result_queue=None, on_progress=None, on_cancel=None):
+        self.channel = channel
+        self.result_queue = result_queue
+        self.on_progress = on_progress
+        self.on_cancel = on_cancel
+
+        # Set when the task is cancelled or replaced by a newer task on the same channel
+        self.cancel_event = threading.Event()
+
+        # The concurrent.futures future of the task, set when the task has been submitted
+        self.future = None
+
+    # Cancels the task. If it has not started it never will, otherwise its result is thrown away
+    def cancel(self):
+        self.cancel_event.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    # Returns True if the task has been cancelled
+    def is_cancelled(self):
+        return self.cancel_event.is_set()
+
+    # Called from the worker thread. Has on_progress called in the main thread with value, unless the task has been
+    # cancelled. The task keeps running
+    def report_progress(self, value):
+        if self.on_progress is not None and not self.is_cancelled():
+            self.result_queue.put((self, self.on_progress, value, False))
+
+
+# Executor that runs functions in a pool of worker threads and hands the results back to the tkinter main thread.
+# The main thread polls a queue with after(), so no tkinter widget is ever touched from a worker thread.
+#
+# Every task is submitted on a channel, which can be any hashable value, for example (frame, 'search').
+# A new task on a channel replaces the old ones: they are cancelled and their results are thrown away.
+# This makes sure that an old search never overwrites the results of a newer one.
+# Tasks that are cancelled with cancel or cancel_all, for example when the user goes to another page, have their
+# on_cancel called instead of on_success or on_error, so that the page can hide its loading labels and the like.
+# Tasks that are replaced by a newer task on the same channel do not, the newer task takes over the widgets.
+# cancel and cancel_all must be called from the main thread.
+class BackgroundTaskExecutor:
+
+    # Initialize the executor. root is the tkinter object whose after() method is used for polling
+    def __init__(self, root, max_workers=DEFAULT_MAX_WORKERS):
+        self.root = root
+
+        # Worker threads that run the tasks
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='background-task')
+
+        # Queue with finished tasks, filled by the workers and emptied by the main thread
+        self.result_queue = queue.Queue()
+
+        # Dictionary with channel as key and the set of active tasks on the channel as value
+        self.active_tasks = {}
+
+        # Lock for active_tasks
+        self.lock = threading.Lock()
+
+        # Start polling for finished tasks
+        self.after_id = self.root.after(POLL_INTERVAL_MS, self.poll_results)
+
+    # Runs function with the arguments args in a worker thread. The tasks already running on channel are cancelled.
+    # When the function has returned, on_success is called in the main thread with the return value as argument.
+    # If the function raises an exception, on_error is called in the main thread with the exception as argument.
+    # If pass_task is True the BackgroundTask is given to function as the keyword argument task, so that
+    # it can check if it has been cancelled and report progress. on_progress is called in the main thread with the
+    # values the function gives to task.report_progress. on_cancel is called in the main thread without arguments if
+    # the task is cancelled with cancel or cancel_all before on_success or on_error has been called.
+    # Returns the BackgroundTask handle
+    def submit(self, channel, function, args=(), on_success=None, on_error=None, pass_task=False, on_progress=None,
+               on_cancel=None):
+        task = BackgroundTask(channel, self.result_queue, on_progress, on_cancel)
+
+        # Replace the old tasks on this channel with the new one
+        with self.lock:
+            for old_task in self.active_tasks.get(channel, ()):
+                old_task.cancel()
+            self.active_tasks[channel] = {task}
+
+        task.future = self.executor.submit(self.run_task, task, function, args, on_success, on_error, pass_task)
+        return task
+
+    # Cancels all tasks on channel and calls their on_cancel
+    def cancel(self, channel):
+        with self.lock:
+            cancelled_tasks = list(self.active_tasks.pop(channel, ()))
+            for task in cancelled_tasks:
+                task.cancel()
+
+        self.call_on_cancel(cancelled_tasks)
+
+    # Cancels all tasks on all channels and calls their on_cancel, for example when the user navigates to another page
+    def cancel_all(self):
+        with self.lock:
+            cancelled_tasks = [task for tasks in self.active_tasks.values() for task in tasks]
+            for task in cancelled_tasks:
+                task.cancel()
+            self.active_tasks.clear()
+
+        self.call_on_cancel(cancelled_tasks)
+
+    # Calls on_cancel of the cancelled_tasks that have one. Called in the main thread without holding the lock, so
+    # that on_cancel can submit new tasks
+    def call_on_cancel(self, cancelled_tasks):
+        for task in cancelled_tasks:
+            if task.on_cancel is None:
+                continue
+
+            # An error in one callback should not stop the others
+            try:
+                task.on_cancel()
+            except Exception:
+                logger.exception('Error in background task cancel callback')
+
+    # Returns the number of tasks that have been submitted but not yet handled by the main thread
+    def active_task_count(self):
+        with self.lock:
+            return sum(len(tasks) for tasks in self.active_tasks.values())
+
+    # Runs in a worker thread. Runs the function and puts the outcome in the result queue
+    def run_task(self, task, function, args, on_success, on_error, pass_task):
+        # Do not even start if the task was cancelled while waiting in the queue
+        if task.is_cancelled():
+            return
+
+        try:
+            if pass_task:
+                result = function(*args, task=task)
+            else:
+                result = function(*args)
+            self.result_queue.put((task, on_success, result, True))
+        except Exception as e:
+            self.result_queue.put((task, on_error, e, True))
+
+    # Runs in the main thread every POLL_INTERVAL_MS. Calls the callbacks of the finished tasks that have not been
+    # cancelled, but only for POLL_TIME_BUDGET seconds so the GUI does not freeze
+    def poll_results(self):
+        poll_start = time.perf_counter()
+
+        while time.perf_counter() - poll_start < POLL_TIME_BUDGET:
+            try:
+                task, callback, value, is_final = self.result_queue.get_nowait()
+            except queue.Empty:
+                break
+
+            # Remove the task from the active tasks when it is done, if it is not there it has been replaced or
+            # cancelled. Progress reports leave the task active
+            with self.lock:
+                channel_tasks = self.active_tasks.get(task.channel, set())
+                is_current = task in channel_tasks and not task.is_cancelled()
+                if is_final:
+                    channel_tasks.discard(task)
+                    if not channel_tasks:
+                        self.active_tasks.pop(task.channel, None)
+
+            # Throw away stale results
+            if not is_current:
+                continue
+
+            # An error in one callback should not stop the polling
+            try:
+                if callback is not None:
+                    callback(value)
+                elif isinstance(value, Exception):
+                    logger.error('Error in background task: %s', value)
+            except Exception:
+                logger.exception('Error in background task callback')
+
+        # Check again soon
+        self.after_id = self.root.after(POLL_INTERVAL_MS, self.poll_results)
+
+    # Stops polling, cancels all tasks and lets the worker threads finish in the background. on_cancel is not
+    # called, the widgets are being destroyed
+    def shutdown(self):
+        with self.lock:
+            for tasks in self.active_tasks.values():
+                for task in tasks:
+                    task.cancel()
+            self.active_tasks.clear()
+        self.root.after_cancel(self.after_id)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Copyright 2020 Oliver Midbrink
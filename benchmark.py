@@ -0,0 +1,1314 @@
+# Benchmarks for the performance of the app. Run with python benchmark.py <benchmark>, the results are printed as
+# JSON. With --check the exit code is 1 if a result is worse than its target, so the benchmarks can be used as
+# regression tests.
+#
+# Benchmarks:
+#   startup   import time of the app and time until the menu is painted
+#   parse     time and peak memory to parse a lookup page of the same size as the real one, the way the app does
+#             and by parsing the whole page as the app used to
+#   search_table  time to show 10, 100 and 1000 search results in the results table of a StockSelectorFrame and the
+#             number of widgets it has afterwards, needs a display
+#   listframe number of widgets on the BetaRankingPage before and after 1000 cycles of adding stocks and restarting
+#             the comparison, and of a ListFrame before and after 1000 updates of its rows, needs a display
+#   workers   ranking of a universe of stocks from an in-memory data provider with a delay, with 1 to 16 workers,
+#             with the speedup over one worker
+#   pipeline  search, technical analysis, fundamental analysis and comparison of universes of 1 to 5000 stocks
+#             against a local fake yahoo finance server (fake_yahoo.py), with throughput, p50/p95/p99 latency and
+#             peak memory for every universe size
+#   providers price downloads for universes of stocks from the fake yahoo finance server with the asynchronous
+#             YahooProvider (many requests on one event loop) against one thread per request, and a whole ranking
+#             with the provider
+#   memory    peak memory (RSS) of ranking universes of stocks from a filled price store, with the prices in one
+#             pandas dataframe per stock and tuple results (how the app used to work) against the compact PricePanel
+#             and the TechnicalResult records
+#   ratelimit requests for universes of stocks from a fake yahoo finance server that enforces a quota, with and
+#             without the adaptive rate limiter, with the number of failed and throttled requests
+#   sharded   ranking of universes of stocks from a filled price store with threads (rank_stocks) against processes
+#             (rank_stocks_sharded), with the speedup and if both give the same ranking
+#   directory time to build and load the index of synthetic symbol directories and p50/p95/p99 latency of searches
+#             in them, for the index alone and with the result dataframe
+#   screener  time to load the statements of universes of stocks into the screener from the fake yahoo finance server
+#             and to load the saved columns, and p50/p95/p99 latency of screener queries
+#   snapshots time to save synthetic rankings as snapshots, and p50/p95/p99 latency of opening them with all their
+#             rows and of comparing two of them
+#
+# Examples:
+#   python benchmark.py pipeline --sizes 1 100 5000 --latency 0.02 --error-rate 0.01 --output results.json
+#   python benchmark.py providers --sizes 100 1000 --latency 0.05
+#   python benchmark.py memory --sizes 5000 --check
+#   python benchmark.py ratelimit --sizes 1000 --latency 0.02 --quota-rate 150 --max-concurrent 16
+#   python benchmark.py sharded --sizes 1000 5000 --processes 16 --check
+#   python benchmark.py directory --sizes 100000 --check
+#   python benchmark.py screener --sizes 10000 --check
+#   python benchmark.py snapshots --sizes 10000 --check
+#   python benchmark.py startup --check
+#   python benchmark.py search_table listframe --check
+#   python benchmark.py workers --latency 0.05 --check
+
+# For reading the command line arguments and printing the results
+import argparse
+import json
+
+# Every measurement is done in a new python process, so that nothing is already imported or cached
+import os
+import subprocess
+import sys
+
+# For timing, the operations of the pipeline benchmark are run in a pool of threads like in the app
+import platform
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+
+# For the peak memory use of a process, and of single operations
+import resource
+import tracemalloc
+
+# Directory of the app, the measurements are run from here
+APP_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# The menu should be visible within this many milliseconds after python has started
+FIRST_PAINT_TARGET_MS = 300
+
+# Number of times each startup measurement is repeated, the median is reported
+STARTUP_REPETITIONS = 5
+
+# Number of times the lookup page is parsed in the parse benchmark, fewer times with the slow parsing of the whole
+# page that the app used to do
+PARSE_REPETITIONS = 20
+BASELINE_PARSE_REPETITIONS = 3
+
+# The parsing of the app should be at least this many times faster than parsing the whole page
+PARSE_SPEEDUP_TARGET = 5.0
+
+# Quota of the fake server in the ratelimit benchmark if nothing else is given, requests per second and concurrent
+# requests
+DEFAULT_QUOTA_RATE = 150.0
+DEFAULT_MAX_CONCURRENT = 16
+
+# Number of threads that send requests in the ratelimit benchmark, more than the quota allows
+RATE_LIMIT_WORKERS = 64
+
+# The ranking of the largest universe in the memory benchmark should use this many times less memory with the
+# compact representation than with dataframes
+MEMORY_REDUCTION_TARGET = 4.0
+
+# Ways of holding the prices and results compared in the memory benchmark
+MEMORY_REPRESENTATIONS = ('frames', 'compact')
+
+# Metric that the memory benchmark ranks by. The return statistics need more than a year of prices per stock
+MEMORY_METRIC = 'beta_60'
+
+# Price types in the panels of the 'frames' representation, see build_price_panel
+FRAMES_PRICE_TYPES = ('Open', 'High', 'Low', 'Close')
+
+# Numbers of search results shown in the search_table benchmark, the number of times each is shown and the largest
+# median time in milliseconds to show the most results that passes
+SEARCH_TABLE_ROWS = (10, 100, 1000)
+SEARCH_TABLE_REPETITIONS = 10
+SEARCH_TABLE_RENDER_TARGET_MS = 200.0
+
+# Number of add and restart cycles and of row updates in the listframe benchmark, and the largest number of rows
+# that a ListFrame shows in it
+LIST_FRAME_CYCLES = 1000
+LIST_FRAME_MAX_ROWS = 20
+
+# Worker counts of the workers benchmark, the number of stocks ranked and the number of stocks per chunk, so that
+# there are more chunks than workers
+WORKER_COUNTS = (1, 2, 4, 8, 16)
+WORKERS_UNIVERSE_SIZE = 64
+WORKERS_CHUNK_SIZE = 2
+
+# Seconds every call to the in-memory provider of the workers benchmark waits if no --latency is given
+WORKERS_LATENCY = 0.05
+
+# The speedup with n workers should be at least this share of n (linear speedup is 1.0)
+WORKERS_EFFICIENCY_TARGET = 0.7
+
+# Metric that the sharded benchmark ranks by, the return statistics are the heaviest calculation
+SHARDED_METRIC = 'beta_60'
+
+# Universe sizes of the pipeline benchmark if nothing else is given
+DEFAULT_UNIVERSE_SIZES = (1, 10, 100, 1000, 5000)
+
+# Number of symbols in the directories of the directory benchmark if nothing else is given
+DEFAULT_DIRECTORY_SIZES = (10000, 100000)
+
+# Searches in the symbol directory should take less than this many milliseconds at p95, without the result dataframe
+DIRECTORY_SEARCH_TARGET_MS = 1.0
+
+# Number of searches timed in every directory
+DIRECTORY_SEARCHES = 600
+
+# Universe sizes of the screener benchmark, and the largest p95 latency in milliseconds of a screener query with the
+# result dataframe that passes
+DEFAULT_SCREENER_SIZES = (1000, 10000)
+SCREENER_QUERY_TARGET_MS = 5.0
+
+# The queries of the screener benchmark, each is run SCREENER_QUERY_REPETITIONS times
+SCREENER_QUERIES = ('equity ratio > 40% and p/s < 2, top 50', 'roe > 15%, sort by net margin, top 20',
+                    'p/e > 0 and p/e < 15 and equity ratio >= 30%, top 100', 'net margin < 0, all',
+                    'sort by return on assets desc, top 10')
+SCREENER_QUERY_REPETITIONS = 100
+
+# Ranking sizes of the snapshots benchmark, the number of times a snapshot is opened and compared, and the largest
+# p95 latency in milliseconds of opening a snapshot with all its rows that passes
+DEFAULT_SNAPSHOT_SIZES = (1000, 10000)
+SNAPSHOT_REPETITIONS = 20
+SNAPSHOT_OPEN_TARGET_MS = 50.0
+
+# Syllables of the names in the synthetic symbol directories
+NAME_SYLLABLES = ('ka', 'ro', 'vo', 'lu', 'mi', 'te', 'sa', 'no', 'ri', 'ba', 'de', 'fo', 'gu', 'ha', 'ji', 'le', 'mo',
+                  'pe', 'si', 'tu', 'vi', 'xa', 'ze', 'ar', 'en', 'ol', 'us', 'in')
+
+# Highest number of searches and single stock analyses timed per universe. The comparison always uses the whole
+# universe
+MAX_SEARCHES = 50
+MAX_SINGLE_ANALYSES = 500
+
+# Number of analyses that run at the same time in the pipeline benchmark, like in the app
+PIPELINE_WORKERS = 8
+
+# Program that is run in a new process to measure the time until the menu is painted. It prints the milliseconds
+# from the start of the process, or 'no display' if tkinter can not open a window
+FIRST_PAINT_PROGRAM = '''
+import time
+start_time = time.perf_counter()
+import tkinter
+import main
+try:
+    app = main.StockAnalysisApp()
+except tkinter.TclError:
+    print('no display')
+    raise SystemExit
+app.update_idletasks()
+app.update()
+print((time.perf_counter() - start_time) * 1000)
+app.close()
+'''
+
+
+# Returns the median of a non-empty list of numbers
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+
+    if len(values) % 2 == 1:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2
+
+
+# Imports module_name in a new python process with -X importtime.
+# Returns a dictionary with the total import time of the module in milliseconds and the slowest modules it imported
+def measure_import_time(module_name, slowest_count=10):
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module_name],
+                               cwd=APP_DIRECTORY, capture_output=True, text=True, check=True)
+
+    # The lines look like 'import time:       self |  cumulative | module', the module is indented by its depth
+    module_times = []
+    for line in completed.stderr.splitlines():
+        parts = line.split('|')
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        module_times.append((parts[2].strip(), int(parts[1]) / 1000, parts[2].startswith(' ' * 2)))
+
+    total_ms = sum(cumulative_ms for name, cumulative_ms, is_nested in module_times if not is_nested)
+    module_ms = [cumulative_ms for name, cumulative_ms, is_nested in module_times if name == module_name]
+
+    slowest = sorted(((name, cumulative_ms) for name, cumulative_ms, is_nested in module_times if not is_nested),
+                     key=lambda x: x[1], reverse=True)[:slowest_count]
+
+    return {'module': module_name, 'import_ms': module_ms[-1] if module_ms else total_ms,
+            'slowest_top_level_imports_ms': dict(slowest)}
+
+
+# Starts the app in a new process and returns the milliseconds until the menu was painted, or None if there is no
+# display to open a window on
+def measure_first_paint():
+    completed = subprocess.run([sys.executable, '-c', FIRST_PAINT_PROGRAM], cwd=APP_DIRECTORY, capture_output=True,
+                               text=True, check=True)
+    output = completed.stdout.strip().splitlines()[-1]
+
+    if output == 'no display':
+        return None
+    return float(output)
+
+
+# Measures the import time of the app and the time until the menu is painted, STARTUP_REPETITIONS times each.
+# Returns a dictionary with the results and if the first paint target was met
+def benchmark_startup(repetitions=STARTUP_REPETITIONS):
+    import_results = [measure_import_time('main') for repetition in range(repetitions)]
+    first_paint_times = [measure_first_paint() for repetition in range(repetitions)]
+
+    results = {
+        'import_main_ms': median([result['import_ms'] for result in import_results]),
+        'slowest_top_level_imports_ms': import_results[-1]['slowest_top_level_imports_ms'],
+        'first_paint_target_ms': FIRST_PAINT_TARGET_MS,
+    }
+
+    if None in first_paint_times:
+        # Without a display only the import time can be measured
+        results['first_paint_ms'] = None
+        results['passed'] = results['import_main_ms'] < FIRST_PAINT_TARGET_MS
+    else:
+        results['first_paint_ms'] = median(first_paint_times)
+        results['passed'] = results['first_paint_ms'] < FIRST_PAINT_TARGET_MS
+
+    return results
+
+
+# Opens the app for the benchmarks of the GUI. Returns the StockAnalysisApp, or None if there is no display to open a
+# window on
+def open_app():
+    import tkinter
+    import main
+
+    try:
+        return main.StockAnalysisApp()
+    except tkinter.TclError:
+        return None
+
+
+# Returns the number of widgets inside widget, counted through all the levels of children
+def count_widgets(widget):
+    return sum(1 + count_widgets(child) for child in widget.winfo_children())
+
+
+# Shows SEARCH_RESULT_COLUMNS dataframes with 10, 100 and 1000 search results (row_counts) in the results table of a
+# StockSelectorFrame, SEARCH_TABLE_REPETITIONS times each, as after a search.
+# Returns a dictionary with the median time to show and draw the results and the number of widgets in the frame
+# afterwards for every number of results. Without a display nothing can be measured and display is False
+def benchmark_search_table(row_counts=SEARCH_TABLE_ROWS):
+    app = open_app()
+    if app is None:
+        return {'display': False}
+
+    import pandas
+    from functional_frames import StockSelectorFrame
+    from stock_search import SEARCH_RESULT_COLUMNS
+
+    try:
+        selector = StockSelectorFrame(app.container, lambda stock_data: None, app, False)
+        selector.grid(row=1, column=0, sticky='nsew')
+        app.update()
+
+        results = {'render_target_ms': SEARCH_TABLE_RENDER_TARGET_MS, 'widgets_before': count_widgets(selector),
+                   'results': []}
+        for row_count in row_counts:
+            search_results = pandas.DataFrame([['SYM' + str(row_idx), 'Company ' + str(row_idx) + ' Inc.',
+                                                str(10 + row_idx % 90), 'Technology', 'Stocks', 'NMS']
+                                               for row_idx in range(row_count)], columns=SEARCH_RESULT_COLUMNS)
+
+            render_times = []
+            for repetition in range(SEARCH_TABLE_REPETITIONS):
+                start_time = time.perf_counter()
+                selector.display_search_results(search_results)
+                app.update_idletasks()
+                render_times.append(time.perf_counter() - start_time)
+
+            results['results'].append({'rows': row_count, 'render_median_ms': round(median(render_times) * 1000, 3),
+                                       'widgets': count_widgets(selector)})
+    finally:
+        app.close()
+
+    # The table only draws the visible rows, so the number of widgets must not depend on the number of results
+    results['passed'] = (len({size_results['widgets'] for size_results in results['results']}) == 1 and
+                         all(size_results['render_median_ms'] < SEARCH_TABLE_RENDER_TARGET_MS
+                             for size_results in results['results']))
+    return results
+
+
+# Adds stocks to the comparison on the BetaRankingPage and restarts it, cycles times, and changes the rows of a
+# ListFrame between 0 and LIST_FRAME_MAX_ROWS rows cycles times. The widgets of the rows are reused, so the number of
+# widgets must be the same after all the cycles as after the first one.
+# Returns a dictionary with the number of widgets before and after the cycles and the time per cycle. Without a
+# display nothing can be measured and display is False
+def benchmark_list_frame(cycles=LIST_FRAME_CYCLES):
+    app = open_app()
+    if app is None:
+        return {'display': False}
+
+    from functional_frames import ListFrame
+    from pages import BetaRankingPage
+
+    stocks = [{'Symbol': 'SYM' + str(stock_idx), 'Name': 'Company ' + str(stock_idx)} for stock_idx in range(3)]
+
+    # Adds the stocks one at a time like the stock selector does and restarts the comparison
+    def add_and_restart(page):
+        for stock_data in stocks:
+            page.add_stock_to_ranking_list(stock_data)
+        page.start_or_restart_selected_stocks_frame()
+
+    # Shows a number of rows that changes every cycle, from none to LIST_FRAME_MAX_ROWS, and clears them
+    def update_rows(list_frame, cycle_idx):
+        list_frame.set_rows(['Row ' + str(row_idx) for row_idx in range(cycle_idx % (LIST_FRAME_MAX_ROWS + 1))])
+        list_frame.append_row('Last row')
+        list_frame.clear_rows()
+
+    try:
+        app.display_frame(BetaRankingPage)
+        page = app.frames[BetaRankingPage]
+        list_frame = ListFrame(page, 'Rows', [])
+
+        results = {'cycles': cycles}
+        for name, widget, cycle_function in (('add_and_restart', page, lambda cycle_idx: add_and_restart(page)),
+                                             ('update_rows', list_frame,
+                                              lambda cycle_idx: update_rows(list_frame, cycle_idx))):
+            # The first cycles create the widgets that are reused after that
+            for cycle_idx in range(LIST_FRAME_MAX_ROWS + 1):
+                cycle_function(cycle_idx)
+            app.update_idletasks()
+            widgets_before = count_widgets(widget)
+
+            start_time = time.perf_counter()
+            for cycle_idx in range(cycles):
+                cycle_function(cycle_idx)
+            app.update_idletasks()
+            cycle_seconds = (time.perf_counter() - start_time) / cycles
+
+            results[name] = {'widgets_before': widgets_before, 'widgets_after': count_widgets(widget),
+                             'cycle_ms': round(cycle_seconds * 1000, 3)}
+    finally:
+        app.close()
+
+    results['passed'] = all(results[name]['widgets_before'] == results[name]['widgets_after']
+                            for name in ('add_and_restart', 'update_rows'))
+    return results
+
+
+# Returns the value at percentile (0-100) of a list of numbers, with linear interpolation between the values
+def percentile(values, percentile_rank):
+    values = sorted(values)
+    if len(values) == 0:
+        return None
+
+    position = (len(values) - 1) * percentile_rank / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+# Returns a dictionary with the number of operations, the throughput and the p50, p95 and p99 latency in
+# milliseconds for a list of latencies in seconds, measured over total_seconds. items is the number of stocks that
+# were handled, if it differs from the number of operations
+def latency_summary(latencies, total_seconds, errors=0, items=None):
+    if items is None:
+        items = len(latencies)
+
+    return {
+        'operations': len(latencies),
+        'errors': errors,
+        'total_s': round(total_seconds, 4),
+        'throughput_per_s': round(items / total_seconds, 2) if total_seconds > 0 else None,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3) if latencies else None,
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3) if latencies else None,
+    }
+
+
+# Runs function for every argument in arguments with workers threads and times every call.
+# Returns the latency summary from latency_summary. A call that raises an exception or returns None counts as an error
+def time_operations(function, arguments, workers=PIPELINE_WORKERS):
+    def timed_call(argument):
+        start_time = time.perf_counter()
+        try:
+            failed = function(argument) is None
+        except Exception:
+            failed = True
+        return time.perf_counter() - start_time, failed
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        timings = list(executor.map(timed_call, arguments))
+    total_seconds = time.perf_counter() - start_time
+
+    return latency_summary([latency for latency, failed in timings], total_seconds,
+                           errors=sum(1 for latency, failed in timings if failed))
+
+
+# Returns the symbols of a universe with universe_size stocks, the same every run
+def universe_symbols(universe_size):
+    return ['SYM' + str(symbol_idx).zfill(4) for symbol_idx in range(universe_size)]
+
+
+# Runs the pipeline for one universe against the fake yahoo finance server at base_url, in this process with an
+# empty cache directory. This is run in a new process for every universe size, so that the peak memory is only for
+# that universe.
+# Returns a dictionary with the latency summaries of every stage and the peak memory use
+def run_universe(universe_size, base_url):
+    # Use an empty cache so that everything is downloaded from the fake server
+    cache_directory = tempfile.mkdtemp(prefix='stock_app_benchmark_')
+    os.environ['STOCK_APP_CACHE_DIR'] = cache_directory
+
+    # Import the heavy libraries before the timing starts, the import time is measured by the startup benchmark
+    import numpy
+    import pandas
+    import requests
+
+    import analysis
+    import fake_yahoo
+    import http_session
+    import price_store
+    import statement_store
+    import stock_search
+    from index_cache import index_series_cache
+
+    # Starts with an empty price store, no cached index series and no open connections, as when the app is started
+    # for the first time
+    def start_cold(database_name):
+        price_store.shared_price_store = price_store.PriceStore(
+            os.path.join(cache_directory, database_name), downloader=fake_yahoo.make_price_downloader(base_url))
+        index_series_cache.clear()
+
+        with http_session.shared_session_lock:
+            if http_session.shared_session is not None:
+                http_session.shared_session.close()
+            http_session.shared_session = None
+
+    # Point the app at the fake server
+    stock_search.LOOKUP_URL = base_url + '/lookup'
+    start_cold('prices.sqlite')
+    statement_store.shared_statement_store = statement_store.StatementStore(
+        os.path.join(cache_directory, 'statements.sqlite'),
+        downloader=fake_yahoo.make_statement_downloader(base_url))
+
+    symbols = universe_symbols(universe_size)
+    single_symbols = symbols[:MAX_SINGLE_ANALYSES]
+    keywords = ['company ' + str(keyword_idx) for keyword_idx in range(min(universe_size, MAX_SEARCHES))]
+
+    results = {'universe_size': universe_size}
+
+    # Searches that are not in the cache, one at a time like a user typing
+    results['search'] = time_operations(
+        lambda keyword: stock_search.search_stocks(keyword, use_cache=False, use_directory=False), keywords, workers=1)
+
+    # Technical analysis of single stocks with cold prices, as on the TechnicalAnalysisPage. The currency needs the
+    # real yahoo finance, so the batch function is used with one symbol and without currency
+    def technical_analysis_of_one(symbol):
+        stage_results, errors = analysis.technical_analysis_batch([symbol])
+        return stage_results.get(symbol)
+
+    results['technical_cold'] = time_operations(technical_analysis_of_one, single_symbols)
+    results['technical_warm'] = time_operations(technical_analysis_of_one, single_symbols)
+
+    # Fundamental analysis of single stocks, as on the FundamentalAnalysisPage
+    results['fundamental_cold'] = time_operations(lambda symbol: analysis.fundamental_analysis({'Symbol': symbol}),
+                                                  single_symbols)
+    results['fundamental_warm'] = time_operations(lambda symbol: analysis.fundamental_analysis({'Symbol': symbol}),
+                                                  single_symbols)
+
+    # Comparison of the whole universe, as done by compare_stocks on the BetaRankingPage. First with no prices stored
+    # and a new session, then again with all the prices stored
+    for stage_name in ('compare_cold', 'compare_warm'):
+        if stage_name == 'compare_cold':
+            start_cold('compare_prices.sqlite')
+
+        start_time = time.perf_counter()
+        ranking = analysis.run_stock_comparison(symbols, symbols, max_workers=PIPELINE_WORKERS)
+        total_seconds = time.perf_counter() - start_time
+        errors = sum(1 for symbol, score, description in ranking if description.startswith('Error'))
+        results[stage_name] = latency_summary([total_seconds], total_seconds, errors=errors, items=universe_size)
+
+    results['peak_rss_mib'] = peak_rss_mib()
+
+    return results
+
+
+# Downloads the prices of a universe with universe_size stocks from the chart endpoint of the fake yahoo finance
+# server at base_url, once with one thread per request and once with the asynchronous YahooProvider, both with at
+# most DEFAULT_MAX_CONCURRENCY requests at the same time, and then ranks the universe with the provider.
+# Like run_universe this is run in a new process for every universe size.
+# Returns a dictionary with the latency summaries of every stage
+def run_providers(universe_size, base_url):
+    os.environ['STOCK_APP_CACHE_DIR'] = tempfile.mkdtemp(prefix='stock_app_benchmark_')
+
+    import pandas
+
+    import analysis
+    from data_providers import (YahooProvider, chart_result_to_dataframe, run_sync, DEFAULT_MAX_CONCURRENCY,
+                                HAS_AIOHTTP)
+    from http_session import http_get
+    from index_cache import STATISTICS_PERIOD
+    from price_store import period_start_date
+
+    chart_url = base_url + '/v8/finance/chart/'
+    symbols = universe_symbols(universe_size)
+    start = period_start_date(STATISTICS_PERIOD)
+    params = {'period1': str(int(pandas.Timestamp(start).timestamp())), 'interval': '1d'}
+
+    results = {'universe_size': universe_size, 'concurrency': DEFAULT_MAX_CONCURRENCY}
+
+    # One blocking request per thread, DEFAULT_MAX_CONCURRENCY threads
+    def download_one(symbol):
+        chart = http_get(chart_url + symbol, params=params).json()
+        return chart_result_to_dataframe(chart['chart']['result'][0])
+
+    # Connect once before the timing, so that both ways start with a warm connection
+    download_one(symbols[0])
+    results['thread_per_request'] = time_operations(download_one, symbols, workers=DEFAULT_MAX_CONCURRENCY)
+
+    if not HAS_AIOHTTP:
+        results['async'] = 'aiohttp is not installed'
+        return results
+
+    provider = YahooProvider(chart_url=chart_url)
+
+    # Connect once before the timing, like the warm session of the threads
+    run_sync(provider.get_prices(symbols[:1], start))
+
+    start_time = time.perf_counter()
+    prices_by_symbol = run_sync(provider.get_prices(symbols, start))
+    total_seconds = time.perf_counter() - start_time
+    results['async'] = latency_summary([total_seconds], total_seconds, errors=universe_size - len(prices_by_symbol),
+                                       items=universe_size)
+    results['async_speedup'] = round(results['thread_per_request']['total_s'] / max(total_seconds, 1e-9), 2)
+
+    # The whole ranking by 60 day beta, with the prices read from the provider instead of the local store
+    start_time = time.perf_counter()
+    ranking = analysis.run_stock_comparison(symbols, symbols, max_workers=PIPELINE_WORKERS, metric='beta_60',
+                                            provider=provider)
+    total_seconds = time.perf_counter() - start_time
+    errors = sum(1 for symbol, score, description in ranking if description.startswith('Error'))
+    results['ranking_async'] = latency_summary([total_seconds], total_seconds, errors=errors, items=universe_size)
+
+    run_sync(provider.close())
+    return results
+
+
+# Returns the peak memory use (RSS) of this process so far in MiB
+def peak_rss_mib():
+    # ru_maxrss is in kilobytes on linux and in bytes on mac
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak_rss //= 1024
+    return round(peak_rss / 1024, 1)
+
+
+# Downloader of the price stores that are filled before a benchmark, nothing may be downloaded
+def no_downloads(symbols, start, interval):
+    raise RuntimeError('The price store of the benchmark is not filled')
+
+
+# Makes the app read the prices from the filled price store database at database_path. Also used as the initializer
+# of the processes of the sharded benchmark
+def use_filled_price_store(database_path):
+    import price_store
+    from index_cache import index_series_cache
+
+    price_store.shared_price_store = price_store.PriceStore(database_path, downloader=no_downloads)
+    index_series_cache.clear()
+
+
+# Fills a new price store database with the prices of the stocks of the largest universe in universe_sizes and the
+# index from a fake yahoo finance server, for the return statistics. Returns the path of the database
+def fill_price_store(universe_sizes):
+    import price_store
+    from fake_yahoo import FakeYahooServer, make_price_downloader
+    from index_cache import BENCHMARK_INDEX_SYMBOL, STATISTICS_PERIOD
+
+    database_path = os.path.join(tempfile.mkdtemp(prefix='stock_app_benchmark_'), 'prices.sqlite')
+
+    with FakeYahooServer() as server:
+        store = price_store.PriceStore(database_path, downloader=make_price_downloader(server.base_url))
+        store.refresh(universe_symbols(max(universe_sizes)) + [BENCHMARK_INDEX_SYMBOL],
+                      price_store.period_start_date(STATISTICS_PERIOD))
+    return database_path
+
+
+# Builds a float64 price panel the way the app did before price_panel.PricePanel, for the 'frames' representation
+# of the memory benchmark, from a dictionary with symbols as keys and price dataframes (with the columns Open, High, Low
+# and Close, one row per day) as values. The dataframes are aligned on the union of all their dates.
+# symbols gives the order of the rows, symbols without a dataframe get rows with only NaN.
+# Returns a dictionary with the price types as keys and 2-D float arrays (symbols x days) as values, and the
+# dates as a pandas DatetimeIndex.
+def build_price_panel(prices_by_symbol, symbols):
+    import numpy as np
+    import pandas as pd
+
+    # Row number of every symbol that has prices
+    symbol_rows = [(symbol_idx, prices_by_symbol[symbols[symbol_idx]]) for symbol_idx in range(len(symbols))
+                   if symbols[symbol_idx] in prices_by_symbol and len(prices_by_symbol[symbols[symbol_idx]]) > 0]
+
+    if len(symbol_rows) == 0:
+        dates = pd.DatetimeIndex([])
+        empty_panel = np.full((len(symbols), 0), np.nan)
+        return {price_type: empty_panel.copy() for price_type in FRAMES_PRICE_TYPES}, dates
+
+    # Position of the price types among the columns of each dataframe. Looking the names up is slow compared to the
+    # rest, and the dataframes from the price store all have the same columns, so it is only done once per layout
+    column_positions_by_layout = {}
+    for symbol_idx, stock_prices in symbol_rows:
+        layout = tuple(stock_prices.columns)
+        if layout not in column_positions_by_layout:
+            column_positions_by_layout[layout] = stock_prices.columns.get_indexer(FRAMES_PRICE_TYPES)
+
+    # Stack the prices and dates of all the stocks on top of each other as plain numpy arrays, so the rest can be done
+    # with a few whole-array operations
+    stacked_prices = np.concatenate([
+        stock_prices.to_numpy(float)[:, column_positions_by_layout[tuple(stock_prices.columns)]]
+        for symbol_idx, stock_prices in symbol_rows])
+    stacked_dates = np.concatenate([stock_prices.index.values for symbol_idx, stock_prices in symbol_rows])
+
+    # All the dates that any of the stocks has prices for, and the column in the panel for every stacked price row
+    unique_dates, panel_columns = np.unique(stacked_dates, return_inverse=True)
+    dates = pd.DatetimeIndex(unique_dates)
+
+    # Row (symbol) in the panel for every stacked price row
+    panel_rows = np.repeat([symbol_idx for symbol_idx, stock_prices in symbol_rows],
+                           [len(stock_prices) for symbol_idx, stock_prices in symbol_rows])
+
+    # One matrix per price type, all filled in at the same time (price types x symbols x days)
+    matrices = np.full((len(FRAMES_PRICE_TYPES), len(symbols), len(dates)), np.nan)
+    matrices[:, panel_rows, panel_columns] = stacked_prices.T
+
+    panel = {FRAMES_PRICE_TYPES[type_idx]: matrices[type_idx] for type_idx in range(len(FRAMES_PRICE_TYPES))}
+    return panel, dates
+
+
+# Ranks a universe with universe_size stocks by MEMORY_METRIC with the prices in the price store database at
+# database_path, which already has all the prices. representation is 'compact' for the analysis functions of the app
+# or 'frames' for the same calculation with one dataframe per stock, a float64 panel and tuple and dictionary results
+# with numpy values, like the app did before price_panel.PricePanel. This is run in a new process for every
+# universe size and representation, so that the peak memory is only for that ranking.
+# Returns a dictionary with the time of the ranking, the peak memory before it (the libraries and the index prices)
+# and the peak memory of the whole process
+def run_memory(universe_size, representation, database_path):
+    import numpy
+    import pandas
+
+    import analysis
+    import price_store
+    from index_cache import index_series_cache, BENCHMARK_INDEX_SYMBOL, STATISTICS_PERIOD
+    from indicators import latest_return_statistics
+    from ranking import rank_stocks
+
+    use_filled_price_store(database_path)
+    start = price_store.period_start_date(STATISTICS_PERIOD)
+
+    # The return statistics with one dataframe per stock
+    def frames_statistics_batch(symbols):
+        prices_by_symbol = price_store.get_price_store().get_prices_batch(symbols, start)
+        price_panel, dates = build_price_panel(prices_by_symbol, symbols)
+        index_close = index_series_cache.get_series(BENCHMARK_INDEX_SYMBOL, STATISTICS_PERIOD)['Close']
+        latest_statistics = latest_return_statistics(price_panel['Close'], index_close.reindex(dates).to_numpy(float))
+        return {symbols[symbol_idx]: {metric: latest_statistics[metric][symbol_idx] for metric in latest_statistics}
+                for symbol_idx in range(len(symbols)) if len(prices_by_symbol[symbols[symbol_idx]]) > 0}, {}
+
+    if representation == 'frames':
+        batch_analysis_function = frames_statistics_batch
+    else:
+        batch_analysis_function = analysis.return_statistics_batch
+
+    symbols = universe_symbols(universe_size)
+
+    # Read the index prices and run the calculation once before measuring, so that only the ranking is measured
+    batch_analysis_function(symbols[:1])
+    results = {'universe_size': universe_size, 'representation': representation,
+               'peak_rss_before_ranking_mib': peak_rss_mib()}
+
+    start_time = time.perf_counter()
+    ranking = rank_stocks(symbols, symbols, batch_analysis_function, max_workers=PIPELINE_WORKERS,
+                          chunk_size=universe_size, score_function=lambda statistics: statistics[MEMORY_METRIC])
+    results['ranking_s'] = round(time.perf_counter() - start_time, 3)
+    results['errors'] = sum(1 for symbol, score, description in ranking if description.startswith('Error'))
+
+    results['peak_rss_mib'] = peak_rss_mib()
+    results['ranking_rss_mib'] = round(results['peak_rss_mib'] - results['peak_rss_before_ranking_mib'], 1)
+    return results
+
+
+# Runs the memory benchmark: fills a price store with the prices of the largest universe from a fake yahoo finance
+# server, then ranks every universe once per representation in MEMORY_REPRESENTATIONS, each in a new process.
+# The memory of a ranking is the growth of the peak RSS during it, the libraries and the index prices are left out.
+# Returns a dictionary with the results of every universe and representation, and if the compact representation
+# used MEMORY_REDUCTION_TARGET times less memory than the dataframes for the largest universe
+def benchmark_memory(universe_sizes=DEFAULT_UNIVERSE_SIZES):
+    database_path = fill_price_store(universe_sizes)
+
+    results = {'metric': MEMORY_METRIC, 'target_reduction': MEMORY_REDUCTION_TARGET, 'universes': []}
+    for universe_size in universe_sizes:
+        universe_results = {'universe_size': universe_size}
+
+        for representation in MEMORY_REPRESENTATIONS:
+            completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--run-memory', str(universe_size),
+                                        '--representation', representation, '--database', database_path],
+                                       cwd=APP_DIRECTORY, capture_output=True, text=True)
+
+            if completed.returncode != 0:
+                universe_results[representation] = {'failed': completed.stderr.strip().splitlines()[-1:]}
+                continue
+
+            universe_results[representation] = json.loads(completed.stdout.strip().splitlines()[-1])
+
+        if 'ranking_rss_mib' in universe_results['frames'] and 'ranking_rss_mib' in universe_results['compact']:
+            universe_results['reduction'] = round(universe_results['frames']['ranking_rss_mib'] /
+                                                  max(universe_results['compact']['ranking_rss_mib'], 0.1), 1)
+        results['universes'].append(universe_results)
+
+    results['passed'] = results['universes'][-1].get('reduction', 0) >= MEMORY_REDUCTION_TARGET
+    return results
+
+
+# Runs the pipeline benchmark for every universe size against a fake yahoo finance server with the latency and
+# error rate given. Every universe size is run in a new process.
+# Returns a dictionary with the settings and the results of every universe size
+def benchmark_pipeline(universe_sizes=DEFAULT_UNIVERSE_SIZES, latency=0.0, latency_jitter=0.0, error_rate=0.0,
+                       fixture_directory=None):
+    from fake_yahoo import FakeYahooServer
+
+    results = {'latency_s': latency, 'latency_jitter_s': latency_jitter, 'error_rate': error_rate,
+               'universes': []}
+
+    with FakeYahooServer(latency=latency, latency_jitter=latency_jitter, error_rate=error_rate,
+                         fixture_directory=fixture_directory) as server:
+        for universe_size in universe_sizes:
+            completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--run-universe',
+                                        str(universe_size), '--base-url', server.base_url],
+                                       cwd=APP_DIRECTORY, capture_output=True, text=True)
+
+            if completed.returncode != 0:
+                results['universes'].append({'universe_size': universe_size,
+                                             'failed': completed.stderr.strip().splitlines()[-1:]})
+                continue
+
+            results['universes'].append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+        results['requests'] = dict(server.request_counts)
+        results['injected_errors'] = server.error_count
+
+    return results
+
+
+# Runs the providers benchmark for every universe size against a fake yahoo finance server with the latency and
+# error rate given. Every universe size is run in a new process, so that the server does not share the interpreter
+# with the downloads.
+# Returns a dictionary with the settings and the results of every universe size
+def benchmark_providers(universe_sizes=DEFAULT_UNIVERSE_SIZES, latency=0.0, latency_jitter=0.0, error_rate=0.0,
+                        fixture_directory=None):
+    from fake_yahoo import FakeYahooServer
+
+    results = {'latency_s': latency, 'latency_jitter_s': latency_jitter, 'error_rate': error_rate,
+               'universes': []}
+
+    with FakeYahooServer(latency=latency, latency_jitter=latency_jitter, error_rate=error_rate,
+                         fixture_directory=fixture_directory) as server:
+        for universe_size in universe_sizes:
+            completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--run-providers',
+                                        str(universe_size), '--base-url', server.base_url],
+                                       cwd=APP_DIRECTORY, capture_output=True, text=True)
+
+            if completed.returncode != 0:
+                results['universes'].append({'universe_size': universe_size,
+                                             'failed': completed.stderr.strip().splitlines()[-1:]})
+                continue
+
+            results['universes'].append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+        results['requests'] = dict(server.request_counts)
+        results['injected_errors'] = server.error_count
+
+    return results
+
+
+# Requests the chart of every stock in universes of universe_sizes stocks, one request per stock from
+# RATE_LIMIT_WORKERS threads, from a fake yahoo finance server that answers with 429 above quota_rate requests per
+# second or max_concurrent requests at the same time. Every universe is run once with the rate limiter turned off
+# (only the retries with backoff) and once with the adaptive rate limiter.
+# Returns a dictionary with the settings and, for every universe and limiter setting, the latency summary of the
+# requests, the number of 429 answers and the statistics of the limiter
+def benchmark_rate_limit(universe_sizes=DEFAULT_UNIVERSE_SIZES, latency=0.0, latency_jitter=0.0, error_rate=0.0,
+                         fixture_directory=None, quota_rate=DEFAULT_QUOTA_RATE, max_concurrent=DEFAULT_MAX_CONCURRENT):
+    import rate_limiter
+    from fake_yahoo import FakeYahooServer
+    from http_session import http_get
+
+    results = {'latency_s': latency, 'error_rate': error_rate, 'quota_rate': quota_rate,
+               'max_concurrent': max_concurrent, 'universes': []}
+
+    for universe_size in universe_sizes:
+        universe_results = {'universe_size': universe_size}
+
+        for limiter_name, enabled in (('without_limiter', False), ('with_limiter', True)):
+            # A new server for every run, so that both start with a full quota
+            with FakeYahooServer(latency=latency, latency_jitter=latency_jitter, error_rate=error_rate,
+                                 fixture_directory=fixture_directory, quota_rate=quota_rate,
+                                 max_concurrent=max_concurrent) as server:
+                rate_limiter.shared_rate_limiter = rate_limiter.AdaptiveRateLimiter(enabled=enabled)
+
+                run_results = time_operations(lambda symbol: http_get(server.chart_url + symbol,
+                                                                      params={'range': '1d'}),
+                                              universe_symbols(universe_size), workers=RATE_LIMIT_WORKERS)
+                run_results['throttled_answers'] = server.throttled_count
+                run_results['limiter'] = rate_limiter.shared_rate_limiter.statistics()
+                universe_results[limiter_name] = run_results
+
+        results['universes'].append(universe_results)
+
+    return results
+
+
+# Runs the sharded benchmark: fills a price store with the prices of the largest universe, then ranks every universe
+# by SHARDED_METRIC with threads in this process and with rank_stocks_sharded in processes processes (all the cores by
+# default). The time of the processes includes starting them.
+# Returns a dictionary with the times and the speedup for every universe, and if the rankings were the same
+def benchmark_sharded(universe_sizes=DEFAULT_UNIVERSE_SIZES, processes=None):
+    import operator
+
+    import analysis
+    from ranking import rank_stocks, rank_stocks_sharded
+
+    processes = processes or os.cpu_count() or 1
+    database_path = fill_price_store(universe_sizes)
+    use_filled_price_store(database_path)
+    score_function = operator.itemgetter(SHARDED_METRIC)
+
+    results = {'metric': SHARDED_METRIC, 'processes': processes, 'universes': []}
+    for universe_size in universe_sizes:
+        symbols = universe_symbols(universe_size)
+
+        start_time = time.perf_counter()
+        thread_ranking = rank_stocks(symbols, symbols, analysis.return_statistics_batch, max_workers=PIPELINE_WORKERS,
+                                     chunk_size=analysis.BATCH_CHUNK_SIZE, score_function=score_function)
+        thread_seconds = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        process_ranking = rank_stocks_sharded(symbols, symbols, analysis.return_statistics_batch, processes=processes,
+                                              max_workers=PIPELINE_WORKERS, chunk_size=analysis.BATCH_CHUNK_SIZE,
+                                              score_function=score_function, initializer=use_filled_price_store,
+                                              initargs=(database_path,))
+        process_seconds = time.perf_counter() - start_time
+
+        results['universes'].append({
+            'universe_size': universe_size,
+            'threads_s': round(thread_seconds, 3),
+            'processes_s': round(process_seconds, 3),
+            'speedup': round(thread_seconds / process_seconds, 2),
+            'errors': sum(1 for symbol, score, description in process_ranking if description.startswith('Error')),
+            'same_ranking': process_ranking == thread_ranking,
+        })
+
+    results['passed'] = all(universe_results['same_ranking'] for universe_results in results['universes'])
+    return results
+
+
+# Ranks WORKERS_UNIVERSE_SIZE stocks with rank_stocks and the technical analysis, reading the prices from an
+# InMemoryProvider where every call waits latency seconds, once for every number of workers in worker_counts. The
+# downloads are the slow part, so the ranking should be about n times faster with n workers.
+# Returns a dictionary with the time, speedup over one worker and efficiency (speedup per worker) for every number of
+# workers, and if all of them gave the same ranking
+def benchmark_workers(worker_counts=WORKER_COUNTS, latency=WORKERS_LATENCY):
+    import functools
+
+    import analysis
+    from data_providers import InMemoryProvider, chart_result_to_dataframe
+    from fake_yahoo import synthetic_chart_result
+    from ranking import rank_stocks
+
+    symbols = universe_symbols(WORKERS_UNIVERSE_SIZE)
+    prices_by_symbol = {symbol: chart_result_to_dataframe(synthetic_chart_result(symbol))
+                        for symbol in symbols + [analysis.BENCHMARK_INDEX_SYMBOL]}
+    provider = InMemoryProvider(prices_by_symbol, latency=latency)
+    batch_analysis_function = functools.partial(analysis.technical_analysis_batch, provider=provider)
+
+    results = {'stocks': WORKERS_UNIVERSE_SIZE, 'chunk_size': WORKERS_CHUNK_SIZE, 'latency_s': latency,
+               'efficiency_target': WORKERS_EFFICIENCY_TARGET, 'workers': []}
+    rankings = []
+    for worker_count in worker_counts:
+        start_time = time.perf_counter()
+        rankings.append(rank_stocks(symbols, symbols, batch_analysis_function, max_workers=worker_count,
+                                    chunk_size=WORKERS_CHUNK_SIZE))
+        results['workers'].append({'max_workers': worker_count, 'total_s': round(time.perf_counter() - start_time, 3)})
+
+    for worker_results in results['workers']:
+        speedup = results['workers'][0]['total_s'] / worker_results['total_s'] * worker_counts[0]
+        worker_results['speedup'] = round(speedup, 2)
+        worker_results['efficiency'] = round(speedup / worker_results['max_workers'], 2)
+
+    results['errors'] = sum(1 for symbol, score, description in rankings[0] if description.startswith('Error'))
+    results['same_ranking'] = all(ranking == rankings[0] for ranking in rankings)
+    results['passed'] = (results['same_ranking'] and results['errors'] == 0 and
+                         all(worker_results['efficiency'] >= WORKERS_EFFICIENCY_TARGET
+                             for worker_results in results['workers']))
+    return results
+
+
+# Writes a listing file with directory_size synthetic symbols to path, the same every run. The names are made of
+# NAME_SYLLABLES so that many of them share words and beginnings, like real company names.
+# Returns the list of (symbol, name) of the symbols
+def write_synthetic_listing(path, directory_size):
+    import csv
+    import random
+
+    generator = random.Random(directory_size)
+    listing = []
+    with open(path, 'w', newline='', encoding='utf-8') as listing_file:
+        writer = csv.writer(listing_file)
+        writer.writerow(['symbol', 'name', 'type', 'exchange', 'industry'])
+        for symbol_idx in range(directory_size):
+            words = [''.join(generator.choice(NAME_SYLLABLES) for syllable in range(generator.randint(2, 4)))
+                     for word in range(generator.randint(1, 3))]
+            name = ' '.join(word.title() for word in words) + ' ' + generator.choice(('Inc.', 'AB', 'Corp', 'Group'))
+            symbol = words[0][:generator.randint(2, 4)].upper() + str(symbol_idx)
+            writer.writerow([symbol, name, generator.choice(('Equity', 'Equity', 'Equity', 'ETF', 'Mutual Fund')),
+                             generator.choice(('NMS', 'NYQ', 'STO', 'LSE')), ''])
+            listing.append((symbol, name))
+    return listing
+
+
+# Returns search_count searches for the symbols in listing like the ones users type: whole symbols, the start of
+# symbols and names, two words of names and misspelled names
+def directory_searches(listing, search_count=DIRECTORY_SEARCHES):
+    import random
+
+    generator = random.Random(search_count)
+    searches = []
+    for search_idx in range(search_count):
+        symbol, name = generator.choice(listing)
+        words = name.lower().split()
+        kind = search_idx % 5
+        if kind == 0:
+            searches.append(symbol)
+        elif kind == 1:
+            searches.append(symbol[:2])
+        elif kind == 2:
+            searches.append(words[0][:generator.randint(3, len(words[0]))])
+        elif kind == 3:
+            searches.append(' '.join(word[:3] for word in words[:2]))
+        else:
+            # Two letters in the first word swapped
+            word = words[0]
+            swap_idx = generator.randrange(len(word) - 1)
+            searches.append(word[:swap_idx] + word[swap_idx + 1] + word[swap_idx] + word[swap_idx + 2:])
+    return searches
+
+
+# Builds symbol directories with every size in directory_sizes and times searches in them, the way the app searches
+# (only stocks, at most DEFAULT_RESULT_LIMIT results).
+# Returns a dictionary with the build and load times and the latency of the searches for every directory size, and
+# if all the searches met DIRECTORY_SEARCH_TARGET_MS
+def benchmark_directory(directory_sizes=DEFAULT_DIRECTORY_SIZES):
+    import symbol_directory
+    from stock_search import DIRECTORY_SEARCH_TYPES
+
+    results = {'search_target_ms': DIRECTORY_SEARCH_TARGET_MS}
+    for directory_size in directory_sizes:
+        listings_directory = tempfile.mkdtemp(prefix='stock_app_listings_')
+        listing = write_synthetic_listing(os.path.join(listings_directory, 'synthetic.csv'), directory_size)
+        searches = directory_searches(listing)
+
+        # Built from the listing file and saved, then loaded from the saved index by a new directory
+        start_time = time.perf_counter()
+        symbol_directory.SymbolDirectory(listings_directory).get_indexes()
+        build_seconds = time.perf_counter() - start_time
+
+        directory = symbol_directory.SymbolDirectory(listings_directory)
+        start_time = time.perf_counter()
+        index, scraped_index = directory.get_indexes()
+        load_seconds = time.perf_counter() - start_time
+
+        size_results = {'symbols': len(index), 'build_s': round(build_seconds, 3), 'load_s': round(load_seconds, 4),
+                        'index_bytes': os.path.getsize(directory.index_path())}
+        size_results['index_search'] = time_operations(
+            lambda keywords: index.search(keywords, types=DIRECTORY_SEARCH_TYPES), searches, workers=1)
+        size_results['search'] = time_operations(
+            lambda keywords: directory.search(keywords, types=DIRECTORY_SEARCH_TYPES), searches, workers=1)
+        results[directory_size] = size_results
+
+    results['passed'] = all(results[directory_size]['index_search']['p95_ms'] < DIRECTORY_SEARCH_TARGET_MS
+                            for directory_size in directory_sizes)
+    return results
+
+
+# Loads the statements of universes of stocks into the screener from a local fake yahoo finance server (the first load,
+# as with python screener.py load), saves the columns and loads them again, and runs screener queries on them.
+# Returns a dictionary with the load times and latency summaries of the queries for every universe size
+def benchmark_screener(universe_sizes=DEFAULT_SCREENER_SIZES, latency=0.0, latency_jitter=0.0, error_rate=0.0,
+                       fixture_directory=None):
+    from fake_yahoo import FakeYahooServer, make_statement_downloader
+    import screener
+    import statement_store
+
+    results = {'query_target_ms': SCREENER_QUERY_TARGET_MS}
+    queries = [screener.ScreenQuery.parse(query_text) for query_text in SCREENER_QUERIES] * SCREENER_QUERY_REPETITIONS
+
+    with FakeYahooServer(latency, latency_jitter, error_rate, fixture_directory) as server:
+        for universe_size in universe_sizes:
+            # An empty statement store, so that all the statements are downloaded
+            cache_directory = tempfile.mkdtemp(prefix='stock_app_screener_')
+            statement_store.shared_statement_store = statement_store.StatementStore(
+                os.path.join(cache_directory, 'statements.sqlite'),
+                downloader=make_statement_downloader(server.base_url))
+
+            start_time = time.perf_counter()
+            statement_columns = screener.load_universe(universe_symbols(universe_size), max_workers=PIPELINE_WORKERS)
+            load_seconds = time.perf_counter() - start_time
+
+            path = os.path.join(cache_directory, screener.SCREENER_FILE)
+            statement_columns.save(path)
+            start_time = time.perf_counter()
+            statement_columns = screener.StatementColumns.load(path)
+            reload_seconds = time.perf_counter() - start_time
+
+            universe_results = {'loaded': sum(1 for period in statement_columns.periods if period),
+                                'load_s': round(load_seconds, 3), 'reload_s': round(reload_seconds, 4),
+                                'file_bytes': os.path.getsize(path)}
+            universe_results['screen'] = time_operations(statement_columns.screen, queries, workers=1)
+            universe_results['query'] = time_operations(statement_columns.query, queries, workers=1)
+            results[universe_size] = universe_results
+
+    statement_store.shared_statement_store = None
+
+    results['passed'] = all(results[universe_size]['query']['p95_ms'] < SCREENER_QUERY_TARGET_MS
+                            for universe_size in universe_sizes)
+    return results
+
+
+# Returns a synthetic ranking of ranking_size stocks like from run_stock_comparison, the same for the same seed.
+# About one stock in a hundred is left out and one in a hundred failed, so that two rankings with different seeds
+# differ like the rankings of two days
+def synthetic_ranking(ranking_size, seed):
+    import numpy
+
+    generator = numpy.random.default_rng(seed)
+    symbols = universe_symbols(ranking_size)
+    scores = generator.normal(1.0, 0.5, ranking_size)
+    kept = generator.random(ranking_size) > 0.01
+    failed = generator.random(ranking_size) < 0.01
+
+    ranking = []
+    failed_ranking = []
+    for stock_idx in numpy.argsort(-scores, kind='stable').tolist():
+        if not kept[stock_idx]:
+            continue
+        identifier = 'Symbol: ' + symbols[stock_idx] + ' - Name: Company ' + str(stock_idx)
+        if failed[stock_idx]:
+            failed_ranking.append((symbols[stock_idx], 0, 'Error for this stock: ' + identifier))
+        else:
+            ranking.append((symbols[stock_idx], float(scores[stock_idx]), identifier))
+    return ranking + failed_ranking
+
+
+# Saves synthetic rankings of every size as snapshots, and measures opening them with all their rows as the
+# BetaRankingPage does and comparing the snapshots of two days.
+# Returns a dictionary with the save times and latency summaries of opening and comparing for every ranking size
+def benchmark_snapshots(ranking_sizes=DEFAULT_SNAPSHOT_SIZES):
+    import price_store
+    import snapshots
+
+    # Imported before the timing starts, the import time is measured by the startup benchmark
+    import pandas
+
+    # The snapshots are saved in an empty cache directory, and the cache directory of the app is used again after
+    cache_directory = price_store.CACHE_DIRECTORY
+    price_store.CACHE_DIRECTORY = tempfile.mkdtemp(prefix='stock_app_snapshots_')
+
+    results = {'open_target_ms': SNAPSHOT_OPEN_TARGET_MS}
+    for ranking_size in ranking_sizes:
+        names = ['yesterday-' + str(ranking_size), 'today-' + str(ranking_size)]
+
+        start_time = time.perf_counter()
+        for seed in range(len(names)):
+            snapshots.save_ranking(synthetic_ranking(ranking_size, seed), 'beta_assignment', names[seed])
+        save_seconds = (time.perf_counter() - start_time) / len(names)
+
+        size_results = {'save_s': round(save_seconds, 4),
+                        'snapshot_bytes': sum(os.path.getsize(os.path.join(snapshots.snapshot_path(names[1]), name))
+                                              for name in os.listdir(snapshots.snapshot_path(names[1])))}
+        size_results['open'] = time_operations(lambda name: snapshots.Snapshot.open(name).ranking(),
+                                               [names[1]] * SNAPSHOT_REPETITIONS, workers=1)
+        size_results['diff'] = time_operations(
+            lambda name: snapshots.diff_snapshots(snapshots.Snapshot.open(names[0]), snapshots.Snapshot.open(name)),
+            [names[1]] * SNAPSHOT_REPETITIONS, workers=1)
+        results[ranking_size] = size_results
+
+    price_store.CACHE_DIRECTORY = cache_directory
+
+    results['passed'] = all(results[ranking_size]['open']['p95_ms'] < SNAPSHOT_OPEN_TARGET_MS
+                            for ranking_size in ranking_sizes)
+    return results
+
+
+# Parses a lookup page the way the app used to: the whole page with the html parser that comes with python and then
+# every table row of it. Returns the same dataframe as parse_lookup_page, used as the baseline of the parse benchmark
+def parse_whole_lookup_page(html):
+    import pandas
+    from bs4 import BeautifulSoup
+    from stock_search import SEARCH_RESULT_COLUMNS
+
+    soup = BeautifulSoup(html, 'html.parser')
+
+    stock_result_list = []
+    for result in soup.find_all('tr')[1:]:
+        columns = result.find_all('td')
+        result_info = [columns[0].find('a').get_text().strip()] + [column.get_text() for column in columns[1:6]]
+        if 'Stocks' in result_info[4]:
+            stock_result_list.append(result_info)
+
+    return pandas.DataFrame(stock_result_list, columns=SEARCH_RESULT_COLUMNS)
+
+
+# Returns the median time in milliseconds of repetitions calls of function with page, and the peak memory in MiB
+# that python allocated during one more call
+def measure_parse(function, page, repetitions):
+    parse_times = []
+    for repetition in range(repetitions):
+        start_time = time.perf_counter()
+        function(page)
+        parse_times.append(time.perf_counter() - start_time)
+
+    # Measured separately, tracing the allocations makes the parsing slower
+    tracemalloc.start()
+    try:
+        function(page)
+        current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {'median_ms': round(median(parse_times) * 1000, 3), 'peak_mib': round(peak_bytes / 2 ** 20, 2)}
+
+
+# Measures how long it takes to parse a lookup page of the same size as the real one, and how much memory it takes:
+# the way the app used to (parse_whole_lookup_page), and with parse_lookup_page with the parser the app uses and with
+# the html parser that comes with python.
+# Returns a dictionary with the page size, the median parse time and peak memory per way of parsing, the speedup of
+# the app over the old way, and if all of them found the same stocks
+def benchmark_parse(repetitions=PARSE_REPETITIONS):
+    from fake_yahoo import synthetic_lookup_page
+    from stock_search import parse_lookup_page, HTML_PARSER
+
+    page = synthetic_lookup_page('apple').encode('utf-8')
+    results = {'page_bytes': len(page), 'app_parser': HTML_PARSER, 'speedup_target': PARSE_SPEEDUP_TARGET}
+
+    results['whole_page'] = measure_parse(parse_whole_lookup_page, page, BASELINE_PARSE_REPETITIONS)
+    for parser in dict.fromkeys((HTML_PARSER, 'html.parser')):
+        results['tables_' + parser] = measure_parse(lambda html: parse_lookup_page(html, parser), page, repetitions)
+
+    app_results = results['tables_' + HTML_PARSER]
+    results['speedup'] = round(results['whole_page']['median_ms'] / app_results['median_ms'], 1)
+    results['memory_reduction'] = round(results['whole_page']['peak_mib'] / max(app_results['peak_mib'], 0.01), 1)
+    results['same_results'] = all(parse_lookup_page(page, parser).equals(parse_whole_lookup_page(page))
+                                  for parser in dict.fromkeys((HTML_PARSER, 'html.parser')))
+
+    results['passed'] = results['same_results'] and results['speedup'] >= PARSE_SPEEDUP_TARGET
+    return results
+
+
+# The benchmarks that can be run, with the name used on the command line as key
+BENCHMARKS = {'startup': benchmark_startup, 'parse': benchmark_parse, 'search_table': benchmark_search_table,
+              'listframe': benchmark_list_frame, 'workers': benchmark_workers, 'pipeline': benchmark_pipeline,
+              'providers': benchmark_providers, 'ratelimit': benchmark_rate_limit, 'memory': benchmark_memory,
+              'sharded': benchmark_sharded, 'directory': benchmark_directory, 'screener': benchmark_screener,
+              'snapshots': benchmark_snapshots}
+
+
+# Runs the benchmarks given on the command line and prints the results as JSON. Returns the exit code
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run performance benchmarks of the app.')
+    parser.add_argument('benchmarks', nargs='*', help='benchmarks to run, all of them by default: ' +
+                        ', '.join(BENCHMARKS))
+    parser.add_argument('--check', action='store_true', help='exit with code 1 if a benchmark misses its target')
+    parser.add_argument('--output', '-o', help='also write the results as JSON to this file')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        help='universe sizes of the pipeline, providers, ratelimit, memory, sharded and screener '
+                             'benchmarks, directory sizes of the directory benchmark and ranking sizes of the '
+                             'snapshots benchmark')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds the fake server, or the in-memory provider of the workers benchmark, waits '
+                             'before answering')
+    parser.add_argument('--latency-jitter', type=float, default=0.0, help='up to this many seconds more at random')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with an error')
+    parser.add_argument('--fixtures', help='directory with recorded answers for the fake server')
+    parser.add_argument('--quota-rate', type=float, default=DEFAULT_QUOTA_RATE,
+                        help='requests per second the fake server allows in the ratelimit benchmark')
+    parser.add_argument('--max-concurrent', type=int, default=DEFAULT_MAX_CONCURRENT,
+                        help='concurrent requests the fake server allows in the ratelimit benchmark')
+    parser.add_argument('--processes', type=int, help='processes of the sharded benchmark, all the cores by default')
+
+    # Used by the pipeline and providers benchmarks to run one universe in a new process
+    parser.add_argument('--run-universe', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--run-providers', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--base-url', help=argparse.SUPPRESS)
+
+    # Used by the memory benchmark to run one ranking in a new process
+    parser.add_argument('--run-memory', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--representation', choices=MEMORY_REPRESENTATIONS, help=argparse.SUPPRESS)
+    parser.add_argument('--database', help=argparse.SUPPRESS)
+    arguments = parser.parse_args(argv)
+
+    if arguments.run_universe is not None:
+        # Libraries like yfinance sometimes print, only the results may go to stdout
+        stdout = sys.stdout
+        with redirect_stdout(sys.stderr):
+            universe_results = run_universe(arguments.run_universe, arguments.base_url)
+        print(json.dumps(universe_results), file=stdout)
+        return 0
+
+    if arguments.run_providers is not None:
+        stdout = sys.stdout
+        with redirect_stdout(sys.stderr):
+            universe_results = run_providers(arguments.run_providers, arguments.base_url)
+        print(json.dumps(universe_results), file=stdout)
+        return 0
+
+    if arguments.run_memory is not None:
+        stdout = sys.stdout
+        with redirect_stdout(sys.stderr):
+            universe_results = run_memory(arguments.run_memory, arguments.representation, arguments.database)
+        print(json.dumps(universe_results), file=stdout)
+        return 0
+
+    for benchmark_name in arguments.benchmarks:
+        if benchmark_name not in BENCHMARKS:
+            parser.error('unknown benchmark: ' + benchmark_name)
+
+    universe_sizes = arguments.sizes or list(DEFAULT_UNIVERSE_SIZES)
+
+    all_results = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+                   'platform': platform.platform()}
+    for benchmark_name in arguments.benchmarks or list(BENCHMARKS):
+        if benchmark_name in ('pipeline', 'providers'):
+            all_results[benchmark_name] = BENCHMARKS[benchmark_name](universe_sizes, arguments.latency,
+                                                                     arguments.latency_jitter, arguments.error_rate,
+                                                                     arguments.fixtures)
+        elif benchmark_name == 'memory':
+            all_results[benchmark_name] = benchmark_memory(universe_sizes)
+        elif benchmark_name == 'sharded':
+            all_results[benchmark_name] = benchmark_sharded(universe_sizes, arguments.processes)
+        elif benchmark_name == 'directory':
+            all_results[benchmark_name] = benchmark_directory(arguments.sizes or list(DEFAULT_DIRECTORY_SIZES))
+        elif benchmark_name == 'screener':
+            all_results[benchmark_name] = benchmark_screener(arguments.sizes or list(DEFAULT_SCREENER_SIZES),
+                                                             arguments.latency, arguments.latency_jitter,
+                                                             arguments.error_rate, arguments.fixtures)
+        elif benchmark_name == 'workers':
+            all_results[benchmark_name] = benchmark_workers(latency=arguments.latency or WORKERS_LATENCY)
+        elif benchmark_name == 'snapshots':
+            all_results[benchmark_name] = benchmark_snapshots(arguments.sizes or list(DEFAULT_SNAPSHOT_SIZES))
+        elif benchmark_name == 'ratelimit':
+            all_results[benchmark_name] = benchmark_rate_limit(universe_sizes, arguments.latency,
+                                                               arguments.latency_jitter, arguments.error_rate,
+                                                               arguments.fixtures, arguments.quota_rate,
+                                                               arguments.max_concurrent)
+        else:
+            all_results[benchmark_name] = BENCHMARKS[benchmark_name]()
+
+    output = json.dumps(all_results, indent=2)
+    print(output)
+
+    if arguments.output:
+        with open(arguments.output, 'w') as output_file:
+            output_file.write(output + '\n')
+
+    benchmark_results = [results for results in all_results.values() if isinstance(results, dict)]
+    if arguments.check and not all(results.get('passed', True) for results in benchmark_results):
+        return 1
+    return 0
+
+
+# Run the benchmarks if this file is run, not when it is imported
+if __name__ == "__main__":
+    sys.exit(main())
+
+
+# Copyright 2020 Oliver Midbrink
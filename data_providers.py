@@ -0,0 +1,462 @@
+# Market data providers. All the market data that the app uses (historic prices, financial statements, metadata such
+# as the currency, and symbol search) is read through a DataProvider, so that the source can be changed without
+# changing the analysis. The methods are asynchronous and take many symbols at once, so that a provider can batch
+# requests and run many of them at the same time on one event loop.
+#
+# Providers:
+#   YahooProvider         yahoo finance. With aiohttp installed the prices and metadata are downloaded from the chart
+#                         api with many concurrent requests on one event loop, otherwise yfinance is run in threads
+#   CSVDirectoryProvider  a local directory with csv and json files, for offline use and recorded data
+#   InMemoryProvider      data given as python objects, for benchmarks and trying things out
+#
+# The app itself is not asynchronous, run_sync runs a coroutine on a shared event loop in a background thread and
+# waits for the result, so providers can be used from any thread.
+
+# For the event loop that the providers run on
+import asyncio
+import atexit
+import threading
+
+# For reading the local data files
+import json
+import os
+
+# For finding out if aiohttp is installed without importing it
+import importlib.util
+
+# For logging what the providers do
+import logging
+
+# Heavy libraries are imported the first time they are used
+from lazy_modules import lazy_import
+
+# For the price dataframes
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# For downloading from yahoo finance without aiohttp
+yf = lazy_import('yfinance')
+
+# For the symbol search results
+from stock_search import scrape_lookup, SEARCH_RESULT_COLUMNS
+
+# The yahoo finance downloads that are run in threads, and the columns of the price dataframes
+from price_store import download_price_history, PRICE_COLUMNS
+from statement_store import download_financial_statements
+
+# Timing of the downloads
+from tracing import span
+
+# Same browser user agent, timeouts and retries as the requests session
+from http_session import (USER_AGENT, REQUEST_TIMEOUT, MAX_RETRIES, RETRY_STATUS_CODES, backoff_seconds,
+                          retry_after_seconds)
+
+# All requests to yahoo finance go through the shared rate limiter
+from rate_limiter import get_rate_limiter
+
+# The yahoo finance chart api, one symbol per request
+YAHOO_CHART_URL = 'https://query1.finance.yahoo.com/v8/finance/chart/'
+
+# Largest number of requests to yahoo finance that run at the same time on the event loop
+DEFAULT_MAX_CONCURRENCY = 64
+
+# Number of symbols per yfinance download when aiohttp is not installed
+YFINANCE_CHUNK_SIZE = 50
+
+# aiohttp is only used if it is installed
+HAS_AIOHTTP = importlib.util.find_spec('aiohttp') is not None
+
+logger = logging.getLogger(__name__)
+
+
+# The interface of the market data providers. All the methods are coroutines.
+class DataProvider:
+
+    # Returns the daily (or interval) prices of symbols from the date start (a pandas Timestamp).
+    # Returns a dictionary with symbols as keys and dataframes with the PRICE_COLUMNS and one row per bar as values,
+    # oldest first. Symbols without any prices are left out.
+    async def get_prices(self, symbols, start, interval='1d'):
+        raise NotImplementedError
+
+    # Returns the financial statements for the latest fiscal period of symbols.
+    # Returns two dictionaries (results, errors). results has symbols as keys and tuples (period, balance_sheet,
+    # income_statement) as values, the same as download_financial_statements. errors has the symbols that failed
+    # as keys and the exceptions as values.
+    async def get_statements(self, symbols, frequency='annual'):
+        raise NotImplementedError
+
+    # Returns metadata about symbols as a dictionary with symbols as keys and dictionaries with at least the key
+    # 'currency' as values. Symbols that are not found are left out.
+    async def get_metadata(self, symbols):
+        raise NotImplementedError
+
+    # Searches for stocks matching keywords. Returns a dataframe with the SEARCH_RESULT_COLUMNS
+    async def search(self, keywords):
+        raise NotImplementedError
+
+
+# Turns a result of the yahoo finance chart api into a price dataframe with the PRICE_COLUMNS and the dates of the
+# bars as index. Returns None if the result has no prices
+def chart_result_to_dataframe(chart_result):
+    timestamps = chart_result.get('timestamp') or []
+    if len(timestamps) == 0:
+        return None
+
+    # Built from one float matrix instead of one column at a time, a ranking converts thousands of these.
+    # Missing prices are null in the json and become NaN
+    quote = chart_result['indicators']['quote'][0]
+    values = np.array([quote['open'], quote['high'], quote['low'], quote['close'], quote['volume']], dtype=float)
+
+    # The timestamps are in UTC. A bar is dated by the day at the exchange, which for exchanges east of UTC (and for
+    # late bars in new york) is not the same day, so the offset of the exchange from UTC is added first
+    gmt_offset = chart_result.get('meta', {}).get('gmtoffset') or 0
+    days = ((np.array(timestamps, dtype=np.int64) + int(gmt_offset)) // 86400).astype('datetime64[D]')
+    prices = pd.DataFrame(values.T, index=pd.DatetimeIndex(days), columns=PRICE_COLUMNS)
+
+    # Remove the days without prices and keep only the last bar of each day
+    prices = prices.dropna(how='all')
+    return prices[~prices.index.duplicated(keep='last')]
+
+
+# Returns the rows of the dataframe listings (with at least the SEARCH_RESULT_COLUMNS) where the symbol or the name
+# contains keywords, ignoring case. Used by the providers that search local data
+def filter_listings(listings, keywords):
+    key = keywords.strip().lower()
+    if key == '' or len(listings) == 0:
+        return pd.DataFrame([], columns=SEARCH_RESULT_COLUMNS)
+
+    matches = (listings['Symbol'].astype(str).str.lower().str.contains(key, regex=False) |
+               listings['Name'].astype(str).str.lower().str.contains(key, regex=False))
+    return listings.loc[matches, SEARCH_RESULT_COLUMNS].reset_index(drop=True)
+
+
+# Market data from yahoo finance.
+# With aiohttp the prices and metadata are downloaded from the chart api at chart_url with one request per symbol,
+# at most max_concurrency at the same time, all on the event loop. Without aiohttp the prices are downloaded with
+# yfinance in chunks in threads. Statements are always downloaded with yahoofinancials in threads and searches by
+# scraping the lookup page.
+class YahooProvider(DataProvider):
+
+    def __init__(self, chart_url=YAHOO_CHART_URL, max_concurrency=DEFAULT_MAX_CONCURRENCY, use_aiohttp=HAS_AIOHTTP):
+        self.chart_url = chart_url
+        self.max_concurrency = max_concurrency
+        self.use_aiohttp = use_aiohttp
+
+        # The aiohttp session and the semaphore that limits the concurrent requests, created on the event loop the
+        # first time they are needed
+        self.session = None
+        self.semaphore = None
+
+    # Returns the aiohttp session, creating it the first time
+    async def get_session(self):
+        if self.session is None:
+            import aiohttp
+
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency, ttl_dns_cache=300)
+            self.session = aiohttp.ClientSession(
+                connector=connector, headers={'User-Agent': USER_AGENT},
+                timeout=aiohttp.ClientTimeout(sock_connect=REQUEST_TIMEOUT[0], sock_read=REQUEST_TIMEOUT[1]))
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+
+            # Close the connections when python exits, otherwise aiohttp warns about them
+            atexit.register(self.close_at_exit)
+
+        return self.session
+
+    # Downloads the chart api result for symbol with params. Returns the chart result dictionary, or None if yahoo
+    # finance has no data for the symbol. Every request waits for the shared rate limiter, and answers that mean that
+    # yahoo finance is throttling the app are retried with backoff, like http_get.
+    # Only the requests hold one of the max_concurrency places, a symbol that waits to be retried lets the others run
+    async def get_chart(self, symbol, params):
+        session = await self.get_session()
+
+        for attempt in range(MAX_RETRIES + 1):
+            async with self.semaphore, get_rate_limiter().limited_async() as slot:
+                with span('provider.chart'):
+                    async with session.get(self.chart_url + symbol, params=params) as response:
+                        if response.status in RETRY_STATUS_CODES and attempt < MAX_RETRIES:
+                            slot.throttled(retry_after_seconds(response.headers.get('Retry-After')))
+                        elif response.status == 404:
+                            return None
+                        else:
+                            response.raise_for_status()
+                            chart = await response.json(content_type=None)
+                            break
+
+            await asyncio.sleep(backoff_seconds(attempt))
+
+        results = chart.get('chart', {}).get('result') or []
+        return results[0] if results else None
+
+    async def get_prices(self, symbols, start, interval='1d'):
+        symbols = list(dict.fromkeys(symbols))
+
+        if not self.use_aiohttp:
+            chunks = [symbols[chunk_start:chunk_start + YFINANCE_CHUNK_SIZE]
+                      for chunk_start in range(0, len(symbols), YFINANCE_CHUNK_SIZE)]
+            chunk_results = await asyncio.gather(*[asyncio.to_thread(download_price_history, chunk, start, interval)
+                                                   for chunk in chunks])
+
+            prices_by_symbol = {}
+            for chunk_result in chunk_results:
+                prices_by_symbol.update(chunk_result)
+            return prices_by_symbol
+
+        params = {'period1': str(int(pd.Timestamp(start).timestamp())),
+                  'period2': str(int(pd.Timestamp.now().timestamp()) + 86400), 'interval': interval}
+
+        # One request per symbol, all at the same time up to max_concurrency. A symbol that fails is left out like
+        # a symbol without prices
+        chart_results = await asyncio.gather(*[self.get_chart(symbol, params) for symbol in symbols],
+                                             return_exceptions=True)
+
+        prices_by_symbol = {}
+        for symbol, chart_result in zip(symbols, chart_results):
+            if isinstance(chart_result, Exception):
+                logger.warning('Could not download prices for %s: %s', symbol, chart_result)
+                continue
+            if chart_result is None:
+                continue
+
+            prices = chart_result_to_dataframe(chart_result)
+            if prices is not None and len(prices) > 0:
+                prices_by_symbol[symbol] = prices
+
+        return prices_by_symbol
+
+    async def get_statements(self, symbols, frequency='annual'):
+        symbols = list(dict.fromkeys(symbols))
+        statements = await asyncio.gather(*[asyncio.to_thread(download_financial_statements, symbol, frequency)
+                                            for symbol in symbols], return_exceptions=True)
+
+        return split_results(symbols, statements)
+
+    async def get_metadata(self, symbols):
+        symbols = list(dict.fromkeys(symbols))
+
+        if self.use_aiohttp:
+            # The chart api has the currency in the meta data of every result, the shortest range is enough
+            chart_results = await asyncio.gather(*[self.get_chart(symbol, {'range': '1d', 'interval': '1d'})
+                                                   for symbol in symbols], return_exceptions=True)
+            metadata = [chart_result['meta'] if isinstance(chart_result, dict) else chart_result
+                        for chart_result in chart_results]
+        else:
+            metadata = await asyncio.gather(*[asyncio.to_thread(download_ticker_info, symbol) for symbol in symbols],
+                                            return_exceptions=True)
+
+        results, errors = split_results(symbols, metadata)
+        return {symbol: results[symbol] for symbol in results if results[symbol] and 'currency' in results[symbol]}
+
+    async def search(self, keywords):
+        return await asyncio.to_thread(scrape_lookup, keywords)
+
+    # Closes the aiohttp session
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    # Closes the aiohttp session from the thread that runs the exit handlers
+    def close_at_exit(self):
+        try:
+            run_sync(self.close(), timeout=5)
+        except Exception as e:
+            logger.debug('Could not close the yahoo finance session: %s', e)
+
+
+# Downloads the information about symbol from yahoo finance with yfinance, waiting for the shared rate limiter
+def download_ticker_info(symbol):
+    with get_rate_limiter().limited():
+        return yf.Ticker(symbol).info
+
+
+# Market data from a local directory with the layout
+#   prices/<symbol>.csv        columns Date, Open, High, Low, Close, Volume, one row per day
+#   statements/<symbol>.json   {"period": ..., "balance_sheet": {...}, "income_statement": {...}}
+#   symbols.csv                the SEARCH_RESULT_COLUMNS and Currency, one row per symbol, for search and metadata
+# Files are read in threads so that many symbols are read at the same time.
+class CSVDirectoryProvider(DataProvider):
+
+    def __init__(self, directory):
+        self.directory = directory
+
+        # The symbols.csv listing, read the first time it is needed
+        self.listings = None
+
+    # Returns the path of a data file, symbols with / in them are stored with _ instead
+    def data_path(self, kind, symbol, extension):
+        return os.path.join(self.directory, kind, symbol.replace('/', '_') + extension)
+
+    # Reads the prices of one symbol from start, or returns None if there is no price file
+    def read_prices(self, symbol, start):
+        path = self.data_path('prices', symbol, '.csv')
+        if not os.path.exists(path):
+            return None
+
+        prices = pd.read_csv(path, index_col=0, parse_dates=True)
+        prices = prices.reindex(columns=PRICE_COLUMNS).astype(float)
+        return prices[prices.index >= pd.Timestamp(start)].sort_index()
+
+    # Reads the statements of one symbol, raises ValueError if there are none
+    def read_statements(self, symbol):
+        path = self.data_path('statements', symbol, '.json')
+        if not os.path.exists(path):
+            raise ValueError('No statements found for ' + symbol)
+
+        with open(path) as statements_file:
+            statements = json.load(statements_file)
+        return statements['period'], statements['balance_sheet'], statements['income_statement']
+
+    # Returns the listing dataframe from symbols.csv, empty if there is no such file
+    def get_listings(self):
+        if self.listings is None:
+            path = os.path.join(self.directory, 'symbols.csv')
+            if os.path.exists(path):
+                self.listings = pd.read_csv(path, dtype=str, keep_default_na=False)
+            else:
+                self.listings = pd.DataFrame([], columns=SEARCH_RESULT_COLUMNS + ['Currency'])
+        return self.listings
+
+    async def get_prices(self, symbols, start, interval='1d'):
+        symbols = list(dict.fromkeys(symbols))
+        all_prices = await asyncio.gather(*[asyncio.to_thread(self.read_prices, symbol, start) for symbol in symbols])
+        return {symbol: prices for symbol, prices in zip(symbols, all_prices) if prices is not None and len(prices)}
+
+    async def get_statements(self, symbols, frequency='annual'):
+        symbols = list(dict.fromkeys(symbols))
+        statements = await asyncio.gather(*[asyncio.to_thread(self.read_statements, symbol) for symbol in symbols],
+                                          return_exceptions=True)
+        return split_results(symbols, statements)
+
+    async def get_metadata(self, symbols):
+        listings = await asyncio.to_thread(self.get_listings)
+        currencies = dict(zip(listings['Symbol'], listings.get('Currency', [])))
+        return {symbol: {'currency': currencies[symbol]} for symbol in symbols if currencies.get(symbol)}
+
+    async def search(self, keywords):
+        listings = await asyncio.to_thread(self.get_listings)
+        return filter_listings(listings, keywords)
+
+
+# Market data given as python objects. prices_by_symbol has symbols as keys and price dataframes as values,
+# statements_by_symbol has symbols as keys and (period, balance_sheet, income_statement) as values,
+# metadata_by_symbol has symbols as keys and dictionaries with 'currency' as values, and listings is a dataframe with
+# the SEARCH_RESULT_COLUMNS. latency is the number of seconds every call waits, to act like a remote source.
+class InMemoryProvider(DataProvider):
+
+    def __init__(self, prices_by_symbol=None, statements_by_symbol=None, metadata_by_symbol=None, listings=None,
+                 latency=0.0):
+        self.prices_by_symbol = prices_by_symbol or {}
+        self.statements_by_symbol = statements_by_symbol or {}
+        self.metadata_by_symbol = metadata_by_symbol or {}
+        self.listings = listings
+        self.latency = latency
+
+    async def get_prices(self, symbols, start, interval='1d'):
+        await asyncio.sleep(self.latency)
+
+        prices_by_symbol = {}
+        for symbol in symbols:
+            prices = self.prices_by_symbol.get(symbol)
+            if prices is not None:
+                prices = prices[prices.index >= pd.Timestamp(start)]
+                if len(prices) > 0:
+                    prices_by_symbol[symbol] = prices
+        return prices_by_symbol
+
+    async def get_statements(self, symbols, frequency='annual'):
+        await asyncio.sleep(self.latency)
+
+        results = {}
+        errors = {}
+        for symbol in symbols:
+            if symbol in self.statements_by_symbol:
+                results[symbol] = self.statements_by_symbol[symbol]
+            else:
+                errors[symbol] = ValueError('No statements found for ' + symbol)
+        return results, errors
+
+    async def get_metadata(self, symbols):
+        await asyncio.sleep(self.latency)
+        return {symbol: self.metadata_by_symbol[symbol] for symbol in symbols if symbol in self.metadata_by_symbol}
+
+    async def search(self, keywords):
+        await asyncio.sleep(self.latency)
+        if self.listings is None:
+            return pd.DataFrame([], columns=SEARCH_RESULT_COLUMNS)
+        return filter_listings(self.listings, keywords)
+
+
+# Splits a list of results from asyncio.gather(..., return_exceptions=True) for symbols into the two dictionaries
+# (results, errors)
+def split_results(symbols, gathered):
+    results = {}
+    errors = {}
+
+    for symbol, result in zip(symbols, gathered):
+        if isinstance(result, BaseException):
+            errors[symbol] = result
+        else:
+            results[symbol] = result
+
+    return results, errors
+
+
+# The event loop that the providers run on, in a background thread, created the first time it is used
+shared_event_loop = None
+shared_event_loop_lock = threading.Lock()
+
+
+# Returns the shared event loop, starting it the first time
+def get_event_loop():
+    global shared_event_loop
+
+    with shared_event_loop_lock:
+        if shared_event_loop is None:
+            shared_event_loop = asyncio.new_event_loop()
+            threading.Thread(target=shared_event_loop.run_forever, name='data-provider-loop', daemon=True).start()
+        return shared_event_loop
+
+
+# Runs coroutine on the shared event loop and waits for its result, so that the asynchronous providers can be used
+# from normal code in any thread. Exceptions from the coroutine are raised here.
+# Must not be called from a coroutine on the shared event loop, that would wait forever
+def run_sync(coroutine, timeout=None):
+    loop = get_event_loop()
+
+    try:
+        running_loop = asyncio.get_running_loop()
+    except RuntimeError:
+        running_loop = None
+    if running_loop is loop:
+        coroutine.close()
+        raise RuntimeError('run_sync can not be used on the data provider event loop, await the coroutine instead')
+
+    return asyncio.run_coroutine_threadsafe(coroutine, loop).result(timeout)
+
+
+# The provider used when no provider is given, created the first time it is used
+default_provider = None
+default_provider_lock = threading.Lock()
+
+
+# Returns the provider that the app uses when no provider is given, by default a YahooProvider
+def get_default_provider():
+    global default_provider
+
+    with default_provider_lock:
+        if default_provider is None:
+            default_provider = YahooProvider()
+        return default_provider
+
+
+# Changes the provider that the app uses when no provider is given. The shared price and statement stores keep what
+# they have already downloaded, so this should be done before anything is analyzed
+def set_default_provider(provider):
+    global default_provider
+
+    with default_provider_lock:
+        default_provider = provider
+
+
+# Copyright 2020 Oliver Midbrink
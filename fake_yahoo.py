@@ -0,0 +1,403 @@
+# A local stand-in for the yahoo finance endpoints that the app uses, for benchmarks that have to be reproducible and
+# must not depend on the real yahoo finance. The server answers with recorded pages from a fixture directory when it
+# has them, and otherwise with synthetic pages in the same format that are generated from the symbol, so the same
+# request always gets the same answer.
+# Latency and errors can be injected to see how the app behaves when yahoo finance is slow or unreliable, and a
+# quota can be enforced to see how the app behaves when yahoo finance throttles it.
+#
+# Endpoints:
+#   /lookup?s=<keywords>                          lookup page with search results, same html as yahoo finance
+#   /v7/finance/spark?symbols=<a,b>&period1=<t>   daily prices for several symbols, chart json for every symbol
+#   /v8/finance/chart/<symbol>?period1=<t>        daily prices and meta data of one symbol, as read by YahooProvider.
+#                                                 range=<1d> instead of period1 gives the latest days only
+#   /statements/<symbol>?frequency=<annual>       balance sheets and income statements as from yahoofinancials
+#
+# The downloaders at the end of the file read from these endpoints and can be given to PriceStore and StatementStore.
+# A data_providers.YahooProvider reads from the chart endpoint when it is given chart_url=server.chart_url.
+
+# For the server
+import json
+import os
+import random
+import threading
+import time
+import zlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, unquote
+
+# Heavy libraries are imported the first time they are used
+from lazy_modules import lazy_import
+
+# For the synthetic prices and the price dataframes of the downloaders
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# For downloading from the server with the same session as the rest of the app
+from http_session import http_get
+
+# For turning the chart json into price dataframes the same way as the yahoo data provider
+from data_providers import chart_result_to_dataframe
+
+# Number of market days of synthetic prices that the server has for every symbol
+HISTORY_DAYS = 320
+
+# Number of search results on a synthetic lookup page
+LOOKUP_RESULTS = 25
+
+# Size in bytes of the scripts and menus around the result table of a synthetic lookup page. The real page is about
+# a megabyte of scripts and menus
+LOOKUP_PAGE_PADDING = 1024 * 1024
+
+
+# Returns a random number generator that is the same every time for text, so the synthetic data does not change
+# between runs
+def seeded_random(text):
+    return np.random.default_rng(zlib.crc32(text.encode('utf-8')))
+
+
+# Returns the html of a lookup page for keywords with LOOKUP_RESULTS results, mostly stocks but also some etfs,
+# surrounded by padding_size bytes of scripts like the real page
+def synthetic_lookup_page(keywords, padding_size=LOOKUP_PAGE_PADDING):
+    generator = random.Random(keywords)
+
+    rows = []
+    for result_idx in range(LOOKUP_RESULTS):
+        symbol = keywords.upper().replace(' ', '')[:4] + str(result_idx)
+        result_type = 'ETF' if result_idx % 5 == 4 else 'Stocks'
+        rows.append('<tr><td><a href="/quote/' + symbol + '">' + symbol + '</a></td>'
+                    '<td>' + keywords.title() + ' Company ' + str(result_idx) + ' Inc.</td>'
+                    '<td>' + str(round(generator.uniform(5, 500), 2)) + '</td>'
+                    '<td>Technology</td><td>' + result_type + '</td><td>NMS</td></tr>')
+
+    # Half of the padding is menus with many small elements and half is a script, like the real page
+    menu_item = '<li class="menu-item"><a href="/topic/news" class="link"><span>News</span></a></li>'
+    menu = '<div class="menu"><ul>' + menu_item * (padding_size // 2 // len(menu_item)) + '</ul></div>'
+    script = '<script>var data = "' + 'x' * max(padding_size - len(menu) - 200, 0) + '";</script>'
+    return ('<!DOCTYPE html><html><head><title>Lookup</title>' + script + '</head><body>' + menu +
+            '<table><thead><tr><th>Symbol</th><th>Name</th><th>Last Price</th><th>Industry / Category</th>'
+            '<th>Type</th><th>Exchange</th></tr></thead><tbody>' + ''.join(rows) + '</tbody></table>'
+            '</body></html>')
+
+
+# Returns the market days of the synthetic price history as a pandas DatetimeIndex, the last one is today or the
+# latest weekday before it
+def synthetic_dates():
+    today = pd.Timestamp.now().normalize()
+
+    # Building the date range is the slowest part of a synthetic answer, it is only done once per day
+    if today not in synthetic_dates_by_day:
+        synthetic_dates_by_day[today] = pd.bdate_range(end=today, periods=HISTORY_DAYS)
+    return synthetic_dates_by_day[today]
+
+
+# The synthetic dates by the day they were built, used by synthetic_dates
+synthetic_dates_by_day = {}
+
+
+# Returns the synthetic daily prices of symbol from the date start (seconds since epoch) as a chart result, the same
+# json as in the yahoo finance chart api
+def synthetic_chart_result(symbol, start_timestamp=0):
+    generator = seeded_random(symbol)
+    dates = synthetic_dates()
+
+    close_prices = generator.uniform(10, 300) * np.exp(np.cumsum(generator.normal(0.0003, 0.015, len(dates))))
+    open_prices = close_prices * (1 + generator.normal(0, 0.004, len(dates)))
+    high_prices = np.maximum(open_prices, close_prices) * (1 + np.abs(generator.normal(0, 0.006, len(dates))))
+    low_prices = np.minimum(open_prices, close_prices) * (1 - np.abs(generator.normal(0, 0.006, len(dates))))
+    volumes = generator.integers(10000, 5000000, len(dates))
+
+    # The bars start at the opening of the market in new york, 14:30 UTC or 9:30 at the exchange
+    timestamps = dates.to_numpy().astype('datetime64[s]').astype(np.int64) + 14 * 3600 + 1800
+    keep = timestamps >= start_timestamp - 86400
+
+    return {
+        'meta': {'symbol': symbol, 'currency': 'USD', 'exchangeName': 'NMS', 'dataGranularity': '1d',
+                 'exchangeTimezoneName': 'America/New_York', 'gmtoffset': -5 * 3600},
+        'timestamp': timestamps[keep].tolist(),
+        'indicators': {'quote': [{
+            'open': np.round(open_prices[keep], 4).tolist(),
+            'high': np.round(high_prices[keep], 4).tolist(),
+            'low': np.round(low_prices[keep], 4).tolist(),
+            'close': np.round(close_prices[keep], 4).tolist(),
+            'volume': volumes[keep].tolist(),
+        }]},
+    }
+
+
+# Returns synthetic statements for symbol in the same format as YahooFinancials.get_financial_stmts with the
+# statement types 'balance' and 'income'
+def synthetic_statements(symbol, frequency='annual'):
+    generator = seeded_random(symbol + frequency)
+
+    total_assets = float(generator.integers(10 ** 8, 10 ** 11))
+    equity = total_assets * generator.uniform(0.1, 0.8)
+    revenue = total_assets * generator.uniform(0.2, 1.5)
+    net_income = revenue * generator.uniform(-0.1, 0.3)
+
+    # The latest fiscal period ended at the end of last year
+    period = str(pd.Timestamp.now().year - 1) + '-12-31'
+    suffix = '' if frequency == 'annual' else 'Quarterly'
+
+    return {
+        'balanceSheetHistory' + suffix: {symbol: [{period: {'totalAssets': total_assets,
+                                                            'totalStockholderEquity': equity}}]},
+        'incomeStatementHistory' + suffix: {symbol: [{period: {'totalRevenue': revenue, 'netIncome': net_income}}]},
+    }
+
+
+# Local http server with the yahoo finance endpoints, run in a background thread.
+# latency is the number of seconds every answer is delayed, with up to latency_jitter seconds more at random.
+# error_rate is the share of requests (0 to 1) that get a 503 error answer.
+# fixture_directory is a directory with recorded answers, lookup/<keywords>.html, chart/<symbol>.json and
+# statements/<symbol>.json, that are used instead of the synthetic ones when they exist.
+# The quota is enforced like yahoo finance does it: requests above quota_rate per second (with bursts of up to
+# quota_burst requests) or above max_concurrent requests at the same time get a 429 Too Many Requests answer, with a
+# Retry-After header of retry_after seconds if it is given. None means no limit.
+class FakeYahooServer:
+
+    # Initialize the server, it is started by start() or by using it in a with statement
+    def __init__(self, latency=0.0, latency_jitter=0.0, error_rate=0.0, fixture_directory=None, seed=0,
+                 quota_rate=None, quota_burst=None, max_concurrent=None, retry_after=None):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.fixture_directory = fixture_directory
+
+        # The quota, a token bucket and the number of requests being answered
+        self.quota_rate = quota_rate
+        self.quota_burst = quota_burst if quota_burst is not None else quota_rate
+        self.max_concurrent = max_concurrent
+        self.retry_after = retry_after
+        self.quota_tokens = self.quota_burst or 0
+        self.quota_refilled_at = time.monotonic()
+        self.active_requests = 0
+        self.quota_lock = threading.Lock()
+
+        # Number of requests that got a 429 answer because they were above the quota
+        self.throttled_count = 0
+
+        # Random numbers for the latency and the errors, used by all the request threads
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+
+        # Number of answered requests per endpoint and number of injected errors
+        self.request_counts = {}
+        self.error_count = 0
+
+        self.http_server = None
+        self.thread = None
+
+    # Starts the server on a free port on localhost. Returns the server
+    def start(self):
+        fake_server = self
+
+        # One handler object is created per request, it asks the fake server for the answer
+        class RequestHandler(BaseHTTPRequestHandler):
+            # Keep-alive connections, like the real yahoo finance
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                if fake_server.admit():
+                    try:
+                        status, content_type, body = fake_server.answer(self.path)
+                    finally:
+                        fake_server.finish()
+                else:
+                    status, content_type, body = 429, 'text/plain', b'Too Many Requests'
+
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                if status == 429 and fake_server.retry_after is not None:
+                    self.send_header('Retry-After', str(fake_server.retry_after))
+                self.end_headers()
+                self.wfile.write(body)
+
+            # Do not print a line for every request
+            def log_message(self, format, *args):
+                pass
+
+        # The default listen backlog of 5 connections makes clients that connect many at once wait for retries
+        class Server(ThreadingHTTPServer):
+            request_queue_size = 256
+
+        self.http_server = Server(('127.0.0.1', 0), RequestHandler)
+        self.http_server.daemon_threads = True
+        self.thread = threading.Thread(target=self.http_server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    # Stops the server
+    def stop(self):
+        if self.http_server is not None:
+            self.http_server.shutdown()
+            self.http_server.server_close()
+            self.http_server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exception_type, exception, traceback):
+        self.stop()
+
+    # The address of the server, for example 'http://127.0.0.1:51234'
+    @property
+    def base_url(self):
+        host, port = self.http_server.server_address[:2]
+        return 'http://' + host + ':' + str(port)
+
+    # The url of the lookup page, to be used as stock_search.LOOKUP_URL
+    @property
+    def lookup_url(self):
+        return self.base_url + '/lookup'
+
+    # The url of the chart endpoint, the symbol is added at the end
+    @property
+    def chart_url(self):
+        return self.base_url + '/v8/finance/chart/'
+
+    # Returns True if a new request is within the quota and starts answering it, False if it should get a 429 answer.
+    # A request that is admitted must be finished with finish()
+    def admit(self):
+        with self.quota_lock:
+            if self.quota_rate is not None:
+                now = time.monotonic()
+                self.quota_tokens = min(self.quota_burst,
+                                        self.quota_tokens + (now - self.quota_refilled_at) * self.quota_rate)
+                self.quota_refilled_at = now
+
+            over_quota = ((self.quota_rate is not None and self.quota_tokens < 1) or
+                          (self.max_concurrent is not None and self.active_requests >= self.max_concurrent))
+            if over_quota:
+                self.throttled_count += 1
+                return False
+
+            if self.quota_rate is not None:
+                self.quota_tokens -= 1
+            self.active_requests += 1
+            return True
+
+    # Ends a request that was admitted
+    def finish(self):
+        with self.quota_lock:
+            self.active_requests -= 1
+
+    # Returns (status, content type, body as bytes) for a request path, after the injected latency
+    def answer(self, path):
+        url = urlsplit(path)
+        query = parse_qs(url.query)
+
+        with self.random_lock:
+            delay = self.latency + self.random.uniform(0, self.latency_jitter)
+            is_error = self.random.random() < self.error_rate
+            if url.path.startswith('/statements/'):
+                endpoint = 'statements'
+            elif url.path.startswith('/v8/finance/chart/'):
+                endpoint = 'chart'
+            else:
+                endpoint = url.path.rsplit('/', 1)[-1]
+            self.request_counts[endpoint] = self.request_counts.get(endpoint, 0) + 1
+            if is_error:
+                self.error_count += 1
+
+        if delay > 0:
+            time.sleep(delay)
+
+        if is_error:
+            return 503, 'text/plain', b'Service unavailable'
+
+        try:
+            if url.path == '/lookup':
+                keywords = query.get('s', [''])[0]
+                body = self.read_fixture('lookup', keywords, '.html')
+                if body is None:
+                    body = synthetic_lookup_page(keywords).encode('utf-8')
+                return 200, 'text/html; charset=utf-8', body
+
+            if url.path == '/v7/finance/spark':
+                symbols = [symbol for symbol in query.get('symbols', [''])[0].split(',') if symbol]
+                start_timestamp = int(query.get('period1', ['0'])[0])
+                results = [{'symbol': symbol, 'response': [self.chart_result(symbol, start_timestamp)]}
+                           for symbol in symbols]
+                return 200, 'application/json', json.dumps({'spark': {'result': results, 'error': None}}).encode()
+
+            if url.path.startswith('/v8/finance/chart/'):
+                symbol = unquote(url.path[len('/v8/finance/chart/'):])
+                if 'range' in query:
+                    start_timestamp = int(time.time()) - 5 * 86400
+                else:
+                    start_timestamp = int(query.get('period1', ['0'])[0])
+                chart = {'chart': {'result': [self.chart_result(symbol, start_timestamp)], 'error': None}}
+                return 200, 'application/json', json.dumps(chart).encode()
+
+            if url.path.startswith('/statements/'):
+                symbol = unquote(url.path[len('/statements/'):])
+                frequency = query.get('frequency', ['annual'])[0]
+                body = self.read_fixture('statements', symbol, '.json')
+                if body is None:
+                    body = json.dumps(synthetic_statements(symbol, frequency)).encode()
+                return 200, 'application/json', body
+        except Exception as e:
+            return 500, 'text/plain', str(e).encode()
+
+        return 404, 'text/plain', b'Not found'
+
+    # Returns the chart result for symbol, recorded if there is a fixture and synthetic otherwise
+    def chart_result(self, symbol, start_timestamp):
+        recorded = self.read_fixture('chart', symbol, '.json')
+        if recorded is not None:
+            return json.loads(recorded)
+        return synthetic_chart_result(symbol, start_timestamp)
+
+    # Returns the bytes of the fixture file <fixture_directory>/<kind>/<name><extension>, or None if there is none
+    def read_fixture(self, kind, name, extension):
+        if self.fixture_directory is None:
+            return None
+
+        path = os.path.join(self.fixture_directory, kind, name.replace('/', '_') + extension)
+        if not os.path.exists(path):
+            return None
+
+        with open(path, 'rb') as fixture_file:
+            return fixture_file.read()
+
+
+# Returns a downloader for PriceStore that downloads from the server at base_url, with one request per call like
+# download_price_history
+def make_price_downloader(base_url):
+
+    def download_prices(symbols, start, interval):
+        response = http_get(base_url + '/v7/finance/spark',
+                            params={'symbols': ','.join(symbols), 'interval': interval,
+                                    'period1': int(pd.Timestamp(start).timestamp())})
+
+        prices_by_symbol = {}
+        for result in response.json()['spark']['result']:
+            prices = chart_result_to_dataframe(result['response'][0])
+            if prices is not None and len(prices) > 0:
+                prices_by_symbol[result['symbol']] = prices
+
+        return prices_by_symbol
+
+    return download_prices
+
+
+# Returns a downloader for StatementStore that downloads from the server at base_url, same return value as
+# download_financial_statements
+def make_statement_downloader(base_url):
+
+    def download_statements(symbol, frequency='annual'):
+        raw_statements = http_get(base_url + '/statements/' + symbol, params={'frequency': frequency}).json()
+        suffix = '' if frequency == 'annual' else 'Quarterly'
+
+        balance_sheet_history = raw_statements['balanceSheetHistory' + suffix][symbol][0]
+        period = list(balance_sheet_history.keys())[0]
+        income_statement_history = raw_statements['incomeStatementHistory' + suffix][symbol][0]
+
+        return (period, balance_sheet_history[period],
+                income_statement_history[list(income_statement_history.keys())[0]])
+
+    return download_statements
+
+
+# Copyright 2020 Oliver Midbrink
@@ -1,21 +1,55 @@
+# For logging what the app does, instead of printing it
+import logging
+
+# For naming the files that the stage timings are dumped to
+import os
+import time
+
 #import tkinter for GUI purposes
 import tkinter as tk
-from tkscrolledframe import ScrolledFrame
 from tkinter.ttk import *
 from pages import *
 
-# Mostly for web-scraping used in the StockSelector search_stock method
-import requests
-from bs4 import BeautifulSoup
+# Web-scraping used in the StockSelector search_stock method
+from stock_search import search_stocks, SEARCH_RESULT_COLUMNS
+
+# Search results cache shared by all StockSelectorFrames
+from search_cache import search_cache
+
+# Timing of the stages of the app, shown in the TraceOverlay
+from tracing import tracer, traced, enable_tracing, is_tracing_enabled
+
+# The stage timings are dumped to the same directory as the cached data
+from price_store import get_cache_directory
+
+# Number of requests that shared a download with another one, shown in the TraceOverlay, and the state of the rate
+# limiter, dumped with the stage timings
+from single_flight import coalescing_statistics
+from rate_limiter import get_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+# Number of milliseconds to wait after the last key press before searching as you type
+SEARCH_DEBOUNCE_MS = 300
+
+# Number of rows that are visible in the search results table
+SEARCH_RESULTS_TABLE_HEIGHT = 20
+
+# Number of milliseconds between the refreshes of the TraceOverlay
+TRACE_OVERLAY_REFRESH_MS = 1000
 
-# For data purposes
-import pandas
+# Width in pixels of the columns in the search results table
+SEARCH_RESULT_COLUMN_WIDTHS = {'Symbol': 90, 'Name': 250, 'Last Price': 80, 'Industry/Category': 160, 'Type': 70,
+                               'Exchange': 80}
 
 # List frame to show specific data, for example fundamental analysis data or technical analysis data or
 # even beta ranking list
 # The frame will contain a title in bold text
 # then a column of values after as specified in the data_list argument
 # it is also possible to select a custom font for the data_list. If you have lots of values you can reduce the font size
+# The rows can be changed after the frame is created with set_rows, set_rows_from, append_row, replace_row and
+# clear_rows. The row
+# widgets are reused, so a ListFrame can be kept for the whole session instead of creating a new one for every update
 class ListFrame(tk.Frame):
 
     # Initialize list frame with data in the form of an array
@@ -23,26 +57,88 @@ class ListFrame(tk.Frame):
     def __init__(self, parent, title, data_list, font=('Times', 16, 'normal')):
         tk.Frame.__init__(self, parent)
 
+        # Font of the data rows
+        self.font = font
+
         # Create a title for the list frame
         self.title_label = tk.Label(self, text=title,
                                     font=('Times', 16, 'bold'))
         self.title_label.grid(row=0, column=0, padx=10, pady=10, sticky='w')
 
-        # Create an array to store all the data rows or items
+        # Create an array to store the text of all the data rows or items that are shown
         self.data_rows = []
 
-        # Create all the data labels (rows) by iterating throught the data_list
-        for str_data_idx in range(len(data_list)):
+        # Label and separator widgets for the rows. Widgets for rows that are not shown anymore are hidden and
+        # kept for reuse, so these lists only grow to the largest number of rows shown at the same time
+        self.row_labels = []
+        self.row_separators = []
+
+        # Create all the data labels (rows) from the data_list
+        self.set_rows(data_list)
+
+    # Changes the title of the list frame to title
+    def set_title(self, title):
+        self.title_label.config(text=title)
+
+    # Changes the font of all data rows to font
+    def set_font(self, font):
+        self.font = font
+        for row_label in self.row_labels:
+            row_label.config(font=font)
+
+    # Replaces all the data rows with the values in data_list
+    def set_rows(self, data_list):
+        self.set_rows_from(0, data_list)
+
+    # Replaces the data rows from index first_str_data_idx to the end with the values in data_list. The rows before
+    # first_str_data_idx are kept as they are, so only the part of a growing list that has changed is redrawn
+    def set_rows_from(self, first_str_data_idx, data_list):
+        # Show the new rows, reusing the widgets of the old ones. Rows that already show the right text are skipped
+        for data_idx in range(len(data_list)):
+            str_data_idx = first_str_data_idx + data_idx
+            if str_data_idx < len(self.data_rows) and self.data_rows[str_data_idx] == str(data_list[data_idx]):
+                continue
+            self.show_row(str_data_idx, data_list[data_idx])
+
+        # Hide the widgets of old rows that are not needed anymore
+        for str_data_idx in range(first_str_data_idx + len(data_list), len(self.data_rows)):
+            self.hide_row(str_data_idx)
+
+        self.data_rows = self.data_rows[:first_str_data_idx] + [str(str_data) for str_data in data_list]
+
+    # Adds a data row with the value str_data at the bottom of the list
+    def append_row(self, str_data):
+        self.show_row(len(self.data_rows), str_data)
+        self.data_rows.append(str(str_data))
+
+    # Changes the value of the data row with index str_data_idx (the first data row is 0) to str_data
+    def replace_row(self, str_data_idx, str_data):
+        self.row_labels[str_data_idx].config(text=str(str_data))
+        self.data_rows[str_data_idx] = str(str_data)
+
+    # Removes all data rows, the title is kept
+    def clear_rows(self):
+        self.set_rows([])
+
+    # Shows str_data in the data row with index str_data_idx. The widgets for the row are created if needed
+    def show_row(self, str_data_idx, str_data):
+        # Create the widgets if this row has never been shown before
+        if str_data_idx >= len(self.row_labels):
             # Create a separator between for easier reading
-            Separator(self, orient='horizontal').grid(row=str_data_idx * 2 + 1,
-                                                      column=0,
-                                                      sticky='ew',
-                                                      columnspan=7
-                                                      )
+            self.row_separators.append(Separator(self, orient='horizontal'))
+
+            # Create and configure the label
+            self.row_labels.append(tk.Label(self, font=self.font))
+
+        # Position the separator and label. str_data_idx * 2 + 2 because the title is at row 0
+        self.row_separators[str_data_idx].grid(row=str_data_idx * 2 + 1, column=0, sticky='ew', columnspan=7)
+        self.row_labels[str_data_idx].config(text=str(str_data))
+        self.row_labels[str_data_idx].grid(row=str_data_idx * 2 + 2, column=0, padx=10, pady=10, sticky='w')
 
-            # Create, configure and position the label. str_data_idx + 1 because the title is at row 0
-            self.data_rows.append(tk.Label(self, text=str(data_list[str_data_idx]), font=font)
-                                  .grid(row=str_data_idx * 2 + 2, column=0, padx=10, pady=10, sticky='w'))
+    # Hides the widgets of the data row with index str_data_idx, they are kept so that they can be reused
+    def hide_row(self, str_data_idx):
+        self.row_separators[str_data_idx].grid_remove()
+        self.row_labels[str_data_idx].grid_remove()
 
 
 # Navigation frame with title in right top corner and back to main menu button in top left corner
@@ -88,9 +184,9 @@ class StockSelectorFrame(tk.Frame):
         search_label = tk.Label(self, text="Search stock by company name or symbol: ")
         search_label.grid(row=0, column=0, padx=10, pady=10, sticky='e')
 
-        # Search function for searching up stocks. Used both in search button and entry
+        # Search function for searching up stocks. Used both in search button and entry.
         def search_function(*args):
-            self.display_search_results(self.search_stock(search_bar.get()))
+            self.start_search(search_bar.get())
 
         # Search field for stock keyword
         search_bar = tk.Entry(self)
@@ -102,187 +198,283 @@ class StockSelectorFrame(tk.Frame):
         # Bind search_bar enter to searching stocks
         search_bar.bind("<Return>", search_function)
 
+        # Bind typing in the search_bar to searching as you type (if turned on)
+        search_bar.bind("<KeyRelease>", self.schedule_search_as_you_type)
+
+        # Id of the waiting search as you type, so that it can be cancelled when the user types again
+        self.pending_search_id = None
+
+        # The keywords that were last searched for, so that keys like arrows do not start the same search again
+        self.last_searched_keywords = ''
+
         # Search button that when pressed, feeds the
         # string from search_bar to search_stock method as well as
         # should_hide_when_selected.
         search_button = tk.Button(self, text="Search", command=search_function)
         search_button.grid(row=0, column=2, padx=10, pady=10, sticky='w')
 
-    # Function that inputs financia_item_info and prints all the values out to terminal
-    # This function needs slight modification to be compatible with latest version of program
-    # arguments: financial_item_info, a dictionary with values and keys
-    # returns nothing
-    def log_financial_item_info(self, financial_item_info):
-        # Output information of financial item to terminal/console
-        print('Result __________')
-        print('Symbol: ', financial_item_info['symbol'])
-        print('Name: ', financial_item_info['name'])
-        print('Last price: ', financial_item_info['last_price'])
-        print('Industry/category: ', financial_item_info['industry_or_category'])
-        print('Type: ', financial_item_info['type'])
-        print('Exchange: ', financial_item_info['exchange'])
-
+        # Check button that turns searching as you type on and off
+        self.search_as_you_type_variable = tk.BooleanVar(value=False)
+        search_as_you_type_button = tk.Checkbutton(self, text="Search as you type",
+                                                   variable=self.search_as_you_type_variable)
+        search_as_you_type_button.grid(row=0, column=3, padx=10, pady=10, sticky='w')
+
+        # Label that tells the user that a search is running or that it failed
+        self.status_label = tk.Label(self, text='')
+        self.status_label.grid(row=0, column=4, padx=10, pady=10, sticky='w')
+
+        # Table for the search results, reused for every search
+        self.create_search_results_table()
+
+    # Starts a search for keywords. If the search is in the app wide search cache the results are displayed right away,
+    # otherwise the search runs in the background and a new search replaces one that is still running.
+    # If show_prefix_results is True, the cached results of a shorter search are shown while waiting.
+    # Returns nothing
+    def start_search(self, keywords, show_prefix_results=False):
+        self.last_searched_keywords = keywords
+
+        # Use the cached results if there are any
+        cached_results = search_cache.get(keywords)
+        if cached_results is not None:
+            # A search that is still running would be outdated
+            self.controller.task_executor.cancel((self, 'search'))
+            self.display_search_results(cached_results)
+            return
+
+        # Show the best guess from a shorter search while the real search runs
+        if show_prefix_results:
+            prefix_results = search_cache.get_prefix_results(keywords)
+            if prefix_results is not None and len(prefix_results) > 0:
+                self.display_search_results(prefix_results)
+
+        self.status_label.config(text='Searching...')
+        self.controller.task_executor.submit((self, 'search'), self.search_stock, (keywords, False),
+                                             on_success=self.display_search_results,
+                                             on_error=self.display_search_error,
+                                             on_cancel=self.search_cancelled)
+
+    # Called every time a key is released in the search bar. If search as you type is turned on, a search is started
+    # when the user has not typed anything for SEARCH_DEBOUNCE_MS milliseconds. event is the tkinter key event
+    def schedule_search_as_you_type(self, event):
+        if not self.search_as_you_type_variable.get():
+            return
+
+        # Cancel the search that was waiting for the user to stop typing
+        if self.pending_search_id is not None:
+            self.after_cancel(self.pending_search_id)
+            self.pending_search_id = None
+
+        self.pending_search_id = self.after(SEARCH_DEBOUNCE_MS, self.search_as_you_type)
+
+    # Searches for the text in the search bar if it has changed since the last search. Called by
+    # schedule_search_as_you_type when the user has stopped typing
+    def search_as_you_type(self):
+        self.pending_search_id = None
+        keywords = self.search_bar.get()
+
+        if keywords.strip() == '' or keywords == self.last_searched_keywords:
+            return
+
+        self.start_search(keywords, show_prefix_results=True)
+
+    # Clears the status of a search that was cancelled, for example because the user went to another page. The same
+    # keywords are searched again if the user types them again
+    def search_cancelled(self):
+        self.status_label.config(text='')
+        self.last_searched_keywords = ''
+
+    # Tells the user that the search failed. Called in the main thread with the exception e raised by search_stock
+    def display_search_error(self, e):
+        self.status_label.config(text='Search failed: ' + str(e))
 
     # Searches a stock through webscrabing based on a keyword string argument
     # Returns dataframe with the columns containing stock data and one row for each stock
     # columns are symbol, name, latest price, industry/category then type then exchange
-    def search_stock(self, keywords):
-        # Search for the stocks and create a list with search results
-        print('Searched for: ', keywords)
-
-        # Escape keywords to fit better in url
-        #escaped_keywords = re.escape(keywords)
-
-        # Create search url
-        URL = "https://finance.yahoo.com/lookup?s=" + keywords
-        print(URL)
-
-        # Use requests to download information including html
-        results_page = requests.get(URL)
-
-        # Create a BeautifulSoup object using the html from the
-        # results page for web-scraping and extracting the relevant results
-        soup = BeautifulSoup(results_page.content, 'html.parser')
-
-        # Get all search results, including not only stocks but also ETF
-        # and MUTUAL FUND. The first row is column information so do not
-        # include it (Hence "[1:]"). Tr is a tag used for marking rows
-        # in yahoo finance
-        all_html_results = soup.find_all('tr')[1:]
-
-
-        # Create temporary list to store all the stock search results
-        stock_result_list = []
-
-        # Iterate through search results and create info dictionaries for each
-        # result. Then filter only for stocks by adding only stocks to stock_results
-        for result in all_html_results:
-
-            # List for storing information for this current result
-            # (that will be of type STOCK or ETF or MUTUAL FUND or other)
-            result_info = [0] * 6
-
-            # Get all the html columns of this result
-            columns = result.find_all('td')
-
-            # Get the symbol name of result, strip() to remove leading and trailing spaces
-            result_info[0] = columns[0].find('a').get_text().strip()
-
-            # Get the name of result
-            result_info[1] = columns[1].get_text()
-
-            # Get the Last price of result
-            result_info[2] = columns[2].get_text()
-
-            # Get the industry of the result
-            result_info[3] = columns[3].get_text()
-
-            # Get the type of the result (for example stock or etf)
-            result_info[4] = columns[4].get_text()
-
-            # Get the Exchange that trades this result
-            result_info[5] = columns[5].get_text()
-
-            # Log information about this financial item result
-            # self.log_financial_item_info(result_info)
-
-            # If the search result is a stock, add its data to stock_results
-            if 'Stocks' in result_info[4]:
-                # Append all stock search results to temporary stock result list
-                stock_result_list.append(result_info)
-
-        # Column names for search results data
-        col_names = ['Symbol', 'Name', 'Last Price', 'Industry/Category', 'Type', 'Exchange']
-
-        # List for storing stock results from search
-        search_results_data_frame = pandas.DataFrame(stock_result_list, columns=col_names)
-
-        print('Data frame: \n', search_results_data_frame)
-        return search_results_data_frame
+    # The results are stored in the app wide search cache. If use_cache is True and the search is already cached,
+    # the cached results are returned without scraping. The scraping itself is done in the stock_search module
+    def search_stock(self, keywords, use_cache=True):
+        return search_stocks(keywords, use_cache)
+
+    # Creates the table that shows the search results. The same table is reused for every search, only its rows
+    # are replaced. A ttk.Treeview only draws the rows that are visible, so even long result lists are fast and
+    # the number of widgets does not grow with the number of results or searches.
+    # No arguments except self, returns nothing
+    def create_search_results_table(self):
+        # Frame that houses the table, its scrollbar and the select button. Shown when there are search results
+        self.results_frame = tk.Frame(self)
+
+        # The table with one column for each column of the search results
+        self.results_table = Treeview(self.results_frame, columns=SEARCH_RESULT_COLUMNS, show='headings',
+                                      selectmode='browse', height=SEARCH_RESULTS_TABLE_HEIGHT)
+        for col_name in SEARCH_RESULT_COLUMNS:
+            self.results_table.heading(col_name, text=col_name)
+            self.results_table.column(col_name, width=SEARCH_RESULT_COLUMN_WIDTHS[col_name], anchor='w')
+        self.results_table.grid(row=0, column=0, sticky='nsew')
+
+        # Scrollbar for the table
+        results_scrollbar = Scrollbar(self.results_frame, orient='vertical', command=self.results_table.yview)
+        self.results_table.configure(yscrollcommand=results_scrollbar.set)
+        results_scrollbar.grid(row=0, column=1, sticky='ns')
+
+        # Select the marked stock by pressing the button, double clicking or pressing enter in the table
+        select_button = tk.Button(self.results_frame, text='Select stock', command=self.select_marked_stock)
+        select_button.grid(row=1, column=0, padx=5, pady=10, sticky='w')
+        self.results_table.bind('<Double-1>', lambda event: self.select_marked_stock())
+        self.results_table.bind('<Return>', lambda event: self.select_marked_stock())
+
+        # Label telling the user that a search gave no results
+        self.no_results_label = tk.Label(self, text='')
+
+        # The dataframe with the results that are shown in the table
+        self.displayed_results = None
 
     # Function that displays the search results from search_stocks function that searches based on user keywords
-    # This function takes in the stock_results_dataframe as argument and displays a table containg the info and
-    # select stock buttons. These button run a certain specified command "function_to_run" with the input argument
+    # This function takes in the stock_results_dataframe as argument and displays the rows in the search results
+    # table. When the user selects a stock, a certain specified command "function_to_run" is run with the input argument
     # being the stock data as a row in the dataframe
     # The function returns nothing.
+    @traced('render.search_results')
     def display_search_results(self, stock_results_dataframe):
-        # stock_results is a list containing dictionaries. Each dictionary represents a stock
-        # . The stock dictionaries contain keywords 'symbol', 'name', 'last_price', 'industry_or_category'
-        # as well as 'type', 'exchange'
-
-        # Display the search results and let user select stock
-
-        # Scrolled frame for results
-        sf_stock_results = ScrolledFrame(self, width=810, height=500)
-        sf_stock_results.grid(row=1, column=0, columnspan=3)
-
-        # Save sf_stock_results as attribute
-        self.sf_stock_results = sf_stock_results
-
-        # Bind arrow keys and scroll wheel for scrolling functionality
-        sf_stock_results.bind_scroll_wheel(self.controller)
-        sf_stock_results.bind_arrow_keys(self.controller)
-
-        # Inner frame that is displayed inside the scrollable frame
-        inner_frame = sf_stock_results.display_widget(tk.Frame)
-
-        # Set the column names if there are any search results
-        if len(stock_results_dataframe) > 0:
-            # set column names
-            col_names = ['Select buttons'] + list(stock_results_dataframe.columns)
-            # Iterate through column names
-            for col_idx in range(len(col_names)):
-                col_label = tk.Label(inner_frame, text=col_names[col_idx], font=('Arial', 15, 'bold'))
-                col_label.grid(row=0, column=col_idx, sticky='w')
-        # Otherwise tell user there were no results
-        else:
-            no_results_label = tk.Label(inner_frame, text='No search reults for keyword: ' + self.search_bar.get())
-            no_results_label.grid(row=0, column=0, sticky='w')
-
-        # Here are the column keys
-        col_keys = stock_results_dataframe.columns
-
-        # Iterate through rows and columns and add all data for resulting stocks
-        for row_idx in range(len(stock_results_dataframe.index)):
-
-            # Separate rows for easier navigation using separator class
-            Separator(inner_frame, orient='horizontal').grid(row=row_idx * 2 + 1,
-                                                             column=0,
-                                                             sticky='ew',
-                                                             columnspan=7
-                                                             )
-            # Create select stock button for each row
-
-            # Function that runs this stock_selectors function_to_run with
-            # the selected stock. Data passed to function to run is row from the dataframe
-            def select_stock(symbol):
-                # hide StockSelector frame
-                # if should_hide_when_selected is true
-                if self.should_hide_when_selected is True:
-                    print('removing stockresults frame')
-                    self.sf_stock_results.grid_forget()
-
-                # Run function, for example analysis or return stock name
-                self.function_to_run(symbol)
-
-            print('Button command, ', stock_results_dataframe['Symbol'][row_idx])
-            # Create the select_stock_button and bind the custom made func to it
-            select_button = tk.Button(inner_frame, text='Select stock',
-                                      command=lambda symbol=stock_results_dataframe.iloc[row_idx]: select_stock(symbol))
-
-            # Position the select_button with grid
-            select_button.grid(row=row_idx * 2 + 2, column=0, padx=5, pady=10, sticky='w')
-
-            # There are 6 data columns, iterate through each and add corresponding data
-            for col_idx in range(6):
-                # Add each stock as a row in a scrollable canvas
-                # This: stock_results[row_idx][col_keys[col_idx]] gets the data value
-                # for each stock and column
-                info_label = tk.Label(inner_frame, text=stock_results_dataframe[col_keys[col_idx]][row_idx])
-
-                # Place the info_label at the correct place. row_idx + 1 because
-                # the first row is just column info. Second row is the first stock
-                info_label.grid(row=row_idx * 2 + 2, column=col_idx + 1, padx=5, pady=10, sticky='w')
-
-
-# Copyright 2020 Oliver Midbrink
\ No newline at end of file
+        # The search is done, remove the searching text
+        self.status_label.config(text='')
+
+        # Save the results so that the selected row can be found
+        self.displayed_results = stock_results_dataframe
+
+        # Remove the rows of the last search
+        self.results_table.delete(*self.results_table.get_children())
+
+        # If there are no results tell the user, otherwise show the table
+        if len(stock_results_dataframe) == 0:
+            self.results_frame.grid_forget()
+            self.no_results_label.config(text='No search reults for keyword: ' + self.search_bar.get())
+            self.no_results_label.grid(row=1, column=0, columnspan=5, sticky='w')
+            return
+
+        self.no_results_label.grid_forget()
+        self.results_frame.grid(row=1, column=0, columnspan=5, sticky='nsew')
+
+        # Add one table row per stock, the row id is the row number in the dataframe
+        for row_idx, row_values in enumerate(stock_results_dataframe[SEARCH_RESULT_COLUMNS].itertuples(index=False)):
+            self.results_table.insert('', 'end', iid=str(row_idx), values=row_values)
+
+        # Scroll to the top for the new results
+        self.results_table.yview_moveto(0)
+
+    # Runs this stock_selectors function_to_run with the stock that is marked in the results table.
+    # Data passed to function to run is row from the dataframe
+    # Returns nothing
+    def select_marked_stock(self):
+        marked_rows = self.results_table.selection()
+
+        # Nothing to do if no stock is marked
+        if len(marked_rows) == 0 or self.displayed_results is None:
+            return
+
+        stock_data = self.displayed_results.iloc[int(marked_rows[0])]
+
+        # hide the search results if should_hide_when_selected is true
+        if self.should_hide_when_selected is True:
+            logger.debug('Removing stock results frame')
+            self.results_frame.grid_forget()
+
+        # Run function, for example analysis or return stock name
+        self.function_to_run(stock_data)
+
+
+# Debug window that shows how long the stages of the app (fetch, parse, compute and render) have taken, from the spans
+# in tracing.py. It is refreshed every TRACE_OVERLAY_REFRESH_MS while it is open. Tracing can be turned on and off
+# here, and the timings can be dumped to a json file in the cache directory.
+class TraceOverlay(tk.Toplevel):
+
+    # Initialize the window, parent is the app window
+    def __init__(self, parent):
+        tk.Toplevel.__init__(self, parent)
+        self.title('Stage timings')
+
+        # Table with one row per span name
+        columns = ('count', 'errors', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms')
+        self.timings_table = Treeview(self, columns=columns, height=15)
+        self.timings_table.heading('#0', text='Stage')
+        self.timings_table.column('#0', width=200)
+        for column in columns:
+            self.timings_table.heading(column, text=column)
+            self.timings_table.column(column, width=80, anchor='e')
+        self.timings_table.grid(row=0, column=0, columnspan=4, padx=10, pady=10, sticky='nsew')
+
+        # Table with one row per single flight group, how many requests shared a download with another one
+        coalescing_columns = ('requests', 'executions', 'coalesced', 'errors', 'in_flight')
+        self.coalescing_table = Treeview(self, columns=coalescing_columns, height=4)
+        self.coalescing_table.heading('#0', text='Coalesced requests')
+        self.coalescing_table.column('#0', width=200)
+        for column in coalescing_columns:
+            self.coalescing_table.heading(column, text=column)
+            self.coalescing_table.column(column, width=80, anchor='e')
+        self.coalescing_table.grid(row=3, column=0, columnspan=4, padx=10, pady=10, sticky='nsew')
+
+        # Tracing is off by default, it can be turned on here
+        self.tracing_variable = tk.BooleanVar(value=is_tracing_enabled())
+        tracing_button = Checkbutton(self, text='Tracing on', variable=self.tracing_variable,
+                                     command=lambda: enable_tracing(self.tracing_variable.get()))
+        tracing_button.grid(row=1, column=0, padx=10, pady=10, sticky='w')
+
+        clear_button = tk.Button(self, text='Clear', command=self.clear_timings)
+        clear_button.grid(row=1, column=1, padx=10, pady=10)
+
+        dump_button = tk.Button(self, text='Dump to file', command=self.dump_timings)
+        dump_button.grid(row=1, column=2, padx=10, pady=10)
+
+        # Shows where the timings were dumped
+        self.status_label = tk.Label(self, text='')
+        self.status_label.grid(row=2, column=0, columnspan=4, padx=10, pady=5, sticky='w')
+
+        self.refresh_id = None
+        self.refresh()
+
+        self.protocol("WM_DELETE_WINDOW", self.close)
+
+    # Shows the latest statistics in the table and schedules the next refresh
+    def refresh(self):
+        statistics = tracer.statistics()
+
+        self.timings_table.delete(*self.timings_table.get_children())
+        for name in statistics:
+            span_statistics = statistics[name]
+            self.timings_table.insert('', 'end', text=name, values=tuple(
+                '' if span_statistics[column] is None else round(span_statistics[column], 2)
+                for column in self.timings_table['columns']))
+
+        statistics = coalescing_statistics()
+        self.coalescing_table.delete(*self.coalescing_table.get_children())
+        for name in statistics:
+            self.coalescing_table.insert('', 'end', text=name, values=tuple(
+                statistics[name][column] for column in self.coalescing_table['columns']))
+
+        self.refresh_id = self.after(TRACE_OVERLAY_REFRESH_MS, self.refresh)
+
+    # Removes all the timings
+    def clear_timings(self):
+        tracer.clear()
+        self.refresh_now()
+
+    # Writes the timings to a json file in the cache directory
+    def dump_timings(self):
+        path = os.path.join(get_cache_directory(), 'trace-' + time.strftime('%Y%m%d-%H%M%S') + '.json')
+        tracer.dump(path, {'coalescing': coalescing_statistics(), 'rate_limiter': get_rate_limiter().statistics()})
+        self.status_label.config(text='Timings written to ' + path)
+
+    # Refreshes the table at once instead of waiting for the next refresh
+    def refresh_now(self):
+        if self.refresh_id is not None:
+            self.after_cancel(self.refresh_id)
+        self.refresh()
+
+    # Stops refreshing and closes the window
+    def close(self):
+        if self.refresh_id is not None:
+            self.after_cancel(self.refresh_id)
+            self.refresh_id = None
+        self.destroy()
+
+
+# Copyright 2020 Oliver Midbrink
@@ -0,0 +1,442 @@
+# Headless command line mode for analyzing large lists of stocks without the GUI, for example a whole exchange
+# overnight. Symbols are read from a file or stdin, one per line, and analyzed in chunks by a pool of workers.
+# The results are written as CSV or JSON lines as soon as each chunk is done, so memory use does not grow with the
+# number of symbols and a run that is stopped can be resumed where it ended.
+#
+# Examples:
+#   python headless.py symbols.txt --output results.csv --fundamental
+#   cat symbols.txt | python headless.py - --format jsonl > results.jsonl
+#   python headless.py symbols.txt --output results.csv --resume
+#   python headless.py symbols.txt --data-dir recorded_data --output results.csv
+#   python headless.py symbols.txt --output results.csv --snapshot
+#
+# This module must not import tkinter, so that it can run on servers without a display.
+
+# For reading the command line arguments
+import argparse
+
+# Log messages go to stderr, the level is set with --log-level
+import logging
+
+# For writing the results
+import csv
+import json
+import math
+import os
+import sys
+
+# For sending anything the libraries print to stderr when the results are written to stdout
+from contextlib import redirect_stdout
+
+# For running the chunks of symbols at the same time with a bounded number of chunks waiting
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# For the progress reports
+import time
+
+# The analysis functions, the same as in the GUI
+from analysis import technical_analysis_batch, fundamental_analysis, BATCH_CHUNK_SIZE
+
+# For reading the market data from a local directory instead of yahoo finance
+from data_providers import CSVDirectoryProvider
+
+# Limits for the number of chunks that are analyzed at the same time
+from ranking import DEFAULT_MAX_WORKERS, MAX_WORKERS_LIMIT
+
+# Timing of the stages of the analysis
+from tracing import tracer, enable_tracing
+
+# For saving the results as a snapshot that can be shown and compared later
+from snapshots import save_analysis_results
+
+# Number of requests that shared a download with another one and the state of the rate limiter, written with the
+# stage timings
+from single_flight import coalescing_statistics
+from rate_limiter import get_rate_limiter
+
+# Formats that the results can be written in
+OUTPUT_FORMATS = ('csv', 'jsonl')
+
+# Columns of a result row that are texts, the others are numbers
+TEXT_FIELDS = ('symbol', 'status', 'error')
+
+# Names of the values from technical_analysis_batch and fundamental_analysis, the attributes of their results
+TECHNICAL_FIELDS = ['price_development', 'beta_assignment', 'lowest_price', 'highest_price']
+FUNDAMENTAL_FIELDS = ['equity_ratio', 'price_per_earnings', 'price_per_revenue']
+
+# Seconds between the progress reports on stderr
+PROGRESS_INTERVAL = 5
+
+
+# Reads the symbols from lines, for example an open file. Empty lines and lines starting with # are skipped, and only
+# the first word of each line is used, so files with a symbol and a name on each line work as well.
+# Yields the symbols one at a time so that a large file is never read into memory at once
+def read_symbols(lines):
+    for line in lines:
+        words = line.replace(',', ' ').split()
+
+        if len(words) == 0 or words[0].startswith('#'):
+            continue
+
+        yield words[0]
+
+
+# Yields lists of up to chunk_size symbols from the iterable symbols
+def chunked(symbols, chunk_size):
+    chunk = []
+
+    for symbol in symbols:
+        chunk.append(symbol)
+
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+
+    if len(chunk) > 0:
+        yield chunk
+
+
+# Returns the names of all the columns of a result row
+def result_fields(include_fundamental):
+    fields = ['symbol', 'status', 'error'] + TECHNICAL_FIELDS
+    if include_fundamental:
+        fields += FUNDAMENTAL_FIELDS
+    return fields
+
+
+# Turns a calculated value into a number that can be written. NaN and infinite values (for example from a division
+# by zero) become None
+def clean_value(value):
+    if value is None:
+        return None
+
+    value = float(value)
+    if math.isnan(value) or math.isinf(value):
+        return None
+    return value
+
+
+# Analyzes a chunk of symbols. The technical analysis is done for the whole chunk at once and the fundamental
+# analysis, if include_fundamental is True, for one symbol at a time.
+# Returns a list with one result row per symbol, a dictionary with the result_fields as keys. status is 'ok' or
+# 'error' and error describes what went wrong. provider is the data provider to read from, the local stores if None
+def analyze_chunk(symbols, include_fundamental=False, provider=None):
+    results, errors = technical_analysis_batch(symbols, provider=provider)
+
+    rows = []
+    for symbol in symbols:
+        row = {'symbol': symbol, 'status': 'ok', 'error': None}
+
+        if symbol in results:
+            for field in TECHNICAL_FIELDS:
+                row[field] = clean_value(getattr(results[symbol], field))
+        else:
+            row['status'] = 'error'
+            row['error'] = errors.get(symbol, 'Unknown error')
+
+        if include_fundamental:
+            try:
+                fundamental_values = fundamental_analysis({'Symbol': symbol}, provider=provider)
+
+                for field in FUNDAMENTAL_FIELDS:
+                    row[field] = clean_value(getattr(fundamental_values, field))
+            except Exception as e:
+                # Keep the technical values, but report the error
+                row['status'] = 'error'
+                row['error'] = (row['error'] + '; ' if row['error'] else '') + 'Fundamental analysis: ' + str(e)
+
+        rows.append(row)
+
+    return rows
+
+
+# Writes result rows to an open text file as CSV or JSON lines. The file is flushed after every chunk of rows so that
+# the results that are done are on disk if the run is stopped.
+class ResultWriter:
+
+    # Initialize the writer. output_file is an open text file, output_format one of OUTPUT_FORMATS, fields the names
+    # of the columns and write_header is False when appending to a file that already has a header
+    def __init__(self, output_file, output_format, fields, write_header=True):
+        self.output_file = output_file
+        self.output_format = output_format
+        self.fields = fields
+
+        if output_format == 'csv':
+            self.csv_writer = csv.DictWriter(output_file, fieldnames=fields, extrasaction='ignore')
+            if write_header:
+                self.csv_writer.writeheader()
+
+    # Writes a list of result rows and flushes the file
+    def write_rows(self, rows):
+        for row in rows:
+            if self.output_format == 'csv':
+                # Missing values are written as empty cells
+                self.csv_writer.writerow({field: '' if row.get(field) is None else row.get(field)
+                                          for field in self.fields})
+            else:
+                self.output_file.write(json.dumps({field: row.get(field) for field in self.fields}) + '\n')
+
+        self.output_file.flush()
+
+
+# Yields the lines that end with a newline. A last line without one was only partly written when a run was stopped,
+# even if its first columns look complete
+def complete_lines(lines):
+    for line in lines:
+        if line.endswith('\n'):
+            yield line
+
+
+# Reads the symbols that already have results in the file at output_path, so that a stopped run can be resumed.
+# Returns a set with the symbols, empty if the file does not exist. A last line that was only partly written when the
+# run was stopped is ignored
+def read_finished_symbols(output_path, output_format):
+    finished_symbols = set()
+
+    if not os.path.exists(output_path):
+        return finished_symbols
+
+    with open(output_path, newline='') as output_file:
+        if output_format == 'csv':
+            for row in csv.DictReader(complete_lines(output_file)):
+                if row.get('symbol') and row.get('status') in ('ok', 'error'):
+                    finished_symbols.add(row['symbol'])
+        else:
+            for line in complete_lines(output_file):
+                try:
+                    finished_symbols.add(json.loads(line)['symbol'])
+                except (ValueError, KeyError, TypeError):
+                    continue
+
+    return finished_symbols
+
+
+# Returns True if the file at path exists and does not end with a newline, which happens if a run was stopped in the
+# middle of writing a line
+def has_unfinished_line(path):
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return False
+
+    with open(path, 'rb') as existing_file:
+        existing_file.seek(-1, os.SEEK_END)
+        return existing_file.read(1) != b'\n'
+
+
+# Removes the last line of the file at path if it was only partly written when a run was stopped, so that the
+# results of the next run start on a line of their own and the symbol of that line is analyzed again.
+# The file is searched backwards from the end for the last newline, one block at a time
+def remove_unfinished_line(path, block_size=65536):
+    if not has_unfinished_line(path):
+        return
+
+    with open(path, 'rb+') as existing_file:
+        block_end = existing_file.seek(0, os.SEEK_END)
+        while block_end > 0:
+            block_start = max(0, block_end - block_size)
+            existing_file.seek(block_start)
+            newline_idx = existing_file.read(block_end - block_start).rfind(b'\n')
+            if newline_idx >= 0:
+                existing_file.truncate(block_start + newline_idx + 1)
+                return
+            block_end = block_start
+
+        # Not even the first line was finished
+        existing_file.truncate(0)
+
+
+# Reports the progress of a run on stderr at most every PROGRESS_INTERVAL seconds
+class ProgressReporter:
+
+    # Initialize the reporter. skipped is the number of symbols that were already done in an earlier run
+    def __init__(self, skipped=0, stream=sys.stderr):
+        self.stream = stream
+        self.skipped = skipped
+        self.analyzed = 0
+        self.errors = 0
+        self.start_time = time.monotonic()
+        self.last_report_time = self.start_time
+
+    # Counts the result rows of a finished chunk and reports if it is time to
+    def add_rows(self, rows):
+        self.analyzed += len(rows)
+        self.errors += sum(1 for row in rows if row['status'] == 'error')
+
+        if time.monotonic() - self.last_report_time >= PROGRESS_INTERVAL:
+            self.report()
+
+    # Writes a line with the number of analyzed symbols, errors and symbols per second
+    def report(self, final=False):
+        self.last_report_time = time.monotonic()
+        elapsed_time = max(self.last_report_time - self.start_time, 1e-9)
+
+        print(('Done: ' if final else 'Progress: ') + str(self.analyzed) + ' symbols analyzed, ' + str(self.errors) +
+              ' errors, ' + str(self.skipped) + ' skipped from earlier run, ' +
+              str(round(self.analyzed / elapsed_time, 1)) + ' symbols/s', file=self.stream, flush=True)
+
+
+# Runs analyze_function for every chunk of symbols with max_workers chunks at the same time and gives the result rows
+# to write_rows as soon as each chunk is done, in the order the chunks finish.
+# At most two chunks per worker are waiting or running at once, so symbols are only read as fast as they are analyzed
+# and memory use does not depend on the number of symbols.
+# progress is a ProgressReporter or None
+def run_pipeline(symbol_chunks, analyze_function, write_rows, max_workers=DEFAULT_MAX_WORKERS, progress=None):
+    max_pending = 2 * max_workers
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = set()
+
+        for chunk in symbol_chunks:
+            # Wait for a chunk to finish before more are started
+            while len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    write_finished_chunk(future, write_rows, progress)
+
+            pending.add(executor.submit(analyze_function, chunk))
+
+        # Write the last chunks
+        while len(pending) > 0:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                write_finished_chunk(future, write_rows, progress)
+
+
+# Writes the result rows of a finished chunk and counts them in progress. Errors for single symbols are in the rows,
+# so an exception here is unexpected and stops the run
+def write_finished_chunk(future, write_rows, progress):
+    rows = future.result()
+    write_rows(rows)
+
+    if progress is not None:
+        progress.add_rows(rows)
+
+
+# Returns the argument parser of the command line mode
+def create_argument_parser():
+    parser = argparse.ArgumentParser(
+        description='Analyze stocks without the GUI and write the results as they are done.')
+    parser.add_argument('symbols', nargs='?', default='-',
+                        help='file with one symbol per line, or - to read from stdin (default)')
+    parser.add_argument('--output', '-o', default='-', help='file to write the results to, or - for stdout (default)')
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default=None,
+                        help='output format, by default jsonl for .jsonl and .json files and csv otherwise')
+    parser.add_argument('--fundamental', action='store_true',
+                        help='also run the fundamental analysis, one extra request per stock')
+    parser.add_argument('--workers', type=int, default=DEFAULT_MAX_WORKERS,
+                        help='number of chunks analyzed at the same time (1-' + str(MAX_WORKERS_LIMIT) + ')')
+    parser.add_argument('--chunk-size', type=int, default=BATCH_CHUNK_SIZE,
+                        help='number of symbols whose prices are downloaded with one request')
+    parser.add_argument('--resume', action='store_true',
+                        help='skip the symbols that already have results in the output file and append the rest')
+    parser.add_argument('--data-dir', help='read prices and statements from this directory of csv and json files '
+                                           'instead of yahoo finance, see CSVDirectoryProvider in data_providers.py')
+    parser.add_argument('--log-level', default='WARNING', help='level of the log messages on stderr, for example INFO')
+    parser.add_argument('--trace', help='time the stages of the analysis and write the timings to this json file')
+    parser.add_argument('--snapshot', nargs='?', const='', metavar='NAME',
+                        help='also save the results of this run as a snapshot with this name, or a name from the '
+                             'current time if none is given, see snapshots.py. The results are kept in memory '
+                             'until the run is done')
+    return parser
+
+
+# Runs the command line mode. argv is the list of arguments, by default the arguments the program was started with.
+# Returns the exit code
+def main(argv=None):
+    arguments = create_argument_parser().parse_args(argv)
+
+    logging.basicConfig(level=arguments.log_level.upper(), stream=sys.stderr,
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    if arguments.trace:
+        enable_tracing()
+
+    max_workers = max(1, min(arguments.workers, MAX_WORKERS_LIMIT))
+    chunk_size = max(1, arguments.chunk_size)
+
+    output_format = arguments.format
+    if output_format is None:
+        output_format = 'jsonl' if arguments.output.endswith(('.jsonl', '.json')) else 'csv'
+
+    fields = result_fields(arguments.fundamental)
+
+    provider = None
+    if arguments.data_dir:
+        if not os.path.isdir(arguments.data_dir):
+            print('No such directory: ' + arguments.data_dir, file=sys.stderr)
+            return 2
+        provider = CSVDirectoryProvider(arguments.data_dir)
+
+    # Find the symbols that were done in an earlier run
+    finished_symbols = set()
+    if arguments.resume:
+        if arguments.output == '-':
+            print('--resume needs an output file', file=sys.stderr)
+            return 2
+        remove_unfinished_line(arguments.output)
+        finished_symbols = read_finished_symbols(arguments.output, output_format)
+
+    # Append to the output file when resuming, otherwise start a new one
+    appending = arguments.resume and os.path.exists(arguments.output) and os.path.getsize(arguments.output) > 0
+    if arguments.output == '-':
+        output_file = sys.stdout
+    else:
+        output_file = open(arguments.output, 'a' if appending else 'w', newline='')
+
+    symbols_file = sys.stdin if arguments.symbols == '-' else open(arguments.symbols)
+
+    try:
+        writer = ResultWriter(output_file, output_format, fields, write_header=not appending)
+        progress = ProgressReporter(skipped=0)
+
+        # Skip the duplicates in the input and the symbols that are done. Only the symbols that were done in an
+        # earlier run count as skipped, and each of them only once
+        def symbols_to_analyze():
+            seen_symbols = set()
+            for symbol in read_symbols(symbols_file):
+                if symbol in seen_symbols:
+                    continue
+                seen_symbols.add(symbol)
+
+                if symbol in finished_symbols:
+                    progress.skipped += 1
+                    continue
+                yield symbol
+
+        # The rows of a snapshot are collected while they are written
+        write_rows = writer.write_rows
+        snapshot_rows = []
+        if arguments.snapshot is not None:
+            def write_rows(rows):
+                writer.write_rows(rows)
+                snapshot_rows.extend(rows)
+
+        # Libraries like yfinance sometimes print, keep that away from the results when they go to stdout
+        with redirect_stdout(sys.stderr):
+            run_pipeline(chunked(symbols_to_analyze(), chunk_size),
+                         lambda chunk: analyze_chunk(chunk, arguments.fundamental, provider), write_rows,
+                         max_workers=max_workers, progress=progress)
+
+        progress.report(final=True)
+
+        if arguments.snapshot is not None:
+            snapshot_path = save_analysis_results(snapshot_rows, fields, TEXT_FIELDS, arguments.snapshot or None,
+                                                  {'fundamental': arguments.fundamental})
+            print('Saved the results as snapshot ' + snapshot_path, file=sys.stderr)
+
+        if arguments.trace:
+            tracer.dump(arguments.trace, {'coalescing': coalescing_statistics(),
+                                          'rate_limiter': get_rate_limiter().statistics()})
+    finally:
+        if symbols_file is not sys.stdin:
+            symbols_file.close()
+        if output_file is not sys.stdout:
+            output_file.close()
+
+    return 0
+
+
+# Run the command line mode if this file is run, not when it is imported
+if __name__ == "__main__":
+    sys.exit(main())
+
+
+# Copyright 2020 Oliver Midbrink
@@ -0,0 +1,104 @@
+# For downloading web pages when web-scraping yahoo finance
+import threading
+
+# For waiting between retries, with some randomness so that throttled requests do not all retry at the same time
+import random
+import time
+
+# Heavy libraries are imported the first time they are used, so that the app starts fast
+from lazy_modules import lazy_import
+requests = lazy_import('requests')
+requests_adapters = lazy_import('requests.adapters')
+urllib3_retry = lazy_import('urllib3.util.retry')
+
+# All requests to yahoo finance go through the shared rate limiter
+from rate_limiter import get_rate_limiter
+
+# Seconds to wait for a connection and for an answer. Without a timeout a hanging server would block forever
+REQUEST_TIMEOUT = (3.05, 10)
+
+# Number of times a request is retried after a connection error or a throttling or server error answer.
+# Connection errors are retried by the session, throttling and server errors by http_get through the rate limiter
+MAX_RETRIES = 3
+
+# The waiting time between retries grows as 0.5, 1, 2 ... seconds
+BACKOFF_FACTOR = 0.5
+
+# Answers from the server that are worth retrying. 429 means too many requests
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Largest number of open connections that are kept for reuse per host
+POOL_SIZE = 32
+
+# Yahoo finance answers requests without a browser user agent with an error page
+USER_AGENT = 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36'
+
+
+# Creates a requests session with a pool of keep-alive connections and a retry policy with backoff for connection
+# errors. The same connections are reused for all requests to the same host, which saves a TCP and TLS handshake per
+# request.
+def create_session():
+    session = requests.Session()
+
+    # Answers with an error status are not retried here but in http_get, so that the rate limiter sees them
+    retry_policy = urllib3_retry.Retry(total=MAX_RETRIES, status=0, backoff_factor=BACKOFF_FACTOR,
+                                       allowed_methods=('GET',))
+    adapter = requests_adapters.HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE,
+                                             max_retries=retry_policy)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    session.headers['User-Agent'] = USER_AGENT
+    return session
+
+
+# The session shared by the whole app, created the first time it is used
+shared_session = None
+shared_session_lock = threading.Lock()
+
+
+# Returns the session shared by the whole app
+def get_session():
+    global shared_session
+
+    with shared_session_lock:
+        if shared_session is None:
+            shared_session = create_session()
+        return shared_session
+
+
+# Returns the number of seconds in the value of a Retry-After header, or None if there is no such header or it is
+# a date
+def retry_after_seconds(header_value):
+    try:
+        return float(header_value)
+    except (TypeError, ValueError):
+        return None
+
+
+# Returns the number of seconds to wait before retry number attempt (0 for the first retry)
+def backoff_seconds(attempt):
+    return BACKOFF_FACTOR * 2 ** attempt * random.uniform(0.5, 1.5)
+
+
+# Downloads url with the shared session. params is a dictionary with query parameters that are escaped and added to
+# the url. Every request waits for the shared rate limiter, and answers that mean that yahoo finance is throttling
+# the app or is overloaded (RETRY_STATUS_CODES) slow the limiter down and are retried with backoff.
+# Raises a requests.HTTPError if the server answers with an error after all the retries.
+# Returns the requests.Response
+def http_get(url, params=None, timeout=REQUEST_TIMEOUT):
+    for attempt in range(MAX_RETRIES + 1):
+        with get_rate_limiter().limited() as slot:
+            response = get_session().get(url, params=params, timeout=timeout)
+            if response.status_code in RETRY_STATUS_CODES:
+                slot.throttled(retry_after_seconds(response.headers.get('Retry-After')))
+
+        if response.status_code not in RETRY_STATUS_CODES or attempt == MAX_RETRIES:
+            break
+        time.sleep(backoff_seconds(attempt))
+
+    response.raise_for_status()
+    return response
+
+
+# Copyright 2020 Oliver Midbrink
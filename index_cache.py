@@ -0,0 +1,132 @@
+# For keeping the cache safe when several analyses read from it at the same time
+import threading
+
+# For working out when the cached index prices are outdated
+from datetime import datetime, timedelta, timezone, time
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+# The market index that stocks are compared to when calculating the "betavalue" as defined in the assignment
+BENCHMARK_INDEX_SYMBOL = '^DJI'
+
+# The time window of index prices that is used when calculating the "betavalue"
+BENCHMARK_PERIOD = '1mo'
+
+# The time window of prices used for the rolling return statistics. The longest window is 250 trading days, which
+# needs a bit more than a year of prices
+STATISTICS_PERIOD = '14mo'
+
+# New York stock exchange closes 16:00 local time, after that a new daily bar exists for the indexes
+MARKET_CLOSE_TIME = time(16, 0)
+
+# Time zone of the New York stock exchange. Fall back to a fixed offset if the time zone database is missing
+try:
+    MARKET_TIME_ZONE = ZoneInfo('America/New_York')
+except ZoneInfoNotFoundError:
+    MARKET_TIME_ZONE = timezone(timedelta(hours=-5))
+
+
+# Reads the historic prices for a market index, for example '^DJI', during the time window period, for example
+# '1mo', from the local price store. Only prices that are not already stored are downloaded.
+# Returns a pandas dataframe with the columns Open, High, Low, Close and Volume, one row per market day.
+def download_index_series(index_symbol, period):
+    # Imported here because the price store uses the market close helpers in this module
+    from price_store import get_price_store, period_start_date
+
+    index_prices = get_price_store().get_prices(index_symbol, period_start_date(period))
+
+    if len(index_prices) == 0:
+        raise ValueError('No price data found for ' + index_symbol)
+
+    return index_prices
+
+
+# Returns the next time the New York stock exchange closes after the datetime now. Weekends are skipped, holidays
+# are not, so on a holiday the cache will just be refreshed one time too many.
+def next_market_close(now):
+    # Do the calculation in New York time
+    now = now.astimezone(MARKET_TIME_ZONE)
+
+    # Closing time today
+    close = datetime.combine(now.date(), MARKET_CLOSE_TIME, tzinfo=MARKET_TIME_ZONE)
+
+    # If the market has already closed today, the next close is tomorrow
+    if now >= close:
+        close += timedelta(days=1)
+
+    # Skip saturday (5) and sunday (6)
+    while close.weekday() >= 5:
+        close += timedelta(days=1)
+
+    return close
+
+
+# Cache that stores the price series of market indexes. The same index series is used for every stock in a ranking,
+# so it only has to be downloaded once until the market closes and a new daily bar exists.
+# The series are stored with (index_symbol, period) as key. The attributes hits and misses count how many times a
+# series could be read from the cache and how many times it had to be downloaded.
+class IndexSeriesCache:
+
+    # Initialize the cache. loader is the function used to download a series when it is not in the cache,
+    # it takes index_symbol and period as arguments just like download_index_series
+    def __init__(self, loader=download_index_series):
+        self.loader = loader
+
+        # Dictionary with (index_symbol, period) as keys and (series, expiry datetime) as values
+        self.entries = {}
+
+        # Hit and miss counters
+        self.hits = 0
+        self.misses = 0
+
+        # Lock for the dictionaries and counters
+        self.lock = threading.Lock()
+
+        # One lock per key, so that only one thread downloads a series while the others wait for it
+        self.key_locks = {}
+
+    # Returns the price series for index_symbol during period, downloaded at most once per market day.
+    # Errors from the download are passed on to the caller and nothing is cached in that case.
+    def get_series(self, index_symbol=BENCHMARK_INDEX_SYMBOL, period=BENCHMARK_PERIOD):
+        key = (index_symbol, period)
+
+        with self.lock:
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+
+        # Hold the key lock while checking and downloading so concurrent misses only download once
+        with key_lock:
+            now = datetime.now(MARKET_TIME_ZONE)
+
+            with self.lock:
+                entry = self.entries.get(key)
+
+                # Return the cached series if it is still valid
+                if entry is not None and now < entry[1]:
+                    self.hits += 1
+                    return entry[0]
+
+                self.misses += 1
+
+            # Download the series and keep it until the market closes
+            series = self.loader(index_symbol, period)
+
+            with self.lock:
+                self.entries[key] = (series, next_market_close(now))
+
+            return series
+
+    # Removes all cached series. The counters are kept.
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    # Returns a dictionary with the number of hits, misses and cached series
+    def statistics(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries)}
+
+
+# The cache shared by the whole app
+index_series_cache = IndexSeriesCache()
+
+
+# Copyright 2020 Oliver Midbrink
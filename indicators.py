@@ -0,0 +1,203 @@
+# Heavy libraries are imported the first time they are used, so that the app starts fast
+from lazy_modules import lazy_import
+
+# For matrix operations on historic stock price data
+np = lazy_import('numpy')
+
+# For turning price dataframes into matrices
+pd = lazy_import('pandas')
+
+# Lengths in trading days of the rolling windows that the return statistics are calculated over
+ROLLING_WINDOWS = (20, 60, 250)
+
+# Names of the statistics calculated for every rolling window
+RETURN_STATISTICS = ('beta', 'correlation', 'volatility', 'alpha')
+
+# Used to turn daily volatility and alpha into yearly numbers
+TRADING_DAYS_PER_YEAR = 252
+
+
+# Returns the first value that is not NaN in every row of the 2-D array panel (symbols x days). Rows that only
+# contain NaN get NaN. A stock that was listed during the period gets its first existing price.
+def first_valid_values(panel):
+    # A panel without days has no valid values at all
+    if panel.shape[1] == 0:
+        return np.full(panel.shape[0], np.nan)
+
+    is_valid = ~np.isnan(panel)
+
+    # argmax gives the index of the first True in every row
+    first_valid_idx = is_valid.argmax(axis=1)
+    values = panel[np.arange(panel.shape[0]), first_valid_idx]
+
+    # Rows without any valid values get NaN
+    return np.where(is_valid.any(axis=1), values, np.nan)
+
+
+# Returns the last value that is not NaN in every row of the 2-D array panel (symbols x days). Rows that only
+# contain NaN get NaN.
+def last_valid_values(panel):
+    return first_valid_values(panel[:, ::-1])
+
+
+# Calculates the technical values for every stock in a price panel with a few vectorized operations.
+# open_prices, high_prices, low_prices and close_prices are 2-D arrays (symbols x days) with NaN for missing days,
+# for example the float32 matrices of a price_panel.PricePanel. The lowest and highest prices have the type of the
+# prices, the rest is always float64.
+# index_open and index_close are 1-D arrays with the open and close prices of the market index the stocks are
+# compared to, oldest first.
+#
+# Returns a dictionary with 1-D arrays (one value per symbol):
+# 'price_development' price development in percent from the first open to the last close
+# 'beta_assignment' "betavalue" as defined in the assignment:
+#     (stock_price_now / old_stock_price) / (index_price_now / old_index_price)
+# 'lowest_price' and 'highest_price' during the period
+# Symbols without any prices get NaN.
+def compute_technical_panel(open_prices, high_prices, low_prices, close_prices, index_open, index_close):
+    # Price at the start of the period and the latest price for every stock
+    first_open = first_valid_values(open_prices).astype(float)
+    last_close = last_valid_values(close_prices).astype(float)
+
+    # Index price development as a ratio, the index prices are treated as a panel with one row
+    index_first_open = first_valid_values(np.asarray(index_open, dtype=float)[np.newaxis, :])[0]
+    index_last_close = last_valid_values(np.asarray(index_close, dtype=float)[np.newaxis, :])[0]
+
+    # Symbols without prices give 0/0 or NaN/NaN, that is fine since they should get NaN
+    with np.errstate(divide='ignore', invalid='ignore'):
+        index_ratio = index_last_close / index_first_open
+        stock_ratio = last_close / first_open
+
+    # Highest and lowest price during the period. fmax and fmin skip NaN, and rows with only NaN get NaN
+    if high_prices.shape[1] > 0:
+        highest_price = np.fmax.reduce(high_prices, axis=1)
+        lowest_price = np.fmin.reduce(low_prices, axis=1)
+    else:
+        highest_price = np.full(len(first_open), np.nan)
+        lowest_price = np.full(len(first_open), np.nan)
+
+    return {
+        'price_development': (stock_ratio - 1) * 100,
+        'beta_assignment': stock_ratio / index_ratio,
+        'lowest_price': lowest_price,
+        'highest_price': highest_price,
+    }
+
+
+# Returns the daily log returns of a 2-D price array (symbols x days) as an array with one day less.
+# A return is NaN if the price that day or the day before is missing.
+def log_returns(close_prices):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.diff(np.log(close_prices), axis=1)
+
+
+# Returns the sums of every window of window days in the 2-D array values (rows x days), calculated from cumulative
+# sums so that the cost does not grow with the window length. Result has one column per window, that is
+# days - window + 1 columns, where the last column is the sum of the latest window days.
+def rolling_sums(values, window):
+    # With only one window the sums are taken directly, without the array of cumulative sums
+    if values.shape[1] == window:
+        return values.sum(axis=1, keepdims=True)
+
+    cumulative_sums = np.zeros((values.shape[0], values.shape[1] + 1))
+    np.cumsum(values, axis=1, out=cumulative_sums[:, 1:])
+    return cumulative_sums[:, window:] - cumulative_sums[:, :-window]
+
+
+# Calculates beta, correlation, volatility and alpha against the market index for every rolling window of window
+# days in one pass over the daily log returns.
+# stock_returns is a 2-D array (symbols x days) and index_returns a 1-D array with the index returns of the same days,
+# both with NaN for missing days. Only the days where both the stock and the index have a return are used. Windows
+# with fewer than min_observations such days get NaN, by default half the window.
+#
+# Returns a dictionary with the RETURN_STATISTICS as keys and 2-D arrays (symbols x windows) as values, where the
+# last column is the latest window:
+# 'beta' covariance of the stock and index returns divided by the variance of the index returns
+# 'correlation' correlation between the stock and index returns
+# 'volatility' standard deviation of the stock returns as a yearly number
+# 'alpha' mean stock return that beta does not explain, as a yearly log return
+def rolling_return_statistics(stock_returns, index_returns, window, min_observations=None):
+    if min_observations is None:
+        min_observations = max(2, window // 2)
+
+    stock_returns = np.asarray(stock_returns, dtype=float)
+    index_returns = np.broadcast_to(np.asarray(index_returns, dtype=float), stock_returns.shape)
+
+    number_of_windows = stock_returns.shape[1] - window + 1
+    if number_of_windows < 1:
+        empty_statistics = np.full((stock_returns.shape[0], 0), np.nan)
+        return {statistic: empty_statistics.copy() for statistic in RETURN_STATISTICS}
+
+    # Days where both returns exist, the others are set to 0 so that they do not count in the sums
+    is_valid = ~np.isnan(stock_returns) & ~np.isnan(index_returns)
+    x = np.where(is_valid, index_returns, 0.0)
+    y = np.where(is_valid, stock_returns, 0.0)
+
+    # Subtracting the mean of each row first keeps the sums of squares small, so the differences of cumulative sums
+    # do not lose precision on long series. Covariances and variances do not change by it
+    observations_per_row = np.maximum(is_valid.sum(axis=1, keepdims=True), 1)
+    index_row_mean = x.sum(axis=1, keepdims=True) / observations_per_row
+    stock_row_mean = y.sum(axis=1, keepdims=True) / observations_per_row
+    x = np.where(is_valid, x - index_row_mean, 0.0)
+    y = np.where(is_valid, y - stock_row_mean, 0.0)
+
+    # Number of days and sums of the returns, squares and products for every window
+    count = rolling_sums(is_valid.astype(float), window)
+    sum_x = rolling_sums(x, window)
+    sum_y = rolling_sums(y, window)
+    sum_xx = rolling_sums(x * x, window)
+    sum_yy = rolling_sums(y * y, window)
+    sum_xy = rolling_sums(x * y, window)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Sample covariance and variances from the sums
+        covariance = (sum_xy - sum_x * sum_y / count) / (count - 1)
+        index_variance = (sum_xx - sum_x * sum_x / count) / (count - 1)
+        stock_variance = (sum_yy - sum_y * sum_y / count) / (count - 1)
+
+        # Rounding can give tiny negative variances for flat prices
+        index_variance = np.maximum(index_variance, 0.0)
+        stock_variance = np.maximum(stock_variance, 0.0)
+
+        beta = covariance / index_variance
+        correlation = covariance / np.sqrt(index_variance * stock_variance)
+        volatility = np.sqrt(stock_variance * TRADING_DAYS_PER_YEAR)
+
+        # The means were subtracted above, add them back for alpha
+        stock_mean = sum_y / count + stock_row_mean
+        index_mean = sum_x / count + index_row_mean
+        alpha = (stock_mean - beta * index_mean) * TRADING_DAYS_PER_YEAR
+
+    # Windows with too few days get NaN
+    too_few_days = count < min_observations
+    statistics = {'beta': beta, 'correlation': correlation, 'volatility': volatility, 'alpha': alpha}
+    for statistic in RETURN_STATISTICS:
+        statistics[statistic] = np.where(too_few_days, np.nan, statistics[statistic])
+
+    return statistics
+
+
+# Calculates the return statistics of the latest window for every window length in windows.
+# close_prices is a 2-D array (symbols x days) and index_close a 1-D array with the index close prices of the same
+# days, both with NaN for missing days.
+# Returns a dictionary with keys like 'beta_60' (statistic and window length) and 1-D arrays with one value per
+# symbol. Symbols with too little history get NaN.
+def latest_return_statistics(close_prices, index_close, windows=ROLLING_WINDOWS):
+    stock_returns = log_returns(np.asarray(close_prices, dtype=float))
+    index_returns = log_returns(np.asarray(index_close, dtype=float)[np.newaxis, :])[0]
+
+    latest_statistics = {}
+    for window in windows:
+        # Only the latest window is needed, so only its days are given. That gives one window instead of one per
+        # day, with much smaller temporary arrays
+        statistics = rolling_return_statistics(stock_returns[:, -window:], index_returns[-window:], window)
+
+        for statistic in RETURN_STATISTICS:
+            if statistics[statistic].shape[1] > 0:
+                latest_statistics[statistic + '_' + str(window)] = statistics[statistic][:, -1]
+            else:
+                latest_statistics[statistic + '_' + str(window)] = np.full(stock_returns.shape[0], np.nan)
+
+    return latest_statistics
+
+
+# Copyright 2020 Oliver Midbrink
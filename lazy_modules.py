@@ -0,0 +1,56 @@
+# For importing the heavy modules when they are first used
+import importlib
+
+# Several background threads can use a module for the first time at once
+import threading
+
+
+# Stand-in for a module that is imported the first time one of its attributes is used, for example
+# np = lazy_import('numpy') and later np.array(...). Importing pandas, numpy, yfinance and the other large libraries
+# takes most of a second, so they are imported only when the user starts something that needs them instead of when
+# the app starts.
+# The import is done by importlib.import_module under a lock, so that two threads that use the module at the same time
+# do not import it twice or see a half imported module.
+class LazyModule:
+
+    # Initialize the stand-in, module_name is the full name of the module, for example 'urllib3.util.retry'
+    def __init__(self, module_name):
+        # Set through __dict__ so that __getattr__ is not used for the own attributes
+        self.__dict__['_module_name'] = module_name
+        self.__dict__['_module'] = None
+        self.__dict__['_lock'] = threading.Lock()
+
+    # Returns the module, importing it if that has not been done yet
+    def _load(self):
+        module = self.__dict__['_module']
+
+        if module is None:
+            with self.__dict__['_lock']:
+                module = self.__dict__['_module']
+                if module is None:
+                    module = importlib.import_module(self.__dict__['_module_name'])
+                    self.__dict__['_module'] = module
+
+        return module
+
+    # Only called for attributes that are not found on the stand-in, that is all the attributes of the module
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._load(), name, value)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        return '<lazy module ' + repr(self.__dict__['_module_name']) + '>'
+
+
+# Returns a LazyModule for module_name. Use it instead of an import statement for modules that are slow to import
+# and not needed when the app starts
+def lazy_import(module_name):
+    return LazyModule(module_name)
+
+
+# Copyright 2020 Oliver Midbrink
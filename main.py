@@ -1,10 +1,17 @@
+# For the log messages of the app, the level is set with the STOCK_APP_LOG_LEVEL environment variable
+import logging
+import os
+
 # For GUI purposes
 import tkinter as tk
 
 
 # Self made modules, Like FundamentalAnalysisPage, TechnicalAnalysisPage and BetaRankingPage
 from pages import *
-from functional_frames import StockSelectorFrame
+from functional_frames import StockSelectorFrame, TraceOverlay
+
+# For running network and analysis work without blocking the GUI
+from background_tasks import BackgroundTaskExecutor
 
 
 # Inspiration taken from: https://www.geeksforgeeks.org/tkinter-application-to-switch-between-different-page-frames/
@@ -25,36 +32,42 @@ class StockAnalysisApp(tk.Tk):
         # This might need to change if something isnt working
         self.container.grid(row=0, column=0)
 
+        # Executor that runs slow work like downloads and analyses in background threads. The pages submit their
+        # work to it and get the results back in the main thread, so the GUI never freezes
+        self.task_executor = BackgroundTaskExecutor(self)
+
+        # Stop the background work when the window is closed
+        self.protocol("WM_DELETE_WINDOW", self.close)
+
+        # F12 opens a debug window with the timings of the stages of the app
+        self.trace_overlay = None
+        self.bind_all('<F12>', lambda event: self.open_trace_overlay())
+
         # Variable to store all the frames
         self.frames = {}
 
         # Variable to store last frame
         self.last_frame = None
 
-        # Tuple containing pages the StockAnalysisApp will use
-        pages = (MenuPage, FundamentalAnalysisPage, TechnicalAnalysisPage, BetaRankingPage)
-
-        # Create frames from all the pages (and set them up).
-        # Also add them to the frames variable
-        for Frame_name in pages:
-
-            # create af frame using one of the pages
-            # from "pages" as template
-            frame = Frame_name(self.container, self)
-
-            # Add the created frame to frames variable
-            self.frames[Frame_name] = frame
-
+        # The pages are created the first time they are displayed, so only the MenuPage is built when the app starts
         # Show the MenuPage as display
         self.display_frame(MenuPage)
 
     # Method that displays a certain frame based on the input argument container which will be one of the page classes.
-    # The page class in the self.frames dictionary will be displayed
+    # The page class in the self.frames dictionary will be displayed. A page is created the first time it is displayed
+    # and then kept, so that it looks the same when the user comes back to it
     # no return values, only container as argument
     def display_frame(self, container):
         if self.last_frame is not None:
             self.last_frame.grid_forget()
 
+        # The results of the background work on the last page would be outdated, so cancel it
+        self.task_executor.cancel_all()
+
+        # Create the frame from the page class if it has not been displayed before
+        if container not in self.frames:
+            self.frames[container] = container(self.container, self)
+
         # Choose the frame type specified in the function argument
         frame = self.frames[container]
 
@@ -65,12 +78,28 @@ class StockAnalysisApp(tk.Tk):
         frame.grid(row=0, column=0, sticky="nsew")
         frame.tkraise()
 
+    # Opens the debug window with the stage timings, or shows it again if it is already open
+    def open_trace_overlay(self):
+        if self.trace_overlay is None or not self.trace_overlay.winfo_exists():
+            self.trace_overlay = TraceOverlay(self)
+        else:
+            self.trace_overlay.lift()
+
+    # Method that closes the app. Background work is cancelled before the window is destroyed
+    def close(self):
+        self.task_executor.shutdown()
+        self.destroy()
+
 
 # The main function will run the full program by creating an instance of the class stockAnalysisApp
 # No inputted arguments required
 # mostly to prevent program from being run as an imported module
 # Could put the contents of main in if statement below.
 def main():
+    # Show warnings and errors by default, STOCK_APP_LOG_LEVEL=DEBUG shows everything
+    logging.basicConfig(level=os.environ.get('STOCK_APP_LOG_LEVEL', 'WARNING').upper(),
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
     # Create the tkinter app window from the class called StockAnalysisApp()
     app = StockAnalysisApp()
     # Run the app
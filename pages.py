@@ -1,148 +1,45 @@
+# For logging what the app does, instead of printing it
+import logging
+
+# For the number of cores, the highest number of processes of a comparison
+import os
+
 # Import GUI items
 import tkinter as tk
+from tkinter import filedialog
+from tkinter.ttk import Progressbar
 from functional_frames import StockSelectorFrame, NavigationFrame, ListFrame
 
-# For reading data about stocks such as balance sheet and historical prices
-import yfinance as yf
-from yahoofinancials import YahooFinancials
-
-# For matrix operations on historic stock price data
-import numpy as np
-
-""" FUNCTIONS"""
-
-# Technical analysis function that inputs some stock data as a dictionary
-# with the mandatory 'Symbol' key inside. The symbol will be as standard in yahoo finance. for example 'AAPL'
-
-# The function returns a tuple containing the following data in the form of floats for the LAST 30 DAYS:
-# Stock_price_change_in_percent during the latest 30 days
-# Beta_value_as_defined_in_the_assignment (instead of traditional betavalue)
-# lowest_price during these 30 days
-# highest_price during last 30 days
-# currency of stock (in the form of a string)
-
-# If an error occurs the function will return None
-def technical_analysis(stock_data):
-    # Added try catch to catch errors
-    try:
-        # Run technical analysis
-
-        # Retrieve a data frame containing the stock price for the latest 30 days
-        stock_prices_latest_30_days = yf.download(stock_data['Symbol'], period='1mo')
-        print('Dataframe: ', stock_prices_latest_30_days)
-        print('Close: ', stock_prices_latest_30_days['Close'])
-        print('Open: ', stock_prices_latest_30_days['Open'])
-
-        # Get the opening price from 30 days ago using pandas dataframe indexing
-        stock_price_30_days_ago = stock_prices_latest_30_days['Open'][0]
-        print('Price 30 days ago: ', stock_price_30_days_ago)
-
-        # Get the latest price
-        stock_price_latest_close = stock_prices_latest_30_days['Close'][-1]
-        print('Latest closing price: ', stock_price_latest_close)
-
-        # Calculate price development during 30 latest days
-        price_development_percentage = (stock_price_latest_close / stock_price_30_days_ago - 1) * 100
-        print('Price development %: ', price_development_percentage)
-
-        # Calculate highest price during latest 30 days
-        highest_price = np.amax(stock_prices_latest_30_days['High'])
-        print('Highest_price latest 30 days: ', highest_price)
-
-        # Calculate lowest price during latest 30 days
-        lowest_price = np.amin(stock_prices_latest_30_days['Low'])
-        print('Lowest_price latest 30 days: ', lowest_price)
-
-        # Calculate "betavärde" for a this stock. "betavärde" is
-        # Get a Ticker object that can retrieve information about a market index
-        dow_jones_ticker = yf.Ticker('^DJI')
-        dow_jones_data = dow_jones_ticker.history()
-
-        print(dow_jones_data)
-
-        # Dow jones price 30 days ago
-        dow_jones_price_30_days_ago = dow_jones_data['Open'][0]
-
-        # Dow jones price around now
-        dow_jones_price_latest_close = dow_jones_data['Close'][-1]
-
-        # "beta value" for this is calculated as:
-        # (stock_price_now / old_stock_price) / (index_price_now / old_index_price)
-        # Where the old price represents the price approximately 30 days ago depending
-        # when the market open days are
-        QUOTE_beta_value_UNQUOTE_for_stock = (stock_price_latest_close / stock_price_30_days_ago) / (
-                    dow_jones_price_latest_close / dow_jones_price_30_days_ago)
+# The analysis functions, shared with the headless command line mode
+from analysis import technical_analysis, fundamental_analysis, run_stock_comparison
 
-        print('"Beta value": ', QUOTE_beta_value_UNQUOTE_for_stock)
+# Limits and metrics for the ranking of many stocks
+from ranking import DEFAULT_MAX_WORKERS, MAX_WORKERS_LIMIT, ASSIGNMENT_METRIC, RANKING_METRICS
 
-        # Get currency for stock
-        stock_ticker = yf.Ticker(stock_data['Symbol'])
+# For saving rankings and showing them again later
+from snapshots import Snapshot, save_ranking, diff_with_ranking, get_snapshots_directory, RANKING_KIND
 
-        # Get stock currency
-        currency = stock_ticker.info['currency']
-        print('Currency: ', currency)
+# Timing of the rendering of the results
+from tracing import traced
 
+# Fonts for the selected stocks and the ranking on the BetaRankingPage
+SELECTED_STOCKS_FONT = ('Courier', 12, 'normal')
+RANKING_FONT = ('Courier', 10, 'normal')
 
-        # Return the values calculated above in function. Order will be as defined in comment above function
-        return (price_development_percentage, QUOTE_beta_value_UNQUOTE_for_stock, lowest_price, highest_price, currency)
-    except Exception as e:
-        print('Error: ', e)
+# Length in pixels of the progress bar of a comparison
+COMPARISON_PROGRESS_LENGTH = 300
 
-    return None
+logger = logging.getLogger(__name__)
 
+""" FUNCTIONS """
 
-# Input: dictionary with 'Symbol' key that corresponds to the yahoo symbol string used in their API and website.
-# For example 'AAPL' or 'SAAX' or 'VOLV-B.ST'
-# The method will the caluclate a set of fundamental values. The equity ratio, price_per_earnings for the
-# company (not stock), and lastly price per revenue (also for company).
-# The output will be a tuple of consisting of these values represented as floats.
-def fundamental_analysis(stock_data):
+# Runs run_stock_comparison in a background task. The ranking is reported to the main thread as it grows and the
+# comparison stops when the task is cancelled. task is the BackgroundTask, given by the task executor
+def run_comparison_task(stock_symbols, stock_identifiers, max_workers, metric, processes, task):
+    return run_stock_comparison(stock_symbols, stock_identifiers, max_workers, metric,
+                                on_progress=lambda *progress: task.report_progress(progress),
+                                cancel_event=task.cancel_event, processes=processes)
 
-    # Run fundamental analysis
-
-    # Get stock balance sheet
-    yahoo_financials = YahooFinancials(stock_data['Symbol'])
-    raw_balance_sheet = yahoo_financials.get_financial_stmts('annual', 'balance')
-
-    # Calculate solidity
-    print('balance_sheet ', raw_balance_sheet)
-
-    # Get the balance_sheet for latest fiscal year
-    balanceSheetHistory_for_stock = raw_balance_sheet['balanceSheetHistory'][stock_data['Symbol']][0]
-    balance_sheet_latest_year_for_this_stock = balanceSheetHistory_for_stock[list(balanceSheetHistory_for_stock.keys())[0]]
-
-    total_shareholder_equity = balance_sheet_latest_year_for_this_stock['totalStockholderEquity']
-    total_assets = balance_sheet_latest_year_for_this_stock['totalAssets']
-
-    # Equity ratio ~ soliditet
-    equity_ratio = total_shareholder_equity / total_assets
-    print('Equity ratio: ', equity_ratio)
-
-    # Calulate p/e
-
-    # Get income statement to read earnings value
-    raw_income_statement = yahoo_financials.get_financial_stmts('annual', 'income')['incomeStatementHistory'][stock_data['Symbol']][0]
-    income_statement_latest_year_for_this_stock = raw_income_statement[list(raw_income_statement.keys())[0]]
-    print('raw_income_statement', raw_income_statement)
-
-
-    # Get net income for the latest fiscal year
-    net_income = income_statement_latest_year_for_this_stock['netIncome']
-    print('Net income: ', net_income)
-    print('Shareholder Equity: ', total_shareholder_equity)
-
-
-    # Calculate price per earnings by dividing total shareholder equity by net income
-    price_per_earnings = total_shareholder_equity / net_income
-    print('Price per earnings: ', price_per_earnings)
-
-    # Calculate price per revenue by dividing total shareholder equity with total_revenue
-    total_revenue = income_statement_latest_year_for_this_stock['totalRevenue']
-    price_per_revenue = total_shareholder_equity / total_revenue
-
-    print(price_per_revenue)
-
-    return (equity_ratio, price_per_earnings, price_per_revenue)
 
 """ CLASSES """
 
@@ -201,6 +98,9 @@ class FundamentalAnalysisPage(tk.Frame):
         # Initialize parent class/standard tkinter frame initialization.
         tk.Frame.__init__(self, parent)
 
+        # Save controller as attribute, its task_executor is used to run the analysis in the background
+        self.controller = controller
+
         """" Navigation """
         # use a navigation frame obects as described in functional_frames
         navigation_frame = NavigationFrame(self, page_title="Fundamental Analysis",
@@ -215,59 +115,81 @@ class FundamentalAnalysisPage(tk.Frame):
         # Position the StockSelector frame
         stock_selector.grid(row=1, column=0, padx=10, pady=10, sticky="nsew")
 
+        # The labels and the list frame for the results are created once and reused for every analysis, they are
+        # shown and hidden as needed. The fundamental_analysis takes some time, so show a loading label while we wait
+        self.loading_label = tk.Label(self, text='Loading data...')
+
+        # List frame that shows the fundamental values
+        self.list_frame = ListFrame(self, '', [])
+
+        # Error label and a label that describes what went wrong
+        self.error_label = tk.Label(self, text="Something went wrong with the fundamental analysis", font=('Times', 16, 'bold'))
+        self.error_description_label = tk.Label(self, text='')
 
     # A function that calls the fundamental_analysis function and retrieves appropriate fundamental values.
-    # The values will be displayed using the ListFrame class from functional frames.
+    # The analysis is run in the background by the controllers task_executor so that the GUI stays responsive, and
+    # the values will be displayed using the ListFrame class from functional frames when they are ready.
     # Input is the stock_data dictionary with keys 'Symbol' and 'Name' that contains the stock symbol and
     # the stock/company name respectively.
     # No values are returned. Results will be displayed in GUI
     def present_fundamental_analysis(self, stock_data):
 
-        # Using self.* in order to prevent duplicates when analysis is run multiple times
-
-        # The method fundamental_analysis takes some time, so show a loading screen while we wait
-        self.loading_label = tk.Label(self, text='Loading data...')
+        # The method fundamental_analysis takes some time, so hide the old results and show a loading label while we wait
+        self.list_frame.grid_remove()
+        self.error_label.grid_remove()
+        self.error_description_label.grid_remove()
         self.loading_label.grid(row=2, column=0, padx=10, pady=10)
 
-        # Try running the fundamental analysis, also except if there are errors
-        try:
-            # Run the fundamental_analysis method to retrieve fundamental key performance indicators
-            equity_ratio, price_per_earnings, price_per_revenue = fundamental_analysis(stock_data)
+        # Run the fundamental_analysis method in the background to retrieve fundamental key performance indicators.
+        # A new analysis replaces one that is still running
+        self.controller.task_executor.submit((self, 'analysis'), fundamental_analysis, (stock_data,),
+                                             on_success=lambda values: self.display_fundamental_values(stock_data,
+                                                                                                      values),
+                                             on_error=self.display_fundamental_error,
+                                             on_cancel=self.loading_label.grid_remove)
 
-            print('Ran fundamental analysis with:', stock_data['Symbol'])
+    # Displays the values returned from fundamental_analysis. Called in the main thread when the background
+    # analysis is done. stock_data is the same dictionary as in present_fundamental_analysis and
+    # fundamental_values is the FundamentalResult returned from fundamental_analysis.
+    @traced('render.fundamental')
+    def display_fundamental_values(self, stock_data, fundamental_values):
 
-            # Present the values
-            # Label showing what company has been analyzed
+        logger.info('Ran fundamental analysis with: %s', stock_data['Symbol'])
 
-            # Title for the list_frame_class
-            list_frame_title = "Fundamental Analysis for:  " + stock_data['Name']
+        # Present the values
+        # Label showing what company has been analyzed
 
-            # Data containing strings for the list_frame_class. All rounded to 3 decimals
-            list_frame_data = [
-                "Yahoo Finance Symbol is:\t" + stock_data['Symbol'],
-                "Equity ratio (Soliditet):\t" + str(round(equity_ratio * 100, 3)) + "%",
-                "Price per earnings (P/E):\t" + str(round(price_per_earnings, 3)),
-                "Price per revenue (P/S):\t" + str(round(price_per_revenue, 3))
-            ]
+        # Title for the list_frame_class
+        list_frame_title = "Fundamental Analysis for:  " + stock_data['Name']
 
-            # Create a listFrame to show all the data in a convenient manner
-            self.list_frame = ListFrame(self, list_frame_title, list_frame_data)
-            self.list_frame.grid(row=2, column=0, padx=10, pady=10, sticky='nsew')
+        # Data containing strings for the list_frame_class. All rounded to 3 decimals
+        list_frame_data = [
+            "Yahoo Finance Symbol is:\t" + stock_data['Symbol'],
+            "Equity ratio (Soliditet):\t" + str(round(fundamental_values.equity_ratio * 100, 3)) + "%",
+            "Price per earnings (P/E):\t" + str(round(fundamental_values.price_per_earnings, 3)),
+            "Price per revenue (P/S):\t" + str(round(fundamental_values.price_per_revenue, 3))
+        ]
 
+        # Update the listFrame to show all the data in a convenient manner
+        self.list_frame.set_title(list_frame_title)
+        self.list_frame.set_rows(list_frame_data)
 
-        except Exception as e:
-            # If something goes wrong in the fundamental_analysis tell the user that an error occured
+        # Finally replace the loading label with the list frame once the values have been retrieved and calculated
+        self.loading_label.grid_remove()
+        self.list_frame.grid(row=2, column=0, padx=10, pady=10, sticky='nsew')
 
-            # Error label
-            self.error_label = tk.Label(self, text="Something went wrong with the fundamental analysis", font=('Times', 16, 'bold'))
-            self.error_label.grid(row=2, column=0, padx=10, pady=10, sticky='w')
+    # If something goes wrong in the fundamental_analysis tell the user that an error occured.
+    # Called in the main thread with the exception e that was raised by fundamental_analysis
+    def display_fundamental_error(self, e):
+        # Error label
+        self.error_label.grid(row=2, column=0, padx=10, pady=10, sticky='w')
 
-            # Describe what went wrong
-            self.error_description_label = tk.Label(self, text="Error description: " + str(e))
-            self.error_description_label.grid(row=3, column=0, padx=10, pady=10, sticky='w')
+        # Describe what went wrong
+        self.error_description_label.config(text="Error description: " + str(e))
+        self.error_description_label.grid(row=3, column=0, padx=10, pady=10, sticky='w')
 
-        # Finally remove the loading label once the values have been retrieved and calculated
-        self.loading_label.grid_forget()
+        # Remove the loading label
+        self.loading_label.grid_remove()
 
 
 # Technical analysis page for
@@ -281,6 +203,9 @@ class TechnicalAnalysisPage(tk.Frame):
         # Initialize parent class/standard tkinter frame initialization.
         tk.Frame.__init__(self, parent)
 
+        # Save controller as attribute, its task_executor is used to run the analysis in the background
+        self.controller = controller
+
         """" Navigation """
         # use a navigation frame obects as described in functional_frames
         navigation_frame = NavigationFrame(self, page_title="Technical Analysis",
@@ -295,8 +220,12 @@ class TechnicalAnalysisPage(tk.Frame):
         # Position the StockSelector frame
         stock_selector.grid(row=1, column=0, padx=10, pady=10, sticky="nsew")
 
+        # The list frame and error label for the results are created once and reused for every analysis
+        self.list_frame = ListFrame(self, '', [])
+        self.error_label = tk.Label(self, text='')
+
     # A function that will display some gathered technical values that are retrieved from the
-    # technical_analysis_function. If the value returned from the technical_analysis function are None istead of a tuple
+    # technical_analysis_function. If the value returned from the technical_analysis function is None instead of a result
     # present that an error occured to the user. Otherwise use a ListFrame object (see functional_frames) in order
     # to display the data.
     #
@@ -306,13 +235,19 @@ class TechnicalAnalysisPage(tk.Frame):
     #
     # This function returns nothing. Only the GUI is updated for the user.
     def present_technical_analysis(self, stock_data):
-        # Get technical_values
-        technical_values = technical_analysis(stock_data)
-
+        # Get technical_values in the background and display them when they are ready.
+        # A new analysis replaces one that is still running
+        self.controller.task_executor.submit((self, 'analysis'), technical_analysis, (stock_data,),
+                                             on_success=lambda technical_values:
+                                             self.display_technical_values(stock_data, technical_values))
+
+    # Displays the technical_values returned from technical_analysis for the stock in stock_data. Called in the main
+    # thread when the background analysis is done. technical_values is None if there was an error.
+    @traced('render.technical')
+    def display_technical_values(self, stock_data, technical_values):
         # If there was no error unpack the technical values and continue
         if technical_values is not None:
-            price_development, QUOTE_betavalue_UNQUOTE, lowest_price, highest_price, currency = technical_values
-            print('Ran technical analysis with: ', stock_data['Symbol'])
+            logger.info('Ran technical analysis with: %s', stock_data['Symbol'])
 
             # Present values with a list frame
 
@@ -322,25 +257,31 @@ class TechnicalAnalysisPage(tk.Frame):
             # Create list frame data
             list_frame_data = [
                 "Yahoo Finance Symbol is:\t\t\t\t\t\t" + stock_data['Symbol'],
-                "Price development of stock during last 30 days:\t\t\t\t" + str(round(price_development, 3)) + '%',
-                "Betavalue as defined in assignment last 30 days, compared to DOW JONES: \t" + str(round(QUOTE_betavalue_UNQUOTE, 3)),
-                "Lowest stock price during last 30 days:\t\t\t\t\t" + currency + ' ' + str(round(lowest_price, 3)),
-                "Highest stock price during last 30 days:\t\t\t\t\t" + currency + ' ' + str(round(highest_price, 3))
+                "Price development of stock during last 30 days:\t\t\t\t" +
+                str(round(technical_values.price_development, 3)) + '%',
+                "Betavalue as defined in assignment last 30 days, compared to DOW JONES: \t" +
+                str(round(technical_values.beta_assignment, 3)),
+                "Lowest stock price during last 30 days:\t\t\t\t\t" + technical_values.currency + ' ' +
+                str(round(technical_values.lowest_price, 3)),
+                "Highest stock price during last 30 days:\t\t\t\t\t" + technical_values.currency + ' ' +
+                str(round(technical_values.highest_price, 3))
             ]
 
 
-            # Create a listFrame to show all the data in a convenient manner
-            self.list_frame = ListFrame(self, list_frame_title, list_frame_data)
+            # Update the listFrame to show all the data in a convenient manner
+            self.list_frame.set_title(list_frame_title)
+            self.list_frame.set_rows(list_frame_data)
+            self.error_label.grid_remove()
             self.list_frame.grid(row=2, column=0, padx=10, pady=10, sticky='nsew')
         else:
             # There was an error with the technical_analysis. Could be lots of reasons
 
             # Tell the user there was an error
-            error_label = tk.Label(self,
-                                   text="An error occured when running the technical analysis for stock with symbol: " +
-                                   stock_data['Symbol'])
+            self.error_label.config(text="An error occured when running the technical analysis for stock with symbol: " +
+                                    stock_data['Symbol'])
             # position the error label
-            error_label.grid(row=2, column=0, padx=10, pady=10, sticky='nsew')
+            self.list_frame.grid_remove()
+            self.error_label.grid(row=2, column=0, padx=10, pady=10, sticky='nsew')
 
 # A class that defines the beta_value ranking of stocks as defined in the assignment
 # It will let the user enter a number of stocks and will then attempt to compare these stocks
@@ -354,6 +295,9 @@ class BetaRankingPage(tk.Frame):
         # Initialize parent class
         tk.Frame.__init__(self, parent)
 
+        # Save controller as attribute, its task_executor is used to run the comparison in the background
+        self.controller = controller
+
         """" Navigation """
         # use standard navigation_frame for page title and back to menu button
         navigation_frame = NavigationFrame(self, page_title="Stocks ranked by beta value - Select a few to compare",
@@ -362,8 +306,10 @@ class BetaRankingPage(tk.Frame):
 
         """ Content """
 
-        # Create a selected stocks frame from scratch
-        self.start_or_restart_selected_stocks_frame()
+        # Create the list frame that shows the selected stocks and later the ranking. It is kept for the whole session
+        # and only its rows are changed
+        self.stocks_to_compare_frame = ListFrame(self, 'Selected stocks', [], font=SELECTED_STOCKS_FONT)
+        self.stocks_to_compare_frame.grid(row=1, column=1, padx=10, pady=10, sticky="nsew")
 
         # Create a stock selector window to let user select a stock and run the specified function with it
         stock_selector = StockSelectorFrame(self, self.add_stock_to_ranking_list, controller, False)
@@ -385,30 +331,94 @@ class BetaRankingPage(tk.Frame):
         # Position reset button
         reset_button.grid(row=0, column=1, padx=10, pady=10, sticky='e')
 
+        # Number of stocks that are downloaded and analyzed at the same time when comparing
+        self.max_workers_variable = tk.IntVar(value=DEFAULT_MAX_WORKERS)
+        max_workers_label = tk.Label(button_frame, text="Parallel downloads:")
+        max_workers_label.grid(row=0, column=2, padx=10, pady=10, sticky='e')
+        max_workers_spinbox = tk.Spinbox(button_frame, from_=1, to=MAX_WORKERS_LIMIT, width=4,
+                                         textvariable=self.max_workers_variable)
+        max_workers_spinbox.grid(row=0, column=3, padx=10, pady=10, sticky='w')
+
+        # Number of processes that the stocks are analyzed in, more than 1 for very large comparisons
+        self.processes_variable = tk.IntVar(value=1)
+        processes_label = tk.Label(button_frame, text="Processes:")
+        processes_label.grid(row=0, column=6, padx=10, pady=10, sticky='e')
+        processes_spinbox = tk.Spinbox(button_frame, from_=1, to=os.cpu_count() or 1, width=4,
+                                       textvariable=self.processes_variable)
+        processes_spinbox.grid(row=0, column=7, padx=10, pady=10, sticky='w')
+
+        # The metric that the stocks are ranked by, the assignment "betavalue" by default
+        self.ranking_metric_variable = tk.StringVar(value=RANKING_METRICS[ASSIGNMENT_METRIC])
+        ranking_metric_label = tk.Label(button_frame, text="Rank by:")
+        ranking_metric_label.grid(row=0, column=4, padx=10, pady=10, sticky='e')
+        ranking_metric_menu = tk.OptionMenu(button_frame, self.ranking_metric_variable, *RANKING_METRICS.values())
+        ranking_metric_menu.grid(row=0, column=5, padx=10, pady=10, sticky='w')
+
+        # Progress of a running comparison, the ranking is shown while it grows
+        self.comparison_progressbar = Progressbar(button_frame, orient='horizontal', mode='determinate',
+                                                  length=COMPARISON_PROGRESS_LENGTH)
+        self.comparison_progressbar.grid(row=1, column=0, columnspan=2, padx=10, pady=(0, 10), sticky='ew')
+        self.comparison_status_label = tk.Label(button_frame, text='')
+        self.comparison_status_label.grid(row=1, column=2, columnspan=3, padx=10, pady=(0, 10), sticky='w')
+
+        # Cancel button, stops the downloads of a running comparison and keeps the ranking of the stocks done so far
+        self.cancel_button = tk.Button(button_frame, text="Cancel", command=self.cancel_comparison, state='disabled')
+        self.cancel_button.grid(row=1, column=5, padx=10, pady=(0, 10), sticky='w')
+
+        # Buttons for saving the ranking that is shown as a snapshot, showing a saved ranking and comparing the ranking
+        # that is shown with a saved one
+        save_snapshot_button = tk.Button(button_frame, text="Save ranking", command=self.save_ranking_snapshot)
+        save_snapshot_button.grid(row=2, column=0, padx=10, pady=(0, 10), sticky='w')
+        open_snapshot_button = tk.Button(button_frame, text="Open saved ranking", command=self.open_ranking_snapshot)
+        open_snapshot_button.grid(row=2, column=1, padx=10, pady=(0, 10), sticky='w')
+        compare_snapshot_button = tk.Button(button_frame, text="Compare with saved ranking",
+                                            command=self.compare_with_ranking_snapshot)
+        compare_snapshot_button.grid(row=2, column=2, columnspan=2, padx=10, pady=(0, 10), sticky='w')
+
         # position button frame
         button_frame.grid(row=0, column=1, sticky='nswe')
 
+        # The ranking that is shown and its metric, None until a comparison is done or a snapshot is opened
+        self.shown_ranking = None
+        self.shown_metric = ASSIGNMENT_METRIC
+
+        # The ranking so far of a running comparison, it is shown if the comparison is cancelled
+        self.partial_ranking = None
+
+        # Start with an empty selection
+        self.start_or_restart_selected_stocks_frame()
+
     # This is the function that both initializes the selected stocks frame on the right of the beta_value ranking page.
     # It will empty all the list objects containing the stocks and corresponding descriptions to be compared.
-    # Also the fucntion will create ad new stocks_to_compare frame so that it is clean and fresh witout old labels.
+    # Also the fucntion will clear the stocks_to_compare frame so that it is clean and fresh witout old labels.
     # This will be easier for the user.
     # The method takes no arguments except the self arg and returns nothing.
     def start_or_restart_selected_stocks_frame(self):
+        # Stop a comparison that is still running, its result would be outdated
+        self.controller.task_executor.cancel((self, 'compare'))
+        self.show_comparison_progress(0, 0, '')
+        self.cancel_button.config(state='disabled')
+
         # List to keep track of which stock symbols should be compared
         self.stock_symbols_to_compare = []
 
         # List to keep track of stock names or identifiers
         self.stock_identifiers = []
 
-        # Contain all beta rank presentation within a list frame
-        self.stocks_to_compare_frame = self.create_stocks_to_compare_frame()
+        # Show the empty selection in the list frame
+        self.show_selected_stocks()
 
-    # This function creates a new stocks_to compare frame heavily based on the listFrame object form function_frames.
+    # This function shows the selected stocks in the stocks_to_compare frame, replacing a ranking if one is shown.
     # It sets the title to "Selected Stocks" and the data will be the self.stock_identifiers.
     # This variable will contain the stock symbol and name.
-    # The function returns this newly created ListFrame object
-    def create_stocks_to_compare_frame(self):
-        return ListFrame(self, 'Selected stocks', self.stock_identifiers, font=('Courier', 12, 'normal')).grid(row=1, column=1, padx=10, pady=10, sticky="nsew")
+    # The function returns nothing
+    def show_selected_stocks(self):
+        self.stocks_to_compare_frame.set_title('Selected stocks')
+        self.stocks_to_compare_frame.set_font(SELECTED_STOCKS_FONT)
+        self.stocks_to_compare_frame.set_rows(self.stock_identifiers)
+
+        # Remember that the frame shows the selection and not a ranking
+        self.is_showing_ranking = False
 
     # This function will add a stock to the list of stocks to be compared when the user hits a select stock button
     # in the select stocks. The data added when a "select stock" button is pressed will be the stock symbol and
@@ -419,92 +429,267 @@ class BetaRankingPage(tk.Frame):
     def add_stock_to_ranking_list(self, stock_data):
         # Add stock only if not already added to comparison list
         if stock_data['Symbol'] not in self.stock_symbols_to_compare:
-            print('Added ', stock_data['Symbol'], ' to beta list.')
+            logger.info('Added %s to beta list.', stock_data['Symbol'])
             self.stock_symbols_to_compare.append(stock_data['Symbol'])
 
             # Add a description to stock_identifiers list about this stock
             row_text = 'Symbol: ' + stock_data['Symbol'] + ' - Name: ' + stock_data['Name']
             self.stock_identifiers.append(row_text)
+
+            # Update selected stocks frame. Only the new row has to be added if the selection is already shown
+            if self.is_showing_ranking:
+                self.show_selected_stocks()
+            else:
+                self.stocks_to_compare_frame.append_row(row_text)
         else:
-            print('Symbol ', stock_data['Symbol'], ' already added to beta list.')
+            logger.info('Symbol %s already added to beta list.', stock_data['Symbol'])
 
-        print(self.stock_symbols_to_compare)
-        print(self.stock_identifiers)
+            # Show the selection again if a ranking is shown
+            if self.is_showing_ranking:
+                self.show_selected_stocks()
 
-        # Update selected stocks frame
-        self.stocks_to_compare_frame = self.create_stocks_to_compare_frame()
+        logger.debug('Stocks to compare: %s', self.stock_symbols_to_compare)
 
     # This function will compare the stocks that have been selected by the user. This is done by running a
     # technical_analysis for each stock symbol and the sorting a list of all the stocks based on the highest beta_value
     # first. The function will use the attributes self.stock_symbols_to_compare and self.stock_identifiers in order to
-    # know which stocks to compare.
+    # know which stocks to compare. The comparison runs in the background, the ranking is displayed by
+    # present_partial_ranking while it grows and by present_ranking when it is done.
     # No arguments except self
     # No return values
     def compare_stocks(self):
-        print('Comparing stocks: ', self.stock_symbols_to_compare)
-
-        # List containing "betavalue" and symbol
-        beta_and_symbol_list = []
-
-        # Generate list with stock symbol and "betavalue" as elements
-        for stock_idx in range(len(self.stock_symbols_to_compare)):
-            # Create the proper data structure for the technical_analysis function
-            stock_data = {'Symbol': self.stock_symbols_to_compare[stock_idx]}
-
-            # Run the technical_analysis function and apply the return values to tuple technical_values
-            technical_values = technical_analysis(stock_data)
-
-            # Set the "betavalue" in case there was an error with technical_analysis()
-            QUOTE_betavalue_UNQOUTE = 0
-
-            stock_description = 'Error for this stock: ' + self.stock_identifiers[stock_idx]
-
-            # Set values only if there was no error
-            if technical_values is not None:
-                # "betavalue" will be the second return value
-                QUOTE_betavalue_UNQOUTE = technical_values[1]
-
-                # set stock description value
-                stock_description = self.stock_identifiers[stock_idx]
-
+        logger.info('Comparing %d stocks', len(self.stock_symbols_to_compare))
 
+        # Read the number of parallel downloads, use the default if the user has typed something that is not a number
+        try:
+            max_workers = self.max_workers_variable.get()
+        except tk.TclError:
+            max_workers = DEFAULT_MAX_WORKERS
 
-            # Add three values to the beta_and_symbol list. Stock symbol, "betavalue" and stock description (identifier)
-            beta_and_symbol_list.append((self.stock_symbols_to_compare[stock_idx],
-                                         QUOTE_betavalue_UNQOUTE,
-                                         stock_description))
-
-        beta_and_symbol_list.sort(key=lambda x: x[1], reverse=True)
-        print('Sorted beta list: ', beta_and_symbol_list)
-
+        # Read the number of processes the same way, one process (only threads) by default
+        try:
+            processes = max(1, self.processes_variable.get())
+        except tk.TclError:
+            processes = 1
+
+        # Find the name of the metric that the user has chosen
+        metric = ASSIGNMENT_METRIC
+        for metric_name in RANKING_METRICS:
+            if RANKING_METRICS[metric_name] == self.ranking_metric_variable.get():
+                metric = metric_name
+
+        # Copy the lists so that the background comparison is not affected if the user adds stocks meanwhile
+        stock_symbols = list(self.stock_symbols_to_compare)
+        stock_identifiers = list(self.stock_identifiers)
+
+        # Start with an empty ranking that is filled in as the stocks are analyzed. It can be saved when it is done or
+        # cancelled
+        self.shown_ranking = None
+        self.shown_metric = metric
+        self.partial_ranking = None
+        metric_text, score_text = self.ranking_texts(metric)
+        self.stocks_to_compare_frame.set_title('Ranking according to ' + metric_text)
+        self.stocks_to_compare_frame.set_font(RANKING_FONT)
+        self.stocks_to_compare_frame.clear_rows()
+        self.is_showing_ranking = True
+        self.show_comparison_progress(0, len(stock_symbols), 'Analyzing ' + str(len(stock_symbols)) + ' stocks...')
+        self.cancel_button.config(state='normal')
+
+        # Run the comparison in the background, a new comparison replaces one that is still running
+        self.controller.task_executor.submit((self, 'compare'), run_comparison_task,
+                                             (stock_symbols, stock_identifiers, max_workers, metric, processes),
+                                             on_success=lambda ranking: self.present_ranking(ranking, metric),
+                                             on_error=self.show_comparison_error, pass_task=True,
+                                             on_progress=lambda progress: self.present_partial_ranking(progress,
+                                                                                                       metric),
+                                             on_cancel=self.show_comparison_cancelled)
+
+    # Stops the running comparison. The stocks that have been ranked so far stay in the list
+    def cancel_comparison(self):
+        self.controller.task_executor.cancel((self, 'compare'))
+
+    # Shows that the comparison was cancelled, by the cancel button or because the user went to another page.
+    # The stocks ranked so far become the shown ranking, so that they can be saved and compared.
+    # Called in the main thread
+    def show_comparison_cancelled(self):
+        self.shown_ranking = self.partial_ranking
+        self.cancel_button.config(state='disabled')
+        self.comparison_status_label.config(text='Cancelled, ' + self.comparison_status_label.cget('text'))
+
+    # Shows that the comparison failed. Called in the main thread with the exception
+    def show_comparison_error(self, e):
+        logger.error('Comparison failed: %s', e)
+        self.cancel_button.config(state='disabled')
+        self.comparison_status_label.config(text='Comparison failed: ' + str(e))
+
+    # Shows the progress of a comparison, analyzed_count of total_count stocks done, and the status text
+    def show_comparison_progress(self, analyzed_count, total_count, status_text):
+        self.comparison_progressbar.config(maximum=max(total_count, 1), value=analyzed_count)
+        self.comparison_status_label.config(text=status_text)
+
+    # Returns the name of metric for the title and the text shown before every score as a tuple
+    def ranking_texts(self, metric):
+        if metric == ASSIGNMENT_METRIC:
+            return '"betavalue"', 'Beta: '
+        return RANKING_METRICS[metric], RANKING_METRICS[metric] + ': '
+
+    # Returns the rows of the list frame for the stocks in beta_and_symbol_list, the first one with rank first_rank
+    def ranking_rows(self, beta_and_symbol_list, score_text, first_rank=1):
         # Create a list for the list frame
         beta_info_list = []
 
         # Iterate through the sorted beta_and_symbol_list in order to prepara a data list for a list frame
-        stock_rank_according_to_beta = 1
+        stock_rank_according_to_beta = first_rank
         for stock_info in beta_and_symbol_list:
             # Append all the stocks to the final list frame data list that will be displayed to user
             # First present rank then present beta then present stock information
-            beta_info_list.append(str(stock_rank_according_to_beta) + '. ' + 'Beta: ' +
+            beta_info_list.append(str(stock_rank_according_to_beta) + '. ' + score_text +
                                   str(round(stock_info[1], 3)) + ' - ' + stock_info[2])
 
             # Add to the rank through each iteration so that the ranks are increasing
             stock_rank_according_to_beta += 1
 
+        return beta_info_list
+
+    # Updates the ranking while the comparison is running. progress is the tuple (ranking so far, lowest position
+    # that changed, number of stocks analyzed, number of stocks) from rank_stocks. Only the rows from the lowest
+    # changed position are redrawn. Called in the main thread after every chunk of stocks
+    @traced('render.partial_ranking')
+    def present_partial_ranking(self, progress, metric=ASSIGNMENT_METRIC):
+        beta_and_symbol_list, first_changed_position, analyzed_count, total_count = progress
+        metric_text, score_text = self.ranking_texts(metric)
+        self.partial_ranking = beta_and_symbol_list
+
+        self.stocks_to_compare_frame.set_rows_from(
+            first_changed_position,
+            self.ranking_rows(beta_and_symbol_list[first_changed_position:], score_text, first_changed_position + 1))
+        self.show_comparison_progress(analyzed_count, total_count,
+                                      'Analyzed ' + str(analyzed_count) + ' of ' + str(total_count) + ' stocks')
+
+    # Displays the ranking from run_stock_comparison in a list frame. beta_and_symbol_list is the sorted list of
+    # tuples (symbol, score, description) and metric is the name of the metric in RANKING_METRICS that the stocks
+    # were ranked by. Called in the main thread when the comparison is done.
+    # No return values
+    @traced('render.ranking')
+    def present_ranking(self, beta_and_symbol_list, metric=ASSIGNMENT_METRIC):
+        # The name of the metric in the title and the text shown before every score
+        metric_text, score_text = self.ranking_texts(metric)
+
+        # Create a list for the list frame. Rows that were already shown while the comparison ran are not redrawn
+        beta_info_list = self.ranking_rows(beta_and_symbol_list, score_text)
 
         # If there were no stocks selected, ask user to select stocks
-        if len(self.stock_symbols_to_compare) is 0:
+        if len(beta_and_symbol_list) == 0:
             # Add text to beta_info_list that will be displayed
             # Message to be added is that the user has to choose stocks
 
             beta_info_list.append('Please select stocks to run analysis. Press restart then choose stocks. ')
 
 
-        # Create a listframe to display all the beta ranking data
-        self.stocks_to_compare_frame = ListFrame(self, 'Ranking according to "betavalue"', beta_info_list,
-                                                 font=('Courier', 10, 'normal')).grid(
-            row=1, column=1, padx=10, pady=10, sticky="nsew"
-        )
+        # Show all the beta ranking data in the list frame
+        self.stocks_to_compare_frame.set_title('Ranking according to ' + metric_text)
+        self.stocks_to_compare_frame.set_font(RANKING_FONT)
+        self.stocks_to_compare_frame.set_rows(beta_info_list)
+        self.is_showing_ranking = True
+
+        # Remember the ranking, so that it can be saved and compared with saved rankings
+        self.shown_ranking = beta_and_symbol_list
+        self.shown_metric = metric
+
+        self.cancel_button.config(state='disabled')
+        self.show_comparison_progress(len(beta_and_symbol_list), len(beta_and_symbol_list),
+                                      'Ranked ' + str(len(beta_and_symbol_list)) + ' stocks')
+
+    # Returns the ranking that is shown, or None after showing a message if no ranking is shown
+    def ranking_to_snapshot(self):
+        if self.is_showing_ranking and self.shown_ranking:
+            return self.shown_ranking
+
+        self.comparison_status_label.config(text='Compare stocks or open a saved ranking first')
+        return None
+
+    # Saves the ranking that is shown as a snapshot in the background, see snapshots.py
+    def save_ranking_snapshot(self):
+        ranking = self.ranking_to_snapshot()
+        if ranking is None:
+            return
+
+        self.controller.task_executor.submit(
+            (self, 'snapshot'), save_ranking, (ranking, self.shown_metric),
+            on_success=lambda path: self.comparison_status_label.config(
+                text='Saved as ' + os.path.basename(path)),
+            on_error=lambda e: self.comparison_status_label.config(text='Could not save the ranking: ' + str(e)))
+
+    # Asks the user for a saved ranking and returns it opened as a Snapshot, or None if the user did not choose one or
+    # it could not be opened
+    def choose_ranking_snapshot(self):
+        path = filedialog.askdirectory(parent=self, title='Choose a saved ranking',
+                                       initialdir=get_snapshots_directory(), mustexist=True)
+        if not path:
+            return None
+
+        try:
+            snapshot = Snapshot.open(path)
+            if snapshot.kind != RANKING_KIND:
+                raise ValueError(os.path.basename(path) + ' is not a ranking')
+            return snapshot
+        except (OSError, ValueError) as e:
+            logger.error('Could not open snapshot %s: %s', path, e)
+            self.comparison_status_label.config(text='Could not open the ranking: ' + str(e))
+            return None
+
+    # Shows a saved ranking that the user chooses, without analyzing the stocks again
+    def open_ranking_snapshot(self):
+        snapshot = self.choose_ranking_snapshot()
+        if snapshot is None:
+            return
+
+        # A running comparison would replace the saved ranking when it is done
+        self.controller.task_executor.cancel((self, 'compare'))
+
+        metric = snapshot.metadata.get('metric', ASSIGNMENT_METRIC)
+        if metric not in RANKING_METRICS:
+            metric = ASSIGNMENT_METRIC
+        self.present_ranking(snapshot.ranking(), metric)
+        self.comparison_status_label.config(text='Opened ' + os.path.basename(snapshot.path) + ', ' +
+                                                 str(len(snapshot)) + ' stocks')
+
+    # Compares the ranking that is shown with a saved ranking that the user chooses. The change in rank since the
+    # saved ranking is shown after every stock, and the stocks that are only in the saved ranking are listed last
+    @traced('render.ranking_changes')
+    def compare_with_ranking_snapshot(self):
+        ranking = self.ranking_to_snapshot()
+        if ranking is None:
+            return
+        snapshot = self.choose_ranking_snapshot()
+        if snapshot is None:
+            return
+
+        differences = diff_with_ranking(snapshot, ranking)
+        metric_text, score_text = self.ranking_texts(self.shown_metric)
+
+        # Rows of the stocks in the ranking with their change, +2 means that the stock moved up two places
+        beta_info_list = self.ranking_rows(ranking, score_text)
+        rank_changes = differences['rank_change'].tolist()
+        for stock_idx in range(len(ranking)):
+            if rank_changes[stock_idx] != rank_changes[stock_idx]:
+                change_text = 'new'
+            elif rank_changes[stock_idx] == 0:
+                change_text = '='
+            else:
+                change_text = '%+d' % rank_changes[stock_idx]
+            beta_info_list[stock_idx] += ' (' + change_text + ')'
+
+        # Stocks that are no longer in the ranking
+        removed_stocks = differences.iloc[len(ranking):]
+        for symbol, old_rank in zip(removed_stocks['symbol'].tolist(), removed_stocks['old_rank'].tolist()):
+            beta_info_list.append('Not ranked, was ' + str(int(old_rank)) + '. - ' + symbol)
+
+        snapshot_name = os.path.basename(snapshot.path)
+        self.stocks_to_compare_frame.set_title('Ranking according to ' + metric_text + ' compared with ' +
+                                               snapshot_name)
+        self.stocks_to_compare_frame.set_rows(beta_info_list)
+        self.comparison_status_label.config(text='Compared with ' + snapshot_name)
 
 
 # Copyright 2020 Oliver Midbrink
\ No newline at end of file
@@ -0,0 +1,119 @@
+# Compact storage of the daily prices of many stocks. A PricePanel keeps the prices of all the stocks in a few numpy
+# matrices (stocks x days) that share one date index, instead of one pandas dataframe per stock. The prices are
+# float32 and the volumes int64, so a year of prices for 5000 stocks takes about 30 MB instead of several hundred MB
+# of dataframes and python objects.
+#
+# Usage:
+#   panel = get_price_store().get_price_panel(symbols, start)
+#   technical_panel = compute_technical_panel(panel.open, panel.high, panel.low, panel.close, ...)
+
+# Heavy libraries are imported the first time they are used, so that the app starts fast
+from lazy_modules import lazy_import
+
+# For the price matrices
+np = lazy_import('numpy')
+
+# For turning dataframes into panels and back
+pd = lazy_import('pandas')
+
+# Names of the price matrices of a panel, same order as the columns of the stacked prices in from_stacked
+PANEL_PRICE_FIELDS = ('open', 'high', 'low', 'close')
+
+# Columns of the price dataframes that become the price matrices, same order as PANEL_PRICE_FIELDS
+FRAME_PRICE_COLUMNS = ('Open', 'High', 'Low', 'Close')
+
+# Types of the matrices. float32 has 7 significant digits, which is more than stock prices have
+PRICE_DTYPE = 'float32'
+VOLUME_DTYPE = 'int64'
+
+
+# Returns the dates in the numpy array or pandas index dates as int64 days since 1970-01-01. The time of day is
+# removed, so that bars from the same day get the same day number whatever time zone or resolution they have
+def to_day_numbers(dates):
+    dates = pd.DatetimeIndex(dates)
+    if dates.tz is not None:
+        dates = dates.tz_localize(None)
+    return dates.values.astype('datetime64[D]').astype('int64')
+
+
+# The prices of many stocks on the days that any of them has prices.
+#   symbols  list of the symbols, one row in every matrix per symbol
+#   dates    1-D int64 array with the days of the columns as days since 1970-01-01, oldest first
+#   open, high, low, close  2-D float32 arrays (symbols x days) with NaN on days without a price
+#   volume   2-D int64 array (symbols x days) with 0 on days without a price
+class PricePanel:
+
+    __slots__ = ('symbols', 'dates', 'open', 'high', 'low', 'close', 'volume')
+
+    def __init__(self, symbols, dates, open, high, low, close, volume):
+        self.symbols = list(symbols)
+        self.dates = dates
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+
+    # Returns a panel where every symbol in symbols has only NaN prices and there are no days
+    @classmethod
+    def empty(cls, symbols):
+        empty_prices = np.full((len(symbols), 0), np.nan, dtype=PRICE_DTYPE)
+        return cls(symbols, np.zeros(0, dtype='int64'), empty_prices, empty_prices.copy(), empty_prices.copy(),
+                   empty_prices.copy(), np.zeros((len(symbols), 0), dtype=VOLUME_DTYPE))
+
+    # Builds a panel from the price rows of many stocks stacked on top of each other.
+    # row_symbol_idx is a 1-D array with the index in symbols of every row, row_days the day number (see
+    # to_day_numbers) of every row, stacked_prices a 2-D array with the columns of PANEL_PRICE_FIELDS and
+    # stacked_volumes a 1-D array. Symbols without rows get only NaN
+    @classmethod
+    def from_stacked(cls, symbols, row_symbol_idx, row_days, stacked_prices, stacked_volumes):
+        if len(row_days) == 0:
+            return cls.empty(symbols)
+
+        # All the days that any of the stocks has prices for, and the column in the panel for every row
+        dates, panel_columns = np.unique(row_days, return_inverse=True)
+
+        # One matrix per price type, all filled in at the same time (price types x symbols x days)
+        matrices = np.full((len(PANEL_PRICE_FIELDS), len(symbols), len(dates)), np.nan, dtype=PRICE_DTYPE)
+        matrices[:, row_symbol_idx, panel_columns] = np.asarray(stacked_prices, dtype=PRICE_DTYPE).T
+
+        # Missing volumes (NaN) become 0
+        volume = np.zeros((len(symbols), len(dates)), dtype=VOLUME_DTYPE)
+        volume[row_symbol_idx, panel_columns] = np.nan_to_num(np.asarray(stacked_volumes, dtype=float))
+
+        return cls(symbols, dates.astype('int64'), matrices[0], matrices[1], matrices[2], matrices[3], volume)
+
+    # Builds a panel from a dictionary with symbols as keys and price dataframes (with the columns Open, High, Low
+    # and Close and optionally Volume, one row per day) as values, for example from a data provider.
+    # symbols gives the order of the rows, symbols without a dataframe get only NaN
+    @classmethod
+    def from_frames(cls, prices_by_symbol, symbols):
+        symbol_frames = [(symbol_idx, prices_by_symbol[symbols[symbol_idx]]) for symbol_idx in range(len(symbols))
+                         if symbols[symbol_idx] in prices_by_symbol and len(prices_by_symbol[symbols[symbol_idx]]) > 0]
+        if len(symbol_frames) == 0:
+            return cls.empty(symbols)
+
+        stacked_prices = np.concatenate([stock_prices[list(FRAME_PRICE_COLUMNS)].to_numpy(PRICE_DTYPE)
+                                         for symbol_idx, stock_prices in symbol_frames])
+        stacked_volumes = np.concatenate([stock_prices['Volume'].to_numpy(float) if 'Volume' in stock_prices
+                                          else np.zeros(len(stock_prices)) for symbol_idx, stock_prices in symbol_frames])
+        row_days = np.concatenate([to_day_numbers(stock_prices.index) for symbol_idx, stock_prices in symbol_frames])
+        row_symbol_idx = np.repeat([symbol_idx for symbol_idx, stock_prices in symbol_frames],
+                                   [len(stock_prices) for symbol_idx, stock_prices in symbol_frames])
+
+        return cls.from_stacked(symbols, row_symbol_idx, row_days, stacked_prices, stacked_volumes)
+
+    # Returns the number of symbols
+    def __len__(self):
+        return len(self.symbols)
+
+    # Returns a 1-D bool array that is True for the symbols that have at least one price
+    def has_prices(self):
+        return ~np.isnan(self.close).all(axis=1) if self.close.shape[1] > 0 else np.zeros(len(self), dtype=bool)
+
+    # Returns the dates as a pandas DatetimeIndex, for aligning other price series to the panel
+    def date_index(self):
+        return pd.DatetimeIndex(self.dates.astype('datetime64[D]'), name='Date')
+
+
+# Copyright 2020 Oliver Midbrink
@@ -0,0 +1,367 @@
+# For storing the historic prices on disk between runs of the app
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# For dates and for finding out if the stored prices are up to date
+import time
+from datetime import datetime
+
+# Heavy libraries are imported the first time they are used, so that the app starts fast
+from lazy_modules import lazy_import
+
+# For data purposes
+pd = lazy_import('pandas')
+
+# For downloading historic prices
+yf = lazy_import('yfinance')
+
+# For the prices of many stocks in compact matrices instead of one dataframe per stock
+np = lazy_import('numpy')
+from price_panel import PricePanel, PANEL_PRICE_FIELDS, PRICE_DTYPE, VOLUME_DTYPE
+
+# The stored prices are refreshed once every time the market has closed
+from index_cache import next_market_close, MARKET_TIME_ZONE
+
+# Timing of the downloads
+from tracing import span
+
+# The downloads from yahoo finance wait for the shared rate limiter
+from rate_limiter import get_rate_limiter
+
+# Refreshes of the same symbol at the same time, for example by the ranking page and the technical analysis page, share
+# one download
+from single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Single flight group of the price downloads of all the stores, the key is the database, symbol, interval and the date
+# the download starts at
+download_flight = SingleFlight('prices')
+
+# Directory where the app stores downloaded data, can be changed with the STOCK_APP_CACHE_DIR environment variable
+CACHE_DIRECTORY = os.environ.get('STOCK_APP_CACHE_DIR',
+                                 os.path.join(os.path.expanduser('~'), '.stock_analysis_app'))
+
+# Number of symbols that are downloaded with one request when many symbols have to be refreshed
+DOWNLOAD_CHUNK_SIZE = 50
+
+# Number of symbols asked for with one query when the dates of a price panel are read. SQLite allows at most 999
+# parameters in a query in older versions
+PANEL_QUERY_CHUNK_SIZE = 500
+
+# Columns of the price dataframes returned from the store, same names as in yfinance
+PRICE_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+
+# Returns the directory where the app stores downloaded data. The directory is created if it does not exist.
+def get_cache_directory():
+    os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+    return CACHE_DIRECTORY
+
+
+# Returns the first date of a time window that ends today, for example period '1mo' gives the date one month ago.
+# period is written the same way as in yfinance: a number followed by 'd' (days), 'wk' (weeks), 'mo' (months)
+# or 'y' (years). Returns a pandas Timestamp without time of day.
+def period_start_date(period, today=None):
+    if today is None:
+        today = pd.Timestamp.now().normalize()
+
+    # Split the period into a number and a unit, for example '1mo' into 1 and 'mo'
+    number_length = len(period) - len(period.lstrip('0123456789'))
+    number = int(period[:number_length])
+    unit = period[number_length:]
+
+    if unit == 'd':
+        return today - pd.DateOffset(days=number)
+    if unit == 'wk':
+        return today - pd.DateOffset(weeks=number)
+    if unit == 'mo':
+        return today - pd.DateOffset(months=number)
+    if unit == 'y':
+        return today - pd.DateOffset(years=number)
+
+    raise ValueError('Unknown period: ' + period)
+
+
+# Downloads historic prices for a list of symbols from yahoo finance with one request, starting at the date start.
+# interval is the length of every bar, for example '1d'.
+# Returns a dictionary with symbols as keys and dataframes with the PRICE_COLUMNS as values. Symbols without any
+# prices are left out.
+def download_price_history(symbols, start, interval):
+    with get_rate_limiter().limited() as slot:
+        all_prices = yf.download(symbols, start=start.strftime('%Y-%m-%d'), interval=interval, group_by='ticker',
+                                 threads=False, progress=False)
+        prices_by_symbol = split_price_history(all_prices, symbols)
+
+        # yfinance does not raise when yahoo finance throttles it, the throttled symbols just get no prices. A chunk
+        # of real symbols has prices for at least some of them, so a chunk where none of the symbols got any is taken
+        # as throttling. A single symbol without prices is more likely one that does not exist
+        if len(symbols) > 1 and len(prices_by_symbol) == 0:
+            slot.throttled()
+
+    return prices_by_symbol
+
+
+# Splits all_prices, the dataframe from yf.download for symbols, into a dictionary with symbols as keys and
+# dataframes with the PRICE_COLUMNS as values. Symbols without any prices are left out
+def split_price_history(all_prices, symbols):
+    prices_by_symbol = {}
+    if all_prices is None or len(all_prices) == 0:
+        return prices_by_symbol
+
+    for symbol in symbols:
+        # Pick out the columns for this symbol. Older yfinance versions return plain columns
+        # when only one symbol is downloaded
+        if isinstance(all_prices.columns, pd.MultiIndex):
+            if symbol not in all_prices.columns.get_level_values(0):
+                continue
+            stock_prices = all_prices[symbol]
+        else:
+            stock_prices = all_prices
+
+        # Remove the days where this stock has no prices
+        stock_prices = stock_prices[PRICE_COLUMNS].dropna(how='all')
+
+        if len(stock_prices) > 0:
+            prices_by_symbol[symbol] = stock_prices
+
+    return prices_by_symbol
+
+
+# Downloads historic prices like download_price_history, but with the default data provider of the app
+# (data_providers.get_default_provider), so that the source of the prices can be changed. This is the downloader that
+# the store uses by default
+def download_with_default_provider(symbols, start, interval):
+    # Imported here because the providers use download_price_history in this module
+    from data_providers import get_default_provider, run_sync
+
+    return run_sync(get_default_provider().get_prices(symbols, start, interval))
+
+
+# Local store of historic prices (open, high, low, close and volume) in a SQLite database in the cache directory.
+# The prices are stored per symbol and interval. When prices are asked for, only the bars that are missing since the
+# last stored date are downloaded and added, and nothing is downloaded at all if the symbol has already been
+# refreshed after the latest market close.
+class PriceStore:
+
+    # Initialize the store. database_path is the SQLite file to use, by default prices.sqlite in the cache directory.
+    # downloader is the function used to download missing prices, same arguments as download_price_history
+    def __init__(self, database_path=None, downloader=download_with_default_provider):
+        if database_path is None:
+            database_path = os.path.join(get_cache_directory(), 'prices.sqlite')
+
+        self.database_path = database_path
+        self.downloader = downloader
+
+        # SQLite only allows one writer at a time, so writes from different threads take turns
+        self.write_lock = threading.Lock()
+
+        # Create the tables if this is a new database
+        with self.connect() as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS prices ('
+                               'symbol TEXT, interval TEXT, date TEXT, '
+                               'open REAL, high REAL, low REAL, close REAL, volume REAL, '
+                               'PRIMARY KEY (symbol, interval, date))')
+
+            # Which dates are stored for every symbol and interval and when they were last refreshed
+            connection.execute('CREATE TABLE IF NOT EXISTS coverage ('
+                               'symbol TEXT, interval TEXT, covered_start TEXT, refreshed_at REAL, '
+                               'PRIMARY KEY (symbol, interval))')
+
+    # Opens a new connection to the database, to be used in a with statement. Changes are committed and the
+    # connection is closed when the with block ends. Every thread uses its own connections
+    @contextmanager
+    def connect(self):
+        connection = sqlite3.connect(self.database_path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    # Returns a dataframe with the prices of symbol from the date start until now, one row per bar, oldest first.
+    # The dataframe is empty if there are no prices for the symbol.
+    def get_prices(self, symbol, start, interval='1d'):
+        return self.get_prices_batch([symbol], start, interval)[symbol]
+
+    # Same as get_prices but for a list of symbols. The missing prices for all the symbols are downloaded with as few
+    # requests as possible. Returns a dictionary with the symbols as keys and the dataframes as values.
+    def get_prices_batch(self, symbols, start, interval='1d', chunk_size=DOWNLOAD_CHUNK_SIZE):
+        self.refresh(symbols, start, interval, chunk_size)
+
+        with self.connect() as connection:
+            return {symbol: self.read_prices(connection, symbol, start, interval) for symbol in symbols}
+
+    # Same as get_prices_batch, but returns the prices as a PricePanel with one row per symbol in symbols, in the
+    # same order. The dates are read first, so that the matrices of the panel can be created at their final size and
+    # the prices of one symbol at a time are written straight into them. No dataframe is created per symbol, which
+    # uses much less memory for many symbols
+    def get_price_panel(self, symbols, start, interval='1d', chunk_size=DOWNLOAD_CHUNK_SIZE):
+        self.refresh(symbols, start, interval, chunk_size)
+        start_text = date_to_text(start)
+
+        with self.connect() as connection:
+            # All the dates that any of the symbols has prices for. SQLite allows a limited number of parameters, so
+            # the symbols are asked for in chunks
+            date_texts = set()
+            for chunk_start in range(0, len(symbols), PANEL_QUERY_CHUNK_SIZE):
+                chunk = symbols[chunk_start:chunk_start + PANEL_QUERY_CHUNK_SIZE]
+                date_texts.update(row[0] for row in connection.execute(
+                    'SELECT DISTINCT date FROM prices WHERE interval = ? AND date >= ? AND symbol IN (' +
+                    ', '.join('?' * len(chunk)) + ')', [interval, start_text] + list(chunk)))
+
+            date_texts = sorted(date_texts)
+            if len(date_texts) == 0:
+                return PricePanel.empty(symbols)
+
+            # Column of every date in the panel
+            column_by_date_text = {date_texts[column_idx]: column_idx for column_idx in range(len(date_texts))}
+
+            prices = np.full((len(PANEL_PRICE_FIELDS), len(symbols), len(date_texts)), np.nan, dtype=PRICE_DTYPE)
+            volume = np.zeros((len(symbols), len(date_texts)), dtype=VOLUME_DTYPE)
+
+            for symbol_idx in range(len(symbols)):
+                rows = connection.execute('SELECT date, open, high, low, close, volume FROM prices '
+                                          'WHERE symbol = ? AND interval = ? AND date >= ?',
+                                          (symbols[symbol_idx], interval, start_text)).fetchall()
+                if len(rows) == 0:
+                    continue
+
+                columns = [column_by_date_text[row[0]] for row in rows]
+                # None (NULL in the database) becomes NaN, and missing volumes 0
+                prices[:, symbol_idx, columns] = np.array([row[1:5] for row in rows], dtype=PRICE_DTYPE).T
+                volume[symbol_idx, columns] = np.nan_to_num(np.array([row[5] for row in rows], dtype=float))
+
+        # The panel has one column per day, the time of day is left out
+        dates = np.array([date_text[:10] for date_text in date_texts], dtype='datetime64[D]').astype('int64')
+        return PricePanel(symbols, dates, prices[0], prices[1], prices[2], prices[3], volume)
+
+    # Downloads the prices that are missing in the store for the symbols, from the date start until now.
+    # Symbols that are refreshed after the latest market close are skipped. If a download fails the stored prices
+    # are kept as they are, so they will be tried again next time.
+    # Symbols that another thread is already downloading from the same date are not downloaded again, the refresh
+    # waits for that download instead
+    def refresh(self, symbols, start, interval='1d', chunk_size=DOWNLOAD_CHUNK_SIZE):
+        start_text = date_to_text(start)
+        now = time.time()
+
+        # Dictionary with the date to download from as key and a list of symbols as value, so that symbols that
+        # need the same dates can be downloaded together
+        symbols_by_download_start = {}
+
+        with self.connect() as connection:
+            for symbol in dict.fromkeys(symbols):
+                coverage = connection.execute('SELECT covered_start, refreshed_at FROM coverage '
+                                              'WHERE symbol = ? AND interval = ?', (symbol, interval)).fetchone()
+
+                if coverage is not None and coverage[0] <= start_text:
+                    # Nothing to do if the prices were refreshed after the last market close
+                    refreshed_at = datetime.fromtimestamp(coverage[1], MARKET_TIME_ZONE)
+                    if datetime.now(MARKET_TIME_ZONE) < next_market_close(refreshed_at):
+                        continue
+
+                    # Download from the last stored bar, it is downloaded again in case it was not final
+                    last_date = connection.execute('SELECT MAX(date) FROM prices WHERE symbol = ? AND interval = ?',
+                                                   (symbol, interval)).fetchone()[0]
+                    download_start = start_text if last_date is None else max(last_date, start_text)
+                else:
+                    # The store has no prices this far back, download the whole window
+                    download_start = start_text
+
+                symbols_by_download_start.setdefault(download_start, []).append(symbol)
+
+        # Claim the downloads that are not running already
+        claimed_calls, running_calls = download_flight.claim(
+            (self.database_path, symbol, interval, download_start)
+            for download_start, download_symbols in symbols_by_download_start.items() for symbol in download_symbols)
+
+        # Download the missing prices in chunks and add them to the store. The symbols of a chunk are released as soon
+        # as they are stored, so that the refreshes waiting for them can read them
+        try:
+            for download_start, download_symbols in symbols_by_download_start.items():
+                download_symbols = [symbol for symbol in download_symbols
+                                    if (self.database_path, symbol, interval, download_start) in claimed_calls]
+
+                for chunk_start in range(0, len(download_symbols), chunk_size):
+                    chunk = download_symbols[chunk_start:chunk_start + chunk_size]
+                    chunk_calls = {key: claimed_calls.pop(key)
+                                   for key in [(self.database_path, symbol, interval, download_start)
+                                               for symbol in chunk]}
+
+                    try:
+                        with span('prices.download'):
+                            prices_by_symbol = self.downloader(chunk, pd.Timestamp(download_start), interval)
+                    except Exception as e:
+                        logger.warning('Could not download prices for %d symbols: %s', len(chunk), e)
+                        download_flight.release(chunk_calls, failed=True)
+                        continue
+
+                    try:
+                        self.write_prices(chunk, prices_by_symbol, start_text, interval, now)
+                    finally:
+                        download_flight.release(chunk_calls)
+        finally:
+            # Release what was not downloaded because of an error
+            download_flight.release(claimed_calls, failed=True)
+
+        # Wait for the symbols that were being downloaded by other refreshes
+        download_flight.wait_for(running_calls)
+
+    # Writes downloaded prices to the store and marks the symbols in chunk as refreshed at the time refreshed_at.
+    # prices_by_symbol is a dictionary like the one returned from download_price_history
+    def write_prices(self, chunk, prices_by_symbol, start_text, interval, refreshed_at):
+        with self.write_lock, self.connect() as connection:
+            for symbol, stock_prices in prices_by_symbol.items():
+                rows = [(symbol, interval, date_to_text(date), row[0], row[1], row[2], row[3], row[4])
+                        for date, row in zip(stock_prices.index, stock_prices[PRICE_COLUMNS].itertuples(index=False))]
+                connection.executemany('INSERT OR REPLACE INTO prices VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+            # Symbols without prices are marked as refreshed too, so they are not downloaded again until next close
+            for symbol in chunk:
+                old_start = connection.execute('SELECT covered_start FROM coverage WHERE symbol = ? AND interval = ?',
+                                               (symbol, interval)).fetchone()
+                covered_start = start_text if old_start is None else min(old_start[0], start_text)
+                connection.execute('INSERT OR REPLACE INTO coverage VALUES (?, ?, ?, ?)',
+                                   (symbol, interval, covered_start, refreshed_at))
+
+    # Reads the stored prices for symbol from the date start and returns them as a dataframe with a date index
+    def read_prices(self, connection, symbol, start, interval):
+        rows = connection.execute('SELECT date, open, high, low, close, volume FROM prices '
+                                  'WHERE symbol = ? AND interval = ? AND date >= ? ORDER BY date',
+                                  (symbol, interval, date_to_text(start))).fetchall()
+
+        stock_prices = pd.DataFrame([row[1:] for row in rows], columns=PRICE_COLUMNS,
+                                    index=pd.DatetimeIndex([row[0] for row in rows], name='Date'))
+        return stock_prices
+
+
+# Converts a date or timestamp to the text that is stored in the database, for example '2020-11-30T00:00:00'.
+# Time zones are removed so that all dates can be compared as text
+def date_to_text(date):
+    date = pd.Timestamp(date)
+    if date.tzinfo is not None:
+        date = date.tz_localize(None)
+    return date.strftime('%Y-%m-%dT%H:%M:%S')
+
+
+# The price store shared by the whole app. It is created the first time it is used, so that importing this module
+# does not create any files
+shared_price_store = None
+shared_price_store_lock = threading.Lock()
+
+
+# Returns the price store shared by the whole app
+def get_price_store():
+    global shared_price_store
+
+    with shared_price_store_lock:
+        if shared_price_store is None:
+            shared_price_store = PriceStore()
+        return shared_price_store
+
+
+# Copyright 2020 Oliver Midbrink
@@ -0,0 +1,341 @@
+# For running several analyses at the same time. Each analysis spends nearly all its time waiting for
+# yahoo finance to answer, so a pool of threads is enough to overlap the waiting.
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# For ranking very large universes in several processes. The calculations of a chunk are numpy and pandas work that
+# holds the GIL, so with threads only one chunk is calculated at a time
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+
+# For keeping the ranking sorted while the results come in, and for merging the sorted rankings of the shards
+import bisect
+import heapq
+
+# For finding scores that could not be calculated
+import math
+
+# Window lengths and names of the return statistics that stocks can be ranked by
+from indicators import ROLLING_WINDOWS, RETURN_STATISTICS
+
+# Heavy libraries are imported the first time they are used, so that the app starts fast
+from lazy_modules import lazy_import
+
+# For the compact results of the shards
+np = lazy_import('numpy')
+
+# Number of analyses that are allowed to run at the same time if nothing else is specified
+DEFAULT_MAX_WORKERS = 8
+
+# Highest number of analyses that are allowed to run at the same time, to not flood yahoo finance with requests
+MAX_WORKERS_LIMIT = 32
+
+# Number of symbols that are given to the batch analysis function at a time if nothing else is specified
+DEFAULT_CHUNK_SIZE = 50
+
+# Number of symbols in the first chunk. The chunks grow to the full chunk size from here, so that the first results
+# are shown quickly while the rest are still downloaded in large chunks
+FIRST_CHUNK_SIZE = 5
+
+# Longest time in seconds between two checks if a ranking has been cancelled
+CANCEL_CHECK_INTERVAL = 0.1
+
+# Number of shards per process in rank_stocks_sharded if no shard size is given. More shards than processes keep all
+# the processes busy until the end and give progress reports while the ranking runs
+SHARDS_PER_PROCESS = 4
+
+# The results of a shard are sent back from its process as the bytes of an array of this type, one row per stock
+# sorted like the ranking: the index of the stock in stock_symbols and its score, NaN if the analysis failed
+SHARD_RESULT_DTYPE = [('stock_idx', '<i4'), ('score', '<f8')]
+
+# The "betavalue" as defined in the assignment, the ratio of the stock and index price development
+ASSIGNMENT_METRIC = 'beta_assignment'
+
+# Descriptions of the statistics, shown to the user together with the window length
+RETURN_STATISTIC_LABELS = {'beta': 'Beta', 'correlation': 'Correlation', 'volatility': 'Volatility',
+                           'alpha': 'Alpha'}
+
+# The metrics that stocks can be ranked by, with the metric name as key and the text shown to the user as value.
+# The names of the return statistics are the statistic and the window length, for example 'beta_60'
+RANKING_METRICS = {ASSIGNMENT_METRIC: '"betavalue" (assignment)'}
+for window in ROLLING_WINDOWS:
+    for statistic in RETURN_STATISTICS:
+        RANKING_METRICS[statistic + '_' + str(window)] = RETURN_STATISTIC_LABELS[statistic] + ' ' + str(window) + 'd'
+
+
+# Returns the "betavalue" from the TechnicalResult returned by technical_analysis_batch in analysis.py
+def assignment_beta_score(technical_values):
+    return technical_values.beta_assignment
+
+
+# Splits the indexes of number_of_stocks stocks into chunks for rank_stocks. The first chunk has first_chunk_size stocks
+# and every chunk is twice as large as the one before, up to chunk_size.
+# Returns a list of (start index, end index) of the chunks
+def growing_chunks(number_of_stocks, chunk_size=DEFAULT_CHUNK_SIZE, first_chunk_size=FIRST_CHUNK_SIZE):
+    chunks = []
+    current_chunk_size = max(1, min(first_chunk_size, chunk_size))
+
+    chunk_start = 0
+    while chunk_start < number_of_stocks:
+        chunk_end = min(chunk_start + current_chunk_size, number_of_stocks)
+        chunks.append((chunk_start, chunk_end))
+        chunk_start = chunk_end
+        current_chunk_size = min(current_chunk_size * 2, chunk_size)
+
+    return chunks
+
+
+# A ranking that is kept sorted while the results of the analysis come in, chunk by chunk in any order.
+# Every new stock is put in its place with a binary search instead of sorting the whole ranking again.
+# The ranking is the same as the one rank_stocks returns: the highest score first, equal scores in the order of
+# stock_symbols, and the stocks that failed last in the order of stock_symbols.
+class IncrementalRanking:
+
+    # Initialize an empty ranking of the stocks in stock_symbols, with the descriptions in stock_identifiers and
+    # scores from score_function, same as in rank_stocks
+    def __init__(self, stock_symbols, stock_identifiers, score_function):
+        self.stock_symbols = stock_symbols
+        self.stock_identifiers = stock_identifiers
+        self.score_function = score_function
+
+        # The ranked stocks as tuples (symbol, score, description) and their sort keys (-score, stock index) in the
+        # same order
+        self.ranked_stocks = []
+        self.sort_keys = []
+
+        # The stocks that failed as tuples (symbol, 0, description) and their stock indexes in the same order
+        self.failed_stocks = []
+        self.failed_indexes = []
+
+    # Adds the results of a chunk with the stocks from index chunk_start to chunk_end in stock_symbols. results is
+    # the dictionary from the batch analysis function, stocks that are not in it failed.
+    # Returns the lowest position in the ranking that changed, all the stocks from there on have moved
+    def add_chunk(self, chunk_start, chunk_end, results):
+        first_changed_position = len(self)
+
+        for stock_idx in range(chunk_start, chunk_end):
+            symbol = self.stock_symbols[stock_idx]
+            technical_values = results.get(symbol)
+
+            # Get the score if there was no error with the analysis
+            score = None
+            if technical_values is not None:
+                score = self.score_function(technical_values)
+
+            if score is None or math.isnan(score):
+                # Set the score 0 in case there was an error with the analysis or the score could not be calculated
+                position = bisect.bisect(self.failed_indexes, stock_idx)
+                self.failed_indexes.insert(position, stock_idx)
+                self.failed_stocks.insert(position, (symbol, 0, 'Error for this stock: ' +
+                                                     self.stock_identifiers[stock_idx]))
+                position += len(self.ranked_stocks)
+            else:
+                # Highest score first, and the stock that was first in stock_symbols first if the scores are equal
+                sort_key = (-score, stock_idx)
+                position = bisect.bisect(self.sort_keys, sort_key)
+                self.sort_keys.insert(position, sort_key)
+                self.ranked_stocks.insert(position, (symbol, score, self.stock_identifiers[stock_idx]))
+
+            first_changed_position = min(first_changed_position, position)
+
+        return first_changed_position
+
+    # Returns the number of stocks in the ranking
+    def __len__(self):
+        return len(self.ranked_stocks) + len(self.failed_stocks)
+
+    # Returns the ranking so far as a new list of tuples (symbol, score, description)
+    def ranking(self):
+        return self.ranked_stocks + self.failed_stocks
+
+
+# Ranks a number of stocks according to "betavalue" or another score. The symbols in stock_symbols are split up into chunks of
+# up to chunk_size symbols and batch_analysis_function is run for every chunk. At most max_workers chunks are analyzed
+# at the same time. The chunks start small and grow (see growing_chunks), so the first results come quickly.
+#
+# stock_symbols is a list of yahoo finance symbol strings and stock_identifiers is a list of descriptions
+# (same length and order as stock_symbols) that will be shown to the user.
+# batch_analysis_function is a function with the same contract as technical_analysis_batch in analysis.py. It takes a
+# list of symbols and returns the two dictionaries (results, errors), where the values in results are TechnicalResult
+# records with the "betavalue" as beta_assignment.
+# score_function takes a value from results and returns the score to rank by, by default the "betavalue". To rank by
+# something else, give a batch_analysis_function and score_function that fit together.
+#
+# Stocks where the analysis failed or the score is NaN get the score 0, a description starting with
+# 'Error for this stock: ' and are ranked last.
+# The function returns a list of tuples (symbol, score, description) sorted with the highest score first.
+# Stocks with the same score keep the order they had in stock_symbols.
+#
+# If on_progress is given it is called in the worker thread after every chunk with the arguments
+# (ranking so far, lowest position in it that changed, number of stocks analyzed, number of stocks), so that the
+# ranking can be shown while it grows. If cancel_event (a threading.Event) is set, the chunks that have not started
+# are cancelled and the ranking of the stocks analyzed so far is returned. To also stop the running chunks,
+# batch_analysis_function has to check the same event, like technical_analysis_batch does when it is given one.
+def rank_stocks(stock_symbols, stock_identifiers, batch_analysis_function, max_workers=DEFAULT_MAX_WORKERS,
+                chunk_size=DEFAULT_CHUNK_SIZE, score_function=assignment_beta_score, on_progress=None,
+                cancel_event=None):
+    # Keep the number of workers between 1 and MAX_WORKERS_LIMIT
+    max_workers = max(1, min(int(max_workers), MAX_WORKERS_LIMIT))
+
+    ranking = IncrementalRanking(stock_symbols, stock_identifiers, score_function)
+    analyzed_count = 0
+
+    # Run the analysis for every chunk in the worker pool, every chunk is analyzed by one worker
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        pending_futures = {}
+        for chunk_start, chunk_end in growing_chunks(len(stock_symbols), chunk_size):
+            future = executor.submit(batch_analysis_function, stock_symbols[chunk_start:chunk_end])
+            pending_futures[future] = (chunk_start, chunk_end)
+
+        # Add the results of the chunks to the ranking in the order they finish
+        while pending_futures:
+            if cancel_event is not None and cancel_event.is_set():
+                break
+
+            done_futures, not_done_futures = wait(pending_futures, timeout=CANCEL_CHECK_INTERVAL,
+                                                  return_when=FIRST_COMPLETED)
+            for future in done_futures:
+                chunk_start, chunk_end = pending_futures.pop(future)
+                results, errors = future.result()
+
+                first_changed_position = ranking.add_chunk(chunk_start, chunk_end, results)
+                analyzed_count += chunk_end - chunk_start
+
+                if on_progress is not None:
+                    on_progress(ranking.ranking(), first_changed_position, analyzed_count, len(stock_symbols))
+    finally:
+        # Chunks that have not started are cancelled, the running ones finish in the background or stop at the next
+        # check of cancel_event
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return ranking.ranking()
+
+
+# Analyzes the stocks in shard_symbols in a process of rank_stocks_sharded. shard_start is the index in stock_symbols of
+# the first stock of the shard. The symbols are analyzed in chunks of chunk_size symbols by max_workers threads, so
+# that the downloads of the process overlap.
+# Returns the bytes of an array with the SHARD_RESULT_DTYPE, sorted with the highest score first, equal scores in the
+# order of the stocks and the failed stocks last in the order of the stocks
+def rank_shard(shard_symbols, shard_start, batch_analysis_function, score_function, max_workers, chunk_size):
+    scores = np.full(len(shard_symbols), np.nan)
+
+    # Scores the stocks of the chunk from index chunk_start to chunk_end in shard_symbols
+    def analyze_chunk(chunk):
+        chunk_start, chunk_end = chunk
+        results, errors = batch_analysis_function(shard_symbols[chunk_start:chunk_end])
+
+        for stock_idx in range(chunk_start, chunk_end):
+            technical_values = results.get(shard_symbols[stock_idx])
+            if technical_values is not None:
+                score = score_function(technical_values)
+                if score is not None:
+                    scores[stock_idx] = score
+
+    chunks = [(chunk_start, min(chunk_start + chunk_size, len(shard_symbols)))
+              for chunk_start in range(0, len(shard_symbols), chunk_size)]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # list() to raise the exceptions of the chunks here
+        list(executor.map(analyze_chunk, chunks))
+
+    shard_results = np.empty(len(shard_symbols), dtype=SHARD_RESULT_DTYPE)
+    shard_results['stock_idx'] = np.arange(shard_start, shard_start + len(shard_symbols))
+    shard_results['score'] = scores
+
+    # NaN is sorted last
+    return shard_results[np.lexsort((shard_results['stock_idx'], -scores))].tobytes()
+
+
+# Merges the sorted results of the shards from rank_shard (arrays with the SHARD_RESULT_DTYPE) into one ranking like the
+# one from rank_stocks, a list of tuples (symbol, score, description).
+# Returns the ranking and the lowest position in it of a stock from the shard with the index new_shard_idx in
+# shard_results, len(ranking) if there is none
+def merge_shard_results(shard_results, stock_symbols, stock_identifiers, new_shard_idx=None):
+    ranked_shards = []
+    failed_shards = []
+    for shard_idx in range(len(shard_results)):
+        scores = shard_results[shard_idx]['score']
+        stock_indexes = shard_results[shard_idx]['stock_idx']
+
+        # The failed stocks are at the end of every shard
+        failed_start = len(scores) - int(np.count_nonzero(np.isnan(scores)))
+        ranked_shards.append(zip((-scores[:failed_start]).tolist(), stock_indexes[:failed_start].tolist(),
+                                 [shard_idx] * failed_start))
+        failed_shards.append(zip(stock_indexes[failed_start:].tolist(), [shard_idx] * (len(scores) - failed_start)))
+
+    # The sort keys are the same as in IncrementalRanking, and every stock index is only in one shard
+    ranking = []
+    first_changed_position = None
+    for negative_score, stock_idx, shard_idx in heapq.merge(*ranked_shards):
+        if shard_idx == new_shard_idx and first_changed_position is None:
+            first_changed_position = len(ranking)
+        ranking.append((stock_symbols[stock_idx], -negative_score, stock_identifiers[stock_idx]))
+    for stock_idx, shard_idx in heapq.merge(*failed_shards):
+        if shard_idx == new_shard_idx and first_changed_position is None:
+            first_changed_position = len(ranking)
+        ranking.append((stock_symbols[stock_idx], 0, 'Error for this stock: ' + stock_identifiers[stock_idx]))
+
+    if first_changed_position is None:
+        first_changed_position = len(ranking)
+    return ranking, first_changed_position
+
+
+# Ranks a number of stocks like rank_stocks, but in processes instead of threads, for universes that are so large that
+# the calculations and not the downloads are the slow part, like a whole exchange.
+# The symbols are split into shards of shard_size symbols, by default SHARDS_PER_PROCESS shards per process, and
+# every shard is analyzed by one of processes processes (all the cores by default) with max_workers threads and
+# chunks of chunk_size symbols. Every process has its own data provider connections and opens the local stores
+# itself. The results of a shard come back as a compact array (see rank_shard) instead of the result records, and the
+# sorted shards are merged into the same ranking that rank_stocks returns.
+#
+# batch_analysis_function and score_function are sent to the processes, so they must be functions defined at the top
+# of a module (or functools.partial and operator.itemgetter of them), not lambdas. initializer is called with
+# initargs at the start of every process, for example to use another price store than the default one.
+# on_progress and cancel_event work like in rank_stocks, on_progress is called after every shard.
+# The processes are started with spawn, so that they do not inherit the threads, open database connections or the
+# windows of this process
+def rank_stocks_sharded(stock_symbols, stock_identifiers, batch_analysis_function, processes=None,
+                        max_workers=DEFAULT_MAX_WORKERS, chunk_size=DEFAULT_CHUNK_SIZE,
+                        score_function=assignment_beta_score, shard_size=None, on_progress=None, cancel_event=None,
+                        initializer=None, initargs=()):
+    processes = max(1, processes or os.cpu_count() or 1)
+    max_workers = max(1, min(int(max_workers), MAX_WORKERS_LIMIT))
+    if shard_size is None:
+        shard_size = max(chunk_size, -(-len(stock_symbols) // (processes * SHARDS_PER_PROCESS)))
+
+    shard_results = []
+    analyzed_count = 0
+
+    executor = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=initializer, initargs=initargs)
+    try:
+        pending_futures = {}
+        for shard_start in range(0, len(stock_symbols), shard_size):
+            shard_symbols = list(stock_symbols[shard_start:shard_start + shard_size])
+            future = executor.submit(rank_shard, shard_symbols, shard_start, batch_analysis_function, score_function,
+                                     max_workers, chunk_size)
+            pending_futures[future] = len(shard_symbols)
+
+        # Collect the shards in the order they finish
+        while pending_futures:
+            if cancel_event is not None and cancel_event.is_set():
+                break
+
+            done_futures, not_done_futures = wait(pending_futures, timeout=CANCEL_CHECK_INTERVAL,
+                                                  return_when=FIRST_COMPLETED)
+            for future in done_futures:
+                analyzed_count += pending_futures.pop(future)
+                shard_results.append(np.frombuffer(future.result(), dtype=SHARD_RESULT_DTYPE))
+
+                if on_progress is not None:
+                    ranking, first_changed_position = merge_shard_results(shard_results, stock_symbols,
+                                                                          stock_identifiers, len(shard_results) - 1)
+                    on_progress(ranking, first_changed_position, analyzed_count, len(stock_symbols))
+    finally:
+        # Shards that have not started are cancelled, the running ones finish in the background
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return merge_shard_results(shard_results, stock_symbols, stock_identifiers)[0]
+
+
+# Copyright 2020 Oliver Midbrink
@@ -0,0 +1,313 @@
+# Rate limiting of the requests to yahoo finance. Yahoo finance answers with 429 Too Many Requests (or 5xx errors, or
+# not at all) when it gets too many requests, so all the requests of the app go through one shared limiter that
+# finds the highest request rate and number of concurrent requests that yahoo finance accepts.
+#
+# The limiter is a token bucket (at most rate requests per second, with short bursts) together with a limit on the
+# number of requests that run at the same time. Both limits are adapted like the congestion control of TCP:
+#   slow start            until the first throttling both limits grow by one for every request that succeeds, so
+#                         they double every round
+#   additive increase     after that the rate grows by ADDITIVE_RATE_INCREASE requests per second every second and
+#                         the concurrency limit by one per round of successful requests
+#   multiplicative decrease  when a request is throttled or times out both limits are halved, at most once per
+#                         DECREASE_COOLDOWN seconds so that one burst of failures only counts once
+# A Retry-After answer pauses all new requests for that long.
+#
+# Usage:
+#   with get_rate_limiter().limited() as slot:
+#       response = session.get(url)
+#       if response.status_code == 429:
+#           slot.throttled(retry_after)
+#
+# Exceptions in the with block are classified by classify_exception, timeouts count as throttling.
+
+# For waiting for a free slot in threads and coroutines
+import asyncio
+import threading
+
+# For the token bucket and the pauses
+import time
+
+# For the with statements
+from contextlib import contextmanager, asynccontextmanager
+
+# Answers from the server that mean that it is overloaded or throttling the app
+THROTTLE_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Requests per second at the start and the limits of the rate
+INITIAL_RATE = 20.0
+MIN_RATE = 0.5
+MAX_RATE = 1000.0
+
+# Number of concurrent requests at the start and the limits of the number
+INITIAL_CONCURRENCY = 8
+MIN_CONCURRENCY = 1
+MAX_CONCURRENCY = 64
+
+# Seconds of requests at the current rate that can be sent at once after a pause
+BURST_SECONDS = 0.2
+
+# Requests per second that the rate grows by every second after the slow start
+ADDITIVE_RATE_INCREASE = 10.0
+
+# The limits are multiplied by this when a request is throttled
+DECREASE_FACTOR = 0.5
+
+# Shortest time in seconds between two decreases of the limits
+DECREASE_COOLDOWN = 1.0
+
+# Longest time in seconds a coroutine sleeps before checking again if a slot is free
+ASYNC_POLL_INTERVAL = 0.01
+
+# Outcomes of a request
+SUCCESS = 'success'
+THROTTLED = 'throttled'
+TIMEOUT = 'timeout'
+ERROR = 'error'
+
+
+# Returns the outcome (THROTTLED, TIMEOUT or ERROR) of a request that raised exception. Works for the exceptions of
+# requests, aiohttp, yfinance and yahoofinancials without importing them
+def classify_exception(exception):
+    if isinstance(exception, (TimeoutError, asyncio.TimeoutError)) or 'Timeout' in type(exception).__name__:
+        return TIMEOUT
+
+    # requests.HTTPError has the response, aiohttp.ClientResponseError the status
+    response = getattr(exception, 'response', None)
+    status = getattr(response, 'status_code', None) or getattr(exception, 'status', None)
+    if status in THROTTLE_STATUS_CODES:
+        return THROTTLED
+
+    # yfinance and yahoofinancials only have the text of the error
+    message = str(exception).lower()
+    if 'too many requests' in message or 'rate limit' in message:
+        return THROTTLED
+
+    return ERROR
+
+
+# A request that has been let through by the limiter. The outcome is SUCCESS unless it is changed with throttled()
+# or the request raises an exception
+class RequestSlot:
+
+    __slots__ = ('limiter', 'outcome')
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self.outcome = SUCCESS
+
+    # Marks the request as throttled, for example after a 429 answer. retry_after is the number of seconds the server
+    # asked the app to wait, if it did
+    def throttled(self, retry_after=None):
+        self.outcome = THROTTLED
+        if retry_after:
+            self.limiter.pause(retry_after)
+
+    # Marks the request as failed for another reason than throttling, the limits are not changed
+    def failed(self):
+        self.outcome = ERROR
+
+
+# Token bucket rate limiter with a concurrency limit, both adapted to how the server answers. Shared by all threads
+# and the event loop of the data providers. If enabled is False every request is let through at once, but the
+# statistics are still counted.
+class AdaptiveRateLimiter:
+
+    def __init__(self, initial_rate=INITIAL_RATE, min_rate=MIN_RATE, max_rate=MAX_RATE,
+                 initial_concurrency=INITIAL_CONCURRENCY, min_concurrency=MIN_CONCURRENCY,
+                 max_concurrency=MAX_CONCURRENCY, enabled=True):
+        self.rate = float(initial_rate)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+
+        self.concurrency_limit = float(initial_concurrency)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+
+        self.enabled = enabled
+
+        # Token bucket, filled with rate tokens per second up to the burst size
+        self.tokens = 1.0
+        self.last_refill = time.monotonic()
+
+        # Number of requests that have been let through and not released
+        self.in_flight = 0
+
+        # Slow start until the first throttling
+        self.slow_start = True
+
+        # No requests are let through before this time, set by Retry-After answers
+        self.paused_until = 0.0
+        self.last_decrease = float('-inf')
+
+        # Counters for the statistics
+        self.granted = 0
+        self.outcome_counts = {SUCCESS: 0, THROTTLED: 0, TIMEOUT: 0, ERROR: 0}
+        self.decreases = 0
+        self.total_wait_seconds = 0.0
+
+        # Lock for everything above, waiting threads are woken when a request is released. Reentrant, acquire holds
+        # it while it calls try_acquire
+        self.condition = threading.Condition(threading.RLock())
+
+    # Returns the largest number of tokens in the bucket
+    def burst_size(self):
+        return max(1.0, self.rate * BURST_SECONDS)
+
+    # Tries to let a request through. Returns 0 if it was let through, otherwise the number of seconds to wait before
+    # trying again, or None if it has to wait for a running request to be released
+    def try_acquire(self):
+        with self.condition:
+            now = time.monotonic()
+
+            # Fill the bucket with the tokens since the last time
+            self.tokens = min(self.burst_size(), self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+
+            if self.enabled:
+                if now < self.paused_until:
+                    return self.paused_until - now
+                if self.in_flight >= int(self.concurrency_limit):
+                    return None
+                if self.tokens < 1.0:
+                    return (1.0 - self.tokens) / self.rate
+                self.tokens -= 1.0
+
+            self.in_flight += 1
+            self.granted += 1
+            return 0
+
+    # Waits in this thread until a request can be let through
+    def acquire(self):
+        wait_start = time.monotonic()
+
+        # The lock is held from the check until the wait starts, so that a release in between is not missed
+        with self.condition:
+            while True:
+                wait_seconds = self.try_acquire()
+                if wait_seconds == 0:
+                    break
+                self.condition.wait(timeout=wait_seconds)
+
+        self.add_wait_time(time.monotonic() - wait_start)
+
+    # Waits in a coroutine until a request can be let through, without blocking the event loop
+    async def acquire_async(self):
+        wait_start = time.monotonic()
+
+        while True:
+            wait_seconds = self.try_acquire()
+            if wait_seconds == 0:
+                break
+
+            if wait_seconds is None:
+                wait_seconds = ASYNC_POLL_INTERVAL
+            await asyncio.sleep(wait_seconds)
+
+        self.add_wait_time(time.monotonic() - wait_start)
+
+    # Adds to the total waiting time in the statistics
+    def add_wait_time(self, wait_seconds):
+        with self.condition:
+            self.total_wait_seconds += wait_seconds
+
+    # Releases a request that is done, outcome is SUCCESS, THROTTLED, TIMEOUT or ERROR. The limits are increased after
+    # a success and decreased after throttling or a timeout
+    def release(self, outcome):
+        with self.condition:
+            self.in_flight -= 1
+            self.outcome_counts[outcome] += 1
+
+            if outcome == SUCCESS:
+                self.increase()
+            elif outcome in (THROTTLED, TIMEOUT):
+                self.decrease()
+
+            self.condition.notify_all()
+
+    # Increases the limits after a successful request. Must be called with the lock held
+    def increase(self):
+        if self.slow_start:
+            # One more per success, the limits double every round
+            self.rate = min(self.max_rate, self.rate + 1.0)
+            self.concurrency_limit = min(self.max_concurrency, self.concurrency_limit + 1.0)
+        else:
+            # rate successes take about one second, together they add ADDITIVE_RATE_INCREASE. The concurrency limit
+            # grows by one when as many requests as the limit have succeeded
+            self.rate = min(self.max_rate, self.rate + ADDITIVE_RATE_INCREASE / self.rate)
+            self.concurrency_limit = min(self.max_concurrency,
+                                         self.concurrency_limit + 1.0 / self.concurrency_limit)
+
+    # Decreases the limits after throttling or a timeout. Must be called with the lock held
+    def decrease(self):
+        self.slow_start = False
+
+        now = time.monotonic()
+        if now - self.last_decrease < DECREASE_COOLDOWN:
+            return
+
+        self.rate = max(self.min_rate, self.rate * DECREASE_FACTOR)
+        self.concurrency_limit = max(self.min_concurrency, self.concurrency_limit * DECREASE_FACTOR)
+        self.tokens = min(self.tokens, 1.0)
+        self.last_decrease = now
+        self.decreases += 1
+
+    # Lets no new requests through during the next seconds, for example after a Retry-After answer
+    def pause(self, seconds):
+        with self.condition:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    # Runs the with block as one request. Waits until the request can be let through, and releases it with the
+    # outcome set on the RequestSlot or the outcome of the exception that the block raised
+    @contextmanager
+    def limited(self):
+        self.acquire()
+        slot = RequestSlot(self)
+        try:
+            yield slot
+        except BaseException as e:
+            slot.outcome = classify_exception(e)
+            raise
+        finally:
+            self.release(slot.outcome)
+
+    # Same as limited, for coroutines. Used with async with
+    @asynccontextmanager
+    async def limited_async(self):
+        await self.acquire_async()
+        slot = RequestSlot(self)
+        try:
+            yield slot
+        except BaseException as e:
+            slot.outcome = classify_exception(e)
+            raise
+        finally:
+            self.release(slot.outcome)
+
+    # Returns the limits and the counters as a dictionary
+    def statistics(self):
+        with self.condition:
+            return {
+                'rate_per_s': round(self.rate, 2),
+                'concurrency_limit': round(self.concurrency_limit, 2),
+                'in_flight': self.in_flight,
+                'slow_start': self.slow_start,
+                'granted': self.granted,
+                'successes': self.outcome_counts[SUCCESS],
+                'throttled': self.outcome_counts[THROTTLED],
+                'timeouts': self.outcome_counts[TIMEOUT],
+                'errors': self.outcome_counts[ERROR],
+                'decreases': self.decreases,
+                'total_wait_s': round(self.total_wait_seconds, 3),
+            }
+
+
+# The rate limiter shared by all requests of the app to yahoo finance
+shared_rate_limiter = AdaptiveRateLimiter()
+
+
+# Returns the rate limiter shared by all requests of the app
+def get_rate_limiter():
+    return shared_rate_limiter
+
+
+# Copyright 2020 Oliver Midbrink
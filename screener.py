@@ -0,0 +1,430 @@
+# Fundamental screener for a whole universe of stocks. The balance sheet and income statement fields of all the
+# stocks are loaded once into a columnar store, one float64 array per field with one row per stock, and saved in the
+# cache directory. The ratios (the ones of fundamental_analysis and more) are calculated for all the stocks at once
+# from the columns, so a query like "equity ratio > 40% and p/s < 2, top 50" is a few array operations and answers in
+# well under a millisecond for 10000 stocks, without any downloads.
+#
+# Usage:
+#   python screener.py load symbols.txt
+#   python screener.py query "equity ratio > 40% and p/s < 2, top 50"
+#   python screener.py query "roe > 15%, sort by net margin, top 20" --format csv
+#   python screener.py ratios
+#
+# This module must not import tkinter, so that it can run on servers without a display.
+
+# For the command line
+import argparse
+import sys
+
+# For logging what the app does, instead of printing it
+import logging
+
+# For the operators of the queries and parsing them
+import operator
+import re
+
+# For the path and age of the saved store
+import os
+import time
+
+# For loading the statements of many stocks at the same time
+from concurrent.futures import ThreadPoolExecutor
+
+# Heavy libraries are imported the first time they are used, so that the app starts fast
+from lazy_modules import lazy_import
+
+# For the columns and the ratios
+np = lazy_import('numpy')
+
+# For the query results
+pd = lazy_import('pandas')
+
+# The statements are read from the local statement store, or from a data provider
+from analysis import fetch_statements
+from data_providers import CSVDirectoryProvider
+
+# The store is saved in the cache directory
+from price_store import get_cache_directory
+
+# Limits for the number of statements that are loaded at the same time
+from ranking import DEFAULT_MAX_WORKERS, MAX_WORKERS_LIMIT
+
+# Timing of the loading and the queries
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# File in the cache directory where the store is saved. SCREENER_VERSION is increased when the layout changes
+SCREENER_FILE = 'screener.npz'
+SCREENER_VERSION = 1
+
+# The columns of the store, with the statement and the name of the field in the yahoo finance statements
+STATEMENT_FIELDS = {
+    'total_assets': ('balance_sheet', 'totalAssets'),
+    'total_equity': ('balance_sheet', 'totalStockholderEquity'),
+    'total_liabilities': ('balance_sheet', 'totalLiab'),
+    'current_assets': ('balance_sheet', 'totalCurrentAssets'),
+    'current_liabilities': ('balance_sheet', 'totalCurrentLiabilities'),
+    'cash': ('balance_sheet', 'cash'),
+    'total_revenue': ('income_statement', 'totalRevenue'),
+    'net_income': ('income_statement', 'netIncome'),
+    'gross_profit': ('income_statement', 'grossProfit'),
+    'operating_income': ('income_statement', 'operatingIncome'),
+}
+
+# The ratios that can be screened, with the numerator and denominator columns. The first three are calculated the same
+# way as in fundamental_analysis
+RATIOS = {
+    'equity_ratio': ('total_equity', 'total_assets'),
+    'price_per_earnings': ('total_equity', 'net_income'),
+    'price_per_revenue': ('total_equity', 'total_revenue'),
+    'return_on_equity': ('net_income', 'total_equity'),
+    'return_on_assets': ('net_income', 'total_assets'),
+    'net_margin': ('net_income', 'total_revenue'),
+    'gross_margin': ('gross_profit', 'total_revenue'),
+    'operating_margin': ('operating_income', 'total_revenue'),
+    'debt_to_equity': ('total_liabilities', 'total_equity'),
+    'current_ratio': ('current_assets', 'current_liabilities'),
+}
+
+# Other names of the ratios that can be used in queries, in lower case
+RATIO_ALIASES = {'soliditet': 'equity_ratio', 'p/e': 'price_per_earnings', 'pe': 'price_per_earnings',
+                 'p/s': 'price_per_revenue', 'ps': 'price_per_revenue', 'roe': 'return_on_equity',
+                 'roa': 'return_on_assets', 'd/e': 'debt_to_equity'}
+
+# The comparisons of the queries
+QUERY_OPERATORS = {'>': operator.gt, '>=': operator.ge, '<': operator.lt, '<=': operator.le, '=': operator.eq,
+                   '==': operator.eq, '!=': operator.ne}
+
+# A condition of a query, for example 'equity ratio > 40%'
+CONDITION_PATTERN = re.compile(r'^(.+?)\s*(>=|<=|==|!=|>|<|=)\s*(-?[0-9]*\.?[0-9]+)\s*(%?)$')
+
+# Number of rows of a query result if nothing else is given
+DEFAULT_QUERY_LIMIT = 50
+
+
+# Returns the name in RATIOS of a ratio written as in a query, for example 'equity ratio', 'P/S' or 'roe'.
+# Raises ValueError if there is no such ratio
+def ratio_name(text):
+    name = ' '.join(text.lower().split())
+    name = RATIO_ALIASES.get(name, name.replace(' ', '_'))
+    if name not in RATIOS:
+        raise ValueError('Unknown ratio: ' + text + ', the ratios are ' + ', '.join(RATIOS))
+    return name
+
+
+# Returns the value of field in statement (a dictionary from yahoo finance) as a float, NaN if it is missing or not
+# a number
+def statement_value(statement, field):
+    try:
+        return float(statement[field])
+    except (KeyError, TypeError, ValueError):
+        return float('nan')
+
+
+# Returns a dictionary with the ratio names in RATIOS as keys and float64 arrays with the ratio of every row of
+# columns (a dictionary with the STATEMENT_FIELDS names as keys and float64 arrays as values) as values.
+# A ratio is NaN where a column is missing or the denominator is 0
+def calculate_ratios(columns):
+    ratios = {}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for name, (numerator, denominator) in RATIOS.items():
+            ratio = columns[numerator] / columns[denominator]
+            ratio[~np.isfinite(ratio)] = np.nan
+            ratios[name] = ratio
+    return ratios
+
+
+# A parsed screener query.
+#   conditions  list of (ratio name, operator function, value), all of them must hold
+#   sort_by     ratio name to sort the results by, or None to keep the order of the stocks
+#   descending  True to show the highest values first
+#   limit       largest number of results, or None for all of them
+class ScreenQuery:
+
+    __slots__ = ('conditions', 'sort_by', 'descending', 'limit')
+
+    def __init__(self, conditions=(), sort_by=None, descending=True, limit=DEFAULT_QUERY_LIMIT):
+        self.conditions = list(conditions)
+        self.sort_by = sort_by
+        self.descending = descending
+        self.limit = limit
+
+    # Parses a query written like 'equity ratio > 40% and p/s < 2, sort by roe, top 50'. The parts are separated by
+    # commas: conditions joined by 'and', 'sort by <ratio> [asc|desc]' and 'top <number>' or 'all'. Values with % are
+    # divided by 100. Without a sort part the results are sorted by the ratio of the first condition, the highest
+    # first for > and the lowest first for <.
+    # Raises ValueError if the query can not be parsed
+    @classmethod
+    def parse(cls, text):
+        query = cls()
+        sort_given = False
+
+        for part in text.split(','):
+            part = part.strip()
+            lower_part = part.lower()
+
+            if lower_part == '':
+                continue
+            elif lower_part == 'all':
+                query.limit = None
+            elif lower_part.startswith('top '):
+                try:
+                    query.limit = int(lower_part[len('top '):])
+                except ValueError:
+                    raise ValueError('Not a number of results: ' + part)
+            elif lower_part.startswith(('sort by ', 'order by ')):
+                words = lower_part.split()[2:]
+                query.descending = True
+                if words and words[-1] in ('asc', 'ascending', 'desc', 'descending'):
+                    query.descending = words.pop().startswith('desc')
+                query.sort_by = ratio_name(' '.join(words))
+                sort_given = True
+            else:
+                for condition_text in re.split(r'\s+and\s+', part, flags=re.IGNORECASE):
+                    match = CONDITION_PATTERN.match(condition_text.strip())
+                    if match is None:
+                        raise ValueError('Not a condition: ' + condition_text)
+                    name, operator_text, value_text, percent = match.groups()
+                    value = float(value_text) / 100 if percent else float(value_text)
+                    query.conditions.append((ratio_name(name), QUERY_OPERATORS[operator_text], value))
+
+                    if not sort_given and len(query.conditions) == 1:
+                        query.sort_by = query.conditions[0][0]
+                        query.descending = operator_text in ('>', '>=')
+
+        return query
+
+
+# The statement fields of a universe of stocks in columns, and the ratios calculated from them.
+#   symbols    list of the symbols, one row per symbol
+#   periods    list with the end date of the fiscal period of the statements of every row, '' if there are none
+#   columns    dictionary with the STATEMENT_FIELDS names as keys and float64 arrays as values, NaN where a stock has
+#              no value
+#   ratios     the same for the RATIOS, see calculate_ratios
+#   loaded_at  time (seconds since epoch) when the statements were loaded
+class StatementColumns:
+
+    __slots__ = ('symbols', 'periods', 'columns', 'ratios', 'loaded_at', 'symbol_rows')
+
+    def __init__(self, symbols, periods, columns, loaded_at=None):
+        self.symbols = list(symbols)
+        self.periods = list(periods)
+        self.columns = columns
+        self.ratios = calculate_ratios(columns)
+        self.loaded_at = time.time() if loaded_at is None else loaded_at
+
+        # Row number of every symbol
+        self.symbol_rows = {self.symbols[row]: row for row in range(len(self.symbols))}
+
+    # Builds the columns from statements_by_symbol, a dictionary with symbols as keys and (period, balance_sheet,
+    # income_statement) as values like from fetch_statements. symbols gives the order of the rows, symbols without
+    # statements get NaN
+    @classmethod
+    def from_statements(cls, statements_by_symbol, symbols):
+        columns = {name: np.full(len(symbols), np.nan) for name in STATEMENT_FIELDS}
+        periods = [''] * len(symbols)
+
+        for row in range(len(symbols)):
+            statements = statements_by_symbol.get(symbols[row])
+            if statements is None:
+                continue
+
+            period, balance_sheet, income_statement = statements
+            periods[row] = period
+            statement_by_name = {'balance_sheet': balance_sheet, 'income_statement': income_statement}
+            for name, (statement, field) in STATEMENT_FIELDS.items():
+                columns[name][row] = statement_value(statement_by_name[statement], field)
+
+        return cls(symbols, periods, columns)
+
+    # Loads columns saved with save from the file at path. Returns None if there is no such file or it was saved by
+    # another version of the app
+    @classmethod
+    def load(cls, path):
+        try:
+            with np.load(path) as saved_arrays:
+                if int(saved_arrays['version']) != SCREENER_VERSION:
+                    return None
+                return cls([symbol.decode('utf-8') for symbol in saved_arrays['symbols']],
+                           [period.decode('utf-8') for period in saved_arrays['periods']],
+                           {name: saved_arrays['column_' + name] for name in STATEMENT_FIELDS},
+                           float(saved_arrays['loaded_at']))
+        except (OSError, KeyError, ValueError) as e:
+            logger.debug('Could not load screener columns %s: %s', path, e)
+            return None
+
+    # Saves the columns to the file at path
+    def save(self, path):
+        # Written to another file first, so that columns that are being loaded are never half written
+        temporary_path = path + '.tmp.npz'
+        np.savez(temporary_path, version=SCREENER_VERSION, loaded_at=self.loaded_at,
+                 symbols=np.array([symbol.encode('utf-8') for symbol in self.symbols], dtype=bytes),
+                 periods=np.array([period.encode('utf-8') for period in self.periods], dtype=bytes),
+                 **{'column_' + name: self.columns[name] for name in STATEMENT_FIELDS})
+        os.replace(temporary_path, path)
+
+    # Returns the number of stocks
+    def __len__(self):
+        return len(self.symbols)
+
+    # Returns the rows of the stocks that match query (a ScreenQuery) as an array, sorted and limited as the query says.
+    # Stocks where the sort ratio is NaN come last
+    def screen(self, query):
+        with span('screener.query'):
+            matches = np.ones(len(self), dtype=bool)
+            for name, compare, value in query.conditions:
+                # NaN never matches a comparison
+                matches &= compare(self.ratios[name], value)
+            rows = np.flatnonzero(matches)
+
+            if query.sort_by is None:
+                return rows if query.limit is None else rows[:query.limit]
+
+            # Sorted by the sort ratio, the highest first if descending, NaN last and equal values in the order of
+            # the stocks
+            sort_values = self.ratios[query.sort_by][rows]
+            sort_keys = np.where(np.isnan(sort_values), np.inf, -sort_values if query.descending else sort_values)
+            if query.limit is not None and query.limit < len(rows):
+                best = np.argpartition(sort_keys, query.limit - 1)[:query.limit]
+                rows, sort_keys = rows[best], sort_keys[best]
+            return rows[np.lexsort((rows, sort_keys))]
+
+    # Returns the stocks in rows as a dataframe with the columns Symbol, Period and the RATIOS
+    def to_dataframe(self, rows):
+        result = {'Symbol': [self.symbols[row] for row in rows], 'Period': [self.periods[row] for row in rows]}
+        for name in RATIOS:
+            result[name] = self.ratios[name][rows]
+        return pd.DataFrame(result)
+
+    # Runs query (a ScreenQuery or a query text for ScreenQuery.parse) and returns the matching stocks as a dataframe
+    # from to_dataframe
+    def query(self, query):
+        if isinstance(query, str):
+            query = ScreenQuery.parse(query)
+        return self.to_dataframe(self.screen(query))
+
+
+# Returns the path of the saved columns in the cache directory
+def screener_path():
+    return os.path.join(get_cache_directory(), SCREENER_FILE)
+
+
+# Loads the statements of all the symbols with max_workers at the same time, from the local statement store or from
+# provider (a data_providers.DataProvider) if given, and returns them as StatementColumns. Only the statements that
+# are not stored are downloaded. Symbols whose statements can not be loaded get NaN and are logged.
+# on_progress is called with (number of symbols loaded, number of symbols) after every symbol if given
+def load_universe(symbols, provider=None, max_workers=DEFAULT_MAX_WORKERS, on_progress=None):
+    symbols = list(dict.fromkeys(symbols))
+    max_workers = max(1, min(int(max_workers), MAX_WORKERS_LIMIT))
+
+    def fetch_one(symbol):
+        try:
+            return fetch_statements(symbol, provider)
+        except Exception as e:
+            logger.debug('Could not load the statements of %s: %s', symbol, e)
+            return None
+
+    statements_by_symbol = {}
+    with span('screener.load'), ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for symbol, statements in zip(symbols, executor.map(fetch_one, symbols)):
+            if statements is not None:
+                statements_by_symbol[symbol] = statements
+            if on_progress is not None:
+                on_progress(len(statements_by_symbol), len(symbols))
+
+    if len(statements_by_symbol) < len(symbols):
+        logger.warning('No statements for %d of %d symbols', len(symbols) - len(statements_by_symbol), len(symbols))
+
+    return StatementColumns.from_statements(statements_by_symbol, symbols)
+
+
+# Returns the command line parser of the screener
+def create_argument_parser():
+    parser = argparse.ArgumentParser(description='Screen a universe of stocks by their fundamental ratios.')
+    parser.add_argument('--log-level', default='WARNING', help='level of the log messages on stderr, for example INFO')
+    parser.add_argument('--store', help='file of the screener columns, by default ' + SCREENER_FILE +
+                                        ' in the cache directory')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    load_parser = commands.add_parser('load', help='load the statements of the symbols into the screener')
+    load_parser.add_argument('symbols', nargs='?', default='-',
+                             help='file with one symbol per line, or - to read from stdin (default)')
+    load_parser.add_argument('--workers', type=int, default=DEFAULT_MAX_WORKERS,
+                             help='number of statements loaded at the same time (1-' + str(MAX_WORKERS_LIMIT) + ')')
+    load_parser.add_argument('--data-dir', help='read the statements from this directory instead of yahoo finance, '
+                                                'see CSVDirectoryProvider in data_providers.py')
+
+    query_parser = commands.add_parser('query', help='print the stocks that match a query')
+    query_parser.add_argument('query', help='for example "equity ratio > 40%% and p/s < 2, top 50"')
+    query_parser.add_argument('--format', choices=('table', 'csv'), default='table', help='output format')
+
+    commands.add_parser('ratios', help='list the ratios that can be used in queries')
+    return parser
+
+
+# Runs the screener command line. argv is the list of arguments, by default the arguments the program was started
+# with. Returns the exit code
+def main(argv=None):
+    arguments = create_argument_parser().parse_args(argv)
+
+    logging.basicConfig(level=arguments.log_level.upper(), stream=sys.stderr,
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    path = arguments.store or screener_path()
+
+    if arguments.command == 'ratios':
+        for name, (numerator, denominator) in RATIOS.items():
+            print(name + ' = ' + numerator + ' / ' + denominator)
+        return 0
+
+    if arguments.command == 'load':
+        # Imported here, headless imports the whole analysis
+        from headless import read_symbols
+
+        provider = None
+        if arguments.data_dir:
+            if not os.path.isdir(arguments.data_dir):
+                print('No such directory: ' + arguments.data_dir, file=sys.stderr)
+                return 2
+            provider = CSVDirectoryProvider(arguments.data_dir)
+
+        if arguments.symbols == '-':
+            symbols = list(read_symbols(sys.stdin))
+        else:
+            with open(arguments.symbols) as symbols_file:
+                symbols = list(read_symbols(symbols_file))
+
+        start_time = time.perf_counter()
+        statement_columns = load_universe(symbols, provider, arguments.workers)
+        statement_columns.save(path)
+        loaded_count = sum(1 for period in statement_columns.periods if period)
+        print('Loaded the statements of ' + str(loaded_count) + ' of ' + str(len(statement_columns)) +
+              ' symbols in ' + str(round(time.perf_counter() - start_time, 1)) + ' s', file=sys.stderr)
+        return 0
+
+    statement_columns = StatementColumns.load(path)
+    if statement_columns is None:
+        print('No screener columns in ' + path + ', run the load command first', file=sys.stderr)
+        return 2
+
+    try:
+        query = ScreenQuery.parse(arguments.query)
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        return 2
+
+    results = statement_columns.query(query)
+    if arguments.format == 'csv':
+        results.to_csv(sys.stdout, index=False)
+    else:
+        with pd.option_context('display.max_rows', None, 'display.width', None):
+            print(results.to_string(index=False))
+    return 0
+
+
+# Run the screener command line if this file is run, not when it is imported
+if __name__ == "__main__":
+    sys.exit(main())
+
+
+# Copyright 2020 Oliver Midbrink
@@ -0,0 +1,134 @@
+# For keeping the cached searches in least recently used order
+from collections import OrderedDict
+
+# For keeping the cache safe when searches run in background threads
+import threading
+
+# For checking when cached searches are too old
+import time
+
+# Largest number of searches that are kept in the cache
+DEFAULT_MAX_ENTRIES = 256
+
+# Number of seconds a search result is kept. The search results contain the last price, so they should not be too old
+DEFAULT_TIME_TO_LIVE = 15 * 60
+
+
+# Cache for stock search results that is shared by all StockSelectorFrames in the app, so that the same search does
+# not have to be scraped from yahoo finance again on another page.
+# The cache holds at most max_entries searches. When it is full the search that was used longest ago is removed
+# (least recently used). Searches older than time_to_live seconds are not used.
+# The search results are the dataframes returned from StockSelectorFrame.search_stock.
+class SearchCache:
+
+    # Initialize the cache with the size bound max_entries and the time_to_live in seconds
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, time_to_live=DEFAULT_TIME_TO_LIVE):
+        self.max_entries = max_entries
+        self.time_to_live = time_to_live
+
+        # Ordered dictionary with search key as key and (results dataframe, time stored) as value.
+        # The most recently used search is last
+        self.entries = OrderedDict()
+
+        # Counters for the statistics
+        self.hits = 0
+        self.misses = 0
+        self.prefix_hits = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        # Lock for the entries and the counters
+        self.lock = threading.Lock()
+
+    # Returns the cached results for keywords, or None if the search is not cached or too old
+    def get(self, keywords):
+        key = search_key(keywords)
+
+        with self.lock:
+            results = self.get_entry(key)
+
+            if results is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+            return results
+
+    # Stores the search results dataframe for keywords. The least recently used search is removed if the cache is full
+    def put(self, keywords, results):
+        key = search_key(keywords)
+
+        with self.lock:
+            self.entries[key] = (results, time.monotonic())
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    # Answers a search from the cached results of a shorter search. The longest cached search that keywords starts
+    # with is found, for example 'appl' for 'apple', and its results are filtered to the rows where the symbol or name
+    # contains keywords. Yahoo finance only returns the best matches of a search, so the answer can miss some stocks
+    # and should be replaced by a real search when that is done.
+    # Returns the filtered dataframe, or None if no shorter search is cached.
+    def get_prefix_results(self, keywords):
+        key = search_key(keywords)
+
+        with self.lock:
+            # Try the longest prefixes first
+            for prefix_length in range(len(key) - 1, 0, -1):
+                results = self.get_entry(key[:prefix_length])
+
+                if results is not None:
+                    self.prefix_hits += 1
+                    break
+            else:
+                return None
+
+        # Keep the rows where the symbol or the name contains the keywords
+        matches = (results['Symbol'].str.lower().str.contains(key, regex=False) |
+                   results['Name'].str.lower().str.contains(key, regex=False))
+        return results[matches].reset_index(drop=True)
+
+    # Removes all cached searches. The counters are kept.
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    # Returns a dictionary with the cache statistics: hits, misses, prefix hits, evictions, expirations and the
+    # number of cached searches
+    def statistics(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'prefix_hits': self.prefix_hits,
+                    'evictions': self.evictions, 'expirations': self.expirations, 'entries': len(self.entries)}
+
+    # Returns the results for key if they are cached and not too old, otherwise None. Too old searches are removed.
+    # Must be called with the lock held
+    def get_entry(self, key):
+        entry = self.entries.get(key)
+
+        if entry is None:
+            return None
+
+        results, stored_time = entry
+
+        if time.monotonic() - stored_time > self.time_to_live:
+            del self.entries[key]
+            self.expirations += 1
+            return None
+
+        # Mark the search as the most recently used
+        self.entries.move_to_end(key)
+        return results
+
+
+# Returns the key that a search is cached with. Searches that only differ in case or surrounding spaces are the same
+def search_key(keywords):
+    return keywords.strip().lower()
+
+
+# The search cache shared by the whole app
+search_cache = SearchCache()
+
+
+# Copyright 2020 Oliver Midbrink
@@ -0,0 +1,162 @@
+# Request coalescing. When the same data is asked for again while it is still being downloaded, for example when the
+# same stock is analyzed on two pages at the same time, the second request waits for the first one and gets the same
+# result (or the same exception) instead of downloading everything again.
+#
+# Usage:
+#   technical_flight = SingleFlight('technical')
+#   result = technical_flight.run(symbol, analyze, symbol)
+#
+# Work that is done for many keys at once, like a download of the prices of many symbols with one request, claims
+# the keys that are not running, runs for them, releases them and then waits for the keys that others were running:
+#   claimed_calls, running_calls = download_flight.claim(symbols)
+#   try:
+#       download(list(claimed_calls))
+#   finally:
+#       download_flight.release(claimed_calls)
+#   download_flight.wait_for(running_calls)
+#
+# Nothing is cached, as soon as a request is done the next one with the same key runs again. Caching is done by the
+# stores and caches below.
+
+# For letting the waiting requests know when the running one is done
+import threading
+
+# All the single flight groups of the app with their name as key, for the statistics
+flight_groups = {}
+flight_groups_lock = threading.Lock()
+
+
+# A request that is running. The requests that wait for it get result or error from here
+class InFlightCall:
+
+    __slots__ = ('done_event', 'result', 'error')
+
+    def __init__(self):
+        self.done_event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+# A group of requests where requests with the same key share one run of the function while it is running.
+# name is used in the statistics, for example 'technical'
+class SingleFlight:
+
+    def __init__(self, name):
+        self.name = name
+
+        # Dictionary with key as key and the InFlightCall of the running request as value
+        self.calls = {}
+        self.lock = threading.Lock()
+
+        # Counters for the statistics. requests is the number of calls to run, executions the number of times the
+        # function was actually run and coalesced the number of requests that waited for another one instead
+        self.requests = 0
+        self.executions = 0
+        self.coalesced = 0
+        self.errors = 0
+
+        with flight_groups_lock:
+            flight_groups[name] = self
+
+    # Returns function(*args, **kwargs). If a request with the same key is already running, waits for it and returns
+    # its result instead, or raises its exception. key must be hashable
+    def run(self, key, function, *args, **kwargs):
+        with self.lock:
+            self.requests += 1
+            call = self.calls.get(key)
+
+            if call is not None:
+                self.coalesced += 1
+                is_first = False
+            else:
+                call = self.calls[key] = InFlightCall()
+                is_first = True
+
+        # Wait for the running request with the same key
+        if not is_first:
+            call.done_event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            # The next request with this key runs the function again
+            with self.lock:
+                del self.calls[key]
+                self.executions += 1
+                self.errors += call.error is not None
+            call.done_event.set()
+
+        return call.result
+
+    # Claims the keys that are not running for the caller. Returns two dictionaries with keys as keys and InFlightCalls
+    # as values: the calls of the claimed keys, which the caller has to release when it is done with them, and the
+    # calls of the keys that are already running, which can be waited for with wait_for. keys must be hashable
+    def claim(self, keys):
+        claimed_calls = {}
+        running_calls = {}
+
+        with self.lock:
+            for key in dict.fromkeys(keys):
+                self.requests += 1
+                call = self.calls.get(key)
+
+                if call is not None:
+                    self.coalesced += 1
+                    running_calls[key] = call
+                else:
+                    claimed_calls[key] = self.calls[key] = InFlightCall()
+
+        return claimed_calls, running_calls
+
+    # Releases the claimed keys in claimed_calls (from claim) when the work for them is done, so that the requests
+    # waiting for them continue and the next request with these keys runs again. failed is True if the work failed.
+    # The released keys are removed from claimed_calls, so it can be released again after a part of it
+    def release(self, claimed_calls, failed=False):
+        with self.lock:
+            for key, call in claimed_calls.items():
+                if self.calls.get(key) is call:
+                    del self.calls[key]
+                self.executions += 1
+                self.errors += failed
+
+        for call in claimed_calls.values():
+            call.done_event.set()
+        claimed_calls.clear()
+
+    # Waits until the keys in running_calls (from claim) are released by the requests that claimed them
+    @staticmethod
+    def wait_for(running_calls):
+        for call in running_calls.values():
+            call.done_event.wait()
+
+    # Returns the number of keys that are running right now
+    def in_flight_count(self):
+        with self.lock:
+            return len(self.calls)
+
+    # Returns the counters as a dictionary
+    def statistics(self):
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'executions': self.executions,
+                'coalesced': self.coalesced,
+                'errors': self.errors,
+                'in_flight': len(self.calls),
+            }
+
+
+# Returns a dictionary with the names of all the single flight groups as keys and their statistics as values
+def coalescing_statistics():
+    with flight_groups_lock:
+        groups = list(flight_groups.values())
+    return {group.name: group.statistics() for group in sorted(groups, key=lambda group: group.name)}
+
+
+# Copyright 2020 Oliver Midbrink
@@ -0,0 +1,424 @@
+# Snapshots of rankings and analysis results, so that they can be seen again after the app is closed without
+# analyzing the stocks again. A snapshot is a directory with one NumPy .npy file per column and a small manifest.json
+# with the version of the layout, the kind of snapshot, when it was made, the number of rows, the columns and things
+# like the metric of a ranking. The columns are opened memory mapped, so opening a snapshot does not parse anything
+# and only reads the parts of the files that are used. Two snapshots of the same stocks, for example the ranking of
+# today and of yesterday, are compared by their symbol columns.
+#
+# The snapshots are saved in the snapshots folder of the cache directory, and can be given by their name (the name of
+# their directory) or by a path.
+#
+# Usage:
+#   python snapshots.py list
+#   python snapshots.py show ranking-20201201-120000 --top 20
+#   python snapshots.py diff ranking-20201130-120000 ranking-20201201-120000
+#   python snapshots.py diff ranking-20201130-120000
+#
+# This module must not import tkinter, so that it can run on servers without a display.
+
+# For the command line
+import argparse
+import sys
+
+# For logging what the app does, instead of printing it
+import logging
+
+# For the manifest and the snapshot directories
+import json
+import os
+import shutil
+import time
+
+# Heavy libraries are imported the first time they are used, so that the app starts fast
+from lazy_modules import lazy_import
+
+# For the columns
+np = lazy_import('numpy')
+
+# For showing and comparing snapshots
+pd = lazy_import('pandas')
+
+# The snapshots are saved in the cache directory
+from price_store import get_cache_directory
+
+# Timing of saving and opening snapshots
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Version of the layout of the snapshot files, written in the manifest. Snapshots with another version are not opened
+SNAPSHOT_VERSION = 1
+
+# Name of the manifest file in a snapshot directory, and of the folder of the snapshots in the cache directory
+MANIFEST_FILE = 'manifest.json'
+SNAPSHOTS_FOLDER = 'snapshots'
+
+# The kinds of snapshots. A ranking has the columns of RANKING_COLUMNS, sorted by rank. An analysis has the result
+# rows of headless.py
+RANKING_KIND = 'ranking'
+ANALYSIS_KIND = 'analysis'
+
+# Types of the columns in the manifest, with how they are stored. Texts are stored as UTF-8 bytes with the length of
+# the longest text
+COLUMN_TYPES = {'text': 'S', 'float': '<f8', 'bool': '?'}
+
+# The columns of a ranking snapshot, with their types
+RANKING_COLUMNS = {'symbol': 'text', 'score': 'float', 'description': 'text', 'failed': 'bool'}
+
+# Start of the description of a stock that could not be analyzed in a ranking from run_stock_comparison
+RANKING_ERROR_PREFIX = 'Error for this stock: '
+
+
+# Returns the directory of the snapshots in the cache directory. The directory is created if it does not exist
+def get_snapshots_directory():
+    directory = os.path.join(get_cache_directory(), SNAPSHOTS_FOLDER)
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+# Returns the path of the snapshot name_or_path, which is either the path of a snapshot directory or the name of a
+# snapshot in the snapshots directory
+def snapshot_path(name_or_path):
+    if os.path.isfile(os.path.join(name_or_path, MANIFEST_FILE)):
+        return name_or_path
+    return os.path.join(get_snapshots_directory(), name_or_path)
+
+
+# Returns a name for a new snapshot of kind, from the current time, for example 'ranking-20201201-120000'.
+# A number is added if there already is a snapshot with that name
+def new_snapshot_name(kind):
+    name = kind + '-' + time.strftime('%Y%m%d-%H%M%S')
+    directory = get_snapshots_directory()
+
+    unique_name = name
+    number = 2
+    while os.path.exists(os.path.join(directory, unique_name)):
+        unique_name = name + '-' + str(number)
+        number += 1
+    return unique_name
+
+
+# Returns the values as an array of the column type (a key of COLUMN_TYPES). Missing values (None) become NaN in
+# float columns and '' in text columns
+def column_array(values, column_type):
+    if column_type == 'text':
+        encoded_texts = [b'' if value is None else str(value).encode('utf-8') for value in values]
+        return np.array(encoded_texts, dtype=bytes) if encoded_texts else np.zeros(0, dtype='S1')
+    if column_type == 'float':
+        return np.array([np.nan if value is None else value for value in values], dtype=COLUMN_TYPES['float'])
+    return np.asarray(values, dtype=COLUMN_TYPES[column_type])
+
+
+# Saves a snapshot to the directory at path. columns is a dictionary with the column names as keys and (type, values)
+# as values, where type is a key of COLUMN_TYPES and values a list or array with one value per row. kind is the kind
+# of snapshot and metadata a dictionary with more information that can be written as JSON.
+# An existing snapshot at path is replaced. Returns path
+def write_snapshot(path, kind, columns, metadata=None):
+    row_counts = {len(values) for column_type, values in columns.values()}
+    if len(row_counts) > 1:
+        raise ValueError('The columns of a snapshot must have the same number of rows')
+
+    manifest = {'version': SNAPSHOT_VERSION, 'kind': kind, 'created': time.time(),
+                'rows': row_counts.pop() if row_counts else 0, 'columns': {}, 'metadata': metadata or {}}
+
+    with span('snapshots.write'):
+        # Written to another directory first, so that a snapshot that is being opened is never half written
+        temporary_path = path + '.tmp'
+        shutil.rmtree(temporary_path, ignore_errors=True)
+        os.makedirs(temporary_path)
+
+        for column_name, (column_type, values) in columns.items():
+            file_name = column_name + '.npy'
+            np.save(os.path.join(temporary_path, file_name), column_array(values, column_type))
+            manifest['columns'][column_name] = {'type': column_type, 'file': file_name}
+
+        with open(os.path.join(temporary_path, MANIFEST_FILE), 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.replace(temporary_path, path)
+
+    logger.info('Saved %s snapshot with %d rows to %s', kind, manifest['rows'], path)
+    return path
+
+
+# Returns the columns of a snapshot of ranking, the sorted list of tuples (symbol, score, description) from
+# run_stock_comparison, in the form that write_snapshot takes
+def ranking_columns(ranking):
+    values = {'symbol': [], 'score': [], 'description': [], 'failed': []}
+    for symbol, score, description in ranking:
+        values['symbol'].append(symbol)
+        values['score'].append(score)
+        values['description'].append(description)
+        values['failed'].append(description.startswith(RANKING_ERROR_PREFIX))
+
+    return {column_name: (RANKING_COLUMNS[column_name], values[column_name]) for column_name in RANKING_COLUMNS}
+
+
+# Saves ranking, the sorted list of tuples (symbol, score, description) from run_stock_comparison, as a snapshot.
+# metric is the name of the metric in RANKING_METRICS that the stocks were ranked by. name is the name of the snapshot
+# in the snapshots directory, a new one from the current time if None. Returns the path of the snapshot
+def save_ranking(ranking, metric, name=None):
+    name = name or new_snapshot_name(RANKING_KIND)
+    return write_snapshot(os.path.join(get_snapshots_directory(), name), RANKING_KIND, ranking_columns(ranking),
+                          {'metric': metric})
+
+
+# Saves rows, a list of analysis result rows (dictionaries with fields as keys like from headless.analyze_chunk), as
+# a snapshot. The fields in text_fields are saved as texts and the others as floats. name is the name of the snapshot
+# in the snapshots directory, a new one from the current time if None. Returns the path of the snapshot
+def save_analysis_results(rows, fields, text_fields, name=None, metadata=None):
+    name = name or new_snapshot_name(ANALYSIS_KIND)
+    columns = {field: ('text' if field in text_fields else 'float', [row.get(field) for row in rows])
+               for field in fields}
+    return write_snapshot(os.path.join(get_snapshots_directory(), name), ANALYSIS_KIND, columns, metadata)
+
+
+# Returns the manifests of all the snapshots in the snapshots directory as a list of (name, manifest) tuples, the
+# oldest first. Directories without a readable manifest are skipped
+def list_snapshots():
+    directory = get_snapshots_directory()
+
+    snapshots = []
+    for name in os.listdir(directory):
+        try:
+            with open(os.path.join(directory, name, MANIFEST_FILE)) as manifest_file:
+                snapshots.append((name, json.load(manifest_file)))
+        except (OSError, ValueError):
+            continue
+
+    snapshots.sort(key=lambda snapshot: (snapshot[1].get('created', 0), snapshot[0]))
+    return snapshots
+
+
+# A saved snapshot, opened with Snapshot.open.
+#   path      path of the snapshot directory
+#   manifest  the manifest, a dictionary with the keys version, kind, created, rows, columns and metadata
+#   columns   dictionary with the column names as keys and read only memory mapped arrays as values
+class Snapshot:
+
+    __slots__ = ('path', 'manifest', 'columns')
+
+    def __init__(self, path, manifest, columns):
+        self.path = path
+        self.manifest = manifest
+        self.columns = columns
+
+    # Opens the snapshot name_or_path, see snapshot_path. Raises ValueError if it is not a snapshot or was saved with
+    # another version of the layout, and OSError if it can not be read
+    @classmethod
+    def open(cls, name_or_path):
+        path = snapshot_path(name_or_path)
+
+        with span('snapshots.open'):
+            try:
+                with open(os.path.join(path, MANIFEST_FILE)) as manifest_file:
+                    manifest = json.load(manifest_file)
+            except FileNotFoundError:
+                raise ValueError('Not a snapshot: ' + name_or_path)
+
+            if manifest.get('version') != SNAPSHOT_VERSION:
+                raise ValueError('Snapshot ' + name_or_path + ' has version ' + str(manifest.get('version')) +
+                                 ', this version of the app reads version ' + str(SNAPSHOT_VERSION))
+
+            columns = {}
+            for column_name, column in manifest['columns'].items():
+                columns[column_name] = np.load(os.path.join(path, column['file']), mmap_mode='r')
+
+        return cls(path, manifest, columns)
+
+    # Returns the kind of the snapshot, RANKING_KIND or ANALYSIS_KIND
+    @property
+    def kind(self):
+        return self.manifest['kind']
+
+    # Returns the metadata that was saved with the snapshot
+    @property
+    def metadata(self):
+        return self.manifest.get('metadata', {})
+
+    # Returns the number of rows
+    def __len__(self):
+        return self.manifest['rows']
+
+    # Returns the values of the rows from start to stop (all of them by default) of column as a list, texts as str
+    def column_values(self, column_name, start=0, stop=None):
+        values = self.columns[column_name][start:stop].tolist()
+        if self.manifest['columns'][column_name]['type'] == 'text':
+            return [value.decode('utf-8') for value in values]
+        return values
+
+    # Returns the rows from start to stop of a ranking snapshot as a list of tuples (symbol, score, description), the
+    # same as from run_stock_comparison
+    def ranking(self, start=0, stop=None):
+        if self.kind != RANKING_KIND:
+            raise ValueError('Snapshot ' + self.path + ' is not a ranking')
+        return list(zip(self.column_values('symbol', start, stop), self.column_values('score', start, stop),
+                        self.column_values('description', start, stop)))
+
+    # Returns the rows from start to stop as a dataframe with one column per snapshot column. Rankings also get a
+    # Rank column first
+    def to_dataframe(self, start=0, stop=None):
+        data = {column_name: self.column_values(column_name, start, stop) for column_name in self.columns}
+        dataframe = pd.DataFrame(data)
+        if self.kind == RANKING_KIND:
+            dataframe.insert(0, 'rank', np.arange(start + 1, start + len(dataframe) + 1))
+        return dataframe
+
+
+# Compares two snapshots (or other columns with a symbol column) by symbol. old_columns and new_columns are
+# dictionaries with column names as keys and arrays as values, like Snapshot.columns or ranking_columns, and
+# value_column is the column whose values are compared, for example score.
+# Returns a dataframe with the columns symbol, old_rank, new_rank, rank_change, old_<value_column>,
+# new_<value_column> and change. The ranks are the row positions (from 1) and rank_change is positive when a stock
+# moved up. The stocks of the new columns come first in their order, and then the stocks that are only in the old
+# columns, with NaN as the new values. Stocks that are only in the new columns have NaN as the old values
+def diff_columns(old_columns, new_columns, value_column='score'):
+    old_symbols = np.asarray(old_columns['symbol'])
+    new_symbols = np.asarray(new_columns['symbol'])
+
+    with span('snapshots.diff'):
+        # The row of every new symbol in the old columns, -1 if it is not there
+        old_order = np.argsort(old_symbols, kind='stable')
+        sorted_old_symbols = old_symbols[old_order]
+        old_rows = np.full(len(new_symbols), -1)
+        if len(old_symbols) > 0:
+            positions = np.minimum(np.searchsorted(sorted_old_symbols, new_symbols), len(old_symbols) - 1)
+            found = sorted_old_symbols[positions] == new_symbols
+            old_rows[found] = old_order[positions[found]]
+
+        removed = np.ones(len(old_symbols), dtype=bool)
+        removed[old_rows[old_rows >= 0]] = False
+        removed_rows = np.flatnonzero(removed)
+
+        in_old = old_rows >= 0
+        old_values = np.asarray(old_columns[value_column], dtype=float)
+        new_values = np.asarray(new_columns[value_column], dtype=float)
+
+        old_ranks = np.concatenate((np.where(in_old, old_rows + 1, np.nan), removed_rows + 1))
+        new_ranks = np.concatenate((np.arange(1, len(new_symbols) + 1), np.full(len(removed_rows), np.nan)))
+        # Only the rows that are in the old columns are read, so this works when the old columns are empty
+        old_values_of_new_symbols = np.full(len(new_symbols), np.nan)
+        old_values_of_new_symbols[in_old] = old_values[old_rows[in_old]]
+        old_compared_values = np.concatenate((old_values_of_new_symbols, old_values[removed_rows]))
+        new_compared_values = np.concatenate((new_values, np.full(len(removed_rows), np.nan)))
+        symbols = np.concatenate((new_symbols, old_symbols[removed_rows]))
+
+    return pd.DataFrame({'symbol': [symbol.decode('utf-8') for symbol in symbols.tolist()],
+                         'old_rank': old_ranks, 'new_rank': new_ranks, 'rank_change': old_ranks - new_ranks,
+                         'old_' + value_column: old_compared_values, 'new_' + value_column: new_compared_values,
+                         'change': new_compared_values - old_compared_values})
+
+
+# Compares ranking, the sorted list of tuples (symbol, score, description) from run_stock_comparison, with the ranking
+# snapshot old (a Snapshot), see diff_columns
+def diff_with_ranking(old, ranking):
+    new_columns = {column_name: column_array(values, column_type)
+                   for column_name, (column_type, values) in ranking_columns(ranking).items()}
+    return diff_columns(old.columns, new_columns, 'score')
+
+
+# Compares the snapshots old and new (Snapshot objects) by symbol, see diff_columns. value_column is the column whose
+# values are compared, by default score for rankings and the first float column for analysis results
+def diff_snapshots(old, new, value_column=None):
+    if value_column is None:
+        float_columns = [column_name for column_name, column in new.manifest['columns'].items()
+                         if column['type'] == 'float']
+        if not float_columns:
+            raise ValueError('Snapshot ' + new.path + ' has no values to compare')
+        value_column = 'score' if 'score' in float_columns else float_columns[0]
+
+    for snapshot in (old, new):
+        if value_column not in snapshot.columns:
+            raise ValueError('Snapshot ' + snapshot.path + ' has no column ' + value_column)
+    return diff_columns(old.columns, new.columns, value_column)
+
+
+# Returns the command line parser of the snapshots
+def create_argument_parser():
+    parser = argparse.ArgumentParser(description='Show and compare saved rankings and analysis results.')
+    parser.add_argument('--log-level', default='WARNING', help='level of the log messages on stderr, for example INFO')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('list', help='list the saved snapshots, the newest last')
+
+    show_parser = commands.add_parser('show', help='print a snapshot')
+    show_parser.add_argument('snapshot', help='name or path of the snapshot')
+    show_parser.add_argument('--top', type=int, help='only print this many rows')
+    show_parser.add_argument('--format', choices=('table', 'csv'), default='table', help='output format')
+
+    diff_parser = commands.add_parser('diff', help='print the changes from one snapshot to another')
+    diff_parser.add_argument('old', help='name or path of the old snapshot')
+    diff_parser.add_argument('new', nargs='?', help='name or path of the new snapshot, the newest one by default')
+    diff_parser.add_argument('--column', help='column to compare, by default score or the first number column')
+    diff_parser.add_argument('--all', action='store_true', help='also print the stocks that did not change')
+    diff_parser.add_argument('--top', type=int, help='only print this many stocks, the added and removed stocks and '
+                                                     'then the largest rank changes first')
+    diff_parser.add_argument('--format', choices=('table', 'csv'), default='table', help='output format')
+    return parser
+
+
+# Prints dataframe to stdout as a table or as CSV
+def print_dataframe(dataframe, output_format):
+    if output_format == 'csv':
+        dataframe.to_csv(sys.stdout, index=False)
+    else:
+        with pd.option_context('display.max_rows', None, 'display.width', None):
+            print(dataframe.to_string(index=False))
+
+
+# Runs the snapshots command line. argv is the list of arguments, by default the arguments the program was started
+# with. Returns the exit code
+def main(argv=None):
+    arguments = create_argument_parser().parse_args(argv)
+
+    logging.basicConfig(level=arguments.log_level.upper(), stream=sys.stderr,
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    if arguments.command == 'list':
+        for name, manifest in list_snapshots():
+            print(name + '  ' + manifest.get('kind', '?') + '  ' + str(manifest.get('rows', '?')) + ' rows  ' +
+                  time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(manifest.get('created', 0))) + '  ' +
+                  json.dumps(manifest.get('metadata', {})))
+        return 0
+
+    try:
+        if arguments.command == 'show':
+            snapshot = Snapshot.open(arguments.snapshot)
+            print_dataframe(snapshot.to_dataframe(0, arguments.top), arguments.format)
+            return 0
+
+        new_name = arguments.new
+        if new_name is None:
+            snapshots = list_snapshots()
+            if not snapshots:
+                print('There are no snapshots', file=sys.stderr)
+                return 2
+            new_name = snapshots[-1][0]
+
+        differences = diff_snapshots(Snapshot.open(arguments.old), Snapshot.open(new_name), arguments.column)
+    except (OSError, ValueError) as e:
+        print(str(e), file=sys.stderr)
+        return 2
+
+    if not arguments.all:
+        # The added and removed stocks are kept, their ranks are NaN which is not equal to anything
+        old_values, new_values = differences.iloc[:, 4], differences.iloc[:, 5]
+        unchanged = ((differences['old_rank'] == differences['new_rank']) &
+                     ((old_values == new_values) | (old_values.isna() & new_values.isna())))
+        differences = differences[~unchanged]
+    if arguments.top is not None:
+        largest_changes = differences['rank_change'].abs().fillna(np.inf).sort_values(ascending=False, kind='stable')
+        differences = differences.loc[largest_changes.index[:arguments.top]]
+
+    print_dataframe(differences, arguments.format)
+    return 0
+
+
+# Run the snapshots command line if this file is run, not when it is imported
+if __name__ == "__main__":
+    sys.exit(main())
+
+
+# Copyright 2020 Oliver Midbrink
@@ -0,0 +1,202 @@
+# For storing the financial statements on disk between runs of the app
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# For finding out if a newer fiscal period may have been published
+import time
+from datetime import datetime, timedelta
+
+# Heavy libraries are imported the first time they are used, so that the app starts fast
+from lazy_modules import lazy_import
+
+# For reading balance sheets and income statements
+yahoofinancials = lazy_import('yahoofinancials')
+
+# The statements are stored in the same directory as the prices
+from price_store import get_cache_directory
+
+# Timing of the downloads
+from tracing import span
+
+# The downloads from yahoo finance wait for the shared rate limiter
+from rate_limiter import get_rate_limiter
+
+# Time from the end of a fiscal year until the annual statements are normally published
+FILING_DELAY = timedelta(days=90)
+
+# When a newer period may exist but was not found, wait this long before asking yahoo finance again
+RECHECK_INTERVAL = timedelta(days=1)
+
+# Length of the fiscal periods for each frequency
+PERIOD_LENGTHS = {'annual': timedelta(days=365), 'quarterly': timedelta(days=91)}
+
+
+# Downloads the balance sheets and income statements for symbol with one request to yahoo finance.
+# frequency is 'annual' or 'quarterly'.
+# Returns a tuple (period, balance_sheet, income_statement) for the latest fiscal period, where period is the end date
+# of the period as a string, for example '2020-09-26', and the statements are dictionaries as in yahoo finance.
+def download_financial_statements(symbol, frequency='annual'):
+    # Get both statement types with one request
+    with get_rate_limiter().limited():
+        raw_statements = yahoofinancials.YahooFinancials(symbol).get_financial_stmts(frequency,
+                                                                                      ['balance', 'income'])
+
+    # The history keys are named like balanceSheetHistory or balanceSheetHistoryQuarterly
+    history_suffix = '' if frequency == 'annual' else 'Quarterly'
+
+    # Get the balance_sheet for latest fiscal year
+    balance_sheet_history = raw_statements['balanceSheetHistory' + history_suffix][symbol][0]
+    period = list(balance_sheet_history.keys())[0]
+    balance_sheet = balance_sheet_history[period]
+
+    # Get the income statement for the same fiscal year
+    income_statement_history = raw_statements['incomeStatementHistory' + history_suffix][symbol][0]
+    income_statement = income_statement_history[list(income_statement_history.keys())[0]]
+
+    return period, balance_sheet, income_statement
+
+
+# Downloads the statements of symbol like download_financial_statements, but with the default data provider of the
+# app (data_providers.get_default_provider), so that the source of the statements can be changed. This is the
+# downloader that the store uses by default
+def download_with_default_provider(symbol, frequency='annual'):
+    # Imported here because the providers use download_financial_statements in this module
+    from data_providers import get_default_provider, run_sync
+
+    results, errors = run_sync(get_default_provider().get_statements([symbol], frequency))
+    if symbol in errors:
+        raise errors[symbol]
+    return results[symbol]
+
+
+# Local store of financial statements in a SQLite database in the cache directory, one row per symbol and fiscal
+# period, with the latest statements of recently used symbols kept in memory as well.
+# Statements only change when a new fiscal period is published, so they are only downloaded again when the stored
+# period is so old that a newer one may exist, and then at most once per RECHECK_INTERVAL.
+class StatementStore:
+
+    # Initialize the store. database_path is the SQLite file to use, by default statements.sqlite in the cache
+    # directory. downloader is the function used to download statements, same arguments as
+    # download_financial_statements
+    def __init__(self, database_path=None, downloader=download_with_default_provider):
+        if database_path is None:
+            database_path = os.path.join(get_cache_directory(), 'statements.sqlite')
+
+        self.database_path = database_path
+        self.downloader = downloader
+
+        # Dictionary with (symbol, frequency) as key and (period, balance_sheet, income_statement, checked_at) as value
+        self.memory_cache = {}
+
+        # Lock for the memory cache and the database writes
+        self.lock = threading.Lock()
+
+        # Create the table if this is a new database
+        with self.connect() as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS statements ('
+                               'symbol TEXT, frequency TEXT, period TEXT, '
+                               'balance_sheet TEXT, income_statement TEXT, checked_at REAL, '
+                               'PRIMARY KEY (symbol, frequency, period))')
+
+    # Opens a new connection to the database, to be used in a with statement. Changes are committed and the
+    # connection is closed when the with block ends
+    @contextmanager
+    def connect(self):
+        connection = sqlite3.connect(self.database_path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    # Returns the statements for the latest fiscal period of symbol as a tuple (period, balance_sheet,
+    # income_statement), see download_financial_statements. They are read from memory or disk when possible and
+    # only downloaded when a newer period may exist. If that download fails the stored statements are returned, and
+    # if there are none the error is passed on to the caller.
+    def get_latest_statements(self, symbol, frequency='annual'):
+        key = (symbol, frequency)
+
+        with self.lock:
+            stored = self.memory_cache.get(key)
+
+        # Read from disk if the statements are not in memory
+        if stored is None:
+            stored = self.read_statements(symbol, frequency)
+
+        if stored is not None and not self.newer_period_may_exist(stored[0], stored[3], frequency):
+            with self.lock:
+                self.memory_cache[key] = stored
+            return stored[:3]
+
+        # Download the latest statements
+        try:
+            with span('statements.download'):
+                period, balance_sheet, income_statement = self.downloader(symbol, frequency)
+        except Exception:
+            if stored is None:
+                raise
+
+            # Keep the stored statements and do not ask again until RECHECK_INTERVAL has passed
+            period, balance_sheet, income_statement = stored[:3]
+
+        stored = (period, balance_sheet, income_statement, time.time())
+        self.write_statements(symbol, frequency, stored)
+        return stored[:3]
+
+    # Returns True if a newer fiscal period than period (end date as string) may have been published and
+    # it is more than RECHECK_INTERVAL since checked_at (seconds since epoch) that yahoo finance was asked
+    def newer_period_may_exist(self, period, checked_at, frequency):
+        now = datetime.now()
+
+        if now - datetime.fromtimestamp(checked_at) < RECHECK_INTERVAL:
+            return False
+
+        next_period_published = datetime.strptime(period[:10], '%Y-%m-%d') + PERIOD_LENGTHS[frequency] + FILING_DELAY
+        return now >= next_period_published
+
+    # Reads the stored statements for the latest fiscal period of symbol from disk.
+    # Returns (period, balance_sheet, income_statement, checked_at) or None if nothing is stored
+    def read_statements(self, symbol, frequency):
+        with self.connect() as connection:
+            row = connection.execute('SELECT period, balance_sheet, income_statement, checked_at FROM statements '
+                                     'WHERE symbol = ? AND frequency = ? ORDER BY period DESC LIMIT 1',
+                                     (symbol, frequency)).fetchone()
+
+        if row is None:
+            return None
+
+        return row[0], json.loads(row[1]), json.loads(row[2]), row[3]
+
+    # Writes statements (period, balance_sheet, income_statement, checked_at) for symbol to memory and disk
+    def write_statements(self, symbol, frequency, stored):
+        period, balance_sheet, income_statement, checked_at = stored
+
+        with self.lock:
+            self.memory_cache[(symbol, frequency)] = stored
+
+            with self.connect() as connection:
+                connection.execute('INSERT OR REPLACE INTO statements VALUES (?, ?, ?, ?, ?, ?)',
+                                   (symbol, frequency, period, json.dumps(balance_sheet),
+                                    json.dumps(income_statement), checked_at))
+
+
+# The statement store shared by the whole app, created the first time it is used
+shared_statement_store = None
+shared_statement_store_lock = threading.Lock()
+
+
+# Returns the statement store shared by the whole app
+def get_statement_store():
+    global shared_statement_store
+
+    with shared_statement_store_lock:
+        if shared_statement_store is None:
+            shared_statement_store = StatementStore()
+        return shared_statement_store
+
+
+# Copyright 2020 Oliver Midbrink
@@ -0,0 +1,180 @@
+# For finding out if lxml is installed without importing it
+import importlib.util
+
+# For logging what the app does, instead of printing it
+import logging
+
+# For turning off the live searches with an environment variable
+import os
+
+# Heavy libraries are imported the first time they are used, so that the app starts fast
+from lazy_modules import lazy_import
+
+# Mostly for web-scraping the yahoo finance lookup page
+bs4 = lazy_import('bs4')
+
+# For downloading the lookup page with pooled connections, timeouts and retries
+from http_session import http_get
+
+# For data purposes
+pandas = lazy_import('pandas')
+
+# Search results cache shared by the whole app
+from search_cache import search_cache, search_key
+
+# The same search running twice at the same time is only scraped once
+from single_flight import SingleFlight
+
+# Timing of the fetch and parse stages
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Single flight group of the searches, the key is the normalized search and the provider
+search_flight = SingleFlight('search')
+
+# The yahoo finance page that lists the search results for a keyword
+LOOKUP_URL = "https://finance.yahoo.com/lookup"
+
+# Column names for search results data
+SEARCH_RESULT_COLUMNS = ['Symbol', 'Name', 'Last Price', 'Industry/Category', 'Type', 'Exchange']
+
+# Types of the symbols that are searched for in the symbol directory, the same as the ones kept by parse_lookup_page
+DIRECTORY_SEARCH_TYPES = ('Stocks',)
+
+# Searches that the symbol directory has no results for are scraped from the yahoo finance lookup page, unless the
+# STOCK_APP_LIVE_SEARCH environment variable is 0
+LIVE_SEARCH_FALLBACK = os.environ.get('STOCK_APP_LIVE_SEARCH', '1') != '0'
+
+# lxml is a lot faster than the html parser that comes with python, use it if it is installed
+if importlib.util.find_spec('lxml') is not None:
+    HTML_PARSER = 'lxml'
+else:
+    HTML_PARSER = 'html.parser'
+
+# Only the table rows of the lookup page are needed. The strainer makes BeautifulSoup skip building objects for the
+# rest of the page (scripts, menus, ads...). Created by get_table_row_strainer the first time a page is parsed
+table_row_strainer = None
+
+
+# Returns the SoupStrainer that only keeps the table rows of a page
+def get_table_row_strainer():
+    global table_row_strainer
+
+    if table_row_strainer is None:
+        table_row_strainer = bs4.SoupStrainer('tr')
+    return table_row_strainer
+
+
+# Parses the html of a yahoo finance lookup page and returns the search results that are stocks.
+# html is the page as bytes or string, parser is the BeautifulSoup parser to use.
+# Returns dataframe with the SEARCH_RESULT_COLUMNS and one row for each stock
+def parse_lookup_page(html, parser=HTML_PARSER):
+    # The results are in the tables of the page, so cut away everything before the first and after the last table
+    # before parsing. This is a plain text search and is a lot faster than letting the parser read the whole page
+    if isinstance(html, str):
+        html = html.encode('utf-8')
+    table_start = html.find(b'<table')
+    table_end = html.rfind(b'</table>')
+    if table_start != -1 and table_end > table_start:
+        html = html[table_start:table_end + len(b'</table>')]
+
+    # Create a BeautifulSoup object with only the table rows of the page for web-scraping and
+    # extracting the relevant results
+    soup = bs4.BeautifulSoup(html, parser, parse_only=get_table_row_strainer())
+
+    # Create temporary list to store all the stock search results
+    stock_result_list = []
+
+    # Iterate through search results, including not only stocks but also ETF and MUTUAL FUND.
+    # Tr is a tag used for marking rows in yahoo finance
+    for result in soup.find_all('tr'):
+
+        # Get all the html columns of this result. The first row is column information and has no td columns
+        columns = result.find_all('td')
+        if len(columns) < 6:
+            continue
+
+        # Get the type of the result (for example stock or etf)
+        result_type = columns[4].get_text()
+
+        # Only stocks are of interest, skip the rest before reading the other columns
+        if 'Stocks' not in result_type:
+            continue
+
+        # The symbol is a link, strip() to remove leading and trailing spaces
+        symbol_link = columns[0].find('a')
+        symbol = (symbol_link if symbol_link is not None else columns[0]).get_text().strip()
+
+        # Symbol, name, last price, industry, type and exchange of the result
+        stock_result_list.append([symbol, columns[1].get_text(), columns[2].get_text(), columns[3].get_text(),
+                                  result_type, columns[5].get_text()])
+
+    return pandas.DataFrame(stock_result_list, columns=SEARCH_RESULT_COLUMNS)
+
+
+# Searches the yahoo finance lookup page for stocks matching keywords by webscraping.
+# Returns dataframe with the SEARCH_RESULT_COLUMNS and one row for each stock
+def scrape_lookup(keywords):
+    # Download the lookup page, the keywords are escaped by requests
+    with span('search.fetch'):
+        results_page = http_get(LOOKUP_URL, params={'s': keywords})
+
+    # Parse the stock results from the page
+    with span('search.parse'):
+        return parse_lookup_page(results_page.content)
+
+
+# Searches a stock based on a keyword string argument
+# Returns dataframe with the columns containing stock data and one row for each stock
+# columns are symbol, name, latest price, industry/category then type then exchange
+# The stock is first searched for in the local symbol directory (symbol_directory.py), which has no prices. If it has
+# no results and LIVE_SEARCH_FALLBACK is True, the yahoo finance lookup page is scraped and the results are added to
+# the directory. use_directory=False always scrapes.
+# The scraped results are stored in the app wide search cache. If use_cache is True and the search is already cached,
+# the cached results are returned without scraping.
+# If provider (a data_providers.DataProvider) is given the search is done by the provider instead, and the results
+# are not cached, since they may differ from the yahoo finance results.
+# If the same search is already running, for example on another page, its results are returned instead of scraping
+def search_stocks(keywords, use_cache=True, provider=None, use_directory=True):
+    if provider is not None:
+        # Import here, data_providers uses this module for its searches
+        from data_providers import run_sync
+        return search_flight.run((search_key(keywords), provider), lambda: run_sync(provider.search(keywords)))
+
+    if use_directory:
+        # Import here, symbol_directory uses the columns of this module
+        from symbol_directory import get_symbol_directory
+        directory_results = get_symbol_directory().search(keywords, types=DIRECTORY_SEARCH_TYPES)
+        if len(directory_results) > 0 or not LIVE_SEARCH_FALLBACK:
+            return directory_results
+
+    # Return the cached results if there are any
+    if use_cache:
+        cached_results = search_cache.get(keywords)
+        if cached_results is not None:
+            return cached_results
+
+    return search_flight.run((search_key(keywords), None), scrape_and_cache, keywords)
+
+
+# Scrapes the search for search_stocks and stores the results in the search cache
+def scrape_and_cache(keywords):
+    # Search for the stocks and create a list with search results
+    logger.info('Searched for: %s', keywords)
+    search_results_data_frame = scrape_lookup(keywords)
+    logger.debug('Found %d stocks for %s', len(search_results_data_frame), keywords)
+
+    # Store the results so that the same search is not scraped again
+    search_cache.put(keywords, search_results_data_frame)
+    logger.debug('Search cache: %s', search_cache.statistics())
+
+    # Add the results to the symbol directory, so that they are found without scraping from now on. Imported here,
+    # symbol_directory uses the columns of this module
+    from symbol_directory import get_symbol_directory
+    get_symbol_directory().add_results(search_results_data_frame)
+
+    return search_results_data_frame
+
+
+# Copyright 2020 Oliver Midbrink
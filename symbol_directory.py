@@ -0,0 +1,631 @@
+# Local directory of the symbols that can be searched for, so that a search does not have to scrape the yahoo finance
+# lookup page. The directory is read from listing files (csv files with the columns symbol, name, type, exchange and
+# industry) in the listings directory, and an index is built once when they are read and saved next to them, so it is
+# only built again when they change. Searches are then answered from the index in well under a millisecond.
+#
+# The index has four parts, all numpy arrays:
+#   symbol prefix index  the symbols in sorted order, so the symbols starting with the search are one range
+#   name prefix index    the same for the names
+#   word prefix index    every word of the names and symbols in sorted order, for searches like 'volvo car'
+#   trigram index        the entries that contain every three letter piece of the names and symbols, for searches
+#                        that are misspelled or in the middle of a word
+# The results are ranked: exact symbol first, then symbols that start with the search, names that start with it,
+# names where every word of the search starts a word, and last, if nothing else matches, the fuzzy matches from the
+# trigrams.
+#
+# Usage:
+#   results = get_symbol_directory().search('volvo', types=('Stocks',))
+#
+# When the directory has no results the search falls back to scraping yahoo finance (stock_search.search_stocks), and
+# the scraped results are added to the directory with add_results, so the next search for them is local.
+
+# For reading and writing the listing files
+import csv
+import glob
+import os
+
+# For splitting names into words
+import re
+
+# For the signature of the listing files that a saved index was built from
+import json
+
+# For logging what the app does, instead of printing it
+import logging
+
+# For keeping the directory safe when searches run in background threads
+import threading
+
+# For timing how long it takes to build the index
+import time
+
+# Heavy libraries are imported the first time they are used, so that the app starts fast
+from lazy_modules import lazy_import
+
+# For the arrays of the index
+np = lazy_import('numpy')
+
+# For the search results
+pd = lazy_import('pandas')
+
+# The listing files are kept in the cache directory by default
+from price_store import CACHE_DIRECTORY
+
+# Columns of the search results, the same as the scraped results
+from stock_search import SEARCH_RESULT_COLUMNS
+
+# Timing of the searches
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Directory with the listing files, can be changed with the STOCK_APP_LISTINGS_DIR environment variable
+LISTINGS_DIRECTORY = os.environ.get('STOCK_APP_LISTINGS_DIR', os.path.join(CACHE_DIRECTORY, 'listings'))
+
+# Listing file in the listings directory where the results of live searches are added
+SCRAPED_LISTING_FILE = 'scraped.csv'
+
+# File in the listings directory where the index is saved, so that it is only built again when the listing files
+# change. INDEX_VERSION is increased when the layout of the index changes
+INDEX_FILE = 'symbol_index.npz'
+INDEX_VERSION = 1
+
+# Columns of the listing files
+LISTING_COLUMNS = ['symbol', 'name', 'type', 'exchange', 'industry']
+
+# Other names of the columns that are accepted in listing files, in lower case
+LISTING_COLUMN_ALIASES = {'ticker': 'symbol', 'company': 'name', 'security name': 'name',
+                          'quotetype': 'type', 'quote type': 'type', 'industry/category': 'industry',
+                          'sector': 'industry'}
+
+# The types are shown the same way as on the yahoo finance lookup page. Other ways of writing them in listing files,
+# in lower case
+TYPE_ALIASES = {'stock': 'Stocks', 'stocks': 'Stocks', 'equity': 'Stocks', 'etf': 'ETFs', 'etfs': 'ETFs',
+                'mutual fund': 'Mutual Funds', 'mutualfund': 'Mutual Funds', 'mutual funds': 'Mutual Funds',
+                'index': 'Indices', 'indices': 'Indices', 'future': 'Futures', 'futures': 'Futures',
+                'currency': 'Currencies', 'currencies': 'Currencies'}
+
+# Type of the entries in listing files without a type column
+DEFAULT_TYPE = 'Stocks'
+
+# Largest number of results of a search if nothing else is given
+DEFAULT_RESULT_LIMIT = 50
+
+# Share of the trigrams of a search that an entry must contain to be a fuzzy match
+FUZZY_MIN_SIMILARITY = 0.5
+
+# Rank of the ways a search can match an entry, higher is better. The score of an entry is its rank times
+# RANK_WEIGHT minus its position in the symbol order (shorter symbols first), so that the rank decides first
+MATCH_EXACT_SYMBOL = 5
+MATCH_SYMBOL_PREFIX = 4
+MATCH_NAME_PREFIX = 3
+MATCH_WORD_PREFIXES = 2
+MATCH_FUZZY = 1
+RANK_WEIGHT = 1 << 40
+
+# Fuzzy matches with more trigrams of the search are shown first, the number of trigrams is multiplied by this so it
+# decides before the symbol order
+TRIGRAM_WEIGHT = 1 << 24
+
+# Number of bytes of the names that are kept in the name prefix index. Longer searches only have to match this much
+NAME_KEY_LENGTH = 64
+
+# Parts of names and symbols that are words in the word prefix index
+WORD_PATTERN = re.compile(r'[0-9a-z]+')
+
+
+# Returns text in the form used in the index: lower case without spaces at the ends and with single spaces
+def normalize_text(text):
+    return ' '.join(text.lower().split())
+
+
+# Returns the type as it is shown on the yahoo finance lookup page, for example 'Stocks' for 'equity'
+def normalize_type(entry_type):
+    entry_type = entry_type.strip()
+    if entry_type == '':
+        return DEFAULT_TYPE
+    return TYPE_ALIASES.get(entry_type.lower(), entry_type)
+
+
+# Returns the set of three letter pieces of text, with a space added at both ends so that the start and end of a word
+# count as well
+def trigrams(text):
+    padded_text = ' ' + text + ' '
+    return {padded_text[piece_start:piece_start + 3] for piece_start in range(len(padded_text) - 2)}
+
+
+# Returns the list of strings as a numpy array of utf-8 bytes, which can be saved without pickle and searched with
+# searchsorted
+def encode_strings(strings):
+    if len(strings) == 0:
+        return np.zeros(0, dtype='S1')
+    return np.array([string.encode('utf-8') for string in strings])
+
+
+# Returns the sorted keys and the entries of a prefix index from the arrays keys and entries, where entries[i] is the
+# entry of keys[i]
+def build_prefix_index(keys, entries):
+    order = np.argsort(keys, kind='stable')
+    return keys[order], np.asarray(entries, dtype=np.int32)[order]
+
+
+# Returns the position of the first key in the sorted array keys that is not before key (bytes), or after it if
+# side is 'right'. The key is given the type of the keys, since numpy copies all the keys to a longer type otherwise
+def key_position(keys, key, side='left'):
+    return int(np.searchsorted(keys, np.array(key, dtype=keys.dtype), side=side))
+
+
+# Returns the entries in the prefix index (keys, entries) whose keys start with prefix (bytes). They are one slice of
+# the index, so no entries are copied. 0xff is never part of utf-8, so it is after every key with the prefix
+def prefix_range(keys, entries, prefix):
+    if len(prefix) > keys.itemsize:
+        # No key is that long
+        return entries[:0]
+
+    range_start = key_position(keys, prefix)
+    if len(prefix) == keys.itemsize:
+        # Only keys that are the same as the prefix start with it
+        range_end = key_position(keys, prefix, side='right')
+    else:
+        range_end = key_position(keys, prefix + b'\xff')
+    return entries[range_start:range_end]
+
+
+# Returns the signature of the listing files at paths, their names, sizes and modification times. A saved index is
+# only used if the listing files still have the same signature
+def listing_signature(paths):
+    signature = []
+    for path in paths:
+        file_status = os.stat(path)
+        signature.append([os.path.basename(path), file_status.st_size, file_status.st_mtime_ns])
+    return json.dumps(signature)
+
+
+# Reads a listing file and returns a list of entries, tuples with the LISTING_COLUMNS. The names of the columns are
+# read from the first line, in any case and with the LISTING_COLUMN_ALIASES. Lines without a symbol are skipped
+def read_listing_file(path):
+    entries = []
+
+    with open(path, newline='', encoding='utf-8') as listing_file:
+        reader = csv.reader(listing_file)
+        header = next(reader, None)
+        if header is None:
+            return entries
+
+        # Position of every listing column in the file, None if the file does not have it
+        column_names = [LISTING_COLUMN_ALIASES.get(name.strip().lower(), name.strip().lower()) for name in header]
+        positions = [column_names.index(column) if column in column_names else None for column in LISTING_COLUMNS]
+        if positions[0] is None:
+            raise ValueError('No symbol column in listing file ' + path)
+
+        for line in reader:
+            values = [line[position].strip() if position is not None and position < len(line) else ''
+                      for position in positions]
+            if values[0] != '':
+                entries.append(tuple(values))
+
+    return entries
+
+
+# Reads the listing files at paths and returns all their entries, files that can not be read are skipped
+def read_listing_files(paths):
+    entries = []
+    for path in paths:
+        try:
+            entries.extend(read_listing_file(path))
+        except (OSError, ValueError, csv.Error) as e:
+            logger.warning('Could not read listing file %s: %s', path, e)
+    return entries
+
+
+# The index of a list of entries, all in numpy arrays so that it can be saved and loaded quickly. Built once and never
+# changed, a directory replaces its index with a new one when entries are added, so searches in other threads can
+# keep using the old one without locks.
+# The arrays are:
+#   symbols, names, industries   the columns of the entries as utf-8 bytes, for the results
+#   type_names, exchange_names   the different types and exchanges, type_codes and exchange_codes give the position
+#                                in them for every entry
+#   symbol_order                 position of every entry when sorted by symbol length and then symbol, entries that
+#                                match equally well are shown in this order
+#   symbol_keys, symbol_entries  symbol prefix index, the lower case symbols sorted and their entries
+#   name_keys, name_entries      the same for the first NAME_KEY_LENGTH bytes of the lower case names
+#   word_keys, word_entries      the same for every word of the names and symbols
+#   trigram_keys, trigram_offsets, trigram_entries  trigram index, the entries of trigram_keys[i] are
+#                                trigram_entries[trigram_offsets[i]:trigram_offsets[i + 1]]
+class SymbolIndex:
+
+    ARRAY_NAMES = ('symbols', 'names', 'industries', 'type_names', 'exchange_names', 'type_codes', 'exchange_codes',
+                   'symbol_order', 'symbol_keys', 'symbol_entries', 'name_keys', 'name_entries', 'word_keys',
+                   'word_entries', 'trigram_keys', 'trigram_offsets', 'trigram_entries')
+
+    # Initialize the index from a dictionary with the ARRAY_NAMES as keys and the arrays as values, from build or load
+    def __init__(self, arrays):
+        for array_name in self.ARRAY_NAMES:
+            setattr(self, array_name, arrays[array_name])
+
+        # The type and exchange names as text, for the filters and the results
+        self.type_texts = [type_name.decode('utf-8') for type_name in self.type_names]
+        self.exchange_texts = [exchange_name.decode('utf-8') for exchange_name in self.exchange_names]
+
+        # The filters of allowed_entries that have been used, with the types and exchanges as key
+        self.allowed_cache = {}
+
+    # Builds the index for entries, a list of tuples with the LISTING_COLUMNS. Later entries with the same symbol
+    # replace earlier ones
+    @classmethod
+    def build(cls, entries):
+        # Keep the last entry of every symbol, in the order they were first seen
+        entry_by_symbol = {}
+        for entry in entries:
+            entry_by_symbol[entry[0].upper()] = (entry[0].upper(), entry[1], normalize_type(entry[2]), entry[3],
+                                                 entry[4])
+        entries = list(entry_by_symbol.values())
+
+        arrays = {'symbols': encode_strings([entry[0] for entry in entries]),
+                  'names': encode_strings([entry[1] for entry in entries]),
+                  'industries': encode_strings([entry[4] for entry in entries])}
+
+        # The types and exchanges as numbers, so that the filters are array operations
+        type_texts = sorted({entry[2] for entry in entries})
+        exchange_texts = sorted({entry[3] for entry in entries})
+        type_codes = {type_texts[code]: code for code in range(len(type_texts))}
+        exchange_codes = {exchange_texts[code]: code for code in range(len(exchange_texts))}
+        arrays['type_names'] = encode_strings(type_texts)
+        arrays['exchange_names'] = encode_strings(exchange_texts)
+        arrays['type_codes'] = np.array([type_codes[entry[2]] for entry in entries], dtype=np.int32)
+        arrays['exchange_codes'] = np.array([exchange_codes[entry[3]] for entry in entries], dtype=np.int32)
+
+        lower_symbols = [entry[0].lower() for entry in entries]
+        lower_names = [normalize_text(entry[1]) for entry in entries]
+        entry_indexes = np.arange(len(entries), dtype=np.int32)
+
+        # Entries that match equally well are shown with the shortest symbol first, then in alphabetical order
+        symbol_order = sorted(range(len(entries)), key=lambda entry_idx: (len(lower_symbols[entry_idx]),
+                                                                          lower_symbols[entry_idx]))
+        arrays['symbol_order'] = np.empty(len(entries), dtype=np.int64)
+        arrays['symbol_order'][symbol_order] = np.arange(len(entries))
+
+        arrays['symbol_keys'], arrays['symbol_entries'] = build_prefix_index(encode_strings(lower_symbols),
+                                                                             entry_indexes)
+        arrays['name_keys'], arrays['name_entries'] = build_prefix_index(
+            encode_strings(lower_names).astype('S' + str(NAME_KEY_LENGTH)), entry_indexes)
+
+        # Every word of the names and symbols, and every trigram as a number so that the index can be built with
+        # array operations
+        words = []
+        word_entries = []
+        trigram_ids = {}
+        trigram_pair_ids = []
+        trigram_pair_entries = []
+        for entry_idx in range(len(entries)):
+            entry_words = set(WORD_PATTERN.findall(lower_names[entry_idx])) | set(WORD_PATTERN.findall(
+                lower_symbols[entry_idx]))
+            words.extend(entry_words)
+            word_entries.extend([entry_idx] * len(entry_words))
+
+            entry_trigrams = trigrams(lower_names[entry_idx]) | trigrams(lower_symbols[entry_idx])
+            trigram_pair_ids.extend(trigram_ids.setdefault(trigram, len(trigram_ids)) for trigram in entry_trigrams)
+            trigram_pair_entries.extend([entry_idx] * len(entry_trigrams))
+
+        arrays['word_keys'], arrays['word_entries'] = build_prefix_index(encode_strings(words), word_entries)
+
+        # The trigrams in sorted order, and the entries of every trigram after each other in the same order
+        trigram_keys = encode_strings(list(trigram_ids))
+        trigram_key_order = np.argsort(trigram_keys, kind='stable')
+        trigram_position = np.empty(len(trigram_keys), dtype=np.int64)
+        trigram_position[trigram_key_order] = np.arange(len(trigram_keys))
+        trigram_pair_positions = trigram_position[np.array(trigram_pair_ids, dtype=np.int64)]
+        pair_order = np.argsort(trigram_pair_positions, kind='stable')
+
+        arrays['trigram_keys'] = trigram_keys[trigram_key_order]
+        arrays['trigram_entries'] = np.array(trigram_pair_entries, dtype=np.int32)[pair_order]
+        arrays['trigram_offsets'] = np.zeros(len(trigram_keys) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(trigram_pair_positions, minlength=len(trigram_keys)),
+                  out=arrays['trigram_offsets'][1:])
+
+        return cls(arrays)
+
+    # Loads an index saved with save from the file at path. Returns None if there is no such file, it was saved by
+    # another version of the app or for listing files with another signature than signature
+    @classmethod
+    def load(cls, path, signature):
+        try:
+            with np.load(path) as saved_arrays:
+                if (int(saved_arrays['version']) != INDEX_VERSION or
+                        str(saved_arrays['signature']) != signature):
+                    return None
+                return cls({array_name: saved_arrays[array_name] for array_name in cls.ARRAY_NAMES})
+        except (OSError, KeyError, ValueError) as e:
+            logger.debug('Could not load symbol index %s: %s', path, e)
+            return None
+
+    # Saves the index to the file at path, together with the signature of the listing files it was built from
+    def save(self, path, signature):
+        # Written to another file first, so that an index that is being loaded is never half written
+        temporary_path = path + '.tmp.npz'
+        np.savez(temporary_path, version=INDEX_VERSION, signature=signature,
+                 **{array_name: getattr(self, array_name) for array_name in self.ARRAY_NAMES})
+        os.replace(temporary_path, path)
+
+    # Returns the number of entries
+    def __len__(self):
+        return len(self.symbols)
+
+    # Returns the entries as a list of tuples with the LISTING_COLUMNS
+    def entries(self):
+        return [(self.symbols[entry_idx].decode('utf-8'), self.names[entry_idx].decode('utf-8'),
+                 self.type_texts[self.type_codes[entry_idx]], self.exchange_texts[self.exchange_codes[entry_idx]],
+                 self.industries[entry_idx].decode('utf-8')) for entry_idx in range(len(self))]
+
+    # Returns a bool array that is True for the entries whose type is in types and exchange is in exchanges, or None
+    # if both are None (all entries are allowed). The same filters are used for most searches, so they are kept
+    def allowed_entries(self, types, exchanges):
+        if types is None and exchanges is None:
+            return None
+
+        cache_key = (None if types is None else frozenset(normalize_type(entry_type) for entry_type in types),
+                     None if exchanges is None else frozenset(exchanges))
+        allowed = self.allowed_cache.get(cache_key)
+        if allowed is None:
+            # Whether every type and exchange code is allowed, looked up for the code of every entry
+            allowed = np.ones(len(self), dtype=bool)
+            if cache_key[0] is not None:
+                allowed &= np.array([type_text in cache_key[0] for type_text in self.type_texts] + [False])[
+                    self.type_codes]
+            if cache_key[1] is not None:
+                allowed &= np.array([exchange_text in cache_key[1] for exchange_text in self.exchange_texts] +
+                                    [False])[self.exchange_codes]
+            self.allowed_cache[cache_key] = allowed
+        return allowed
+
+    # Returns the entries that match keywords as an array of entry indexes, the best match first, and an array with
+    # the match rank (MATCH_EXACT_SYMBOL...) of every returned entry.
+    # types and exchanges are lists of the types and exchanges to keep, all of them if None. At most limit entries
+    # are returned. The ways of matching are tried from the best to the worst, and the worse ones are skipped when
+    # the better ones already give limit entries
+    def search(self, keywords, limit=DEFAULT_RESULT_LIMIT, types=None, exchanges=None):
+        query = normalize_text(keywords)
+        if query == '' or len(self) == 0:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int8)
+
+        allowed = self.allowed_entries(types, exchanges)
+
+        # The rank of every entry that has matched so far, 0 for the others, and the arrays of matching entries with
+        # their rank. The ways of matching are tried from the best to the worst and every entry is only added by the
+        # best one, so the arrays have no entries in common and the whole ranks array never has to be scanned
+        ranks = np.zeros(len(self), dtype=np.int8)
+        matched_entries = []
+        match_count = 0
+
+        def add_matches(matching_entries, rank):
+            nonlocal match_count
+            if allowed is not None:
+                matching_entries = matching_entries[allowed[matching_entries]]
+            matching_entries = matching_entries[ranks[matching_entries] == 0]
+            ranks[matching_entries] = rank
+            matched_entries.append((rank, matching_entries))
+            match_count += len(matching_entries)
+
+        # Symbols are written without spaces
+        symbol_query = query.replace(' ', '').encode('utf-8')
+        exact_symbol_idx = key_position(self.symbol_keys, symbol_query[:self.symbol_keys.itemsize])
+        if exact_symbol_idx < len(self.symbol_keys) and self.symbol_keys[exact_symbol_idx] == symbol_query:
+            add_matches(self.symbol_entries[exact_symbol_idx:exact_symbol_idx + 1], MATCH_EXACT_SYMBOL)
+        add_matches(prefix_range(self.symbol_keys, self.symbol_entries, symbol_query), MATCH_SYMBOL_PREFIX)
+
+        add_matches(prefix_range(self.name_keys, self.name_entries, query.encode('utf-8')[:NAME_KEY_LENGTH]),
+                    MATCH_NAME_PREFIX)
+
+        # Every word of the search starts a word of the name or the symbol
+        query_words = WORD_PATTERN.findall(query)
+        if len(query_words) > 0 and match_count < limit:
+            # The entries of the rarest word that also have all the other words. An entry is in a word range once
+            # for every word of it that starts with the search word
+            word_ranges = sorted((prefix_range(self.word_keys, self.word_entries, query_word.encode('utf-8'))
+                                  for query_word in query_words), key=len)
+            has_all_words = np.unique(word_ranges[0])
+            for word_range in word_ranges[1:]:
+                has_word = np.zeros(len(self), dtype=bool)
+                has_word[word_range] = True
+                has_all_words = has_all_words[has_word[has_all_words]]
+            add_matches(has_all_words, MATCH_WORD_PREFIXES)
+
+        # Fuzzy matches from the trigrams if nothing else matches, for misspelled searches. The ones with the most
+        # trigrams of the search first
+        trigram_counts = None
+        if match_count == 0:
+            trigram_postings = self.trigram_postings(query)
+            trigram_counts = np.bincount(trigram_postings, minlength=len(self))
+            add_matches(np.unique(trigram_postings[trigram_counts[trigram_postings] >=
+                                                   FUZZY_MIN_SIMILARITY * len(trigrams(query))]), MATCH_FUZZY)
+
+        # Only the entries with the best ranks can be among the best limit entries, the ones of the worse ranks are
+        # left out once there are limit entries
+        candidates = []
+        for rank, matching_entries in matched_entries:
+            if sum(len(entries) for entries in candidates) >= limit:
+                break
+            candidates.append(matching_entries)
+        candidates = np.concatenate(candidates)
+
+        # The best limit entries, best first
+        scores = ranks[candidates].astype(np.int64) * RANK_WEIGHT - self.symbol_order[candidates]
+        if trigram_counts is not None:
+            scores += np.where(ranks[candidates] == MATCH_FUZZY, trigram_counts[candidates], 0) * TRIGRAM_WEIGHT
+        if len(candidates) > limit:
+            best = np.argpartition(-scores, limit - 1)[:limit]
+            candidates, scores = candidates[best], scores[best]
+        candidates = candidates[np.argsort(-scores, kind='stable')]
+        return candidates, ranks[candidates]
+
+    # Returns True if symbol (in upper case) is in the index
+    def contains(self, symbol):
+        symbol_key = symbol.lower().encode('utf-8')
+        if len(symbol_key) > self.symbol_keys.itemsize:
+            return False
+        symbol_idx = key_position(self.symbol_keys, symbol_key)
+        return symbol_idx < len(self.symbol_keys) and self.symbol_keys[symbol_idx] == symbol_key
+
+    # Returns an array with the entries that contain the trigrams of query, an entry is in it once for every trigram
+    # of query that it contains
+    def trigram_postings(self, query):
+        trigram_entries = [np.zeros(0, dtype=np.int32)]
+        for trigram in trigrams(query):
+            trigram = trigram.encode('utf-8')
+            trigram_idx = key_position(self.trigram_keys, trigram[:self.trigram_keys.itemsize])
+            if trigram_idx < len(self.trigram_keys) and self.trigram_keys[trigram_idx] == trigram:
+                trigram_entries.append(self.trigram_entries[self.trigram_offsets[trigram_idx]:
+                                                            self.trigram_offsets[trigram_idx + 1]])
+        return np.concatenate(trigram_entries)
+
+    # Returns the entries with the entry indexes in entry_indexes as a list of tuples with the SEARCH_RESULT_COLUMNS,
+    # like the rows of the scraped search results. The directory has no prices, so the last price is empty
+    def result_rows(self, entry_indexes):
+        return [(self.symbols[entry_idx].decode('utf-8'), self.names[entry_idx].decode('utf-8'), '',
+                 self.industries[entry_idx].decode('utf-8'), self.type_texts[self.type_codes[entry_idx]],
+                 self.exchange_texts[self.exchange_codes[entry_idx]]) for entry_idx in entry_indexes]
+
+
+# The symbols in the listing files of a directory. The files are read and the index is built the first time the
+# directory is searched.
+# The results of live searches are kept in a listing file of their own with an index of their own, so that adding
+# them only builds the small index again and not the one of the provided listing files
+class SymbolDirectory:
+
+    # Initialize the directory. listings_directory is the directory with the listing files (*.csv)
+    def __init__(self, listings_directory=LISTINGS_DIRECTORY):
+        self.listings_directory = listings_directory
+
+        # The SymbolIndex of the provided listing files and of the scraped listing file, None until they are built
+        self.index = None
+        self.scraped_index = None
+        self.lock = threading.Lock()
+
+    # Returns the paths of the provided listing files, all the listing files except the scraped one
+    def listing_paths(self):
+        return [path for path in sorted(glob.glob(os.path.join(self.listings_directory, '*.csv')))
+                if os.path.basename(path) != SCRAPED_LISTING_FILE]
+
+    # Returns the path of the listing file with the results of live searches
+    def scraped_path(self):
+        return os.path.join(self.listings_directory, SCRAPED_LISTING_FILE)
+
+    # Returns the path of the saved index
+    def index_path(self):
+        return os.path.join(self.listings_directory, INDEX_FILE)
+
+    # Loads the saved index, or reads the provided listing files and builds a new index if they have changed since it
+    # was saved. The index of the scraped listing file is always built, it is small. Files that can not be read are
+    # skipped
+    def load(self):
+        start_time = time.perf_counter()
+        paths = self.listing_paths()
+        signature = listing_signature(paths)
+
+        index = SymbolIndex.load(self.index_path(), signature)
+        if index is None:
+            index = SymbolIndex.build(read_listing_files(paths))
+            self.save_index(index, signature)
+            logger.info('Built symbol directory with %d symbols in %.2f s', len(index),
+                        time.perf_counter() - start_time)
+        else:
+            logger.info('Loaded symbol directory with %d symbols in %.3f s', len(index),
+                        time.perf_counter() - start_time)
+
+        scraped_paths = [self.scraped_path()] if os.path.exists(self.scraped_path()) else []
+        scraped_index = SymbolIndex.build(read_listing_files(scraped_paths))
+
+        with self.lock:
+            self.index = index
+            self.scraped_index = scraped_index
+        return index, scraped_index
+
+    # Saves index for the listing files with the signature, if there are listing files. The directory works without
+    # the saved index, so errors are only logged
+    def save_index(self, index, signature):
+        if len(index) == 0:
+            return
+        try:
+            index.save(self.index_path(), signature)
+        except OSError as e:
+            logger.warning('Could not save symbol index %s: %s', self.index_path(), e)
+
+    # Returns the index of the provided listing files and the index of the scraped listing file, built the first
+    # time they are needed
+    def get_indexes(self):
+        with self.lock:
+            index = self.index
+            scraped_index = self.scraped_index
+        if index is None:
+            index, scraped_index = self.load()
+        return index, scraped_index
+
+    # Returns the number of symbols in the directory
+    def __len__(self):
+        index, scraped_index = self.get_indexes()
+        return len(index) + sum(1 for entry in scraped_index.entries() if not index.contains(entry[0]))
+
+    # Searches the directory for keywords in the symbols and names. Returns a dataframe with the SEARCH_RESULT_COLUMNS
+    # and at most limit rows, the best match first. types and exchanges are lists of the types (for example
+    # ['Stocks']) and exchanges to keep, all of them if None
+    def search(self, keywords, limit=DEFAULT_RESULT_LIMIT, types=None, exchanges=None):
+        index, scraped_index = self.get_indexes()
+
+        with span('search.directory'):
+            entry_indexes, ranks = index.search(keywords, limit, types, exchanges)
+            matches = list(zip(ranks.tolist(), index.result_rows(entry_indexes)))
+
+            # The scraped symbols that are not in the provided listing files, after the provided symbols that match
+            # equally well
+            if len(scraped_index) > 0:
+                entry_indexes, ranks = scraped_index.search(keywords, limit, types, exchanges)
+                scraped_rows = scraped_index.result_rows(entry_indexes)
+                matches.extend((rank, row) for rank, row in zip(ranks.tolist(), scraped_rows)
+                               if not index.contains(row[0]))
+                matches.sort(key=lambda match: -match[0])
+
+            return pd.DataFrame([row for rank, row in matches[:limit]], columns=SEARCH_RESULT_COLUMNS)
+
+    # Adds search results (a dataframe with the SEARCH_RESULT_COLUMNS, for example from scraping yahoo finance) to
+    # the scraped listing file and its index, so that they are found in the directory from now on
+    def add_results(self, results):
+        if len(results) == 0:
+            return
+
+        os.makedirs(self.listings_directory, exist_ok=True)
+        write_header = not os.path.exists(self.scraped_path())
+
+        new_entries = [(row['Symbol'], row['Name'], row['Type'], row['Exchange'], row['Industry/Category'])
+                       for row in results[SEARCH_RESULT_COLUMNS].to_dict('records')]
+
+        with self.lock:
+            with open(self.scraped_path(), 'a', newline='', encoding='utf-8') as listing_file:
+                writer = csv.writer(listing_file)
+                if write_header:
+                    writer.writerow(LISTING_COLUMNS)
+                writer.writerows(new_entries)
+
+            # The new entries replace the old ones with the same symbol. Only the small index of the scraped
+            # symbols is built again, if the directory has been loaded
+            if self.scraped_index is not None:
+                self.scraped_index = SymbolIndex.build(self.scraped_index.entries() + new_entries)
+
+        logger.debug('Added %d scraped symbols to the symbol directory', len(new_entries))
+
+
+# The symbol directory shared by the whole app. It is created the first time it is used
+shared_symbol_directory = None
+shared_symbol_directory_lock = threading.Lock()
+
+
+# Returns the symbol directory shared by the whole app
+def get_symbol_directory():
+    global shared_symbol_directory
+
+    with shared_symbol_directory_lock:
+        if shared_symbol_directory is None:
+            shared_symbol_directory = SymbolDirectory()
+        return shared_symbol_directory
+
+
+# Copyright 2020 Oliver Midbrink
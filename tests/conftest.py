@@ -0,0 +1,27 @@
+# Shared setup of the tests. The modules of the app are at the top of the repository, not in a package, so that
+# directory is put first on the import path
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# A hidden tkinter root window for the tests of the GUI. The tests are skipped without a display, run them with
+# xvfb-run on a server
+@pytest.fixture
+def tk_root():
+    import tkinter as tk
+
+    try:
+        root = tk.Tk()
+    except tk.TclError as e:
+        pytest.skip('No display: ' + str(e))
+
+    root.withdraw()
+    yield root
+    root.destroy()
+
+
+# Copyright 2020 Oliver Midbrink
@@ -0,0 +1,100 @@
+# Tests of the market data providers in data_providers.py
+
+import asyncio
+import time
+
+import data_providers
+from data_providers import YahooProvider, chart_result_to_dataframe
+from fake_yahoo import synthetic_chart_result
+from rate_limiter import AdaptiveRateLimiter
+
+# Seconds a throttled request waits before it is retried in the tests
+BACKOFF_SECONDS = 0.2
+
+
+# An answer of FakeSession, used with async with like an aiohttp response
+class FakeResponse:
+
+    def __init__(self, status, chart=None):
+        self.status = status
+        self.chart = chart
+        self.headers = {}
+
+    async def __aenter__(self):
+        await asyncio.sleep(0.01)
+        return self
+
+    async def __aexit__(self, exception_type, exception, traceback):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    async def json(self, content_type=None):
+        return self.chart
+
+
+# An aiohttp session where the symbols in throttled_symbols always get 429 Too Many Requests and the other symbols
+# their synthetic chart. The charts are made before the timing starts
+class FakeSession:
+
+    def __init__(self, throttled_symbols, symbols):
+        self.throttled_symbols = throttled_symbols
+        self.charts = {symbol: {'chart': {'result': [synthetic_chart_result(symbol)]}} for symbol in symbols}
+
+    def get(self, url, params=None):
+        symbol = url.rsplit('/', 1)[-1]
+        if symbol in self.throttled_symbols:
+            return FakeResponse(429)
+        return FakeResponse(200, self.charts[symbol])
+
+
+# A throttled symbol waiting to be retried does not keep its place among the concurrent requests, so the other
+# symbols are downloaded meanwhile
+def test_throttled_symbol_lets_others_run(monkeypatch):
+    monkeypatch.setattr(data_providers, 'backoff_seconds', lambda attempt: BACKOFF_SECONDS)
+    monkeypatch.setattr(data_providers, 'get_rate_limiter', lambda: AdaptiveRateLimiter(enabled=False))
+
+    provider = YahooProvider(chart_url='http://fake/chart/', max_concurrency=1, use_aiohttp=True)
+    fast_symbols = ['FAST' + str(symbol_idx) for symbol_idx in range(3)]
+    provider.session = FakeSession({'SLOW'}, fast_symbols)
+    provider.semaphore = asyncio.Semaphore(1)
+
+    finish_times = {}
+
+    async def timed_chart(symbol):
+        try:
+            await provider.get_chart(symbol, {})
+        except Exception:
+            pass
+        finish_times[symbol] = time.monotonic()
+
+    async def download_all():
+        await asyncio.gather(timed_chart('SLOW'), *[timed_chart(symbol) for symbol in fast_symbols])
+
+    start_time = time.monotonic()
+    asyncio.run(download_all())
+
+    # The fast symbols are done during the first backoff of the slow one
+    assert all(finish_times[symbol] - start_time < BACKOFF_SECONDS for symbol in fast_symbols)
+    assert finish_times['SLOW'] - start_time >= data_providers.MAX_RETRIES * BACKOFF_SECONDS
+
+
+# Bars are dated by the day at the exchange, not the day in UTC
+def test_bars_are_dated_by_the_exchange_day():
+    chart_result = synthetic_chart_result('AAA')
+    chart_result['timestamp'] = [1700002800]  # 2023-11-14 23:00 UTC, 2023-11-15 08:00 in Tokyo
+    for field in ('open', 'high', 'low', 'close', 'volume'):
+        chart_result['indicators']['quote'][0][field] = [1.0]
+
+    chart_result['meta']['gmtoffset'] = 9 * 3600
+    assert str(chart_result_to_dataframe(chart_result).index[0].date()) == '2023-11-15'
+
+    chart_result['meta']['gmtoffset'] = -5 * 3600
+    assert str(chart_result_to_dataframe(chart_result).index[0].date()) == '2023-11-14'
+
+    del chart_result['meta']['gmtoffset']
+    assert str(chart_result_to_dataframe(chart_result).index[0].date()) == '2023-11-14'
+
+
+# Copyright 2020 Oliver Midbrink
@@ -0,0 +1,53 @@
+# Tests of the frames in functional_frames.py. They need a display, see the tk_root fixture in conftest.py
+
+from benchmark import count_widgets
+
+# pages and functional_frames import each other, the app imports pages first
+import pages
+from functional_frames import ListFrame
+
+# Number of times the rows are changed and the largest number of rows shown at once
+CYCLES = 1000
+MAX_ROWS = 20
+
+
+# Shows a number of rows that changes every cycle, adds one at the end and clears them
+def update_rows(list_frame, cycle_idx):
+    list_frame.set_rows(['Row ' + str(row_idx) for row_idx in range(cycle_idx % (MAX_ROWS + 1))])
+    list_frame.append_row('Last row')
+    list_frame.clear_rows()
+
+
+# The widgets of the rows are hidden and reused instead of created again, so after the first cycles have shown the
+# most rows the number of widgets does not change
+def test_list_frame_reuses_row_widgets(tk_root):
+    list_frame = ListFrame(tk_root, 'Rows', [])
+
+    for cycle_idx in range(MAX_ROWS + 1):
+        update_rows(list_frame, cycle_idx)
+    tk_root.update_idletasks()
+    widgets_before = count_widgets(list_frame)
+
+    for cycle_idx in range(CYCLES):
+        update_rows(list_frame, cycle_idx)
+    tk_root.update_idletasks()
+
+    assert count_widgets(list_frame) == widgets_before
+    assert list_frame.data_rows == []
+
+
+# Rows shown after the widgets were reused have the right texts
+def test_list_frame_shows_rows_after_reuse(tk_root):
+    list_frame = ListFrame(tk_root, 'Rows', ['A', 'B', 'C'])
+    widgets_before = count_widgets(list_frame)
+
+    list_frame.clear_rows()
+    list_frame.set_rows(['D', 'E'])
+    list_frame.append_row('F')
+
+    assert list_frame.data_rows == ['D', 'E', 'F']
+    assert [row_label.cget('text') for row_label in list_frame.row_labels[:3]] == ['D', 'E', 'F']
+    assert count_widgets(list_frame) == widgets_before
+
+
+# Copyright 2020 Oliver Midbrink
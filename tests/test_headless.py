@@ -0,0 +1,48 @@
+# Tests of resuming a stopped run of headless.py
+
+from headless import read_finished_symbols, remove_unfinished_line
+
+# Output of a run that was stopped while the row of MSFT was written. Its first columns look like a finished row
+STOPPED_CSV = ('symbol,status,error,price_development,beta_assignment,lowest_price,highest_price\r\n'
+               'AAPL,ok,,0.02,1.1,150.0,160.0\r\n'
+               'MSFT,ok,,0.03,0.9')
+STOPPED_JSONL = '{"symbol": "AAPL", "status": "ok"}\n{"symbol": "MSFT", "sta'
+
+
+# The partly written last line does not count as finished
+def test_partly_written_line_is_not_finished(tmp_path):
+    csv_path = tmp_path / 'results.csv'
+    csv_path.write_bytes(STOPPED_CSV.encode())
+    jsonl_path = tmp_path / 'results.jsonl'
+    jsonl_path.write_bytes(STOPPED_JSONL.encode())
+
+    assert read_finished_symbols(str(csv_path), 'csv') == {'AAPL'}
+    assert read_finished_symbols(str(jsonl_path), 'jsonl') == {'AAPL'}
+
+
+# The partly written last line is removed, so that its symbol is analyzed again and its row is not kept
+def test_partly_written_line_is_removed(tmp_path):
+    csv_path = tmp_path / 'results.csv'
+    csv_path.write_bytes(STOPPED_CSV.encode())
+
+    # A small block size to also search backwards over more than one block
+    remove_unfinished_line(str(csv_path), block_size=7)
+    assert csv_path.read_bytes() == STOPPED_CSV.rsplit('\r\n', 1)[0].encode() + b'\r\n'
+    assert read_finished_symbols(str(csv_path), 'csv') == {'AAPL'}
+
+    # Files that end with a newline are kept as they are
+    finished = csv_path.read_bytes()
+    remove_unfinished_line(str(csv_path))
+    assert csv_path.read_bytes() == finished
+
+
+# A file where not even the first line was finished becomes empty
+def test_partly_written_first_line_is_removed(tmp_path):
+    csv_path = tmp_path / 'results.csv'
+    csv_path.write_bytes(b'symbol,sta')
+
+    remove_unfinished_line(str(csv_path))
+    assert csv_path.read_bytes() == b''
+
+
+# Copyright 2020 Oliver Midbrink
@@ -0,0 +1,122 @@
+# Tests of the local price store in price_store.py with a slow fake downloader instead of yahoo finance
+
+# For refreshing from several threads at the same time
+import threading
+import time
+
+import pandas as pd
+import yfinance
+
+import price_store
+from data_providers import chart_result_to_dataframe
+from fake_yahoo import synthetic_chart_result
+from price_store import PriceStore, period_start_date, download_flight, download_price_history
+from rate_limiter import AdaptiveRateLimiter
+from single_flight import coalescing_statistics
+
+# Seconds every download takes
+DOWNLOAD_SECONDS = 0.2
+
+
+# A downloader with the same arguments as download_price_history, that remembers the symbols of every download
+class SlowDownloader:
+
+    def __init__(self):
+        self.downloads = []
+        self.lock = threading.Lock()
+
+    def __call__(self, symbols, start, interval):
+        with self.lock:
+            self.downloads.append(list(symbols))
+        time.sleep(DOWNLOAD_SECONDS)
+
+        prices_by_symbol = {}
+        for symbol in symbols:
+            prices = chart_result_to_dataframe(synthetic_chart_result(symbol))
+            prices_by_symbol[symbol] = prices[prices.index >= start]
+        return prices_by_symbol
+
+
+# Runs refresh_function in threads at the same time, one thread per item in arguments
+def run_at_the_same_time(refresh_function, arguments):
+    threads = [threading.Thread(target=refresh_function, args=(argument,)) for argument in arguments]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+# A symbol that is refreshed by the ranking (many symbols in a chunk) and by a page for one stock at the same time is
+# downloaded only once, and both get its prices
+def test_refreshes_of_the_same_symbol_share_a_download(tmp_path):
+    downloader = SlowDownloader()
+    store = PriceStore(str(tmp_path / 'prices.sqlite'), downloader=downloader)
+    start = period_start_date('1mo')
+    coalesced_before = coalescing_statistics()['prices']['coalesced']
+
+    panels = {}
+
+    def refresh(symbols):
+        panels[tuple(symbols)] = store.get_price_panel(symbols, start)
+
+    run_at_the_same_time(refresh, [['AAA', 'BBB', 'CCC'], ['BBB'], ['BBB']])
+
+    downloaded_symbols = [symbol for download in downloader.downloads for symbol in download]
+    assert sorted(downloaded_symbols) == ['AAA', 'BBB', 'CCC']
+    assert coalescing_statistics()['prices']['coalesced'] - coalesced_before == 2
+    assert all(panel.has_prices().all() for panel in panels.values())
+    assert download_flight.in_flight_count() == 0
+
+
+# A symbol is downloaded again when the last download of it failed
+def test_failed_download_is_released(tmp_path):
+    downloads = []
+
+    def failing_downloader(symbols, start, interval):
+        downloads.append(list(symbols))
+        raise ConnectionError('No connection')
+
+    store = PriceStore(str(tmp_path / 'prices.sqlite'), downloader=failing_downloader)
+    start = period_start_date('1mo')
+
+    assert not store.get_price_panel(['AAA'], start).has_prices()[0]
+    assert not store.get_price_panel(['AAA'], start).has_prices()[0]
+    assert downloads == [['AAA'], ['AAA']]
+    assert download_flight.in_flight_count() == 0
+
+
+# Returns a dataframe like yf.download with group_by='ticker' for symbols, where only the symbols in
+# symbols_with_prices have prices
+def downloaded_frame(symbols, symbols_with_prices):
+    frames = {}
+    for symbol in symbols:
+        prices = chart_result_to_dataframe(synthetic_chart_result('AAA')).iloc[-5:]
+        if symbol not in symbols_with_prices:
+            prices = prices * float('nan')
+        frames[symbol] = prices
+    return pd.concat(frames, axis=1)
+
+
+# Downloads symbols with download_price_history from a yf.download that returns frame. Returns the downloaded symbols
+# and the number of throttled answers the rate limiter was told about
+def download_with_frame(monkeypatch, symbols, frame):
+    limiter = AdaptiveRateLimiter()
+    monkeypatch.setattr(price_store, 'get_rate_limiter', lambda: limiter)
+    monkeypatch.setattr(yfinance, 'download', lambda *args, **kwargs: frame)
+
+    prices_by_symbol = download_price_history(symbols, pd.Timestamp('2020-01-01'), '1d')
+    return sorted(prices_by_symbol), limiter.statistics()['throttled']
+
+
+# yfinance does not raise when it is throttled, so a chunk where no symbol got prices counts as throttled. A chunk
+# where some symbols got prices, or a single unknown symbol, does not
+def test_download_without_any_prices_is_throttled(monkeypatch):
+    symbols = ['AAA', 'BBB', 'CCC']
+
+    assert download_with_frame(monkeypatch, symbols, downloaded_frame(symbols, ['AAA', 'CCC'])) == (['AAA', 'CCC'], 0)
+    assert download_with_frame(monkeypatch, symbols, downloaded_frame(symbols, [])) == ([], 1)
+    assert download_with_frame(monkeypatch, symbols, pd.DataFrame()) == ([], 1)
+    assert download_with_frame(monkeypatch, ['XYZ'], pd.DataFrame()) == ([], 0)
+
+
+# Copyright 2020 Oliver Midbrink
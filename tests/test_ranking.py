@@ -0,0 +1,82 @@
+# Tests of rank_stocks in ranking.py against an in-memory data provider that waits before every answer like a
+# server, so that the downloads of the workers overlap
+
+# For the batch analysis function with the provider
+import functools
+
+# For timing the rankings
+import time
+
+import pytest
+
+import analysis
+from data_providers import InMemoryProvider, chart_result_to_dataframe
+from fake_yahoo import synthetic_chart_result
+from ranking import rank_stocks
+
+# Seconds the provider waits before every answer
+LATENCY = 0.05
+
+# Symbols with prices, and symbols that the provider has no prices for
+SYMBOLS = ['SYM' + str(symbol_idx).zfill(4) for symbol_idx in range(32)]
+MISSING_SYMBOLS = ['MISSING1', 'MISSING2']
+
+# Every chunk makes two requests, one for the index and one for the prices
+CHUNK_SIZE = 2
+
+WORKER_COUNTS = (1, 2, 4, 8)
+
+
+# The batch analysis function of a ranking, reading the synthetic prices of SYMBOLS with LATENCY
+@pytest.fixture(scope='module')
+def batch_analysis_function():
+    prices_by_symbol = {symbol: chart_result_to_dataframe(synthetic_chart_result(symbol))
+                        for symbol in SYMBOLS + [analysis.BENCHMARK_INDEX_SYMBOL]}
+    provider = InMemoryProvider(prices_by_symbol, latency=LATENCY)
+    return functools.partial(analysis.technical_analysis_batch, provider=provider)
+
+
+# Returns the ranking of stock_symbols with max_workers workers and the seconds it took
+def timed_ranking(stock_symbols, batch_analysis_function, max_workers):
+    start_time = time.perf_counter()
+    ranking = rank_stocks(stock_symbols, stock_symbols, batch_analysis_function, max_workers=max_workers,
+                          chunk_size=CHUNK_SIZE)
+    return ranking, time.perf_counter() - start_time
+
+
+# More workers download more chunks at the same time, so the ranking gets faster with every doubling of the workers
+# and the ranking is the same
+def test_speedup_grows_with_workers(batch_analysis_function):
+    rankings = []
+    seconds = []
+    for worker_count in WORKER_COUNTS:
+        ranking, ranking_seconds = timed_ranking(SYMBOLS, batch_analysis_function, worker_count)
+        rankings.append(ranking)
+        seconds.append(ranking_seconds)
+
+    speedups = [seconds[0] / ranking_seconds for ranking_seconds in seconds]
+    assert all(speedups[worker_idx] > speedups[worker_idx - 1] * 1.5 for worker_idx in range(1, len(speedups)))
+    assert speedups[-1] > WORKER_COUNTS[-1] / 2
+    assert all(ranking == rankings[0] for ranking in rankings)
+
+
+# The stocks are sorted with the highest score first, and the stocks without prices get score 0 and are last in the
+# order they were given
+def test_ranking_is_sorted_with_failed_stocks_last(batch_analysis_function):
+    stock_symbols = MISSING_SYMBOLS[:1] + SYMBOLS[:10] + MISSING_SYMBOLS[1:]
+    ranking, ranking_seconds = timed_ranking(stock_symbols, batch_analysis_function, 4)
+
+    assert sorted(symbol for symbol, score, description in ranking) == sorted(stock_symbols)
+
+    ranked_stocks = ranking[:len(SYMBOLS[:10])]
+    failed_stocks = ranking[len(SYMBOLS[:10]):]
+    scores = [score for symbol, score, description in ranked_stocks]
+    assert scores == sorted(scores, reverse=True)
+    assert all(not description.startswith('Error') for symbol, score, description in ranked_stocks)
+
+    assert [symbol for symbol, score, description in failed_stocks] == MISSING_SYMBOLS
+    assert all(score == 0 and description == 'Error for this stock: ' + symbol
+               for symbol, score, description in failed_stocks)
+
+
+# Copyright 2020 Oliver Midbrink
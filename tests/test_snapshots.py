@@ -0,0 +1,55 @@
+# Tests of comparing ranking snapshots in snapshots.py
+
+import math
+
+from snapshots import Snapshot, write_snapshot, ranking_columns, diff_snapshots, main, RANKING_KIND
+
+OLD_RANKING = [('AAA', 1.5, 'A Inc.'), ('BBB', 1.2, 'B Corp'), ('CCC', 0, 'Error for this stock: C AB')]
+NEW_RANKING = [('BBB', 1.4, 'B Corp'), ('DDD', 1.3, 'D Group'), ('AAA', 1.1, 'A Inc.')]
+
+
+# Saves ranking as a snapshot in directory under name and returns it opened
+def saved_ranking(directory, name, ranking):
+    return Snapshot.open(write_snapshot(str(directory / name), RANKING_KIND, ranking_columns(ranking),
+                                       {'metric': 'beta_assignment'}))
+
+
+# Moved, added and removed stocks get the right ranks and values
+def test_diff_snapshots(tmp_path):
+    differences = diff_snapshots(saved_ranking(tmp_path, 'old', OLD_RANKING),
+                                 saved_ranking(tmp_path, 'new', NEW_RANKING))
+
+    assert differences['symbol'].tolist() == ['BBB', 'DDD', 'AAA', 'CCC']
+    assert differences['rank_change'].tolist()[0] == 1
+    assert math.isnan(differences['rank_change'].tolist()[1])
+    assert differences['rank_change'].tolist()[2] == -2
+    assert math.isnan(differences['new_rank'].tolist()[3])
+    assert differences['old_score'].tolist()[2] == 1.5
+
+
+# Every stock is new when the old snapshot is empty, and removed when the new one is empty
+def test_diff_with_an_empty_snapshot(tmp_path):
+    empty = saved_ranking(tmp_path, 'empty', [])
+    ranking = saved_ranking(tmp_path, 'ranking', NEW_RANKING)
+
+    differences = diff_snapshots(empty, ranking)
+    assert differences['symbol'].tolist() == ['BBB', 'DDD', 'AAA']
+    assert differences['old_score'].isna().all() and differences['old_rank'].isna().all()
+
+    differences = diff_snapshots(ranking, empty)
+    assert differences['symbol'].tolist() == ['BBB', 'DDD', 'AAA']
+    assert differences['new_score'].isna().all() and differences['old_rank'].tolist() == [1, 2, 3]
+
+    assert len(diff_snapshots(empty, empty)) == 0
+
+
+# The diff command works with an empty old snapshot
+def test_diff_command_with_an_empty_old_snapshot(tmp_path, capsys):
+    empty = saved_ranking(tmp_path, 'empty', [])
+    ranking = saved_ranking(tmp_path, 'ranking', NEW_RANKING)
+
+    assert main(['diff', empty.path, ranking.path, '--format', 'csv']) == 0
+    assert 'DDD' in capsys.readouterr().out
+
+
+# Copyright 2020 Oliver Midbrink
@@ -0,0 +1,63 @@
+# Tests of the startup of the app. The heavy libraries are imported the first time they are used and the pages the
+# first time they are shown, so that the menu is painted within FIRST_PAINT_TARGET_MS
+
+# For importing main in a new process, where no other test has imported the heavy libraries yet
+import json
+import subprocess
+import sys
+
+import pytest
+
+from benchmark import measure_import_time, measure_first_paint, APP_DIRECTORY, FIRST_PAINT_TARGET_MS
+
+# Libraries that take long to import and are not needed to show the menu
+HEAVY_MODULES = ('pandas', 'numpy', 'yfinance', 'yahoofinancials', 'requests', 'bs4')
+
+# Prints the heavy modules that were imported by import main as a json list
+IMPORTED_HEAVY_MODULES_PROGRAM = ('import json, sys\n'
+                                  'import main\n'
+                                  'print(json.dumps([name for name in ' + repr(HEAVY_MODULES) +
+                                  ' if name in sys.modules]))')
+
+
+# Importing the app does not import any of the heavy libraries
+def test_import_main_does_not_load_heavy_modules():
+    completed = subprocess.run([sys.executable, '-c', IMPORTED_HEAVY_MODULES_PROGRAM], cwd=APP_DIRECTORY,
+                               capture_output=True, text=True, check=True)
+    assert json.loads(completed.stdout.splitlines()[-1]) == []
+
+
+# Importing the app takes less than the whole time allowed until the first paint
+def test_import_main_is_fast():
+    assert measure_import_time('main')['import_ms'] < FIRST_PAINT_TARGET_MS
+
+
+# The menu is painted within FIRST_PAINT_TARGET_MS of starting the app. Needs a display
+def test_first_paint_is_fast():
+    first_paint_ms = measure_first_paint()
+    if first_paint_ms is None:
+        pytest.skip('No display')
+    assert first_paint_ms < FIRST_PAINT_TARGET_MS
+
+
+# Only the MenuPage is built when the app starts, the other pages are built the first time they are shown.
+# Needs a display
+def test_only_menu_page_is_built_at_startup():
+    import tkinter as tk
+    import main
+
+    try:
+        app = main.StockAnalysisApp()
+    except tk.TclError as e:
+        pytest.skip('No display: ' + str(e))
+
+    try:
+        assert list(app.frames) == [main.MenuPage]
+
+        app.display_frame(main.BetaRankingPage)
+        assert list(app.frames) == [main.MenuPage, main.BetaRankingPage]
+    finally:
+        app.close()
+
+
+# Copyright 2020 Oliver Midbrink
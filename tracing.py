@@ -0,0 +1,218 @@
+# Timing of the stages of the app (fetch, parse, compute and render) with named spans, for finding out where the time
+# goes. Tracing is off by default and then a span costs one function call and one attribute lookup. It is turned on
+# with the environment variable STOCK_APP_TRACE=1 or by enable_tracing().
+#
+# Usage:
+#   with span('technical.fetch'):
+#       prices = download_prices()
+#
+# For every span name the number of spans, the total time and a histogram of the durations are kept, together with
+# the latest spans. They can be shown in the debug overlay of the GUI (F12) or dumped to a json file.
+
+# For keeping the statistics safe when spans end in background threads
+import threading
+
+# For timing the spans
+import time
+
+# For the list of the latest spans
+from collections import deque
+
+# For keeping the name and comment of functions decorated with traced
+import functools
+
+# For dumping the statistics to a file
+import json
+import os
+
+# Upper bounds in milliseconds of the histogram buckets, every bucket twice as wide as the one before. Durations above
+# the last bound go in an extra bucket
+HISTOGRAM_BOUNDS_MS = tuple(0.05 * 2 ** bucket_idx for bucket_idx in range(20))
+
+# Number of the latest spans that are kept
+RECENT_SPAN_COUNT = 500
+
+
+# Statistics for all the spans with the same name, with a histogram of the durations
+class SpanStatistics:
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.bucket_counts = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+
+    # Adds a span that took duration_ms milliseconds
+    def add(self, duration_ms, failed=False):
+        self.count += 1
+        self.errors += failed
+        self.total_ms += duration_ms
+        self.max_ms = max(self.max_ms, duration_ms)
+
+        bucket_idx = 0
+        while bucket_idx < len(HISTOGRAM_BOUNDS_MS) and duration_ms > HISTOGRAM_BOUNDS_MS[bucket_idx]:
+            bucket_idx += 1
+        self.bucket_counts[bucket_idx] += 1
+
+    # Returns the duration in milliseconds that percentile_rank (0-100) percent of the spans are shorter than,
+    # estimated from the histogram as the upper bound of the bucket
+    def percentile(self, percentile_rank):
+        if self.count == 0:
+            return None
+
+        needed_count = self.count * percentile_rank / 100
+        cumulative_count = 0
+        for bucket_idx in range(len(self.bucket_counts)):
+            cumulative_count += self.bucket_counts[bucket_idx]
+            if cumulative_count >= needed_count:
+                if bucket_idx < len(HISTOGRAM_BOUNDS_MS):
+                    return round(min(HISTOGRAM_BOUNDS_MS[bucket_idx], self.max_ms), 3)
+                return round(self.max_ms, 3)
+
+        return round(self.max_ms, 3)
+
+    # Returns the statistics as a dictionary
+    def summary(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'mean_ms': round(self.total_ms / self.count, 3) if self.count else None,
+            'p50_ms': self.percentile(50),
+            'p95_ms': self.percentile(95),
+            'p99_ms': self.percentile(99),
+            'max_ms': round(self.max_ms, 3),
+        }
+
+
+# Collects the ended spans of the whole app
+class Tracer:
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+
+        # Dictionary with span name as key and SpanStatistics as value
+        self.statistics_by_name = {}
+
+        # The latest spans as tuples (name, start time as seconds since epoch, duration in ms, thread name, failed)
+        self.recent_spans = deque(maxlen=RECENT_SPAN_COUNT)
+
+        self.lock = threading.Lock()
+
+    # Adds an ended span
+    def record(self, name, start_time, duration_ms, failed):
+        with self.lock:
+            statistics = self.statistics_by_name.get(name)
+            if statistics is None:
+                statistics = self.statistics_by_name[name] = SpanStatistics()
+            statistics.add(duration_ms, failed)
+
+            self.recent_spans.append((name, start_time, duration_ms, threading.current_thread().name, failed))
+
+    # Returns a dictionary with the span names as keys and the summaries of their statistics as values
+    def statistics(self):
+        with self.lock:
+            return {name: self.statistics_by_name[name].summary() for name in sorted(self.statistics_by_name)}
+
+    # Returns the latest spans as a list of dictionaries, oldest first
+    def recent(self, count=RECENT_SPAN_COUNT):
+        with self.lock:
+            spans = list(self.recent_spans)[-count:]
+
+        return [{'name': name, 'start': start_time, 'duration_ms': round(duration_ms, 3), 'thread': thread_name,
+                 'failed': failed} for name, start_time, duration_ms, thread_name, failed in spans]
+
+    # Removes all the statistics and spans
+    def clear(self):
+        with self.lock:
+            self.statistics_by_name.clear()
+            self.recent_spans.clear()
+
+    # Writes the statistics and the latest spans to the json file at path. extra is a dictionary with more
+    # values to write in the same file, for example other statistics of the app. Returns the path
+    def dump(self, path, extra=None):
+        dumped = {'dumped_at': time.time(), 'statistics': self.statistics(), 'recent_spans': self.recent()}
+        dumped.update(extra or {})
+
+        with open(path, 'w') as dump_file:
+            json.dump(dumped, dump_file, indent=2)
+        return path
+
+
+# A running span, created by span() when tracing is on. Records its duration in the tracer when it ends.
+# A span that ends with an exception is counted as failed, the exception is passed on
+class Span:
+
+    __slots__ = ('tracer', 'name', 'start_time', 'start_counter')
+
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+
+    def __enter__(self):
+        self.start_time = time.time()
+        self.start_counter = time.perf_counter()
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        duration_ms = (time.perf_counter() - self.start_counter) * 1000
+        self.tracer.record(self.name, self.start_time, duration_ms, exception_type is not None)
+        return False
+
+
+# Span that does nothing, used when tracing is off. The same object is used for all spans
+class NullSpan:
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+# The tracer of the whole app
+tracer = Tracer(enabled=os.environ.get('STOCK_APP_TRACE', '') not in ('', '0'))
+
+
+# Returns a span with name to be used in a with statement, for example 'search.fetch'. Does nothing if tracing is off
+def span(name):
+    if not tracer.enabled:
+        return NULL_SPAN
+    return Span(tracer, name)
+
+
+# Decorator that runs every call of the decorated function in a span with name, for example
+#   @traced('render.ranking')
+#   def present_ranking(self, ranking):
+def traced(name):
+
+    def decorator(function):
+
+        @functools.wraps(function)
+        def traced_function(*args, **kwargs):
+            if not tracer.enabled:
+                return function(*args, **kwargs)
+
+            with Span(tracer, name):
+                return function(*args, **kwargs)
+
+        return traced_function
+
+    return decorator
+
+
+# Turns tracing on or off
+def enable_tracing(enabled=True):
+    tracer.enabled = enabled
+
+
+# Returns True if tracing is on
+def is_tracing_enabled():
+    return tracer.enabled
+
+
+# Copyright 2020 Oliver Midbrink